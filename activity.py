@@ -0,0 +1,302 @@
+#!/usr/bin/env python3
+"""
+Activity-gated recording
+
+Most footage of an empty bar is worthless, so the recorder can keep only the
+segments in which something moves, plus a configurable pre-roll and
+post-roll:
+
+ • Motion score – JPEGs are decoded straight to 1/8 scale greyscale (libjpeg
+   DCT scaling via Pillow's draft mode: QVGA → 40×30, no full decode), and
+   the score is the fraction of pixels that changed by more than PIXEL_DELTA
+   since the previous scored frame (one vectorized NumPy pass).  Frames are
+   scored at ANALYZE_FPS per camera, not at the stream rate, which bounds
+   the cost per camera.
+ • ActivityGate – per camera, at segment granularity: a segment whose best
+   score reaches the threshold is active.  Inactive segments wait in a
+   pre-roll queue until the next active one (kept) or until they fall out
+   of it (deleted); after an active segment the next post-roll segments are
+   kept unconditionally.
+ • Native backend: frames are scored as they are ingested and the gate
+   decides when mjpeg_ingest closes a segment.  ffmpeg backend: each MP4
+   that segment_events.Mp4Watcher reports as finished is scored by decoding
+   it at low resolution with ffmpeg.
+
+Offline (dry run unless --apply):
+    python activity.py recordings/cam_id --pre-roll 30 --post-roll 30
+"""
+
+import argparse
+import collections
+import io
+import math
+import pathlib
+import subprocess
+import threading
+import time
+
+import numpy as np
+from PIL import Image
+
+from segment_store import DATA_SUFFIX, SegmentReader, index_path, remove_segment, segment_bytes
+
+ANALYZE_FPS = 5.0                      # frames scored per camera per second
+DOWNSCALE = 8                          # JPEG DCT scaling: 1/2, 1/4 or 1/8
+PIXEL_DELTA = 24                       # grey levels a pixel must change by
+ACTIVITY_THRESHOLD = 0.01              # fraction of changed pixels = activity
+PRE_ROLL = 30.0                        # seconds kept before activity
+POST_ROLL = 30.0                       # seconds kept after activity
+SEGMENT_SUFFIXES = (DATA_SUFFIX, ".mp4")
+
+
+def decode_small(jpeg, scale: int = DOWNSCALE) -> np.ndarray:
+    """Greyscale JPEG decoded at 1/`scale` size (only the DCT work that size needs)."""
+    im = Image.open(io.BytesIO(jpeg))
+    im.draft("L", (im.width // scale, im.height // scale))
+    return np.asarray(im.convert("L"))
+
+
+def motion_score(a: np.ndarray, b: np.ndarray, delta: int = PIXEL_DELTA) -> float:
+    """Fraction of pixels that differ by more than `delta` between two frames."""
+    if a.shape != b.shape:
+        return 1.0                                     # resolution change: treat as motion
+    diff = np.abs(np.subtract(a, b, dtype=np.int16))
+    return np.count_nonzero(diff > delta) / diff.size
+
+
+class ActivityGate:
+    """Keep active segments of one camera plus pre/post roll; delete the rest."""
+
+    def __init__(self, pre_segments: int, post_segments: int,
+                 threshold: float = ACTIVITY_THRESHOLD, dry_run: bool = False,
+                 on_score=None, on_drop=None):
+        self.threshold = threshold
+        self.dry_run = dry_run
+        self.on_score = on_score                       # called with (path, score) per segment
+        self.on_drop = on_drop                         # called with the path of each deleted segment
+        self.pending = collections.deque()             # inactive segments that may become pre-roll
+        self.pre_segments = pre_segments
+        self.post_segments = post_segments
+        self.post_left = 0
+        self.kept = self.dropped = 0                   # segments
+        self.kept_bytes = self.dropped_bytes = 0
+
+    def segment(self, path: pathlib.Path, score: float) -> None:
+        """A segment was closed with best motion score `score`."""
+        if self.on_score is not None:
+            self.on_score(path, score)
+        if score >= self.threshold:
+            while self.pending:
+                self._keep(self.pending.popleft())     # pre-roll
+            self._keep(path)
+            self.post_left = self.post_segments
+        elif self.post_left > 0:
+            self.post_left -= 1
+            self._keep(path)
+        else:
+            self.pending.append(path)
+            while len(self.pending) > self.pre_segments:
+                self._drop(self.pending.popleft())
+
+    def flush(self) -> None:
+        """No more segments (camera stopped): nothing followed the pending ones."""
+        while self.pending:
+            self._drop(self.pending.popleft())
+
+    def _keep(self, path: pathlib.Path) -> None:
+        self.kept += 1
+        self.kept_bytes += segment_bytes(path)
+
+    def _drop(self, path: pathlib.Path) -> None:
+        self.dropped += 1
+        self.dropped_bytes += segment_bytes(path)
+        if not self.dry_run:
+            remove_segment(path)
+            if self.on_drop is not None:
+                self.on_drop(path)
+
+
+def roll_segments(seconds: float, segment_seconds: float) -> int:
+    """Whole segments needed to cover `seconds` of pre- or post-roll."""
+    return max(0, math.ceil(seconds / segment_seconds - 0.01))
+
+
+class CameraActivity:
+    """Scores one camera's live frames and gates its segments (native backend)."""
+
+    def __init__(self, gate: ActivityGate, analyze_fps: float = ANALYZE_FPS):
+        self.gate = gate
+        self.interval = 1.0 / analyze_fps
+        self.prev = None
+        self.last = 0.0
+        self.best = 0.0                                # best score in the open segment
+        self.scored = 0
+        self.seconds = 0.0                             # time spent scoring
+
+    def frame(self, jpeg, now: float) -> None:
+        if now - self.last < self.interval:
+            return
+        self.last = now
+        t = time.perf_counter()
+        try:
+            small = decode_small(jpeg)
+        except (OSError, ValueError):                  # undecodable frame: no opinion
+            return
+        if self.prev is not None:
+            self.best = max(self.best, motion_score(small, self.prev))
+        self.prev = small
+        self.scored += 1
+        self.seconds += time.perf_counter() - t
+
+    def segment_closed(self, path: pathlib.Path) -> None:
+        self.gate.segment(pathlib.Path(path), self.best)
+        self.best = 0.0
+
+
+class ActivityMonitor:
+    """Per-camera activity gates sharing one configuration."""
+
+    def __init__(self, segment_seconds: float, pre_roll: float = PRE_ROLL,
+                 post_roll: float = POST_ROLL, threshold: float = ACTIVITY_THRESHOLD,
+                 analyze_fps: float = ANALYZE_FPS, dry_run: bool = False,
+                 on_score=None, on_drop=None):
+        self.pre_roll, self.post_roll = pre_roll, post_roll
+        self.pre_segments = roll_segments(pre_roll, segment_seconds)
+        self.post_segments = roll_segments(post_roll, segment_seconds)
+        self.threshold = threshold
+        self.analyze_fps = analyze_fps
+        self.dry_run = dry_run
+        self.on_score, self.on_drop = on_score, on_drop
+        self.cameras = {}
+        self._lock = threading.Lock()
+
+    def camera(self, cam_id: str) -> CameraActivity:
+        with self._lock:
+            c = self.cameras.get(cam_id)
+            if c is None:
+                gate = ActivityGate(self.pre_segments, self.post_segments,
+                                    self.threshold, self.dry_run, self.on_score, self.on_drop)
+                c = self.cameras[cam_id] = CameraActivity(gate, self.analyze_fps)
+            return c
+
+    def set_segment_seconds(self, seconds: float, cam_id: str = None) -> None:
+        """Re-count the pre/post roll in segments of a new length: one
+        camera's, or (no `cam_id`) the default for cameras added later."""
+        pre, post = roll_segments(self.pre_roll, seconds), roll_segments(self.post_roll, seconds)
+        if cam_id is None:
+            self.pre_segments, self.post_segments = pre, post
+            return
+        gate = self.camera(cam_id).gate
+        gate.pre_segments, gate.post_segments = pre, post
+
+    def snapshot(self) -> list:
+        return [{"camera": cam_id, "kept": c.gate.kept, "dropped": c.gate.dropped,
+                 "kept_bytes": c.gate.kept_bytes, "dropped_bytes": c.gate.dropped_bytes,
+                 "frames_scored": c.scored,
+                 "us_per_frame": 1e6 * c.seconds / c.scored if c.scored else None}
+                for cam_id, c in list(self.cameras.items())]
+
+    def score_closed(self, cam_id: str, path: pathlib.Path) -> None:
+        """Score and gate a finished segment that was not scored live (ffmpeg backend)."""
+        self.camera(cam_id).gate.segment(path, score_segment(path, self.analyze_fps))
+
+
+# ───── closed segments (offline and ffmpeg backend) ────────────────────────
+def score_segment(path, analyze_fps: float = ANALYZE_FPS, scale: int = DOWNSCALE) -> float:
+    """Best motion score of a finished .mjpeg or .mp4 segment."""
+    path = pathlib.Path(path)
+    best, prev = 0.0, None
+    for small in _small_frames(path, analyze_fps, scale):
+        if prev is not None:
+            best = max(best, motion_score(small, prev))
+        prev = small
+    return best
+
+
+def _small_frames(path: pathlib.Path, analyze_fps: float, scale: int):
+    if path.suffix == DATA_SUFFIX:
+        with SegmentReader(path) as seg:
+            last = -math.inf
+            for i in range(len(seg)):
+                ts = seg.timestamp(i)
+                if ts - last >= 1.0 / analyze_fps:
+                    last = ts
+                    try:
+                        yield decode_small(seg.frame(i), scale)
+                    except (OSError, ValueError):
+                        pass
+        return
+    # anything else: let ffmpeg decode, resample and shrink it to raw grey
+    w, h = 320 // scale, 240 // scale
+    proc = subprocess.Popen([
+        "ffmpeg", "-hide_banner", "-loglevel", "error", "-i", str(path),
+        "-vf", f"fps={analyze_fps:g},scale={w}:{h}", "-pix_fmt", "gray",
+        "-f", "rawvideo", "pipe:1",
+    ], stdout=subprocess.PIPE)
+    try:
+        while True:
+            buf = proc.stdout.read(w * h)
+            if len(buf) < w * h:
+                break
+            yield np.frombuffer(buf, np.uint8).reshape(h, w)
+    finally:
+        proc.stdout.close()
+        proc.wait()
+
+
+def gate_directory(root, pre_roll: float, post_roll: float, threshold: float,
+                   analyze_fps: float = ANALYZE_FPS, dry_run: bool = True):
+    """Gate every segment below `root` (per camera directory); returns the gates."""
+    root = pathlib.Path(root)
+    by_dir = collections.defaultdict(list)
+    for p in sorted(root.rglob("*")):
+        if p.suffix in SEGMENT_SUFFIXES and (p.suffix != DATA_SUFFIX or index_path(p).exists()):
+            by_dir[p.parent].append(p)
+    gates = {}
+    for cam_dir, paths in by_dir.items():
+        length = _segment_seconds(paths[0]) or 30.0
+        gate = ActivityGate(roll_segments(pre_roll, length), roll_segments(post_roll, length),
+                            threshold, dry_run)
+        for p in paths:
+            gate.segment(p, score_segment(p, analyze_fps))
+        gate.flush()
+        gates[cam_dir] = gate
+    return gates
+
+
+def _segment_seconds(path: pathlib.Path) -> float:
+    """Length of a segment, counting the last frame's interval too."""
+    if path.suffix != DATA_SUFFIX:
+        return 0.0
+    with SegmentReader(path) as seg:
+        n = len(seg)
+        return (seg.end - seg.start) * n / (n - 1) if n > 1 else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Activity gate for recorded segments")
+    parser.add_argument("root", type=pathlib.Path, help="camera or recordings directory")
+    parser.add_argument("--pre-roll", type=float, default=PRE_ROLL, help="seconds")
+    parser.add_argument("--post-roll", type=float, default=POST_ROLL, help="seconds")
+    parser.add_argument("--threshold", type=float, default=ACTIVITY_THRESHOLD,
+                        help="fraction of changed pixels that counts as activity")
+    parser.add_argument("--analyze-fps", type=float, default=ANALYZE_FPS)
+    parser.add_argument("--apply", action="store_true", help="delete the inactive segments")
+    args = parser.parse_args()
+
+    gates = gate_directory(args.root, args.pre_roll, args.post_roll, args.threshold,
+                           args.analyze_fps, dry_run=not args.apply)
+    total_kept = total_dropped = 0
+    for cam_dir, g in gates.items():
+        total = g.kept_bytes + g.dropped_bytes
+        print(f"{cam_dir}: keep {g.kept} / drop {g.dropped} segments, "
+              f"saves {g.dropped_bytes / 1e6:.1f} of {total / 1e6:.1f} MB")
+        total_kept += g.kept_bytes
+        total_dropped += g.dropped_bytes
+    if total_kept + total_dropped:
+        print(f"total: saves {100 * total_dropped / (total_kept + total_dropped):.0f}% "
+              f"({'deleted' if args.apply else 'dry run'})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""
+Activity gate benchmark
+
+ • cost: µs per scored frame for the 1/8-scale draft decode + NumPy diff,
+   against a full-resolution decode, and how many 15 fps cameras one core
+   can gate when scoring every frame or ANALYZE_FPS frames per second.
+ • storage: runs the gate over a recording (--recording DIR) or over a
+   synthetic one – a static bar scene with sensor noise and a few bursts of
+   someone walking through – and reports what it keeps and deletes.
+
+Usage:
+    python bench_activity.py
+    python bench_activity.py --recording recordings/cam_id --pre-roll 30 --post-roll 30
+"""
+
+import argparse
+import io
+import pathlib
+import shutil
+import tempfile
+import time
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+from activity import ANALYZE_FPS, decode_small, gate_directory, motion_score
+from segment_store import SegmentReader, SegmentWriter, iter_segments
+
+W, H = 320, 240
+
+
+def scene(rng: np.random.Generator) -> np.ndarray:
+    """A static 'bar': gradient wall, counter and a few bottles."""
+    img = Image.new("RGB", (W, H))
+    d = ImageDraw.Draw(img)
+    for y in range(H):
+        d.line([(0, y), (W, y)], fill=(90 + y // 4, 70 + y // 6, 50))
+    d.rectangle([0, 170, W, H], fill=(60, 40, 25))
+    for x in range(20, W, 30):
+        d.rectangle([x, 120, x + 8, 168], fill=tuple(int(c) for c in rng.integers(40, 220, 3)))
+    return np.asarray(img, np.int16)
+
+
+def frame(background: np.ndarray, rng: np.random.Generator, person_x=None) -> bytes:
+    img = background + rng.normal(0, 3, background.shape).astype(np.int16)   # sensor noise
+    img = Image.fromarray(np.clip(img, 0, 255).astype(np.uint8))
+    if person_x is not None:
+        d = ImageDraw.Draw(img)
+        d.ellipse([person_x, 60, person_x + 50, 230], fill=(30, 30, 45))
+        d.ellipse([person_x + 12, 30, person_x + 38, 62], fill=(200, 160, 130))
+    buf = io.BytesIO()
+    img.save(buf, "JPEG", quality=35)
+    return buf.getvalue()
+
+
+def synthesize(root: pathlib.Path, segments: int, seconds: float, fps: float,
+               active: set) -> None:
+    """Write a recording where the segments in `active` have someone walking by."""
+    rng = np.random.default_rng(0)
+    background = scene(rng)
+    cam = root / "synthetic_cam"
+    cam.mkdir(parents=True)
+    t = 1.7e9
+    per_seg = int(seconds * fps)
+    for s in range(segments):
+        w = SegmentWriter(cam / f"20250101_000000_{s:03d}.mjpeg")
+        for i in range(per_seg):
+            x = -50 + (W + 50) * i / per_seg if s in active else None
+            w.write(frame(background, rng, x), t)
+            t += 1 / fps
+        w.close()
+
+
+def cost(root: pathlib.Path, limit: int = 500) -> None:
+    jpegs = []
+    for path in iter_segments(root):
+        with SegmentReader(path) as seg:
+            jpegs += [bytes(seg.frame(i)) for i in range(len(seg))]
+        if len(jpegs) >= limit:
+            break
+    jpegs = jpegs[:limit]
+
+    t = time.perf_counter()
+    for j in jpegs:
+        np.asarray(Image.open(io.BytesIO(j)).convert("L"))
+    full = (time.perf_counter() - t) / len(jpegs)
+
+    prev = None
+    t = time.perf_counter()
+    for j in jpegs:
+        small = decode_small(j)
+        if prev is not None:
+            motion_score(small, prev)
+        prev = small
+    gated = (time.perf_counter() - t) / len(jpegs)
+
+    print(f"frames          {len(jpegs)} ({np.mean([len(j) for j in jpegs]) / 1e3:.1f} KB mean), "
+          f"scored at {prev.shape[1]}x{prev.shape[0]}")
+    print(f"full decode     {full * 1e6:8.0f} µs/frame")
+    print(f"draft + diff    {gated * 1e6:8.0f} µs/frame   ({full / gated:.1f}x less)")
+    print(f"one core gates  {1 / gated / 15:8.0f} cameras scoring every frame at 15 fps")
+    print(f"                {1 / gated / ANALYZE_FPS:8.0f} cameras at ANALYZE_FPS={ANALYZE_FPS:g}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Activity gate benchmark")
+    parser.add_argument("--recording", type=pathlib.Path, help="recorded segments (default: synthetic)")
+    parser.add_argument("--segments", type=int, default=24)
+    parser.add_argument("--segment-seconds", type=float, default=5.0)
+    parser.add_argument("--fps", type=float, default=15.0)
+    parser.add_argument("--active", type=int, nargs="*", default=[4, 5, 13, 20],
+                        help="synthetic segments with activity")
+    parser.add_argument("--pre-roll", type=float, default=5.0)
+    parser.add_argument("--post-roll", type=float, default=5.0)
+    parser.add_argument("--threshold", type=float, default=0.01)
+    args = parser.parse_args()
+
+    tmp = None
+    root = args.recording
+    if root is None:
+        tmp = pathlib.Path(tempfile.mkdtemp(prefix="bench_activity_"))
+        t = time.perf_counter()
+        synthesize(tmp, args.segments, args.segment_seconds, args.fps, set(args.active))
+        print(f"synthetic recording: {args.segments} x {args.segment_seconds:g} s segments, "
+              f"active {sorted(args.active)} ({time.perf_counter() - t:.1f} s to render)")
+        root = tmp
+    try:
+        cost(root)
+        t = time.perf_counter()
+        gates = gate_directory(root, args.pre_roll, args.post_roll, args.threshold, dry_run=True)
+        elapsed = time.perf_counter() - t
+        kept = sum(g.kept_bytes for g in gates.values())
+        dropped = sum(g.dropped_bytes for g in gates.values())
+        segs = sum(g.kept + g.dropped for g in gates.values())
+        print(f"gate            keep {sum(g.kept for g in gates.values())} / "
+              f"drop {sum(g.dropped for g in gates.values())} of {segs} segments "
+              f"(pre {args.pre_roll:g} s, post {args.post_roll:g} s) in {elapsed:.1f} s")
+        if kept + dropped:
+            print(f"storage saved   {dropped / 1e6:.1f} of {(kept + dropped) / 1e6:.1f} MB "
+                  f"({100 * dropped / (kept + dropped):.0f}%)")
+    finally:
+        if tmp is not None:
+            shutil.rmtree(tmp, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
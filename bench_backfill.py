@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+Backfill benchmark: frames recorded across WiFi drops, replay ring on vs off
+
+ • Runs the firmware in the host emulation (openmv_emu.py --clients 0) at
+   --fps with --drop windows in which its radio is gone; "ring" keeps the
+   firmware's REPLAY_BYTES, "off" sets it to 0.
+ • Records it with an in-process IngestEngine (which asks for a replay on
+   every reconnect) for --seconds, then reads the segments back.
+ • Per mode: frames on disk against --fps over the recorded time span,
+   frames lost / backfilled as the telemetry counts them (without the ring
+   the device captures nothing while its client is gone, so there is no
+   sequence gap to count), the longest hole in the recorded timeline, and
+   whether every segment's timestamps are in order and the segments do not
+   overlap.
+
+Usage:
+    python bench_backfill.py --drop 10:8 --drop 30:6 --seconds 50
+"""
+
+import argparse
+import pathlib
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from mjpeg_ingest import IngestEngine
+from segment_store import SegmentReader, iter_segments
+from supervisor import camera_key
+from telemetry import MetricsRegistry
+
+PORT = 18750
+
+
+def run(mode: str, args) -> dict:
+    out = pathlib.Path(tempfile.mkdtemp(prefix="bench_backfill_"))
+    cmd = [sys.executable, "openmv_emu.py", "--clients", "0", "--port", str(PORT),
+           "--set", f"TARGET_FPS={args.fps:g}", "--set", f"REPLAY_FPS={args.fps:g}"]
+    for drop in args.drop:
+        cmd += ["--drop", drop]
+    if mode == "off":
+        cmd += ["--set", "REPLAY_BYTES=0"]
+    emu = subprocess.Popen(cmd, cwd=pathlib.Path(__file__).parent, stdout=subprocess.DEVNULL)
+    try:
+        time.sleep(1.0)                                # drops are timed from the emulator's start
+        metrics = MetricsRegistry()
+        engine = IngestEngine(out, args.segment_seconds, metrics)
+        engine.start_in_thread()
+        cam = {"ip": "127.0.0.1", "port": PORT, "id": "bench_emu"}
+        engine.start(cam)
+        time.sleep(args.seconds - 1.0)
+        engine.stop(camera_key(cam))
+        timing = metrics.camera(cam["id"]).timing.snapshot()
+
+        stamps, ordered, prev_end, frames = [], True, 0.0, 0
+        for path in iter_segments(out):
+            with SegmentReader(path) as seg:
+                ts = [seg.timestamp(i) for i in range(len(seg))]
+            frames += len(ts)
+            ordered &= ts == sorted(ts) and (not ts or ts[0] >= prev_end)
+            prev_end = ts[-1] if ts else prev_end
+            stamps += ts
+        hole = max((b - a for a, b in zip(stamps, stamps[1:])), default=0.0)
+        span = stamps[-1] - stamps[0] if stamps else 0.0
+        return {"mode": mode, "span": span, "on_disk": frames, "lost": sum(timing["lost"].values()),
+                "backfilled": timing["backfilled"], "hole": hole, "ordered": ordered}
+    finally:
+        emu.terminate()
+        emu.wait()
+        shutil.rmtree(out, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Frames kept across WiFi drops, with and without replay")
+    parser.add_argument("--drop", action="append", metavar="AT:SECONDS",
+                        help="radio down for SECONDS from AT s (repeatable, default 10:8 and 30:6)")
+    parser.add_argument("--seconds", type=float, default=50.0)
+    parser.add_argument("--fps", type=float, default=15.0)
+    parser.add_argument("--segment-seconds", type=float, default=30.0)
+    parser.add_argument("--modes", nargs="+", default=["off", "ring"], choices=["off", "ring"])
+    args = parser.parse_args()
+    args.drop = args.drop or ["10:8", "30:6"]
+
+    print(f"{args.fps:g} fps, {args.seconds:g} s, radio down at {', '.join(args.drop)} (AT:SECONDS)")
+    print(f"{'mode':>5} {'span':>6} {'on disk':>8} {'covered':>7} {'lost':>6} {'backfilled':>10} "
+          f"{'max hole':>8} {'in order':>8}")
+    for mode in args.modes:
+        r = run(mode, args)
+        covered = 100 * r["on_disk"] / (args.fps * r["span"]) if r["span"] else 0.0
+        print(f"{r['mode']:>5} {r['span']:>5.1f}s {r['on_disk']:>8} {covered:>6.1f}% {r['lost']:>6} "
+              f"{r['backfilled']:>10} {r['hole']:>7.1f}s {'yes' if r['ordered'] else 'NO':>8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+Adaptive bitrate benchmark: the rate controller against a link that changes
+
+ • Starts cameras whose radio follows a --link schedule (Mbit/s over time):
+   simulated cameras (fleet_sim.py, --device sim) or the real firmware in
+   the host emulation (openmv_emu.py --clients 0, --device emu, one camera).
+ • Records them with an in-process IngestEngine and, in the "on" mode, a
+   rate_control.RateController aiming at --target-fps (and --budget-kbps);
+   in the "off" mode the cameras keep their boot settings (QVGA q35 at
+   --target-fps).
+ • Every --interval prints a timeline row per mode: link rate, the settings
+   of camera 0, the fps and kbit/s the recorder received (mean over the
+   cameras); the summary gives mean fps, kbit/s and the share of intervals
+   below 85 % of the target fps for each link phase.
+
+Usage:
+    python bench_bitrate.py --cameras 4 --link 0:8,20:0.8,45:8 --seconds 70
+    python bench_bitrate.py --device emu --link 0:8,20:0.8,45:8
+"""
+
+import argparse
+import pathlib
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from fleet_sim import LinkSchedule, start_fleet
+from mjpeg_ingest import IngestEngine
+from rate_control import CONGESTED, RateController
+from supervisor import camera_key
+from telemetry import MetricsRegistry
+
+BASE_PORT = 18700
+
+
+def start_devices(args):
+    """(cameras, processes); cameras are (cam dict, mac) pairs."""
+    if args.device == "sim":
+        procs, _ = start_fleet(args.cameras, BASE_PORT, fps=args.target_fps,
+                               size_mean=args.size_mean, size_sd=args.size_mean // 4,
+                               link=args.link)
+        cams = [({"ip": "127.0.0.1", "port": BASE_PORT + i, "id": f"bench_{i:03d}"}, f"02bd{i:08x}")
+                for i in range(args.cameras)]
+        return cams, procs
+    emu = subprocess.Popen([sys.executable, "openmv_emu.py", "--clients", "0",
+                            "--port", str(BASE_PORT), "--control-port", str(BASE_PORT + 1),
+                            "--link-mbps", args.link, "--size-mean", str(args.size_mean),
+                            "--set", f"TARGET_FPS={args.target_fps:g}"],
+                           cwd=pathlib.Path(__file__).parent, stdout=subprocess.DEVNULL)
+    return [({"ip": "127.0.0.1", "port": BASE_PORT, "id": "bench_emu"}, "02bd0e000001")], [emu]
+
+
+def run(mode: str, args) -> list:
+    """Timeline rows (t, link Mbit/s, settings, fps, kbit/s) of one mode."""
+    out = pathlib.Path(tempfile.mkdtemp(prefix="bench_bitrate_"))
+    cams, procs = start_devices(args)
+    engine = None
+    try:
+        link = LinkSchedule(args.link)
+        time.sleep(1.0)                                # let the devices listen
+        metrics = MetricsRegistry()
+        engine = IngestEngine(out, 30.0, metrics)
+        engine.start_in_thread()
+        controller = None
+        if mode == "on":
+            port = 1 if args.device == "emu" else 0    # the emulator remaps CONTROL_PORT
+            addresses = {cam["id"]: (mac, cam["ip"], cam["port"] + port) for cam, mac in cams}
+            controller = RateController(metrics, lambda: addresses, args.target_fps,
+                                        args.budget_kbps, interval=args.interval)
+            controller.start()
+        for cam, _ in cams:
+            engine.start(cam)
+        rows, last = [], None
+        t0 = time.monotonic()
+        while time.monotonic() - t0 < args.seconds:
+            time.sleep(args.interval)
+            snaps = metrics.snapshot()
+            frames = sum(s["frames"] for s in snaps)
+            nbytes = sum(s["bytes"] for s in snaps)
+            now = time.monotonic()
+            if last is not None:
+                dt, n = now - last[0], max(1, len(snaps))
+                settings = "QVGA q35"
+                if controller is not None and controller.cameras:
+                    c = controller.snapshot()[0]
+                    settings = f"{c['framesize']} q{c['quality']} {c['fps']:g}fps"
+                rows.append((now - t0, link.mbps(), settings,
+                             (frames - last[1]) / dt / n, (nbytes - last[2]) * 8 / dt / n / 1000))
+            last = (now, frames, nbytes)
+        return rows
+    finally:
+        if engine is not None:                         # the devices serve one client each
+            for cam, _ in cams:
+                engine.stop(camera_key(cam))
+        for p in procs:
+            p.terminate()
+        shutil.rmtree(out, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rate controller vs fixed settings on a changing link")
+    parser.add_argument("--device", choices=["sim", "emu"], default="sim")
+    parser.add_argument("--cameras", type=int, default=4, help="simulated cameras (sim only)")
+    parser.add_argument("--link", default="0:8,20:0.8,45:8", help="per-camera Mbit/s schedule")
+    parser.add_argument("--seconds", type=float, default=70.0)
+    parser.add_argument("--interval", type=float, default=2.0)
+    parser.add_argument("--target-fps", type=float, default=15.0)
+    parser.add_argument("--budget-kbps", type=float, help="per-camera bitrate budget")
+    parser.add_argument("--size-mean", type=int, default=12000, help="JPEG bytes at QVGA q35")
+    parser.add_argument("--modes", nargs="+", default=["off", "on"], choices=["off", "on"])
+    args = parser.parse_args()
+
+    results = {mode: run(mode, args) for mode in args.modes}
+    print(f"link {args.link} Mbit/s per camera, target {args.target_fps:g} fps"
+          + (f", budget {args.budget_kbps:g} kbit/s" if args.budget_kbps else ""))
+    print(f"{'t':>5} {'link':>6}" + "".join(f" | {mode + ' settings':>20} {'fps':>5} {'kbit/s':>7}"
+                                           for mode in args.modes))
+    for i in range(min(len(rows) for rows in results.values())):
+        t, mbps = results[args.modes[0]][i][:2]
+        line = f"{t:>5.0f} {mbps:>6g}"
+        for mode in args.modes:
+            _, _, settings, fps, kbps = results[mode][i]
+            line += f" | {settings:>20} {fps:>5.1f} {kbps:>7.0f}"
+        print(line)
+
+    print(f"\n{'phase':>12} {'mode':>5} {'fps':>6} {'kbit/s':>7} {'slow':>6}")
+    points = LinkSchedule(args.link).points
+    for k, (start, mbps) in enumerate(points):
+        end = points[k + 1][0] if k + 1 < len(points) else args.seconds
+        for mode in args.modes:
+            rows = [r for r in results[mode] if start < r[0] <= end]
+            if not rows:
+                continue
+            slow = sum(r[3] < CONGESTED * args.target_fps for r in rows) / len(rows)
+            print(f"{f'{start:g}-{end:g}s':>12} {mode:>5} {sum(r[3] for r in rows) / len(rows):>6.1f} "
+                  f"{sum(r[4] for r in rows) / len(rows):>7.0f} {100 * slow:>5.0f}%  ({mbps:g} Mbit/s)")
+
+
+if __name__ == "__main__":
+    main()
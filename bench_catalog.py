@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+Segment catalog benchmark
+
+Fills a scratch catalog with synthetic segments (no files: 30 s segments
+for --cameras cameras, --segments in total, activity scores attached), then
+reports
+
+ • incremental insert cost (what the recorder pays per closed segment),
+ • "camera X, one day" and "camera X, one hour" range queries,
+ • per-camera and global quota checks, and the retention candidate queries
+   for both policies,
+
+all with the catalog at its final size.
+
+Usage:
+    python bench_catalog.py --segments 2000000 --cameras 100
+"""
+
+import argparse
+import pathlib
+import random
+import shutil
+import statistics
+import tempfile
+import time
+
+from catalog import ACTIVITY, OLDEST, Catalog
+
+SEGMENT_SECONDS = 30.0
+T0 = 1.7e9
+
+
+def timed(fn, repeat: int = 200) -> float:
+    """Median milliseconds of `fn()`."""
+    samples = []
+    for _ in range(repeat):
+        t = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - t)
+    return 1e3 * statistics.median(samples)
+
+
+def fill(catalog: Catalog, n: int, cameras: int, rng: random.Random) -> None:
+    rows = []
+    for i in range(n):
+        cam, k = i % cameras, i // cameras
+        start = T0 + k * SEGMENT_SECONDS
+        rows.append((f"cam{cam:04d}/{k:09d}.mjpeg", f"cam{cam:04d}", None, start,
+                     start + SEGMENT_SECONDS - 0.07, 430, rng.randint(3_000_000, 6_000_000),
+                     rng.random() * 0.05))
+        if len(rows) == 50_000 or i == n - 1:
+            with catalog._lock:
+                catalog.db.execute("BEGIN")
+                catalog.db.executemany("INSERT INTO segments VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+                catalog.db.execute("COMMIT")
+            rows.clear()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Segment catalog benchmark")
+    parser.add_argument("--segments", type=int, default=1_000_000)
+    parser.add_argument("--cameras", type=int, default=50)
+    args = parser.parse_args()
+
+    tmp = pathlib.Path(tempfile.mkdtemp(prefix="bench_catalog_"))
+    rng = random.Random(0)
+    try:
+        catalog = Catalog(tmp)
+        t = time.perf_counter()
+        fill(catalog, args.segments, args.cameras, rng)
+        elapsed = time.perf_counter() - t
+        size = sum(p.stat().st_size for p in tmp.iterdir())
+        span = args.segments // args.cameras * SEGMENT_SECONDS
+        print(f"catalog         {args.segments} segments, {args.cameras} cameras, "
+              f"{span / 86400:.0f} days each, {size / 1e6:.0f} MB on disk, "
+              f"bulk load {elapsed:.1f} s")
+
+        k = [args.segments // args.cameras]
+
+        def add():
+            k[0] += 1
+            start = T0 + k[0] * SEGMENT_SECONDS
+            catalog.add("cam0000", tmp / "cam0000" / f"{k[0]:09d}.mjpeg",
+                        {"start": start, "end": start + 29.9, "frames": 430, "bytes": 4_000_000})
+        print(f"insert          {timed(add, 500):8.3f} ms per closed segment")
+
+        def day():
+            cam = f"cam{rng.randrange(args.cameras):04d}"
+            t0 = T0 + rng.uniform(0, max(0.0, span - 86400))
+            return catalog.query(cam, t0, t0 + 86400)
+        n = len(day())
+        print(f"query 1 day     {timed(day):8.3f} ms ({n} segments)")
+
+        def hour():
+            cam = f"cam{rng.randrange(args.cameras):04d}"
+            t0 = T0 + rng.uniform(0, max(0.0, span - 3600))
+            return catalog.query(cam, t0, t0 + 3600)
+        print(f"query 1 hour    {timed(hour):8.3f} ms")
+
+        print(f"quota check     {timed(lambda: (catalog.cameras(), catalog.total_bytes()), 20):8.3f} ms "
+              f"(all cameras + total)")
+        for policy in (OLDEST, ACTIVITY):
+            print(f"{policy + '-first':<15} {timed(lambda: catalog.candidates(policy, 'cam0001'), 50):8.3f} ms "
+                  f"per camera batch, "
+                  f"{timed(lambda: catalog.candidates(policy), 20):.3f} ms global batch")
+        catalog.close()
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""
+Dataset extractor benchmark
+
+Extracts every frame of a recording (--recording DIR, or a synthetic one
+rendered like bench_activity.py's) with FrameExtractor and reports frames/s
+for each worker count, the speed-up over one worker, and the same run with
+arrays pickled back instead of passed through shared memory.
+
+Usage:
+    python bench_dataset.py --workers 1 2 4 8
+    python bench_dataset.py --recording recordings/ --fps 5 --size 160x120
+"""
+
+import argparse
+import os
+import pathlib
+import resource
+import shutil
+import tempfile
+import time
+
+from bench_activity import synthesize
+from dataset import FrameExtractor
+
+
+def run(root, args, workers: int, shared: bool = True) -> tuple:
+    ex = FrameExtractor(root, args.fps, workers, args.size, batch=args.batch, shared=shared)
+    t = time.perf_counter()
+    n = sum(1 for _ in ex)
+    return n, time.perf_counter() - t
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Dataset extractor benchmark")
+    parser.add_argument("--recording", type=pathlib.Path, help="recordings directory (default: synthetic)")
+    parser.add_argument("--workers", type=int, nargs="+",
+                        default=sorted({1, 2, 4, os.cpu_count() or 1}))
+    parser.add_argument("--fps", type=float, default=15.0, help="sample rate (15 = every frame)")
+    parser.add_argument("--size", help="WxH, default: full frames")
+    parser.add_argument("--batch", type=int, default=32)
+    parser.add_argument("--segments", type=int, default=12)
+    parser.add_argument("--segment-seconds", type=float, default=5.0)
+    args = parser.parse_args()
+    args.size = tuple(int(v) for v in args.size.lower().split("x")) if args.size else None
+
+    tmp = None
+    root = args.recording
+    if root is None:
+        tmp = pathlib.Path(tempfile.mkdtemp(prefix="bench_dataset_"))
+        synthesize(tmp, args.segments, args.segment_seconds, 15.0, {2, 7})
+        root = tmp
+    try:
+        print(f"{'workers':>7} {'frames':>7} {'seconds':>8} {'frames/s':>9} {'speed-up':>8}")
+        base = None
+        for w in args.workers:
+            n, elapsed = run(root, args, w)
+            fps = n / elapsed
+            base = base or fps
+            print(f"{w:>7} {n:>7} {elapsed:>8.2f} {fps:>9.0f} {fps / base:>7.2f}x")
+        w = args.workers[-1]
+        n, elapsed = run(root, args, w, shared=False)
+        print(f"pickled arrays instead of shared memory, {w} workers: {n / elapsed:.0f} frames/s")
+        print(f"peak RSS of the consumer: "
+              f"{resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} MB")
+    finally:
+        if tmp is not None:
+            shutil.rmtree(tmp, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+Near-duplicate index benchmark
+
+ • hashing: frames/s for pHashing JPEGs (draft decode + batched DCT),
+ • index: builds a HashIndex of --hashes synthetic hashes (clusters of
+   near-identical frames, like a quiet camera, spread over --cameras cameras
+   at one hash per camera per second), then reports insert rate, queries/s
+   for "near-duplicate of anything" and "…in the last 10 minutes" (hits and
+   misses), and the size / save / load time of the on-disk format.
+
+Usage:
+    python bench_dedup.py --hashes 10000000
+"""
+
+import argparse
+import io
+import os
+import pathlib
+import resource
+import tempfile
+import time
+
+import numpy as np
+from PIL import Image
+
+from dedup import RADIUS, HashIndex, hash_jpegs
+
+T0 = 1_700_000_000
+
+
+def synthetic_hashes(n: int, rng: np.random.Generator) -> np.ndarray:
+    """Clusters of ~20 hashes within a few bits of a random centre."""
+    centres = rng.integers(0, 2 ** 63, n // 20 + 1, dtype=np.uint64) * np.uint64(2)
+    h = np.repeat(centres, 20)[:n]
+    for _ in range(3):                                 # up to 3 flipped bits
+        bit = rng.integers(0, 64, n).astype(np.uint64)
+        h ^= np.where(rng.random(n) < 0.5, np.uint64(1) << bit, np.uint64(0))
+    return h
+
+
+def qps(fn, queries) -> float:
+    t = time.perf_counter()
+    for q in queries:
+        fn(q)
+    return len(queries) / (time.perf_counter() - t)
+
+
+def flip(h: np.ndarray, bits: int, rng: np.random.Generator) -> np.ndarray:
+    out = h.copy()
+    for _ in range(bits):
+        out ^= np.uint64(1) << rng.integers(0, 64, len(h)).astype(np.uint64)
+    return out
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Near-duplicate index benchmark")
+    parser.add_argument("--hashes", type=int, default=10_000_000)
+    parser.add_argument("--cameras", type=int, default=100)
+    parser.add_argument("--queries", type=int, default=5000)
+    parser.add_argument("--radius", type=int, default=RADIUS)
+    args = parser.parse_args()
+    rng = np.random.default_rng(0)
+
+    jpegs = []
+    for _ in range(64):
+        buf = io.BytesIO()
+        Image.fromarray(rng.integers(0, 255, (240, 320, 3), dtype=np.uint8)).save(buf, "JPEG", quality=35)
+        jpegs.append(buf.getvalue())
+    t = time.perf_counter()
+    for _ in range(5):
+        hash_jpegs(jpegs)
+    print(f"pHash           {5 * len(jpegs) / (time.perf_counter() - t):8.0f} QVGA JPEGs/s (batches of 64)")
+
+    hashes = synthetic_hashes(args.hashes, rng)
+    index = HashIndex()
+    step = args.cameras * 60                           # one minute of all cameras
+    t = time.perf_counter()
+    for k in range(0, args.hashes, step):
+        ts = T0 + k // args.cameras
+        for c in range(args.cameras):
+            part = hashes[k + c:k + step:args.cameras]
+            if len(part):
+                index.add(part, ts, f"cam{c:03d}")
+    build = time.perf_counter() - t
+    print(f"insert          {args.hashes / build:8.0f} hashes/s ({args.hashes} hashes, "
+          f"{len(index.runs)} runs, {build:.1f} s)")
+
+    now = T0 + args.hashes // args.cameras
+    q = rng.integers(0, args.hashes, args.queries)
+    hits = flip(hashes[q], 2, rng)
+    misses = rng.integers(0, 2 ** 63, args.queries, dtype=np.uint64)
+    recent = flip(hashes[args.hashes - 1 - rng.integers(0, 600 * args.cameras, args.queries)], 2, rng)
+    r = args.radius
+    print(f"query overall   {qps(lambda h: index.contains(h, r), hits):8.0f} q/s hit, "
+          f"{qps(lambda h: index.contains(h, r), misses):.0f} q/s miss")
+    print(f"query last 10m  {qps(lambda h: index.contains(h, r, now - 600), recent):8.0f} q/s hit, "
+          f"{qps(lambda h: index.contains(h, r, now - 600), misses):.0f} q/s miss")
+    found = sum(index.contains(h, r) for h in hits[:500])
+    print(f"recall          {found / 5:8.1f} % of 2-bit-flipped stored hashes found")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = pathlib.Path(tmp) / "dedup.npz"
+        t = time.perf_counter()
+        index.save(path)
+        save = time.perf_counter() - t
+        t = time.perf_counter()
+        HashIndex.load(path)
+        load = time.perf_counter() - t
+        size = os.path.getsize(path)
+    print(f"on disk         {size / 1e6:8.1f} MB ({size / args.hashes:.1f} B/hash), "
+          f"save {save:.1f} s, load + rebuild {load:.1f} s")
+    print(f"peak RSS        {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:8.0f} MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+"""
+Discovery benchmark: a venue-wide registration storm
+
+ • blast: every simulated device fires `--repeats` registrations back to back;
+   reports how many packets/s the listener handles (received / CPU time spent
+   in the handler) and how many ACKs it had to send.
+ • storm: every device behaves like `register_device` after a power cycle –
+   first packet at a random moment within `--ramp` s, then one per second
+   until ACKed – and reports time to first ACK (p50/p99/max) and total packets.
+
+Both phases run against the asyncio listener (discovery.py) and, with
+`--legacy`, against the previous blocking one-thread loop for comparison.
+
+Usage:
+    python bench_discovery.py --devices 1000 --repeats 20
+"""
+
+import argparse
+import contextlib
+import io
+import logging
+import multiprocessing as mp
+import random
+import re
+import resource
+import selectors
+import socket
+import time
+
+PORT = 18000
+
+
+# ───── listeners under test (run in their own process) ─────────────────────
+def asyncio_listener(port: int, ready, done, results) -> None:
+    import asyncio
+    from discovery import serve
+    from registry import CameraRegistry
+
+    logging.basicConfig(level=logging.INFO, stream=io.StringIO())
+
+    async def main():
+        proto = await serve(port, CameraRegistry(), lambda cam: None)
+        handler = proto.datagram_received
+        busy = [0.0]
+
+        def timed(data, addr):
+            t = time.perf_counter()
+            handler(data, addr)
+            busy[0] += time.perf_counter() - t
+        proto.datagram_received = timed
+        ready.set()
+        while not done.is_set():
+            await asyncio.sleep(0.05)
+        results.put({"packets": proto.packets, "acks": proto.acks_sent, "busy": busy[0]})
+
+    asyncio.run(main())
+
+
+def legacy_listener(port: int, ready, done, results) -> None:
+    """The pre-asyncio run_udp_listener loop: 3 regexes, print, INFO log, ACK per packet."""
+    logging.basicConfig(level=logging.INFO, stream=io.StringIO())
+    log = logging.getLogger("legacy")
+    known = {}
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind(("", port))
+    sock.settimeout(0.05)
+    packets = acks = 0
+    busy = 0.0
+    ready.set()
+    with contextlib.redirect_stdout(io.StringIO()) as out:
+        while not done.is_set():
+            try:
+                data, addr = sock.recvfrom(512)
+            except socket.timeout:
+                out.seek(0); out.truncate()
+                continue
+            t = time.perf_counter()
+            packets += 1
+            data_str = data.decode("utf-8")
+            print(data_str)
+            log.info(f"Received registration from {addr[0]}:{addr[1]}: {data_str}")
+            ip = re.search(r"IP:([^|]+)", data_str)
+            mac = re.search(r"MAC:([^|]+)", data_str)
+            re.search(r"PORT:(\d+)", data_str)
+            if ip and mac:
+                sock.sendto(b"SIPBUDDY_ACK", addr)
+                acks += 1
+                log.info(f"Sent acknowledgment to {addr[0]}")
+                known.setdefault(mac.group(1), ip.group(1))
+            busy += time.perf_counter() - t
+    results.put({"packets": packets, "acks": acks, "busy": busy})
+
+
+# ───── simulated devices ───────────────────────────────────────────────────
+def make_devices(n: int) -> list:
+    devices = []
+    for i in range(n):
+        s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        s.setblocking(False)
+        s.bind(("127.0.0.1", 0))
+        mac = f"02bd{i:08x}"
+        msg = f"SIPBUDDY_REGISTER|IP:10.0.{i // 250}.{i % 250 + 1}|MAC:{mac}|PORT:8080".encode()
+        devices.append((s, msg))
+    return devices
+
+
+def blast(devices: list, repeats: int, port: int) -> int:
+    sent = 0
+    for _ in range(repeats):
+        for s, msg in devices:
+            try:
+                s.sendto(msg, ("127.0.0.1", port))
+                sent += 1
+            except BlockingIOError:
+                pass
+    return sent
+
+
+def storm(devices: list, port: int, ramp: float, timeout: float) -> dict:
+    rng = random.Random(1)
+    sel = selectors.DefaultSelector()
+    start = time.monotonic()
+    next_send = {i: start + rng.uniform(0, ramp) for i in range(len(devices))}
+    first_send, acked = {}, {}
+    for i, (s, _) in enumerate(devices):
+        sel.register(s, selectors.EVENT_READ, i)
+    sent = 0
+    while next_send and time.monotonic() - start < timeout:
+        now = time.monotonic()
+        for i in [i for i, t in next_send.items() if t <= now]:
+            s, msg = devices[i]
+            s.sendto(msg, ("127.0.0.1", port))
+            sent += 1
+            first_send.setdefault(i, now)
+            next_send[i] = now + 1.0                   # register_device retries every second
+        wait = max(0.0, min(next_send.values(), default=now) - time.monotonic())
+        for key, _ in sel.select(timeout=min(wait, 0.05)):
+            i = key.data
+            try:
+                while True:
+                    if key.fileobj.recv(64) == b"SIPBUDDY_ACK" and i not in acked:
+                        acked[i] = time.monotonic() - first_send[i]
+                        next_send.pop(i, None)
+            except BlockingIOError:
+                pass
+    sel.close()
+    lat = sorted(acked.values())
+    pct = lambda p: lat[min(len(lat) - 1, int(p * len(lat)))] * 1e3 if lat else float("nan")
+    return {"acked": len(acked), "sent": sent, "p50": pct(0.5), "p99": pct(0.99),
+            "max": lat[-1] * 1e3 if lat else float("nan")}
+
+
+def run(name: str, target, args, devices: list) -> None:
+    for phase in ("blast", "storm"):
+        ready, done, results = mp.Event(), mp.Event(), mp.Queue()
+        proc = mp.Process(target=target, args=(PORT, ready, done, results), daemon=True)
+        proc.start()
+        ready.wait()
+        t0 = time.monotonic()
+        if phase == "blast":
+            sent = blast(devices, args.repeats, PORT)
+            time.sleep(1.0)                            # let the listener drain
+        else:
+            s = storm(devices, PORT, args.ramp, args.timeout)
+        done.set()
+        r = results.get()
+        proc.join()
+        for sock, _ in devices:                        # drop stale ACKs
+            with contextlib.suppress(BlockingIOError):
+                while sock.recv(64):
+                    pass
+        if phase == "blast":
+            print(f"{name:<8} blast  sent {sent:>7}  handled {r['packets']:>7}  "
+                  f"{r['packets'] / r['busy']:>10,.0f} pkt/s  acks {r['acks']:>7}")
+        else:
+            print(f"{name:<8} storm  sent {s['sent']:>7}  handled {r['packets']:>7}  "
+                  f"acked {s['acked']}/{len(devices)}  first ACK p50 {s['p50']:.1f} ms  "
+                  f"p99 {s['p99']:.1f} ms  max {s['max']:.1f} ms  "
+                  f"({time.monotonic() - t0:.1f} s)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SipBuddy discovery storm benchmark")
+    parser.add_argument("--devices", type=int, default=1000)
+    parser.add_argument("--repeats", type=int, default=20, help="packets per device in the blast phase")
+    parser.add_argument("--ramp", type=float, default=2.0, help="seconds over which devices boot")
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--legacy", action="store_true", help="also run the old blocking listener")
+    args = parser.parse_args()
+
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (min(hard, max(soft, args.devices + 256)), hard))
+    devices = make_devices(args.devices)
+    run("asyncio", asyncio_listener, args, devices)
+    if args.legacy:
+        run("legacy", legacy_listener, args, devices)
+
+
+if __name__ == "__main__":
+    main()
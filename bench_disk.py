@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+"""
+Segment write benchmark on a slow disk: direct writes vs the write-behind engine
+
+ • A model of slow storage is injected under both writers: every write call
+   costs --latency-ms plus its size at --disk-mbps, every fsync / syncfs
+   --sync-ms,
+   one request at a time (a USB stick / SD card / busy NAS).  With
+   --latency-ms 0 --disk-mbps 0 --sync-ms 0 nothing is injected and --dir
+   decides which disk is measured.
+ • One event loop plays the ingest loop: --cameras cameras each hand a
+   --frame-kb frame every 1/--fps seconds to a SegmentFile (as
+   IngestEngine.run_camera does).  A camera that falls behind schedule skips
+   frames, like the firmware does when its client is slow.
+ • direct is the per-frame unbuffered SegmentWriter on the loop;
+   the write-behind rows use disk_writer.DiskWriter with each drop policy
+   and a --buffer-mb budget.
+
+Per row: offered and sustained MB/s, frames skipped (camera behind) and
+dropped (drop policy), the event loop's stall per frame (p99 / max), the
+writer's write-call and group-fsync latency, the age of a frame when it hit
+the disk and the peak buffered memory.  Every frame reported as written is
+then read back from the segments to check the index.
+
+Usage:
+    python bench_disk.py --cameras 40 --fps 15 --seconds 10
+"""
+
+import argparse
+import asyncio
+import pathlib
+import shutil
+import tempfile
+import threading
+import time
+
+import mjpeg_ingest
+from disk_writer import BLOCK, POLICIES, DiskWriter
+from mjpeg_ingest import SegmentFile
+from segment_store import SegmentReader, SegmentWriter, iter_segments
+from telemetry import percentile
+
+
+class SlowDisk:
+    """Injected latency: per request, per byte, per sync; one request at a time."""
+
+    def __init__(self, latency: float, mbps: float, sync: float):
+        self.latency, self.mbps, self.sync_latency = latency, mbps, sync
+        self.lock = threading.Lock()
+
+    def request(self, nbytes: int) -> None:
+        delay = self.latency + (nbytes / (self.mbps * 1e6) if self.mbps else 0.0)
+        if delay:
+            with self.lock:
+                time.sleep(delay)
+
+    def sync(self) -> None:
+        if self.sync_latency:
+            with self.lock:
+                time.sleep(self.sync_latency)
+
+
+def slow_segment_writer(disk: SlowDisk):
+    class SlowSegmentWriter(SegmentWriter):
+        def write(self, jpeg, ts):
+            disk.request(len(jpeg))                    # the frame
+            disk.request(24)                           # its index record
+            super().write(jpeg, ts)
+    return SlowSegmentWriter
+
+
+class SlowDiskWriter(DiskWriter):
+    def __init__(self, disk: SlowDisk, **kwargs):
+        super().__init__(**kwargs)
+        self.disk = disk
+
+    def _pwrite(self, fd, data, offset):
+        self.disk.request(len(data))
+        super()._pwrite(fd, data, offset)
+
+    def _datasync(self, fd):
+        self.disk.sync()
+        super()._datasync(fd)
+
+    def _syncfs(self, fd):
+        self.disk.sync()
+        return super()._syncfs(fd)
+
+
+async def camera(i: int, segments: SegmentFile, writer, args, stats: dict, stop: float) -> None:
+    cam_id = f"bench_{i:03d}"
+    frame = (b"\xff\xd8" + bytes([i % 256]) * (args.frame_kb * 1024 - 4) + b"\xff\xd9")
+    period = 1.0 / args.fps
+    block = writer is not None and writer.policy_for(cam_id) == BLOCK
+    due = time.monotonic() + period * i / args.cameras    # spread the cameras out
+    while due < stop:
+        await asyncio.sleep(max(0.0, due - time.monotonic()))
+        if block and writer.full():
+            await writer.room(cam_id)
+        t = time.perf_counter()
+        written = segments.write(frame, time.time())
+        stats["stall"].append(time.perf_counter() - t)
+        stats["offered"] += 1
+        stats["written" if written else "dropped"] += 1
+        due += period
+        now = time.monotonic()
+        if now - due > period:                         # behind: skip what the camera could not send
+            missed = int((now - due) / period)
+            stats["skipped"] += missed
+            due += missed * period
+    segments.close()
+
+
+async def load(out: pathlib.Path, writer, args) -> dict:
+    stats = {"stall": [], "offered": 0, "written": 0, "dropped": 0, "skipped": 0}
+    stop = time.monotonic() + args.seconds
+    start_bytes = writer.written if writer is not None else 0
+    t0 = time.monotonic()
+    await asyncio.gather(*(camera(i, SegmentFile(out / f"bench_{i:03d}", args.segment_seconds,
+                                                 None, writer, f"bench_{i:03d}"),
+                                  writer, args, stats, stop)
+                           for i in range(args.cameras)))
+    elapsed = time.monotonic() - t0
+    if writer is not None:                             # on disk within the run
+        stats["disk_bytes"] = writer.written - start_bytes
+    else:
+        stats["disk_bytes"] = stats["written"] * args.frame_kb * 1024
+    stats["seconds"] = elapsed
+    return stats
+
+
+def run(mode: str, args) -> dict:
+    out = pathlib.Path(tempfile.mkdtemp(prefix="bench_disk_", dir=args.dir))
+    disk = SlowDisk(args.latency_ms / 1000, args.disk_mbps, args.sync_ms / 1000)
+    writer = None
+    original = mjpeg_ingest.SegmentWriter
+    try:
+        if mode == "direct":
+            mjpeg_ingest.SegmentWriter = slow_segment_writer(disk)
+        else:
+            writer = SlowDiskWriter(disk, max_buffer=int(args.buffer_mb * 1e6),
+                                    durability=args.durability, policy=mode)
+            writer.start()
+        stats = asyncio.run(load(out, writer, args))
+        snap = None
+        if writer is not None:
+            snap = writer.snapshot()
+            writer.drain()
+            # drop-oldest also evicts frames that were accepted
+            stats["dropped"] = sum(writer.dropped.values())
+            stats["written"] = stats["offered"] - stats["dropped"]
+        on_disk = sum(len(SegmentReader(p)) for p in iter_segments(out))
+    finally:
+        mjpeg_ingest.SegmentWriter = original
+        shutil.rmtree(out, ignore_errors=True)
+    stall = sorted(stats["stall"])
+    return {"stats": stats, "snap": snap, "on_disk": on_disk,
+            "stall_p99": percentile(stall, 0.99), "stall_max": stall[-1] if stall else 0.0}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Segment writes on a slow disk: direct vs write-behind")
+    parser.add_argument("--cameras", type=int, default=40)
+    parser.add_argument("--fps", type=float, default=15.0)
+    parser.add_argument("--frame-kb", type=int, default=25)
+    parser.add_argument("--seconds", type=float, default=10.0)
+    parser.add_argument("--segment-seconds", type=float, default=30.0)
+    parser.add_argument("--latency-ms", type=float, default=5.0, help="injected per write request")
+    parser.add_argument("--disk-mbps", type=float, default=20.0, help="injected bandwidth, 0 = unlimited")
+    parser.add_argument("--sync-ms", type=float, default=50.0, help="injected per fsync")
+    parser.add_argument("--buffer-mb", type=float, default=64.0)
+    parser.add_argument("--durability", type=float, default=1.0)
+    parser.add_argument("--modes", nargs="+", default=["direct", *POLICIES],
+                        choices=["direct", *POLICIES])
+    parser.add_argument("--dir", help="directory on the disk to measure (default: system temp)")
+    args = parser.parse_args()
+
+    offered = args.cameras * args.fps * args.frame_kb * 1024 / 1e6
+    print(f"{args.cameras} cameras × {args.fps:g} fps × {args.frame_kb} KB = {offered:.1f} MB/s offered; "
+          f"disk: {args.latency_ms:g} ms/request, {args.disk_mbps:g} MB/s, {args.sync_ms:g} ms/fsync")
+    print(f"{'mode':>12} {'MB/s':>6} {'skipped':>8} {'dropped':>8} {'on disk':>8} "
+          f"{'stall p99':>9} {'max':>7} {'write p99':>9} {'fsync p99':>9} {'age p99':>8} {'peak MB':>7}")
+    for mode in args.modes:
+        r = run(mode, args)
+        s, snap = r["stats"], r["snap"]
+        total = s["offered"] + s["skipped"]
+        ms = lambda v: f"{v * 1000:.1f}ms"
+        check = "ok" if r["on_disk"] == s["written"] else f"{r['on_disk']}≠{s['written']}"
+        row = (f"{mode:>12} {s['disk_bytes'] / s['seconds'] / 1e6:>6.1f} "
+               f"{100 * s['skipped'] / total:>7.1f}% {100 * s['dropped'] / total:>7.1f}% {check:>8} "
+               f"{ms(r['stall_p99']):>9} {ms(r['stall_max']):>7}")
+        if snap is not None:
+            row += (f" {ms(snap['write_seconds']['0.99']):>9} {ms(snap['sync_seconds']['0.99']):>9} "
+                    f"{snap['frame_age_seconds']['0.99']:>7.2f}s {snap['peak_buffered_bytes'] / 1e6:>7.1f}")
+        print(row)
+
+
+if __name__ == "__main__":
+    main()
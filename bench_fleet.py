@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+End-to-end scaling benchmark: simulated fleet → joe_try_this_one.py
+
+For each scale step N the benchmark
+
+ • starts N simulated cameras (fleet_sim.py) that register over UDP,
+ • starts the recorder as a separate process on a scratch directory,
+ • waits until every camera is being recorded, then measures a window:
+     sent fps      frames the cameras put on the wire
+     recorded fps  frames that reached disk
+     lost          sent − recorded during the window
+     skipped       frames the cameras could not send (recorder too slow to read)
+     CPU / RSS     recorder process tree (ffmpeg children included)
+     disk MB/s     growth of the recordings directory
+
+Frames on disk are counted exactly from .idx files (native backend) or
+estimated from bytes / mean frame size (ffmpeg backend, marked ≈).  With
+--workers each step runs once per worker count (joe_try_this_one.py
+--workers, shard.py; 0 = in-process).
+
+Linux only (reads /proc).  Usage:
+    python bench_fleet.py --steps 1 10 50 100 200 500 --seconds 30
+    python bench_fleet.py --steps 500 1000 --workers 0 1 2 4 8
+"""
+
+import argparse
+import os
+import pathlib
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+
+from bench_ingest import disk_bytes, process_tree, sample
+from fleet_sim import start_fleet
+
+BASE_PORT = 20000
+UDP_PORT = 18500
+CAMS_PER_SIM_PROCESS = 100
+HERE = pathlib.Path(__file__).resolve().parent
+
+
+def recorded_frames(root: str) -> int:
+    return sum((p.stat().st_size - 8) // 24 for p in pathlib.Path(root).rglob("*.idx"))
+
+
+def cameras_recording(root: str) -> int:
+    return sum(1 for d in pathlib.Path(root).iterdir() if d.is_dir() and any(d.iterdir()))
+
+
+def start_recorder(backend: str, out: str, udp_port: int, extra: list) -> subprocess.Popen:
+    cmd = [sys.executable, str(HERE / "joe_try_this_one.py"), "--backend", backend,
+           "--out", out, "--udp-port", str(udp_port), *extra]
+    return subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                            start_new_session=True)
+
+
+def step(n: int, args, workers: int = 0) -> dict:
+    out = tempfile.mkdtemp(prefix="bench_fleet_")
+    extra = [*args.recorder_args, *(["--workers", str(workers)] if workers else [])]
+    rec = start_recorder(args.backend, out, UDP_PORT, extra)
+    time.sleep(1.0)
+    sims, stats = start_fleet(n, BASE_PORT, args.fps, args.size_mean, args.size_sd, args.jitter,
+                              register_to=("127.0.0.1", UDP_PORT),
+                              processes=max(1, -(-n // CAMS_PER_SIM_PROCESS)))
+    try:
+        deadline = time.monotonic() + args.settle
+        while cameras_recording(out) < n and time.monotonic() < deadline:
+            time.sleep(0.5)
+        ready = cameras_recording(out)
+        time.sleep(args.warmup)
+
+        sent0, skip0 = sum(stats[0::2]), sum(stats[1::2])
+        frames0, bytes0 = recorded_frames(out), disk_bytes(out)
+        cpu0, _ = sample(rec.pid)
+        t0 = time.monotonic()
+        rss_peak = 0
+        while time.monotonic() - t0 < args.seconds:
+            time.sleep(1.0)
+            rss_peak = max(rss_peak, sample(rec.pid)[1])
+        cpu1, _ = sample(rec.pid)
+        elapsed = time.monotonic() - t0
+        sent, skipped = sum(stats[0::2]) - sent0, sum(stats[1::2]) - skip0
+        written = disk_bytes(out) - bytes0
+        if args.backend == "native":
+            recorded = recorded_frames(out) - frames0
+        else:
+            recorded = int(written / args.size_mean)
+    finally:
+        for p in sims:
+            p.terminate()
+        for pid in reversed(process_tree(rec.pid)):
+            try:
+                os.kill(pid, signal.SIGKILL)
+            except OSError:
+                pass
+        rec.wait()
+        shutil.rmtree(out, ignore_errors=True)
+    return {
+        "n": n, "workers": workers, "ready": ready,
+        "sent_fps": sent / elapsed, "rec_fps": recorded / elapsed,
+        "lost": max(0, sent - recorded), "skipped": skipped,
+        "cpu": 100 * (cpu1 - cpu0) / elapsed, "rss": rss_peak / 1024,
+        "disk": written / elapsed / 1e6,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SipBuddy fleet scaling benchmark")
+    parser.add_argument("--steps", type=int, nargs="+", default=[1, 10, 50, 100, 200, 500])
+    parser.add_argument("--backend", choices=["native", "ffmpeg"], default="native")
+    parser.add_argument("--workers", type=int, nargs="+", default=[0],
+                        help="recorder worker processes to try per step (native backend)")
+    parser.add_argument("--seconds", type=float, default=30.0, help="measurement window per step")
+    parser.add_argument("--warmup", type=float, default=3.0)
+    parser.add_argument("--settle", type=float, default=60.0, help="max wait for all cameras to record")
+    parser.add_argument("--fps", type=float, default=15.0)
+    parser.add_argument("--size-mean", type=int, default=12000)
+    parser.add_argument("--size-sd", type=int, default=3000)
+    parser.add_argument("--jitter", type=float, default=0.1)
+    parser.add_argument("recorder_args", nargs="*", help="extra arguments for joe_try_this_one.py (after --)")
+    args = parser.parse_args()
+
+    approx = "≈" if args.backend == "ffmpeg" else " "
+    print(f"{'cams':>5} {'workers':>7} {'ready':>5} {'sent fps':>9} {'rec fps':>9} {'lost':>6} "
+          f"{'skipped':>8} {'cpu%':>6} {'rss MB':>7} {'disk MB/s':>9}")
+    for n in args.steps:
+        for w in args.workers:
+            r = step(n, args, w)
+            print(f"{r['n']:>5} {r['workers']:>7} {r['ready']:>5} {r['sent_fps']:>9.0f} "
+                  f"{approx}{r['rec_fps']:>8.0f} {r['lost']:>6} {r['skipped']:>8} {r['cpu']:>6.1f} "
+                  f"{r['rss']:>7.1f} {r['disk']:>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
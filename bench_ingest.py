@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""
+Ingest benchmark: CPU and RSS per camera for the ffmpeg vs native backends
+
+ • Starts N simulated cameras (fleet_sim.py) on localhost in separate processes.
+ • Runs each recorder backend in its own process against them and samples
+   /proc for CPU time and resident memory (ffmpeg children included).
+ • Prints one row per (backend, N) with totals and per-camera figures.
+
+Linux only (reads /proc).  Usage:
+    python bench_ingest.py --cameras 1 10 50 --seconds 20 --fps 15
+"""
+
+import argparse
+import multiprocessing as mp
+import os
+import pathlib
+import shutil
+import tempfile
+import threading
+import time
+
+from fleet_sim import start_fleet
+
+BASE_PORT = 18080
+CLK_TCK = os.sysconf("SC_CLK_TCK")
+PAGE_KB = os.sysconf("SC_PAGE_SIZE") // 1024
+
+# ───── recorder backends ───────────────────────────────────────────────────
+def fake_cams(n: int) -> list:
+    return [{"ip": "127.0.0.1", "port": BASE_PORT + i, "id": f"bench_{i:03d}"} for i in range(n)]
+
+
+def record(backend: str, n: int, out_root: str, go) -> None:
+    import joe_try_this_one as recorder
+    recorder.OUT_ROOT = pathlib.Path(out_root)
+    if backend == "native":
+        from mjpeg_ingest import IngestEngine
+        engine = IngestEngine(recorder.OUT_ROOT, recorder.SEGMENT_SECONDS)
+        engine.start_in_thread()
+    go.wait()                                          # baseline sampled before this
+    if backend == "native":
+        for cam in fake_cams(n):
+            engine.start(cam)
+    else:
+        for cam in fake_cams(n):
+            threading.Thread(target=recorder.run_ffmpeg, args=(cam,), daemon=True).start()
+    while True:
+        time.sleep(1)
+
+
+# ───── /proc sampling ──────────────────────────────────────────────────────
+def process_tree(pid: int) -> list:
+    children = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(ppid, []).append(int(entry))
+    tree, todo = [], [pid]
+    while todo:
+        p = todo.pop()
+        tree.append(p)
+        todo.extend(children.get(p, []))
+    return tree
+
+
+def sample(pid: int):
+    """(cpu seconds, rss KiB) summed over `pid` and its descendants."""
+    cpu, rss = 0.0, 0
+    for p in process_tree(pid):
+        try:
+            with open(f"/proc/{p}/stat") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+            cpu += (int(fields[11]) + int(fields[12])) / CLK_TCK
+            with open(f"/proc/{p}/statm") as f:
+                rss += int(f.read().split()[1]) * PAGE_KB
+        except (OSError, IndexError, ValueError):
+            continue
+    return cpu, rss
+
+
+def disk_bytes(root: str) -> int:
+    return sum(p.stat().st_size for p in pathlib.Path(root).rglob("*") if p.is_file())
+
+
+def bench(backend: str, n: int, seconds: float, warmup: float) -> dict:
+    out_root = tempfile.mkdtemp(prefix=f"bench_{backend}_")
+    go = mp.Event()
+    proc = mp.Process(target=record, args=(backend, n, out_root, go), daemon=True)
+    proc.start()
+    time.sleep(1.0)
+    _, base_rss = sample(proc.pid)
+    go.set()
+    time.sleep(warmup)
+    cpu0, _ = sample(proc.pid)
+    bytes0, t0 = disk_bytes(out_root), time.monotonic()
+    rss_peak = 0
+    while time.monotonic() - t0 < seconds:
+        time.sleep(0.5)
+        rss_peak = max(rss_peak, sample(proc.pid)[1])
+    cpu1, _ = sample(proc.pid)
+    elapsed = time.monotonic() - t0
+    written = disk_bytes(out_root) - bytes0
+    for p in reversed(process_tree(proc.pid)):
+        try:
+            os.kill(p, 9)
+        except OSError:
+            pass
+    proc.join()
+    shutil.rmtree(out_root, ignore_errors=True)
+    cpu_pct = 100 * (cpu1 - cpu0) / elapsed
+    return {
+        "backend": backend, "cameras": n,
+        "cpu_pct": cpu_pct, "cpu_pct_per_cam": cpu_pct / n,
+        "rss_mb": rss_peak / 1024, "rss_mb_per_cam": (rss_peak - base_rss) / 1024 / n,
+        "disk_mbps": written / elapsed / 1e6,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SipBuddy ingest backend benchmark")
+    parser.add_argument("--cameras", type=int, nargs="+", default=[1, 10, 50])
+    parser.add_argument("--backends", nargs="+", default=["native", "ffmpeg"],
+                        choices=["native", "ffmpeg"])
+    parser.add_argument("--seconds", type=float, default=20.0)
+    parser.add_argument("--warmup", type=float, default=3.0)
+    parser.add_argument("--fps", type=float, default=15.0)
+    parser.add_argument("--jpeg-size", type=int, default=12_000)
+    args = parser.parse_args()
+
+    if "ffmpeg" in args.backends and shutil.which("ffmpeg") is None:
+        print("ffmpeg not in PATH – skipping ffmpeg backend")
+        args.backends.remove("ffmpeg")
+
+    servers, _ = start_fleet(max(args.cameras), BASE_PORT, args.fps, args.jpeg_size,
+                             args.jpeg_size // 4, processes=2)
+    time.sleep(2.0)
+
+    print(f"{'backend':<8} {'cams':>5} {'cpu%':>7} {'cpu%/cam':>9} {'rss MB':>8} {'rss MB/cam':>11} {'disk MB/s':>10}")
+    try:
+        for n in args.cameras:
+            for backend in args.backends:
+                r = bench(backend, n, args.seconds, args.warmup)
+                print(f"{r['backend']:<8} {r['cameras']:>5} {r['cpu_pct']:>7.1f} {r['cpu_pct_per_cam']:>9.2f} "
+                      f"{r['rss_mb']:>8.1f} {r['rss_mb_per_cam']:>11.2f} {r['disk_mbps']:>10.2f}")
+    finally:
+        for p in servers:
+            p.terminate()
+
+
+if __name__ == "__main__":
+    main()
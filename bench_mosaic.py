@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+Mosaic benchmark: recorder CPU as viewers are added
+
+ • Starts --cameras simulated cameras (fleet_sim.py) and records them in
+   this process: IngestEngine + relay + mosaic.Mosaic + the HTTP endpoint.
+ • For each viewer count a separate process opens that many clients, either
+   on /mosaic/stream (one composite) or, for comparison, on every
+   /cam/<id>/stream (a tab per camera, the relay).
+ • Per row: this process's CPU (ingest included, the viewers are
+   elsewhere), composites and tile decodes per second, and what one viewer
+   received.
+
+Usage:
+    python bench_mosaic.py --cameras 16 --viewers 0 1 10 50 --seconds 10
+"""
+
+import argparse
+import asyncio
+import multiprocessing as mp
+import pathlib
+import shutil
+import tempfile
+import time
+
+from fleet_sim import start_fleet
+
+BASE_PORT = 18800
+HTTP_PORT = 18899
+
+
+def view(urls: list, clients: int, received, go, stop) -> None:
+    """`clients` viewers each reading every url until `stop` is set."""
+    import aiohttp
+
+    async def client(session, url):
+        async with session.get(url) as resp:
+            async for chunk in resp.content.iter_any():
+                if go.is_set():
+                    received.value += len(chunk)
+
+    async def main():
+        connector = aiohttp.TCPConnector(limit=0)
+        async with aiohttp.ClientSession(connector=connector) as session:
+            tasks = [asyncio.ensure_future(client(session, url))
+                     for _ in range(clients) for url in urls]
+            while not stop.is_set():
+                await asyncio.sleep(0.2)
+            for t in tasks:
+                t.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    asyncio.run(main())
+
+
+def measure(mode: str, viewers: int, cams: list, composite, args) -> dict:
+    urls = ([f"http://127.0.0.1:{HTTP_PORT}/mosaic/stream"] if mode == "mosaic" else
+            [f"http://127.0.0.1:{HTTP_PORT}/cam/{cam['id']}/stream" for cam in cams])
+    received, go, stop = mp.Value("Q", 0, lock=False), mp.Event(), mp.Event()
+    proc = None
+    if viewers:
+        proc = mp.Process(target=view, args=(urls, viewers, received, go, stop), daemon=True)
+        proc.start()
+    time.sleep(args.warmup)
+    composed, decoded = composite.composed, composite.decoded
+    cpu, t0 = time.process_time(), time.monotonic()
+    go.set()
+    time.sleep(args.seconds)
+    elapsed = time.monotonic() - t0
+    row = {"mode": mode, "viewers": viewers,
+           "cpu_pct": 100 * (time.process_time() - cpu) / elapsed,
+           "composites": (composite.composed - composed) / elapsed,
+           "decodes": (composite.decoded - decoded) / elapsed,
+           "viewer_kbps": received.value * 8 / elapsed / 1000 / max(1, viewers)}
+    stop.set()
+    if proc is not None:
+        proc.join(5)
+    return row
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recorder CPU vs mosaic / relay viewers")
+    parser.add_argument("--cameras", type=int, default=16)
+    parser.add_argument("--viewers", type=int, nargs="+", default=[0, 1, 10, 50])
+    parser.add_argument("--modes", nargs="+", default=["mosaic", "relay"], choices=["mosaic", "relay"])
+    parser.add_argument("--fps", type=float, default=15.0, help="camera fps")
+    parser.add_argument("--mosaic-fps", type=float, default=2.0)
+    parser.add_argument("--seconds", type=float, default=10.0)
+    parser.add_argument("--warmup", type=float, default=3.0)
+    args = parser.parse_args()
+
+    from mjpeg_ingest import IngestEngine
+    from mosaic import Mosaic, add_routes as mosaic_routes
+    from recorder_http import RecorderHttp
+    from relay import Relay, add_routes as relay_routes
+
+    start_fleet(args.cameras, BASE_PORT, args.fps)
+    out = pathlib.Path(tempfile.mkdtemp(prefix="bench_mosaic_"))
+    try:
+        relay = Relay()
+        engine = IngestEngine(out, 30.0, relay=relay)
+        engine.start_in_thread()
+        composite = Mosaic(relay, engine.loop, args.mosaic_fps)
+        composite.start()
+        http = RecorderHttp(HTTP_PORT, "127.0.0.1")
+        relay_routes(http.app, relay)
+        mosaic_routes(http.app, composite)
+        http.start(engine.loop)
+        cams = [{"ip": "127.0.0.1", "port": BASE_PORT + i, "id": f"bench_{i:03d}"}
+                for i in range(args.cameras)]
+        for cam in cams:
+            engine.start(cam)
+
+        print(f"{args.cameras} cameras × {args.fps:g} fps, mosaic {args.mosaic_fps:g} fps")
+        print(f"{'mode':>7} {'viewers':>7} {'CPU %':>6} {'composites/s':>12} {'decodes/s':>9} "
+              f"{'kbit/s per viewer':>17}")
+        for mode in args.modes:
+            for viewers in args.viewers:
+                r = measure(mode, viewers, cams, composite, args)
+                print(f"{r['mode']:>7} {r['viewers']:>7} {r['cpu_pct']:>6.1f} {r['composites']:>12.1f} "
+                      f"{r['decodes']:>9.1f} {r['viewer_kbps']:>17.0f}")
+    finally:
+        shutil.rmtree(out, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""
+Multipart parser benchmark and fuzzer
+
+ • bench: frames/s and MB/s of mjpeg_parser.MultipartParser on synthetic
+   OpenMV streams, for several socket read sizes, next to a naive
+   find-and-slice parser for reference.
+ • fuzz:  feeds truncated, garbled, junk-padded and mislabelled streams in
+   random chunk sizes and checks the parser never raises, never yields a
+   non-JPEG payload and recovers every frame the damage did not touch.
+
+Usage:
+    python bench_parser.py bench --frames 20000 --size 15000
+    python bench_parser.py fuzz --rounds 500 --seed 1
+"""
+
+import argparse
+import io
+import random
+import sys
+import time
+
+from mjpeg_parser import MultipartParser
+
+SOI, EOI = b"\xff\xd8", b"\xff\xd9"
+
+
+def make_frame(rng: random.Random, size: int) -> bytes:
+    """JPEG-shaped payload: SOI, filler without 0xFF, EOI."""
+    body = bytes(rng.randrange(0, 255) for _ in range(64)) * (size // 64 + 1)
+    return SOI + body[:max(0, size - 4)] + EOI
+
+
+def part(jpeg: bytes, length=None, with_length: bool = True) -> bytes:
+    header = b"\r\n--openmv\r\nContent-Type: image/jpeg\r\n"
+    if with_length:
+        header += b"Content-Length:" + str(len(jpeg) if length is None else length).encode() + b"\r\n"
+    return header + b"\r\n" + jpeg
+
+
+def naive_frames(stream: io.BytesIO, chunk: int):
+    """What a straightforward implementation does: bytes concat + find + slice."""
+    pending = b""
+    while True:
+        data = stream.read(chunk)
+        if not data:
+            return
+        pending += data
+        while True:
+            h = pending.find(b"\r\n\r\n", pending.find(b"--openmv"))
+            if h < 0:
+                break
+            header = pending[:h]
+            n = int(header.rsplit(b"Content-Length:", 1)[1])
+            if len(pending) < h + 4 + n:
+                break
+            yield pending[h + 4:h + 4 + n]
+            pending = pending[h + 4 + n:]
+
+
+# ───── benchmark ───────────────────────────────────────────────────────────
+def bench(args) -> None:
+    rng = random.Random(0)
+    sizes = [max(200, int(rng.gauss(args.size, args.size * 0.2))) for _ in range(args.frames)]
+    templates = [make_frame(rng, s) for s in rng.sample(sizes, min(256, len(sizes)))]
+    stream = b"".join(part(templates[i % len(templates)]) for i in range(args.frames))
+    mb = len(stream) / 1e6
+    print(f"stream: {args.frames} frames, {mb:.1f} MB, mean frame {mb * 1e6 / args.frames / 1e3:.1f} KB")
+    print(f"{'parser':<18} {'read size':>9} {'frames/s':>11} {'MB/s':>9}")
+
+    for chunk in args.chunks:
+        src = io.BytesIO(stream)
+        parser = MultipartParser()
+        frames = 0
+        t0 = time.perf_counter()
+        while True:
+            view = parser.readinto_view()
+            n = src.readinto(view[:chunk])
+            if not n:
+                break
+            parser.commit(n)
+            for _ in parser.parse():
+                frames += 1
+        dt = time.perf_counter() - t0
+        assert frames == args.frames, (frames, parser.resyncs, parser.dropped)
+        print(f"{'MultipartParser':<18} {chunk:>9} {frames / dt:>11,.0f} {mb / dt:>9,.0f}")
+
+        src = io.BytesIO(stream)
+        t0 = time.perf_counter()
+        frames = sum(1 for _ in naive_frames(src, chunk))
+        dt = time.perf_counter() - t0
+        print(f"{'naive find+slice':<18} {chunk:>9} {frames / dt:>11,.0f} {mb / dt:>9,.0f}")
+
+
+# ───── fuzzing ─────────────────────────────────────────────────────────────
+def garble(rng: random.Random, frames: list):
+    """Build a damaged stream; return (bytes, indices of untouched frames)."""
+    out, intact = [], []
+    for i, jpeg in enumerate(frames):
+        kind = rng.random()
+        if kind < 0.55:
+            out.append(part(jpeg)); intact.append(i)
+        elif kind < 0.65:
+            out.append(part(jpeg, with_length=False)); intact.append(i)
+        elif kind < 0.75:
+            out.append(part(jpeg, length=len(jpeg) + rng.randint(-50, 50) or 1)); intact.append(i)
+        elif kind < 0.82:
+            out.append(part(jpeg)[:rng.randrange(1, len(jpeg))])            # truncated
+        elif kind < 0.90:
+            p = bytearray(part(jpeg))
+            for _ in range(rng.randint(1, 8)):
+                p[rng.randrange(len(p))] = rng.randrange(256)               # bit rot
+            out.append(bytes(p))
+        else:
+            out.append(bytes(rng.randrange(256) for _ in range(rng.randint(1, 300))))  # junk
+            out.append(part(jpeg)); intact.append(i)
+    return b"".join(out), intact
+
+
+def fuzz(args) -> int:
+    rng = random.Random(args.seed)
+    failures = 0
+    for r in range(args.rounds):
+        frames = [make_frame(rng, rng.randint(4, 5000)) for _ in range(rng.randint(1, 40))]
+        stream, intact = garble(rng, frames)
+        # a live stream keeps going: give a pending part enough bytes to resolve
+        stream += part(make_frame(rng, 6000)) + part(make_frame(rng, 16))
+        parser = MultipartParser(capacity=rng.choice([16 * 1024, 64 * 1024]))
+        got = []
+        try:
+            pos = 0
+            while pos < len(stream):
+                n = rng.randint(1, 4096)
+                got.extend(bytes(f) for f in parser.feed(stream[pos:pos + n]))
+                pos += n
+        except Exception as e:                         # the parser must never raise
+            print(f"round {r}: exception {e!r}")
+            failures += 1
+            continue
+        bad = [g for g in got if not (g.startswith(SOI) and g.endswith(EOI))]
+        # a damaged part may swallow the intact part right after it, nothing more
+        damaged = len(frames) - len(intact)
+        missing = [i for i in intact if frames[i] not in got]
+        if bad or len(missing) > damaged:
+            print(f"round {r}: {len(bad)} non-JPEG payloads, {len(missing)} intact frames lost "
+                  f"({damaged} damaged parts)")
+            failures += 1
+    print(f"{args.rounds} rounds, {failures} failures")
+    return 1 if failures else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="MultipartParser benchmark / fuzzer")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    b = sub.add_parser("bench")
+    b.add_argument("--frames", type=int, default=20000)
+    b.add_argument("--size", type=int, default=15000, help="mean JPEG size in bytes")
+    b.add_argument("--chunks", type=int, nargs="+", default=[1460, 16384, 65536])
+    f = sub.add_parser("fuzz")
+    f.add_argument("--rounds", type=int, default=500)
+    f.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    if args.cmd == "bench":
+        bench(args)
+        return 0
+    return fuzz(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
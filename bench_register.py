@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+Registration benchmark: how soon the firmware streams after boot and after a
+disconnect, with and without a recorder answering its registrations
+
+ • Runs the firmware in the host emulation (openmv_emu.py --clients 0,
+   --firmware to compare an older copy) with its registrations sent to a
+   UDP listener in this process that ACKs them ("ack") or never answers
+   ("silent": the recorder is down, or the ACK is lost).
+ • A client connects as soon as the port takes it (retrying every 50 ms)
+   and reads one frame: time from boot to the first frame.  It then
+   disconnects and, after each --gaps value, reconnects: time from the
+   disconnect to the next frame.
+ • Counts the registrations the device sent over the run and, in "ack"
+   mode, how long after a SIPBUDDY_DISCOVER on its control port the next
+   one arrives.
+
+Usage:
+    python bench_register.py --gaps 0 15
+    git show <old>:on_ae3_AP.py > /tmp/old_fw.py && python bench_register.py --firmware /tmp/old_fw.py
+"""
+
+import argparse
+import pathlib
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+from discovery import ACK, DISCOVER, REGISTER_PREFIX
+from mjpeg_parser import MultipartParser
+
+PORT = 18760
+CONTROL_PORT = 18761
+UDP_PORT = 18762
+
+
+class Listener(threading.Thread):
+    """The recorder's registration port: counts SIPBUDDY_REGISTER, ACKs them if `ack`."""
+
+    def __init__(self, ack: bool):
+        super().__init__(daemon=True)
+        self.ack = ack
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(("127.0.0.1", UDP_PORT))
+        self.sock.settimeout(0.2)
+        self.times = []                                # monotonic arrival of every registration
+        self.stop = False
+
+    def run(self) -> None:
+        while not self.stop:
+            try:
+                data, addr = self.sock.recvfrom(1024)
+            except socket.timeout:
+                continue
+            if data.startswith(REGISTER_PREFIX):
+                self.times.append(time.monotonic())
+                if self.ack:
+                    self.sock.sendto(ACK, addr)
+        self.sock.close()
+
+
+def first_frame(deadline: float):
+    """Connect (retrying), ask for the stream and read one frame; the socket, or None."""
+    while time.monotonic() < deadline:
+        sock = socket.socket()
+        try:
+            sock.connect(("127.0.0.1", PORT))
+            sock.settimeout(max(0.1, deadline - time.monotonic()))
+            sock.sendall(b"GET / HTTP/1.1\r\n\r\n")
+            parser = MultipartParser(1 << 20)
+            while True:
+                chunk = sock.recv(65536)
+                if not chunk:
+                    raise ConnectionError
+                for _ in parser.feed(chunk):
+                    return sock
+        except OSError:
+            sock.close()
+            time.sleep(0.05)
+    return None
+
+
+def run(mode: str, args) -> dict:
+    listener = Listener(ack=mode == "ack")
+    listener.start()
+    cmd = [sys.executable, "openmv_emu.py", "--clients", "0", "--firmware", str(args.firmware),
+           "--port", str(PORT), "--control-port", str(CONTROL_PORT),
+           "--register-to", f"127.0.0.1:{UDP_PORT}"]
+    boot = time.monotonic()
+    emu = subprocess.Popen(cmd, cwd=pathlib.Path(__file__).parent, stdout=subprocess.DEVNULL)
+    r = {"mode": mode, "boot": None, "reconnects": [], "asked": None}
+    try:
+        sock = first_frame(boot + args.timeout)
+        if sock is None:
+            return r
+        r["boot"] = time.monotonic() - boot
+        for gap in args.gaps:
+            sock.close()
+            t = time.monotonic()
+            time.sleep(gap)
+            sock = first_frame(t + gap + args.timeout)
+            r["reconnects"].append(time.monotonic() - t - gap if sock is not None else None)
+            if sock is None:
+                return r
+            time.sleep(args.hold)
+        if mode == "ack":
+            sent = len(listener.times)
+            t = time.monotonic()
+            with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as ask:
+                ask.sendto(DISCOVER, ("127.0.0.1", CONTROL_PORT))
+            while len(listener.times) == sent and time.monotonic() - t < args.timeout:
+                time.sleep(0.01)
+            if len(listener.times) > sent:
+                r["asked"] = listener.times[sent] - t
+        sock.close()
+        return r
+    finally:
+        r["registrations"] = len(listener.times)
+        r["seconds"] = time.monotonic() - boot
+        emu.terminate()
+        emu.wait()
+        listener.stop = True
+        listener.join()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Boot / reconnect to first frame, registration ACKed or not")
+    parser.add_argument("--firmware", type=pathlib.Path, default=pathlib.Path("on_ae3_AP.py"))
+    parser.add_argument("--gaps", type=float, nargs="+", default=[0.0, 15.0],
+                        help="seconds between a disconnect and the reconnect")
+    parser.add_argument("--hold", type=float, default=1.0, help="seconds streamed between reconnects")
+    parser.add_argument("--timeout", type=float, default=30.0, help="give up waiting for a frame after")
+    parser.add_argument("--modes", nargs="+", default=["ack", "silent"], choices=["ack", "silent"])
+    args = parser.parse_args()
+
+    def secs(v):
+        return f"{v:.2f} s" if v is not None else f"> {args.timeout:g} s"
+
+    print(f"firmware {args.firmware.name}")
+    print(f"{'mode':>6} {'boot→frame':>11}" + "".join(f" {f'gap {g:g}s→frame':>14}" for g in args.gaps)
+          + f" {'registrations':>14} {'DISCOVER→announce':>17}")
+    for mode in args.modes:
+        r = run(mode, args)
+        recon = r["reconnects"] + [None] * (len(args.gaps) - len(r["reconnects"]))
+        asked = secs(r["asked"]) if mode == "ack" else "-"
+        print(f"{mode:>6} {secs(r['boot']):>11}" + "".join(f" {secs(v):>14}" for v in recon)
+              + f" {r['registrations']:>5} in {r['seconds']:>4.0f} s {asked:>17}")
+
+
+if __name__ == "__main__":
+    main()
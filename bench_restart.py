@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+Recorder restart benchmark: how long until every camera records again
+
+ • starts N simulated cameras (fleet_sim.py) that register over UDP like
+   the firmware: at once, then at intervals doubling up to --announce-max
+   seconds until ACKed, and again after their client disconnects or when
+   the recorder sends SIPBUDDY_DISCOVER;
+ • starts the recorder, waits until all of them are recording, lets it run
+   --uptime seconds (so the registry has been saved), then kills it
+   (SIGKILL, like a crash or power loss);
+ • after --downtime seconds starts it again on the same recordings
+   directory, cold (--no-registry) or warm (recordings/cameras.json), and
+   reports how long after the new process started every camera had a new
+   segment on disk.
+
+A cold start hears the cameras at their next announcement (the longer the
+downtime, the longer the interval), or at once when its SIPBUDDY_DISCOVER
+reaches them; a warm start does not need them to broadcast at all.
+
+Linux only (reads /proc).  Usage:
+    python bench_restart.py --cameras 20 --downtime 5 60
+"""
+
+import argparse
+import os
+import pathlib
+import shutil
+import signal
+import tempfile
+import time
+
+import fleet_sim
+from bench_fleet import cameras_recording, start_recorder
+from bench_ingest import process_tree
+
+BASE_PORT = 21000
+UDP_PORT = 18600
+CAMS_PER_SIM_PROCESS = 100
+
+
+def cameras_recording_since(root: str, since: float) -> int:
+    """Camera directories with a file written at or after `since` (epoch seconds)."""
+    n = 0
+    for d in pathlib.Path(root).iterdir():
+        if d.is_dir() and any(p.stat().st_mtime >= since for p in d.iterdir()):
+            n += 1
+    return n
+
+
+def kill(rec) -> None:
+    for pid in reversed(process_tree(rec.pid)):
+        try:
+            os.kill(pid, signal.SIGKILL)
+        except OSError:
+            pass
+    rec.wait()
+
+
+def run(n: int, downtime: float, warm: bool, args) -> dict:
+    out = tempfile.mkdtemp(prefix="bench_restart_")
+    extra = [*args.recorder_args, *([] if warm else ["--no-registry"])]
+    rec = start_recorder(args.backend, out, UDP_PORT, extra)
+    time.sleep(1.0)
+    sims, _ = fleet_sim.start_fleet(n, BASE_PORT, args.fps, register_to=("127.0.0.1", UDP_PORT),
+                                    processes=max(1, -(-n // CAMS_PER_SIM_PROCESS)))
+    try:
+        deadline = time.monotonic() + args.settle
+        while cameras_recording(out) < n and time.monotonic() < deadline:
+            time.sleep(0.5)
+        if cameras_recording(out) < n:
+            raise SystemExit(f"only {cameras_recording(out)}/{n} cameras recording before the restart")
+        time.sleep(args.uptime)
+        kill(rec)
+        time.sleep(downtime)
+
+        t0, wall0 = time.monotonic(), time.time()
+        rec = start_recorder(args.backend, out, UDP_PORT, extra)
+        back, t_all = 0, None
+        while time.monotonic() - t0 < args.settle:
+            back = cameras_recording_since(out, wall0)
+            if back == n:
+                t_all = time.monotonic() - t0
+                break
+            time.sleep(0.1)
+    finally:
+        for p in sims:
+            p.terminate()
+        kill(rec)
+        shutil.rmtree(out, ignore_errors=True)
+    return {"back": back, "seconds": t_all}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recorder cold vs warm restart benchmark")
+    parser.add_argument("--cameras", type=int, default=20)
+    parser.add_argument("--downtime", type=float, nargs="+", default=[5.0, 60.0],
+                        help="seconds the recorder stays down")
+    parser.add_argument("--backend", choices=["native", "ffmpeg"], default="native")
+    parser.add_argument("--fps", type=float, default=15.0)
+    parser.add_argument("--uptime", type=float, default=8.0, help="seconds recorded before the kill")
+    parser.add_argument("--settle", type=float, default=90.0, help="max wait for cameras to record")
+    parser.add_argument("--announce-max", type=float, default=fleet_sim.ANNOUNCE_MAX,
+                        help="longest interval between registration broadcasts (firmware: 30)")
+    parser.add_argument("recorder_args", nargs="*", help="extra arguments for joe_try_this_one.py (after --)")
+    args = parser.parse_args()
+    fleet_sim.ANNOUNCE_MAX = args.announce_max         # inherited by the forked simulators
+
+    print(f"{'downtime':>8} {'start':>5} {'cameras back':>12} {'all back after':>14}")
+    for downtime in args.downtime:
+        for warm in (False, True):
+            r = run(args.cameras, downtime, warm, args)
+            took = f"{r['seconds']:.1f} s" if r["seconds"] is not None else f"> {args.settle:g} s"
+            print(f"{downtime:>7g}s {'warm' if warm else 'cold':>5} "
+                  f"{r['back']:>6}/{args.cameras:<5} {took:>14}")
+
+
+if __name__ == "__main__":
+    main()
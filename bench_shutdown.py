@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+Shutdown benchmark: SIGTERM, SIGHUP and SIGKILL against the recorder
+
+ • Starts --cameras simulated cameras (fleet_sim.py) and runs
+   joe_try_this_one.py --backend native on them from a --config file, with
+   an archive of --archive old segments already in its directory.
+ • SIGHUP after --seconds with one camera removed, one added and the rest
+   unchanged: the longest gap in the unchanged cameras' recorded timeline
+   around the reload (a restart would show the reconnect there).
+ • SIGTERM: time until the recorder exited, segments still journaled as
+   open and segments whose index does not match their data afterwards.
+ • The same again ended with SIGKILL: time of the start-up recovery pass
+   (the journal's segments only) against a check of every segment in the
+   archive (what finding the unfinished ones would cost without it).
+
+Usage:
+    python bench_shutdown.py --cameras 8 --archive 0 5000
+"""
+
+import argparse
+import json
+import pathlib
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+
+from fleet_sim import start_fleet
+from recovery import JOURNAL_DIR, OpenJournal, needs_repair, recover
+from segment_store import SegmentReader, SegmentWriter, iter_segments
+
+BASE_PORT = 18900
+UDP_PORT = 18990
+
+
+def make_archive(root: pathlib.Path, n: int) -> None:
+    """`n` small finished segments under root/archive/."""
+    d = root / "archive"
+    d.mkdir(parents=True)
+    first = d / "20200101_000000_000.mjpeg"
+    w = SegmentWriter(first)
+    for i in range(30):
+        w.write(b"\xff\xd8" + bytes(2000) + b"\xff\xd9", 1577836800 + i / 15)
+    w.close()
+    for i in range(1, n):
+        for src in (first, first.with_suffix(".idx")):
+            shutil.copyfile(src, d / f"20200101_000000_{i:03d}{src.suffix}")
+
+
+def timeline_gap(root: pathlib.Path, cam_id: str, around: float) -> float:
+    """Longest gap between frames of `cam_id` within 5 s of `around` (epoch)."""
+    stamps = []
+    for path in iter_segments(root / cam_id):
+        with SegmentReader(path) as seg:
+            stamps += [seg.timestamp(i) for i in range(len(seg))]
+    stamps = sorted(t for t in stamps if abs(t - around) < 5.0)
+    return max((b - a for a, b in zip(stamps, stamps[1:])), default=float("inf"))
+
+
+def run(archive: int, end: str, args) -> dict:
+    out = pathlib.Path(tempfile.mkdtemp(prefix="bench_shutdown_"))
+    try:
+        if archive:
+            make_archive(out, archive)
+        cams = [{"ip": "127.0.0.1", "port": BASE_PORT + i, "id": f"bench_{i:03d}"}
+                for i in range(args.cameras + 1)]
+        config = out / "config.json"
+        config.write_text(json.dumps({"cameras": cams[:-1], "segment_seconds": args.segment_seconds}))
+        rec = subprocess.Popen([sys.executable, "joe_try_this_one.py", "--backend", "native",
+                                "--write-behind", "--config", str(config), "--out", str(out),
+                                "--udp-port", str(UDP_PORT), "--http-port", "0", "--no-registry"],
+                               cwd=pathlib.Path(__file__).parent,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        time.sleep(args.seconds)
+        config.write_text(json.dumps({"cameras": cams[1:], "segment_seconds": args.segment_seconds}))
+        reloaded = time.time()
+        rec.send_signal(signal.SIGHUP)
+        time.sleep(args.seconds)
+        t = time.monotonic()
+        rec.send_signal(signal.SIGTERM if end == "term" else signal.SIGKILL)
+        rec.wait()
+        r = {"archive": archive, "end": end, "exit": time.monotonic() - t,
+             "gap": max(timeline_gap(out, c["id"], reloaded) for c in cams[1:-1])}
+        journal = OpenJournal(out)
+        r["open"] = len(journal)
+        t = time.perf_counter()
+        r["torn"] = sum(needs_repair(p) for p in out.rglob("*.mjpeg") if JOURNAL_DIR not in p.parts)
+        r["walk"] = time.perf_counter() - t
+        r["recover"] = recover(journal)["seconds"]
+        return r
+    finally:
+        shutil.rmtree(out, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recorder SIGTERM / SIGHUP / SIGKILL")
+    parser.add_argument("--cameras", type=int, default=8)
+    parser.add_argument("--fps", type=float, default=15.0)
+    parser.add_argument("--seconds", type=float, default=6.0, help="recorded before / after the SIGHUP")
+    parser.add_argument("--segment-seconds", type=float, default=4.0)
+    parser.add_argument("--archive", type=int, nargs="+", default=[0, 5000],
+                        help="old segments already in the recordings directory")
+    args = parser.parse_args()
+
+    start_fleet(args.cameras + 1, BASE_PORT, args.fps)
+    print(f"{args.cameras} cameras × {args.fps:g} fps, SIGHUP removes 1, adds 1, keeps {args.cameras - 1}")
+    print(f"{'archive':>7} {'end':>4} {'→exit':>6} {'reload gap':>10} {'open':>4} {'torn':>4} "
+          f"{'recovery':>9} {'full check':>10}")
+    for archive in args.archive:
+        for end in ("term", "kill"):
+            r = run(archive, end, args)
+            print(f"{r['archive']:>7} {r['end']:>4} {r['exit']:>5.2f}s {r['gap']:>9.2f}s {r['open']:>4} "
+                  f"{r['torn']:>4} {r['recover'] * 1000:>7.1f}ms {r['walk'] * 1000:>8.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
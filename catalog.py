@@ -0,0 +1,358 @@
+#!/usr/bin/env python3
+"""
+Segment catalog and disk-quota retention
+
+`recordings/<cam_id>/` only describes a segment by its file name, so every
+question about the archive ("what do we have for camera X last Tuesday",
+"how much does camera Y use") used to mean walking the tree.  The catalog is
+a SQLite database, `OUT_ROOT/catalog.sqlite`, kept up to date incrementally:
+
+ • one row per closed segment – camera id and MAC, first/last frame time,
+   frame count, bytes on disk and activity score – inserted from the
+   segment_events "segment closed" event, rescored / removed / resized when
+   the activity gate or the transcoder touch the segment;
+ • triggers maintain per-camera totals (segments, bytes, newest frame), so
+   quota checks read one row per camera, never SUM over the segments;
+ • a (camera, start) index answers time-range queries with a bounded range
+   scan: a segment overlapping [t0, t1] starts in [t0 − longest segment, t1].
+
+RetentionManager enforces a per-camera and a global byte quota from the
+catalog alone, deleting oldest-first or lowest-activity-first (unscored
+segments count as active).
+
+CLI:
+    python catalog.py index recordings/                 # one-time import of an existing tree
+    python catalog.py query recordings/ CAM 2025-06-03 2025-06-04
+    python catalog.py stats recordings/
+    python catalog.py retain recordings/ --camera-quota 50 --total-quota 400 --policy activity
+"""
+
+import argparse
+import datetime
+import json
+import logging
+import os
+import pathlib
+import sqlite3
+import subprocess
+import threading
+import time
+
+from segment_store import DATA_SUFFIX, SegmentReader, index_path, remove_segment, segment_bytes
+
+logger = logging.getLogger('sipbuddy')
+
+CATALOG_NAME = "catalog.sqlite"
+OLDEST, ACTIVITY = "oldest", "activity"
+DELETE_BATCH = 256                     # segments fetched per retention pass
+RETAIN_INTERVAL = 30.0                 # seconds between retention checks
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS segments (
+    path      TEXT PRIMARY KEY,        -- relative to the recordings root
+    camera    TEXT NOT NULL,
+    mac       TEXT,
+    start     REAL NOT NULL,           -- epoch seconds of the first frame
+    end       REAL NOT NULL,           -- epoch seconds of the last frame
+    frames    INTEGER,
+    bytes     INTEGER NOT NULL,
+    activity  REAL                     -- best motion score, NULL if not scored
+);
+CREATE INDEX IF NOT EXISTS segments_camera_start ON segments (camera, start);
+CREATE INDEX IF NOT EXISTS segments_start ON segments (start);
+CREATE INDEX IF NOT EXISTS segments_camera_activity ON segments (camera, activity, start);
+CREATE INDEX IF NOT EXISTS segments_activity ON segments (activity, start);
+
+CREATE TABLE IF NOT EXISTS cameras (
+    camera    TEXT PRIMARY KEY,
+    mac       TEXT,
+    segments  INTEGER NOT NULL DEFAULT 0,
+    bytes     INTEGER NOT NULL DEFAULT 0,
+    last      REAL,
+    longest   REAL NOT NULL DEFAULT 0  -- longest segment (seconds), bounds range scans
+);
+
+CREATE TRIGGER IF NOT EXISTS segments_insert AFTER INSERT ON segments BEGIN
+    INSERT INTO cameras (camera, mac, segments, bytes, last, longest)
+    VALUES (new.camera, new.mac, 1, new.bytes, new.end, new.end - new.start)
+    ON CONFLICT (camera) DO UPDATE SET
+        mac = coalesce(new.mac, mac),
+        segments = segments + 1,
+        bytes = bytes + new.bytes,
+        last = max(last, new.end),
+        longest = max(longest, new.end - new.start);
+END;
+CREATE TRIGGER IF NOT EXISTS segments_delete AFTER DELETE ON segments BEGIN
+    UPDATE cameras SET segments = segments - 1, bytes = bytes - old.bytes
+    WHERE camera = old.camera;
+END;
+CREATE TRIGGER IF NOT EXISTS segments_resize AFTER UPDATE OF bytes ON segments BEGIN
+    UPDATE cameras SET bytes = bytes - old.bytes + new.bytes WHERE camera = new.camera;
+END;
+CREATE TRIGGER IF NOT EXISTS segments_retime AFTER UPDATE OF start, end ON segments BEGIN
+    UPDATE cameras SET last = max(last, new.end), longest = max(longest, new.end - new.start)
+    WHERE camera = new.camera;
+END;
+"""
+
+
+def describe(path: pathlib.Path) -> dict:
+    """start, end, frames and bytes of a finished segment."""
+    path = pathlib.Path(path)
+    size = segment_bytes(path)
+    if path.suffix == DATA_SUFFIX:
+        with SegmentReader(path) as seg:
+            if len(seg):
+                return {"start": seg.start, "end": seg.end, "frames": len(seg), "bytes": size}
+        mtime = path.stat().st_mtime
+        return {"start": mtime, "end": mtime, "frames": 0, "bytes": size}
+    # MP4: the segmenter closes the file when it ends, so mtime is the end
+    end = path.stat().st_mtime
+    try:
+        out = subprocess.run([
+            "ffprobe", "-v", "error", "-select_streams", "v:0",
+            "-show_entries", "stream=nb_frames:format=duration", "-of", "json", str(path),
+        ], check=True, capture_output=True, text=True).stdout
+        info = json.loads(out)
+        duration = float(info.get("format", {}).get("duration") or 0.0)
+        frames = (info.get("streams") or [{}])[0].get("nb_frames")
+        frames = int(frames) if frames not in (None, "N/A") else None
+    except (OSError, ValueError, subprocess.CalledProcessError):
+        duration, frames = 0.0, None
+    return {"start": end - duration, "end": end, "frames": frames, "bytes": size}
+
+
+class Catalog:
+    """The segment catalog of one recordings directory (thread-safe)."""
+
+    def __init__(self, root: pathlib.Path, mac_of=None):
+        self.root = pathlib.Path(root)
+        self.mac_of = mac_of                           # cam_id -> MAC or None, optional
+        self.db = sqlite3.connect(str(self.root / CATALOG_NAME), check_same_thread=False,
+                                  isolation_level=None)
+        self.db.execute("PRAGMA journal_mode = WAL")
+        self.db.execute("PRAGMA synchronous = NORMAL")
+        self.db.executescript(SCHEMA)
+        self._lock = threading.Lock()
+
+    def _rel(self, path) -> str:
+        return os.path.relpath(path, self.root)
+
+    def path(self, rel: str) -> pathlib.Path:
+        return self.root / rel
+
+    # ── updates (segment_events subscriber and gate / transcoder hooks) ────
+    def segment_closed(self, cam_id: str, path: pathlib.Path, activity: float = None) -> None:
+        try:
+            info = describe(path)
+        except FileNotFoundError:
+            return
+        self.add(cam_id, path, info, activity)
+
+    def add(self, cam_id: str, path, info: dict, activity: float = None) -> None:
+        mac = self.mac_of(cam_id) if self.mac_of is not None else None
+        with self._lock:
+            self.db.execute(
+                "INSERT INTO segments (path, camera, mac, start, end, frames, bytes, activity)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?)"
+                " ON CONFLICT (path) DO UPDATE SET start = excluded.start, end = excluded.end,"
+                " frames = excluded.frames, bytes = excluded.bytes,"
+                " activity = coalesce(excluded.activity, activity)",
+                (self._rel(path), cam_id, mac, info["start"], info["end"], info["frames"],
+                 info["bytes"], activity))
+
+    def scored(self, path, score: float) -> None:
+        with self._lock:
+            self.db.execute("UPDATE segments SET activity = ? WHERE path = ?",
+                            (score, self._rel(path)))
+
+    def removed(self, path) -> None:
+        with self._lock:
+            self.db.execute("DELETE FROM segments WHERE path = ?", (self._rel(path),))
+
+    def resized(self, path, size: int) -> None:
+        with self._lock:
+            self.db.execute("UPDATE segments SET bytes = ? WHERE path = ?",
+                            (segment_bytes(path) if size is None else size, self._rel(path)))
+
+    # ── queries ────────────────────────────────────────────────────────────
+    def query(self, camera: str, start: float, end: float) -> list:
+        """Segments of `camera` overlapping [start, end], oldest first."""
+        with self._lock:
+            row = self.db.execute("SELECT longest FROM cameras WHERE camera = ?",
+                                  (camera,)).fetchone()
+            if row is None:
+                return []
+            cur = self.db.execute(
+                "SELECT path, start, end, frames, bytes, activity FROM segments"
+                " WHERE camera = ? AND start BETWEEN ? AND ? AND end >= ? ORDER BY start",
+                (camera, start - row[0], end, start))
+            return [dict(zip(("path", "start", "end", "frames", "bytes", "activity"), r))
+                    for r in cur]
+
+    def cameras(self) -> list:
+        with self._lock:
+            cur = self.db.execute(
+                "SELECT camera, mac, segments, bytes,"
+                " (SELECT min(start) FROM segments s WHERE s.camera = c.camera), last"
+                " FROM cameras c WHERE segments > 0 ORDER BY camera")
+            return [dict(zip(("camera", "mac", "segments", "bytes", "first", "last"), r))
+                    for r in cur]
+
+    def total_bytes(self) -> int:
+        with self._lock:
+            return self.db.execute("SELECT coalesce(sum(bytes), 0) FROM cameras").fetchone()[0]
+
+    def candidates(self, policy: str, camera: str = None, limit: int = DELETE_BATCH) -> list:
+        """(path, bytes) of the segments to delete first under `policy`."""
+        where, args = ("camera = ? AND", (camera,)) if camera is not None else ("", ())
+        with self._lock:
+            if policy == OLDEST:
+                return self.db.execute(f"SELECT path, bytes FROM segments WHERE {where} 1"
+                                       f" ORDER BY start LIMIT ?", args + (limit,)).fetchall()
+            # two index range scans: scored segments by score, then unscored by age
+            rows = self.db.execute(f"SELECT path, bytes FROM segments"
+                                   f" WHERE {where} activity IS NOT NULL"
+                                   f" ORDER BY activity, start LIMIT ?", args + (limit,)).fetchall()
+            if len(rows) < limit:
+                rows += self.db.execute(f"SELECT path, bytes FROM segments"
+                                        f" WHERE {where} activity IS NULL ORDER BY start LIMIT ?",
+                                        args + (limit - len(rows),)).fetchall()
+            return rows
+
+    def close(self) -> None:
+        with self._lock:
+            self.db.close()
+
+
+class RetentionManager(threading.Thread):
+    """Keeps every camera under `camera_quota` bytes and the archive under `total_quota`."""
+
+    def __init__(self, catalog: Catalog, camera_quota: int = None, total_quota: int = None,
+                 policy: str = OLDEST, interval: float = RETAIN_INTERVAL):
+        super().__init__(daemon=True)
+        self.catalog = catalog
+        self.camera_quota = camera_quota
+        self.total_quota = total_quota
+        self.policy = policy
+        self.interval = interval
+        self.deleted = self.deleted_bytes = 0
+
+    def run(self) -> None:
+        while True:
+            try:
+                self.enforce()
+            except Exception:                          # quotas must keep being enforced
+                logger.exception("retention check failed")
+            time.sleep(self.interval)
+
+    def enforce(self) -> int:
+        """Delete segments until every quota holds; returns bytes freed."""
+        freed = 0
+        if self.camera_quota:
+            for cam in self.catalog.cameras():
+                freed += self._trim(cam["bytes"] - self.camera_quota, cam["camera"])
+        if self.total_quota:
+            freed += self._trim(self.catalog.total_bytes() - self.total_quota, None)
+        if freed:
+            logger.info(f"retention ({self.policy}-first): freed {freed / 1e6:.1f} MB")
+        return freed
+
+    def _trim(self, excess: int, camera) -> int:
+        freed = 0
+        failed = set()                                 # left for the next pass (read-only, busy)
+        while excess > freed:
+            batch = self.catalog.candidates(self.policy, camera, DELETE_BATCH + len(failed))
+            batch = [(rel, size) for rel, size in batch if rel not in failed]
+            if not batch:
+                break
+            for rel, size in batch:
+                try:
+                    remove_segment(self.catalog.path(rel))
+                except OSError as e:
+                    logger.error(f"retention: cannot delete {rel}: {e}")
+                    failed.add(rel)
+                    continue
+                self.catalog.removed(self.catalog.path(rel))
+                self.deleted += 1
+                self.deleted_bytes += size
+                freed += size
+                if freed >= excess:
+                    break
+        return freed
+
+
+# ───── CLI ─────────────────────────────────────────────────────────────────
+def index_tree(catalog: Catalog) -> int:
+    """Add every segment below the catalog's root (one walk, for existing archives)."""
+    n = 0
+    for cam_dir in sorted(p for p in catalog.root.iterdir() if p.is_dir()):
+        for path in sorted(cam_dir.iterdir()):
+            if path.suffix == ".mp4" or (path.suffix == DATA_SUFFIX and index_path(path).exists()):
+                catalog.segment_closed(cam_dir.name, path)
+                n += 1
+    return n
+
+
+def parse_time(s: str) -> float:
+    """Epoch seconds from a number or an ISO date/time (UTC unless it has an offset)."""
+    try:
+        return float(s)
+    except ValueError:
+        dt = datetime.datetime.fromisoformat(s)
+        if dt.tzinfo is None:
+            dt = dt.replace(tzinfo=datetime.timezone.utc)
+        return dt.timestamp()
+
+
+def _fmt(ts: float) -> str:
+    return datetime.datetime.fromtimestamp(ts, datetime.timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SipBuddy segment catalog")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("index", help="add every segment of an existing recordings tree")
+    p.add_argument("root", type=pathlib.Path)
+    p = sub.add_parser("query", help="segments of a camera overlapping a time range")
+    p.add_argument("root", type=pathlib.Path)
+    p.add_argument("camera")
+    p.add_argument("start", help="epoch seconds or ISO time (UTC)")
+    p.add_argument("end", help="epoch seconds or ISO time (UTC)")
+    p = sub.add_parser("stats", help="per-camera totals")
+    p.add_argument("root", type=pathlib.Path)
+    p = sub.add_parser("retain", help="enforce quotas once")
+    p.add_argument("root", type=pathlib.Path)
+    p.add_argument("--camera-quota", type=float, help="GB per camera")
+    p.add_argument("--total-quota", type=float, help="GB for all cameras")
+    p.add_argument("--policy", choices=[OLDEST, ACTIVITY], default=OLDEST)
+    args = parser.parse_args()
+
+    catalog = Catalog(args.root)
+    if args.cmd == "index":
+        t = time.perf_counter()
+        n = index_tree(catalog)
+        print(f"indexed {n} segments in {time.perf_counter() - t:.1f} s")
+    elif args.cmd == "query":
+        t = time.perf_counter()
+        rows = catalog.query(args.camera, parse_time(args.start), parse_time(args.end))
+        elapsed = time.perf_counter() - t
+        for r in rows:
+            score = "-" if r["activity"] is None else f"{r['activity']:.3f}"
+            print(f"{_fmt(r['start'])} → {_fmt(r['end'])}  {r['frames'] or '?':>6} frames "
+                  f"{r['bytes'] / 1e6:7.1f} MB  activity {score:>5}  {r['path']}")
+        print(f"{len(rows)} segments in {elapsed * 1e3:.1f} ms")
+    elif args.cmd == "stats":
+        for c in catalog.cameras():
+            print(f"{c['camera']:<20} {c['mac'] or '':<13} {c['segments']:>8} segments "
+                  f"{c['bytes'] / 1e9:8.2f} GB  {_fmt(c['first'])} → {_fmt(c['last'])}")
+    elif args.cmd == "retain":
+        gb = lambda v: int(v * 1e9) if v else None
+        r = RetentionManager(catalog, gb(args.camera_quota), gb(args.total_quota), args.policy)
+        freed = r.enforce()
+        print(f"deleted {r.deleted} segments, {freed / 1e9:.2f} GB")
+    catalog.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,406 @@
+#!/usr/bin/env python3
+"""
+Streaming dataset extraction: recordings → decoded frames / shards
+
+FrameExtractor walks a recordings directory and yields
+
+    (camera_id, timestamp, ndarray)        uint8, H×W×3 (RGB) or H×W (L)
+
+at a target sample rate per camera, oldest first per camera:
+
+ • planning happens in the parent and touches only the indexes: the
+   catalog (catalog.py) or a walk of `<root>/<cam_id>/`, .idx timestamps
+   (binary search for the next due frame) for .mjpeg segments and the
+   duration for MP4s.  The plan is a lazy stream of small tasks (≤ batch
+   frames of one segment), so nothing grows with the archive size.
+ • decoding runs in a pool of worker processes.  Pillow decodes .mjpeg
+   frames, using JPEG DCT scaling (draft mode) when a smaller `size` is asked
+   for; FFmpeg decodes MP4s (`-ss … -vf fps=…`).
+ • results come back through shared memory: there are `prefetch` slots of
+   `batch` frames each, a task is only handed out with a free slot, and the
+   worker writes pixels straight into it.  The result queue only carries
+   (timestamp, shape, offset) tuples – no array is pickled (frames too big
+   for a slot fall back to pickling).  `prefetch` slots bound both the work
+   in flight and the memory.
+ • batches are yielded in plan order whatever order workers finish in.
+   With copy=False the yielded arrays are views into the slot and are only
+   valid until the next item is requested.
+
+ShardWriter writes the stream as WebDataset-style tar shards (`<key>.npy` +
+`<key>.json` per frame) or as stacked .npy shards with a .json sidecar.
+With --dedup-radius, near-duplicate frames are dropped first (dedup.py).
+
+CLI:
+    python dataset.py recordings/ --fps 1 --size 160x120 --workers 4 -o shards/ --format tar
+"""
+
+import argparse
+import bisect
+import io
+import json
+import math
+import multiprocessing as mp
+import pathlib
+import queue
+import subprocess
+import tarfile
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+from PIL import Image
+
+from catalog import CATALOG_NAME, Catalog, describe
+from segment_store import DATA_SUFFIX, SegmentReader, index_path
+
+BATCH = 32                             # frames per task / shared-memory slot
+MAX_FRAME = (640, 480)                 # slot sizing when no `size` is given
+SHARD_FRAMES = 1000
+
+
+# ───── planning (parent process) ───────────────────────────────────────────
+def _segments(root: pathlib.Path, cameras, start: float, end: float):
+    """(camera, path, segment start, segment duration) per camera, oldest first."""
+    if (root / CATALOG_NAME).exists():
+        catalog = Catalog(root)
+        try:
+            for cam in catalog.cameras():
+                if cameras and cam["camera"] not in cameras:
+                    continue
+                for r in catalog.query(cam["camera"], start, end):
+                    yield cam["camera"], catalog.path(r["path"]), r["start"], r["end"] - r["start"]
+        finally:
+            catalog.close()
+        return
+    for cam_dir in sorted(p for p in root.iterdir() if p.is_dir()):
+        if cameras and cam_dir.name not in cameras:
+            continue
+        for path in sorted(cam_dir.iterdir()):
+            if path.suffix == DATA_SUFFIX and index_path(path).exists():
+                yield cam_dir.name, path, None, None
+            elif path.suffix == ".mp4":
+                info = describe(path)
+                if info["end"] >= start and info["start"] <= end:
+                    yield cam_dir.name, path, info["start"], info["end"] - info["start"]
+
+
+def plan(root, fps: float, cameras=None, start: float = 0.0, end: float = math.inf,
+         batch: int = BATCH):
+    """Lazy stream of decode tasks sampling every camera at `fps`.
+
+    ("mjpeg", cam, path, [frame indices]) or ("mp4", cam, path, first ts, [offsets]).
+    """
+    period = 1.0 / fps
+    due = {}                                           # camera -> next timestamp wanted
+    for cam, path, seg_start, duration in _segments(pathlib.Path(root), cameras, start, end):
+        t = max(due.get(cam, start), start)
+        if path.suffix == DATA_SUFFIX:
+            picks = []
+            with SegmentReader(path) as seg:
+                col, n = seg.timestamps_us, len(seg)
+                lo = 0
+                while True:
+                    lo = bisect.bisect_left(col, int(t * 1_000_000), lo)
+                    if lo >= n or col[lo] > end * 1_000_000:
+                        break
+                    picks.append(lo)
+                    ts = col[lo] / 1_000_000
+                    t = t + period if ts - t < period else ts + period   # stay on the grid
+                    lo += 1
+            for k in range(0, len(picks), batch):
+                yield ("mjpeg", cam, str(path), picks[k:k + batch])
+        else:
+            offsets = []
+            off = max(0.0, t - seg_start)
+            while off < duration and seg_start + off <= end:
+                offsets.append(off)
+                off += period
+            if offsets:
+                t = seg_start + offsets[-1] + period
+            for k in range(0, len(offsets), batch):
+                yield ("mp4", cam, str(path), seg_start, offsets[k:k + batch])
+        due[cam] = t
+
+
+# ───── decoding (worker processes) ─────────────────────────────────────────
+def _decode_jpeg(jpeg, size, mode: str) -> np.ndarray:
+    im = Image.open(io.BytesIO(jpeg))
+    if size is not None:
+        im.draft(mode, size)                           # DCT scaling: decode at ≥ size only
+    im = im.convert(mode)
+    if size is not None and im.size != tuple(size):
+        im = im.resize(size, Image.BILINEAR)
+    return np.asarray(im)
+
+
+def _frame_size(path: str):
+    out = subprocess.run([
+        "ffprobe", "-v", "error", "-select_streams", "v:0",
+        "-show_entries", "stream=width,height", "-of", "csv=p=0", path,
+    ], check=True, capture_output=True, text=True).stdout
+    w, h = out.strip().split(",")[:2]
+    return int(w), int(h)
+
+
+def decode(task, size, mode: str):
+    """Yield (timestamp, ndarray) for one task."""
+    if task[0] == "mjpeg":
+        _, _, path, indices = task
+        with SegmentReader(path) as seg:
+            for i in indices:
+                jpeg = seg.frame(i)
+                try:
+                    arr = _decode_jpeg(jpeg, size, mode)
+                finally:
+                    jpeg.release()
+                yield seg.timestamp(i), arr
+        return
+    _, _, path, seg_start, offsets = task
+    fps = 1.0 / (offsets[1] - offsets[0]) if len(offsets) > 1 else 1.0
+    w, h = size if size is not None else _frame_size(path)
+    channels = 3 if mode == "RGB" else 1
+    proc = subprocess.Popen([
+        "ffmpeg", "-hide_banner", "-loglevel", "error", "-ss", f"{offsets[0]:.6f}", "-i", path,
+        "-vf", f"fps={fps:.6f},scale={w}:{h}", "-frames:v", str(len(offsets)),
+        "-pix_fmt", "rgb24" if mode == "RGB" else "gray", "-f", "rawvideo", "pipe:1",
+    ], stdout=subprocess.PIPE)
+    try:
+        for off in offsets:
+            buf = proc.stdout.read(w * h * channels)
+            if len(buf) < w * h * channels:
+                break
+            arr = np.frombuffer(buf, np.uint8).reshape((h, w, 3) if channels == 3 else (h, w))
+            yield seg_start + off, arr
+    finally:
+        proc.stdout.close()
+        proc.wait()
+
+
+def _worker(tasks, results, slot_names, slot_bytes: int, size, mode: str) -> None:
+    slots = [shared_memory.SharedMemory(name=n) for n in slot_names]
+    try:
+        while True:
+            item = tasks.get()
+            if item is None:
+                return
+            seq, slot, task = item
+            meta, off = [], 0
+            try:
+                for ts, arr in decode(task, size, mode):
+                    if slot is not None and off + arr.nbytes <= slot_bytes:
+                        np.ndarray(arr.shape, np.uint8, slots[slot].buf, off)[...] = arr
+                        meta.append((ts, arr.shape, off))
+                        off += arr.nbytes
+                    else:                              # no slot or too big: pickle it
+                        meta.append((ts, arr.shape, np.ascontiguousarray(arr)))
+                results.put((seq, meta, None))
+            except Exception as e:
+                results.put((seq, meta, f"{task[2]}: {type(e).__name__}: {e}"))
+    finally:
+        for s in slots:
+            s.close()
+
+
+class FrameExtractor:
+    """Iterable of (camera_id, timestamp, ndarray) sampled at `fps` (see module docstring)."""
+
+    def __init__(self, root, fps: float = 1.0, workers: int = None, size=None, mode: str = "RGB",
+                 cameras=None, start: float = 0.0, end: float = math.inf, batch: int = BATCH,
+                 prefetch: int = None, copy: bool = True, shared: bool = True):
+        self.root = pathlib.Path(root)
+        self.fps = fps
+        self.workers = workers or mp.cpu_count()
+        self.size = tuple(size) if size is not None else None
+        self.mode = mode
+        self.cameras = set(cameras) if cameras else None
+        self.start, self.end = start, end
+        self.batch = batch
+        self.prefetch = prefetch or 2 * self.workers
+        self.copy = copy
+        self.shared = shared                           # False: pickle arrays (for comparison)
+        self.errors = []
+
+    def __iter__(self):
+        w, h = self.size or MAX_FRAME
+        slot_bytes = self.batch * w * h * (3 if self.mode == "RGB" else 1)
+        slots = [shared_memory.SharedMemory(create=True, size=slot_bytes)
+                 for _ in range(self.prefetch if self.shared else 0)]
+        ctx = mp.get_context()
+        tasks, results = ctx.Queue(), ctx.Queue()
+        procs = [ctx.Process(target=_worker, daemon=True,
+                             args=(tasks, results, [s.name for s in slots], slot_bytes,
+                                   self.size, self.mode))
+                 for _ in range(self.workers)]
+        for p in procs:
+            p.start()
+        todo = plan(self.root, self.fps, self.cameras, self.start, self.end, self.batch)
+        free = list(range(len(slots))) if self.shared else [None] * self.prefetch
+        slot_of, cam_of, done = {}, {}, {}
+        submitted = next_seq = 0
+        try:
+            while True:
+                while free:
+                    task = next(todo, None)
+                    if task is None:
+                        break
+                    slot = free.pop()
+                    slot_of[submitted], cam_of[submitted] = slot, task[1]
+                    tasks.put((submitted, slot, task))
+                    submitted += 1
+                if next_seq == submitted:
+                    return
+                while next_seq not in done:
+                    try:
+                        seq, meta, err = results.get(timeout=1.0)
+                    except queue.Empty:
+                        if not all(p.is_alive() for p in procs):
+                            raise RuntimeError("a decode worker died")
+                        continue
+                    done[seq] = (meta, err)
+                meta, err = done.pop(next_seq)
+                slot, cam = slot_of.pop(next_seq), cam_of.pop(next_seq)
+                if err is not None:
+                    self.errors.append(err)
+                for ts, shape, where in meta:
+                    if isinstance(where, np.ndarray):
+                        arr = where
+                    else:
+                        arr = np.ndarray(shape, np.uint8, slots[slot].buf, where)
+                        if self.copy:
+                            arr = arr.copy()
+                    yield cam, ts, arr
+                    del arr
+                free.append(slot)
+                next_seq += 1
+        finally:
+            for _ in procs:
+                tasks.put(None)
+            for p in procs:
+                p.join(timeout=5)
+                if p.is_alive():
+                    p.terminate()
+            for s in slots:
+                try:
+                    s.close()
+                except BufferError:                    # caller still holds copy=False views
+                    pass
+                s.unlink()
+
+
+# ───── shards ──────────────────────────────────────────────────────────────
+class ShardWriter:
+    """Write frames to numbered shards of `shard_frames` frames each.
+
+    fmt="tar": WebDataset layout, `<camera>_<ts µs>.npy` + `.json` per frame.
+    fmt="npy": one stacked array per shard (all frames must share a shape,
+    use `size`) plus a .json list of (camera, timestamp).
+    """
+
+    def __init__(self, out_dir, fmt: str = "tar", shard_frames: int = SHARD_FRAMES):
+        self.out_dir = pathlib.Path(out_dir)
+        self.out_dir.mkdir(parents=True, exist_ok=True)
+        self.fmt = fmt
+        self.shard_frames = shard_frames
+        self.shards = 0
+        self.frames = 0
+        self._tar = None
+        self._arrays, self._meta = [], []
+
+    def _name(self, suffix: str) -> pathlib.Path:
+        return self.out_dir / f"shard-{self.shards:06d}{suffix}"
+
+    def write(self, cam_id: str, ts: float, arr: np.ndarray) -> None:
+        meta = {"camera": cam_id, "timestamp": ts, "shape": list(arr.shape)}
+        if self.fmt == "tar":
+            if self._tar is None:
+                self._tar = tarfile.open(self._name(".tar"), "w")
+            key = f"{cam_id}_{int(ts * 1_000_000)}"
+            buf = io.BytesIO()
+            np.lib.format.write_array(buf, np.ascontiguousarray(arr))
+            self._add(key + ".npy", buf.getvalue())
+            self._add(key + ".json", json.dumps(meta).encode())
+        else:
+            self._arrays.append(np.array(arr))
+            self._meta.append(meta)
+        self.frames += 1
+        if self.frames % self.shard_frames == 0:
+            self._finish_shard()
+
+    def _add(self, name: str, data: bytes) -> None:
+        info = tarfile.TarInfo(name)
+        info.size = len(data)
+        info.mtime = int(time.time())
+        self._tar.addfile(info, io.BytesIO(data))
+
+    def _finish_shard(self) -> None:
+        if self._tar is not None:
+            self._tar.close()
+            self._tar = None
+        elif self._arrays:
+            np.save(self._name(".npy"), np.stack(self._arrays))
+            self._name(".json").write_text(json.dumps(self._meta))
+            self._arrays, self._meta = [], []
+        else:
+            return
+        self.shards += 1
+
+    def close(self) -> None:
+        self._finish_shard()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Extract sampled frames from recordings")
+    parser.add_argument("root", type=pathlib.Path, help="recordings directory")
+    parser.add_argument("--fps", type=float, default=1.0, help="frames sampled per camera per second")
+    parser.add_argument("--size", help="WxH to decode/resize to, e.g. 160x120")
+    parser.add_argument("--grey", action="store_true", help="decode to greyscale")
+    parser.add_argument("--camera", action="append", help="only these cameras (repeatable)")
+    parser.add_argument("--start", type=float, default=0.0, help="epoch seconds")
+    parser.add_argument("--end", type=float, default=math.inf, help="epoch seconds")
+    parser.add_argument("--workers", type=int, help="decode processes (default: all cores)")
+    parser.add_argument("--batch", type=int, default=BATCH)
+    parser.add_argument("-o", "--output", type=pathlib.Path, help="shard directory (default: count only)")
+    parser.add_argument("--format", choices=["tar", "npy"], default="tar")
+    parser.add_argument("--shard-frames", type=int, default=SHARD_FRAMES)
+    parser.add_argument("--dedup-radius", type=int,
+                        help="drop frames within this many pHash bits of a kept one (see dedup.py)")
+    parser.add_argument("--dedup-window", type=float,
+                        help="only compare with frames kept in the last N seconds")
+    parser.add_argument("--dedup-index", type=pathlib.Path,
+                        help="near-duplicate index to start from and save to (.npz)")
+    args = parser.parse_args()
+
+    size = tuple(int(v) for v in args.size.lower().split("x")) if args.size else None
+    ex = FrameExtractor(args.root, args.fps, args.workers, size, "L" if args.grey else "RGB",
+                        args.camera, args.start, args.end, args.batch)
+    writer = ShardWriter(args.output, args.format, args.shard_frames) if args.output else None
+    frames = iter(ex)
+    dedup_filter = None
+    if args.dedup_radius is not None or args.dedup_index is not None:
+        import dedup
+        index = (dedup.HashIndex.load(args.dedup_index)
+                 if args.dedup_index is not None and args.dedup_index.exists() else None)
+        dedup_filter = dedup.DedupFilter(index, args.dedup_radius if args.dedup_radius is not None
+                                         else dedup.RADIUS, args.dedup_window)
+        frames = dedup.filter_frames(frames, dedup_filter)
+    t = time.perf_counter()
+    n = 0
+    for cam_id, ts, arr in frames:
+        if writer is not None:
+            writer.write(cam_id, ts, arr)
+        n += 1
+    if writer is not None:
+        writer.close()
+    elapsed = time.perf_counter() - t
+    print(f"{n} frames in {elapsed:.1f} s ({n / elapsed if elapsed else 0:.0f} frames/s, "
+          f"{ex.workers} workers)" + (f" → {writer.shards} shards in {args.output}" if writer else ""))
+    if dedup_filter is not None:
+        print(f"dropped {dedup_filter.duplicates} of {dedup_filter.checked} frames as near-duplicates")
+        if args.dedup_index is not None:
+            dedup_filter.index.save(args.dedup_index)
+    for err in ex.errors:
+        print(f"error: {err}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,458 @@
+#!/usr/bin/env python3
+"""
+Near-duplicate frame index
+
+A camera over a quiet bar produces hours of practically identical frames.
+Every frame the recorder (`--dedup`) or the dataset extractor (`dataset.py
+--dedup-radius`) sees can be checked against all frames kept so far, on
+every camera:
+
+ • pHash – frames are reduced to 32×32 grey (JPEGs via DCT-scaled draft
+   decode), then a whole batch goes through one matrix product with the
+   8×32 low-frequency DCT basis; each 64-bit hash is "coefficient above the
+   median" of the 8×8 block.  Hamming distance ≤ RADIUS = near-duplicate.
+ • HashIndex – multi-index hashing: the 64 bits are split into four 16-bit
+   chunks; if two hashes are within r bits, one chunk is within r // 4 bits,
+   so a query probes every 16-bit value that close in each chunk's table and
+   verifies only those candidates (vectorized popcount).  Tables are
+   immutable CSR arrays (ids sorted by chunk value + 65537 offsets, all
+   probed buckets gathered in one vectorized step) built for sealed runs
+   of SEAL_EVERY hashes and merged geometrically, LSM style; the newest,
+   unsealed hashes are scanned brute force.  While ids are inserted in
+   time order (the recorder), "within the last N seconds" is an id bound:
+   old runs are skipped and buckets are cut by binary search; otherwise
+   candidates are filtered by time.
+ • DedupFilter – the streaming filter: `check` answers "near-duplicate of a
+   kept frame (in the window / overall)?" and keeps the frame otherwise, so
+   the index only grows with distinct content.
+ • FrameHasher – the recorder's feed: batches of frames go to a hashing
+   thread through a bounded queue, so neither decoding nor a seal or merge
+   ever runs on the ingest loop.
+ • On disk the index is one .npz of the hash, time (uint32 s) and camera
+   (uint16) columns, 14 bytes per hash; tables are rebuilt on load.
+
+CLI:
+    python dedup.py stats dedup.npz
+    python dedup.py query dedup.npz frame.jpg --radius 7
+"""
+
+import argparse
+import io
+import math
+import os
+import queue
+import threading
+import time
+
+import numpy as np
+from PIL import Image
+
+RADIUS = 7                             # bits: near-duplicate threshold (< 8: 1-bit probes per chunk)
+CHUNKS = 4                             # 16-bit multi-index tables
+CHUNK_BITS = 64 // CHUNKS
+SEAL_EVERY = 1 << 16                   # hashes scanned brute force before indexing
+VERIFY_BLOCK = 4096                    # candidates verified per step (early exit)
+HASH_SIZE = 32                         # pixels per side fed to the DCT
+HASH_FPS = 1.0                         # recorder: frames hashed per camera per second
+HASH_BATCH = 32                        # recorder: frames hashed together
+HASH_QUEUE = 8                         # recorder: batches waiting for the hashing thread
+SAVE_INTERVAL = 600.0                  # recorder: seconds between index saves
+
+
+# ───── hashing ─────────────────────────────────────────────────────────────
+def _dct_rows(n: int = HASH_SIZE, k: int = 8) -> np.ndarray:
+    i = np.arange(n)
+    m = np.cos(np.pi * (2 * i[None, :] + 1) * np.arange(k)[:, None] / (2 * n)) * math.sqrt(2 / n)
+    m[0] /= math.sqrt(2)
+    return m.astype(np.float32)
+
+
+_DCT = _dct_rows()
+
+
+def phash_batch(pixels: np.ndarray) -> np.ndarray:
+    """64-bit pHashes (uint64) of an (N, 32, 32) batch of grey images."""
+    low = _DCT @ pixels.astype(np.float32) @ _DCT.T                 # (N, 8, 8)
+    flat = low.reshape(len(pixels), 64)
+    bits = flat > np.median(flat[:, 1:], axis=1, keepdims=True)     # DC term left out of the median
+    return np.packbits(bits, axis=1).view(">u8").astype(np.uint64).ravel()
+
+
+def _small_jpeg(jpeg) -> np.ndarray:
+    im = Image.open(io.BytesIO(jpeg))
+    im.draft("L", (HASH_SIZE, HASH_SIZE))
+    return np.asarray(im.convert("L").resize((HASH_SIZE, HASH_SIZE), Image.BILINEAR))
+
+
+def hash_jpegs(jpegs) -> np.ndarray:
+    return phash_batch(np.stack([_small_jpeg(j) for j in jpegs]))
+
+
+def hash_arrays(arrays) -> np.ndarray:
+    """pHashes of decoded frames (H×W grey or H×W×3 RGB uint8)."""
+    small = [np.asarray(Image.fromarray(a).convert("L").resize((HASH_SIZE, HASH_SIZE), Image.BILINEAR))
+             for a in arrays]
+    return phash_batch(np.stack(small))
+
+
+if hasattr(np, "bitwise_count"):
+    def popcount(x: np.ndarray) -> np.ndarray:
+        return np.bitwise_count(x)
+else:
+    _POP8 = np.array([bin(i).count("1") for i in range(256)], np.uint8)
+
+    def popcount(x: np.ndarray) -> np.ndarray:
+        return _POP8[x.view(np.uint8).reshape(-1, 8)].sum(axis=1, dtype=np.uint8)
+
+
+def _masks(max_weight: int) -> np.ndarray:
+    """All CHUNK_BITS-bit masks with at most `max_weight` bits set."""
+    v = np.arange(1 << CHUNK_BITS, dtype=np.uint32)
+    w = np.array([bin(i).count("1") for i in range(1 << CHUNK_BITS)])
+    return v[w <= max_weight]
+
+
+# ───── index ───────────────────────────────────────────────────────────────
+class _Run:
+    """Multi-index tables over ids [lo, hi) (immutable)."""
+
+    def __init__(self, hashes: np.ndarray, lo: int, hi: int):
+        self.lo, self.hi = lo, hi
+        n = hi - lo
+        # table j is order[j*n:(j+1)*n]; bucket v of table j is order[starts[j, v]:starts[j, v+1]]
+        self.order = np.empty(CHUNKS * n, np.uint32)
+        self.starts = np.empty((CHUNKS, (1 << CHUNK_BITS) + 1), np.int64)
+        h = hashes[lo:hi]
+        for j in range(CHUNKS):
+            chunk = ((h >> np.uint64(j * CHUNK_BITS)) & np.uint64(0xFFFF)).astype(np.uint32)
+            order = np.argsort(chunk, kind="stable")
+            self.order[j * n:(j + 1) * n] = order + lo
+            self.starts[j] = np.searchsorted(chunk[order], np.arange((1 << CHUNK_BITS) + 1)) + j * n
+
+    def __len__(self) -> int:
+        return self.hi - self.lo
+
+    def candidates(self, h: int, masks: np.ndarray) -> np.ndarray:
+        """Ids sharing a chunk within the probe masks with `h` (may repeat)."""
+        keys = np.array([(h >> (j * CHUNK_BITS)) & 0xFFFF for j in range(CHUNKS)])[:, None] ^ masks
+        rows = np.arange(CHUNKS)[:, None]
+        a, b = self.starts[rows, keys].ravel(), self.starts[rows, keys + 1].ravel()
+        size = b - a
+        a, size = a[size > 0], size[size > 0]
+        if not len(size):
+            return a.astype(np.uint32)
+        # all bucket ranges gathered in one go: run k covers a[k] .. a[k] + size[k]
+        ends = np.cumsum(size)
+        pos = np.repeat(a - (ends - size), size) + np.arange(ends[-1])
+        return self.order[pos]
+
+
+class HashIndex:
+    """Append-only pHash index with Hamming-radius queries (see module docstring)."""
+
+    def __init__(self, capacity: int = 1 << 16):
+        self.hashes = np.zeros(capacity, np.uint64)
+        self.times = np.zeros(capacity, np.uint32)
+        self.cams = np.zeros(capacity, np.uint16)
+        self.n = 0
+        self.cameras = []                              # camera index -> id
+        self._cam_ix = {}
+        self.runs = []
+        self.sealed = 0                                # ids below this are in runs
+        self.monotone = True                           # times never decreased: ids bound windows
+        self._masks = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return self.n
+
+    def camera_index(self, cam_id: str) -> int:
+        ix = self._cam_ix.get(cam_id)
+        if ix is None:
+            ix = self._cam_ix[cam_id] = len(self.cameras)
+            self.cameras.append(cam_id)
+        return ix
+
+    # ── writes ─────────────────────────────────────────────────────────────
+    def add(self, hashes, ts, cam_id: str) -> None:
+        """Append hashes seen at `ts` (scalar or per hash, epoch seconds)."""
+        hashes = np.atleast_1d(np.asarray(hashes, np.uint64))
+        with self._lock:
+            self._add(hashes, ts, self.camera_index(cam_id))
+
+    def _add(self, hashes: np.ndarray, ts, cam: int) -> None:
+        k = len(hashes)
+        if self.n + k > len(self.hashes):
+            cap = max(2 * len(self.hashes), self.n + k)
+            for name in ("hashes", "times", "cams"):
+                old = getattr(self, name)
+                new = np.zeros(cap, old.dtype)
+                new[:self.n] = old[:self.n]
+                setattr(self, name, new)
+        t = np.atleast_1d(ts)
+        if (self.n and np.min(t) < self.times[self.n - 1]) or (len(t) > 1 and (np.diff(t) < 0).any()):
+            self.monotone = False
+        self.hashes[self.n:self.n + k] = hashes
+        self.times[self.n:self.n + k] = ts
+        self.cams[self.n:self.n + k] = cam
+        self.n += k
+        if self.n - self.sealed >= SEAL_EVERY:
+            self._seal()
+
+    def _seal(self) -> None:
+        self.runs.append(_Run(self.hashes, self.sealed, self.n))
+        self.sealed = self.n
+        # merge while the newest run is as large as the one before: O(log n) runs
+        while len(self.runs) > 1 and len(self.runs[-2]) <= 2 * len(self.runs[-1]):
+            b, a = self.runs.pop(), self.runs.pop()
+            self.runs.append(_Run(self.hashes, a.lo, b.hi))
+
+    # ── reads ──────────────────────────────────────────────────────────────
+    def _probe_masks(self, radius: int) -> np.ndarray:
+        s = radius // CHUNKS
+        m = self._masks.get(s)
+        if m is None:
+            m = self._masks[s] = _masks(s)
+        return m
+
+    def _first_id(self, since) -> int:
+        if since is None or not self.monotone:
+            return 0
+        # same dtype as the column, or numpy converts all of it on every query
+        return int(np.searchsorted(self.times[:self.n], np.uint32(min(max(math.ceil(since), 0), 2 ** 32 - 1))))
+
+    def _hits(self, ids: np.ndarray, h, radius: int, since) -> np.ndarray:
+        ok = popcount(self.hashes[ids] ^ h) <= radius
+        if since is not None and not self.monotone:
+            ok &= self.times[ids] >= since
+        return ids[ok]
+
+    def match(self, h: int, radius: int = RADIUS, since: float = None, limit: int = 1) -> list:
+        """Ids of up to `limit` hashes within `radius` bits of `h` (seen at or after `since`)."""
+        h = np.uint64(h)
+        with self._lock:
+            lo = self._first_id(since)
+            found = []
+            tail_lo = max(lo, self.sealed)
+            if tail_lo < self.n:                       # unsealed hashes: brute force
+                ok = popcount(self.hashes[tail_lo:self.n] ^ h) <= radius
+                if since is not None and not self.monotone:
+                    ok &= self.times[tail_lo:self.n] >= since
+                found += (np.flatnonzero(ok)[::-1] + tail_lo).tolist()[:limit]
+            masks = self._probe_masks(radius)
+            for run in reversed(self.runs):            # newest first
+                if len(found) >= limit or run.hi <= lo:
+                    break
+                ids = run.candidates(int(h), masks)
+                if lo > run.lo:
+                    ids = ids[ids >= lo]
+                if len(ids) > VERIFY_BLOCK:
+                    ids = np.sort(ids)[::-1]           # newest first, so big buckets exit early
+                for e in range(0, len(ids), VERIFY_BLOCK):
+                    found += self._hits(ids[e:e + VERIFY_BLOCK], h, radius, since).tolist()
+                    if len(found) >= limit:
+                        break
+            return list(dict.fromkeys(found))[:limit]
+
+    def contains(self, h: int, radius: int = RADIUS, since: float = None) -> bool:
+        return bool(self.match(h, radius, since, 1))
+
+    def describe(self, i: int) -> dict:
+        return {"id": i, "hash": f"{int(self.hashes[i]):016x}", "time": int(self.times[i]),
+                "camera": self.cameras[self.cams[i]]}
+
+    # ── persistence ────────────────────────────────────────────────────────
+    def save(self, path) -> None:
+        """Write the columns to `path` (.npz) atomically; safe while others add."""
+        with self._lock:
+            n = self.n
+            cols = (self.hashes[:n].copy(), self.times[:n].copy(), self.cams[:n].copy())
+            cameras = list(self.cameras)
+        tmp = f"{path}.tmp"
+        with open(tmp, "wb") as f:
+            np.savez(f, hashes=cols[0], times=cols[1], cams=cols[2], cameras=np.array(cameras, dtype=str))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path) -> "HashIndex":
+        with np.load(path) as z:
+            hashes, times, cams = z["hashes"], z["times"], z["cams"]
+            cameras = [str(c) for c in z["cameras"]]
+        index = cls(max(len(hashes), 1 << 16))
+        index.cameras = cameras
+        index._cam_ix = {c: i for i, c in enumerate(cameras)}
+        n = len(hashes)
+        index.hashes[:n], index.times[:n], index.cams[:n] = hashes, times, cams
+        index.n = n
+        index.monotone = bool(n < 2 or (np.diff(index.times[:n].astype(np.int64)) >= 0).all())
+        if n >= SEAL_EVERY:
+            index.runs = [_Run(index.hashes, 0, n)]
+            index.sealed = n
+        return index
+
+
+# ───── streaming filter ────────────────────────────────────────────────────
+class DedupFilter:
+    """Drop frames that near-duplicate a kept frame (within `window` seconds, or ever)."""
+
+    def __init__(self, index: HashIndex = None, radius: int = RADIUS, window: float = None):
+        self.index = index if index is not None else HashIndex()
+        self.radius = radius
+        self.window = window
+        self.checked = self.duplicates = 0
+        self.seconds = 0.0
+
+    def check(self, cam_id: str, ts: float, h) -> bool:
+        """True if the frame is new (and now indexed), False if it is a near-duplicate."""
+        t = time.perf_counter()
+        since = ts - self.window if self.window is not None else None
+        dup = self.index.contains(h, self.radius, since)
+        if not dup:
+            self.index.add(h, ts, cam_id)
+        self.checked += 1
+        self.duplicates += dup
+        self.seconds += time.perf_counter() - t
+        return not dup
+
+    def snapshot(self) -> dict:
+        return {"hashes": len(self.index), "checked": self.checked, "duplicates": self.duplicates,
+                "radius": self.radius, "window_seconds": self.window,
+                "queries_per_second": self.checked / self.seconds if self.seconds else None}
+
+
+def filter_frames(frames, dedup: DedupFilter, batch: int = 256):
+    """Pass through (camera_id, timestamp, ndarray) items that are not near-duplicates."""
+    pending = []
+
+    def flush():
+        hashes = hash_arrays([a for _, _, a in pending])
+        for item, h in zip(pending, hashes):
+            if dedup.check(item[0], item[1], h):
+                yield item
+        pending.clear()
+
+    for item in frames:
+        # copy=False views die with the next item: keep our own
+        pending.append((item[0], item[1], np.array(item[2])))
+        if len(pending) >= batch:
+            yield from flush()
+    if pending:
+        yield from flush()
+
+
+class FrameHasher:
+    """Recorder side: hash each camera's frames at HASH_FPS into a shared
+    DedupFilter.  Decoding, hashing and the index (whose `add` seals and
+    merges runs) stay on a thread of their own, fed batches through a
+    bounded queue; a batch that finds the queue full is dropped."""
+
+    def __init__(self, dedup: DedupFilter, path=None, hash_fps: float = HASH_FPS):
+        self.dedup = dedup
+        self.path = path
+        self.interval = 1.0 / hash_fps
+        self.last = {}                                 # camera -> last hashed time
+        self.pending = []                              # (camera, ts, jpeg bytes)
+        self.batches = queue.Queue(HASH_QUEUE)
+        self.dropped = 0                               # frames: queue full
+        self.undecodable = 0                           # frames: not a JPEG PIL could read
+        self.thread = None
+
+    def frame(self, cam_id: str, jpeg, now: float) -> None:
+        if now - self.last.get(cam_id, 0.0) < self.interval:
+            return
+        self.last[cam_id] = now
+        self.pending.append((cam_id, now, bytes(jpeg)))
+        if len(self.pending) >= HASH_BATCH:
+            batch, self.pending = self.pending, []
+            try:
+                self.batches.put_nowait(batch)
+            except queue.Full:
+                self.dropped += len(batch)
+
+    def _hash(self, batch: list) -> None:
+        try:
+            hashes = hash_jpegs([j for _, _, j in batch])
+        except (OSError, ValueError):              # one bad frame: hash the others one by one
+            small, kept = [], []
+            for item in batch:
+                try:
+                    small.append(_small_jpeg(item[2]))
+                except (OSError, ValueError):
+                    self.undecodable += 1
+                    continue
+                kept.append(item)
+            batch, hashes = kept, phash_batch(np.stack(small)) if small else []
+        for (cam, ts, _), h in zip(batch, hashes):
+            self.dedup.check(cam, ts, h)
+
+    def run_hasher(self) -> threading.Thread:
+        def loop():
+            while (batch := self.batches.get()) is not None:
+                self._hash(batch)
+        self.thread = threading.Thread(target=loop, name="dedup-hasher", daemon=True)
+        self.thread.start()
+        return self.thread
+
+    def stop(self, timeout: float = None) -> None:
+        """Hash what is queued, then end the hashing thread."""
+        if self.thread is not None:
+            self.batches.put(None)
+            self.thread.join(timeout)
+
+    def snapshot(self) -> dict:
+        return dict(self.dedup.snapshot(), dropped_frames=self.dropped,
+                    undecodable_frames=self.undecodable)
+
+    def run_saver(self, interval: float = SAVE_INTERVAL) -> threading.Thread:
+        def loop():
+            while True:
+                time.sleep(interval)
+                self.dedup.index.save(self.path)
+        t = threading.Thread(target=loop, daemon=True)
+        t.start()
+        return t
+
+
+def add_routes(app, dedup) -> None:
+    """Register /dedup.json (`dedup.snapshot()`, a DedupFilter or FrameHasher)
+    on an aiohttp application."""
+    import json
+    from aiohttp import web
+
+    async def status(request):
+        return web.Response(text=json.dumps(dedup.snapshot(), indent=1),
+                            content_type="application/json")
+
+    app.router.add_get("/dedup.json", status)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Near-duplicate frame index")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("stats", help="size of an index file")
+    p.add_argument("index")
+    p = sub.add_parser("query", help="near-duplicates of JPEG files")
+    p.add_argument("index")
+    p.add_argument("jpegs", nargs="+")
+    p.add_argument("--radius", type=int, default=RADIUS)
+    p.add_argument("--limit", type=int, default=10)
+    args = parser.parse_args()
+
+    t = time.perf_counter()
+    index = HashIndex.load(args.index)
+    print(f"{len(index)} hashes from {len(index.cameras)} cameras, "
+          f"{os.path.getsize(args.index) / 1e6:.1f} MB, loaded in {time.perf_counter() - t:.2f} s")
+    if args.cmd == "query":
+        for name, h in zip(args.jpegs, hash_jpegs([open(j, "rb").read() for j in args.jpegs])):
+            t = time.perf_counter()
+            ids = index.match(h, args.radius, limit=args.limit)
+            print(f"{name}: {int(h):016x}, {len(ids)} matches in {(time.perf_counter() - t) * 1e3:.2f} ms")
+            for i in ids:
+                d = index.describe(i)
+                print(f"  {d['camera']} @ {d['time']}  {d['hash']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,203 @@
+"""
+UDP discovery of SipBuddy devices (asyncio)
+
+Every device broadcasts
+
+    SIPBUDDY_REGISTER|IP:192.168.4.1|MAC:0123456789ab|PORT:8080|CTRL:8001
+
+(CTRL, the UDP control port for rate_control.py, only from newer firmware)
+until it hears `SIPBUDDY_ACK`: at boot and when its last client leaves, then
+at intervals doubling from 1 s to 30 s (older firmware: once a second,
+before every client).  Once ACKed a device is silent, so on start-up the
+listener sends `SIPBUDDY_DISCOVER` to CONTROL_PORT (broadcast, and to every
+known camera's control port) and the devices announce themselves again.
+When a whole venue power-cycles that is thousands of identical packets, so
+the listener is built to shrug them off:
+
+ • parse_registration: one precompiled regex pass over the raw bytes.
+ • a TTL cache keyed by MAC drops repeats of an already-known registration
+   before they touch the registry, the recorder or the log.
+ • ACKs are coalesced: at most one per sender per event-loop pass, and at
+   most one per MAC every ACK_INTERVAL (the device retries, so a lost ACK is
+   still re-sent on its next attempt).
+ • logging is rate-limited per MAC / per offending address.
+"""
+
+import asyncio
+import logging
+import re
+import socket
+import time
+
+from registry import NEW, MOVED, CameraRegistry
+
+logger = logging.getLogger('sipbuddy')
+
+REGISTER_PREFIX = b"SIPBUDDY_REGISTER"
+ACK = b"SIPBUDDY_ACK"
+DISCOVER = b"SIPBUDDY_DISCOVER"
+CONTROL_PORT = 8001                    # where devices listen for DISCOVER (their default CTRL)
+BROADCAST_IP = "255.255.255.255"
+DEDUP_TTL = 30.0                       # seconds a registration is considered known
+ACK_INTERVAL = 0.5                     # min seconds between ACKs to one MAC
+LOG_INTERVAL = 10.0                    # min seconds between similar log lines
+RCVBUF_BYTES = 1 << 20                 # kernel buffer to ride out bursts
+
+_FIELD_RE = re.compile(rb"\|(IP|MAC|PORT|CTRL):([^|]*)")
+
+
+def parse_registration(data: bytes):
+    """Parse a registration datagram into a camera dict, or None."""
+    if not data.startswith(REGISTER_PREFIX):
+        return None
+    fields = dict(_FIELD_RE.findall(data, len(REGISTER_PREFIX)))
+    ip, mac = fields.get(b"IP"), fields.get(b"MAC")
+    if not (ip and mac):
+        return None
+    try:
+        mac = mac.decode()
+        info = {
+            "ip": ip.decode(),
+            "mac": mac,
+            "id": f"sipbuddy_{mac[-6:]}",  # Use last 6 chars of MAC as ID
+            "port": (fields.get(b"PORT") or b"8080").decode(),
+        }
+        if fields.get(b"CTRL"):
+            info["ctrl"] = fields[b"CTRL"].decode()
+        return info
+    except UnicodeDecodeError:
+        return None
+
+
+class RateLimitedLog:
+    """Log at most once per `interval` per key, counting what was suppressed."""
+
+    def __init__(self, interval: float = LOG_INTERVAL):
+        self.interval = interval
+        self._last = {}                                # key -> (time, suppressed)
+
+    def __call__(self, level: int, key, msg: str) -> None:
+        now = time.monotonic()
+        last, suppressed = self._last.get(key, (0.0, 0))
+        if now - last < self.interval:
+            self._last[key] = (last, suppressed + 1)
+            return
+        if suppressed:
+            msg += f" ({suppressed} similar suppressed)"
+        self._last[key] = (now, 0)
+        logger.log(level, msg)
+
+
+class DiscoveryProtocol(asyncio.DatagramProtocol):
+    """Handles SIPBUDDY_REGISTER datagrams; calls `on_camera` for every
+    registration not dropped as a repeat (the supervisor ignores cameras it
+    already records at that address, and starts known ones it does not)."""
+
+    def __init__(self, registry: CameraRegistry, on_camera):
+        self.registry = registry
+        self.on_camera = on_camera
+        self.transport = None
+        self.seen = {}                     # mac -> (ip, port, expires)
+        self.last_ack = {}                 # mac -> monotonic time of last ACK
+        self.pending_acks = set()          # addresses to ACK on the next flush
+        self.log = RateLimitedLog()
+        # counters for benchmarks / telemetry
+        self.packets = 0
+        self.duplicates = 0
+        self.acks_sent = 0
+        self.asks = 0
+
+    def connection_made(self, transport) -> None:
+        self.transport = transport
+        self.ask()
+
+    def ask(self, mac: str = None) -> None:
+        """Send SIPBUDDY_DISCOVER (to one MAC, or to every device) so ACKed
+        devices announce themselves again."""
+        msg = DISCOVER if mac is None else DISCOVER + b"|MAC:" + mac.encode()
+        targets = {(BROADCAST_IP, CONTROL_PORT)}
+        for cam in self.registry.snapshot():
+            if cam.get("ctrl") and (mac is None or cam["mac"] == mac):
+                targets.add((cam["ip"], int(cam["ctrl"])))
+        for addr in targets:
+            try:
+                self.transport.sendto(msg, addr)
+            except (OSError, ValueError) as e:
+                self.log(logging.WARNING, ("ask", addr[0]), f"Failed to send DISCOVER to {addr[0]}: {e}")
+        self.asks += 1
+
+    def datagram_received(self, data: bytes, addr) -> None:
+        self.packets += 1
+        info = parse_registration(data)
+        if info is None:
+            self.log(logging.WARNING, addr[0], f"Ignoring malformed datagram from {addr[0]}:{addr[1]}")
+            return
+        mac = info["mac"]
+        now = time.monotonic()
+        if now - self.last_ack.get(mac, -ACK_INTERVAL) >= ACK_INTERVAL:
+            self.last_ack[mac] = now
+            if not self.pending_acks:
+                asyncio.get_running_loop().call_soon(self._flush_acks)
+            self.pending_acks.add(addr)
+
+        cached = self.seen.get(mac)
+        if cached is not None and cached[2] > now and cached[:2] == (info["ip"], info["port"]):
+            self.duplicates += 1
+            return
+        self.seen[mac] = (info["ip"], info["port"], now + DEDUP_TTL)
+        if len(self.seen) > 4 * len(self.registry) + 1024:
+            self._expire(now)
+
+        change = self.registry.update(info)
+        if change == NEW:
+            self.log(logging.INFO, mac, f"New SipBuddy discovered: {info}")
+        elif change == MOVED:
+            self.log(logging.INFO, mac, f"SipBuddy IP updated: {info}")
+        self.on_camera(info)
+
+    def _flush_acks(self) -> None:
+        for addr in self.pending_acks:
+            try:
+                self.transport.sendto(ACK, addr)
+                self.acks_sent += 1
+            except OSError as e:
+                self.log(logging.ERROR, ("ack", addr[0]), f"Failed to ACK {addr[0]}: {e}")
+        self.pending_acks.clear()
+
+    def _expire(self, now: float) -> None:
+        for mac in [m for m, c in self.seen.items() if c[2] <= now]:
+            del self.seen[mac]
+            self.last_ack.pop(mac, None)
+
+    def error_received(self, exc) -> None:
+        self.log(logging.ERROR, "error", f"Error in UDP listener: {exc}")
+
+
+def make_socket(port: int) -> socket.socket:
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)   # for DISCOVER
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, RCVBUF_BYTES)
+    except OSError:
+        pass
+    sock.bind(('', port))
+    sock.setblocking(False)
+    return sock
+
+
+async def serve(port: int, registry: CameraRegistry, on_camera) -> DiscoveryProtocol:
+    """Start listening on `port`; returns the protocol (runs until the loop stops)."""
+    loop = asyncio.get_running_loop()
+    _, protocol = await loop.create_datagram_endpoint(
+        lambda: DiscoveryProtocol(registry, on_camera), sock=make_socket(port))
+    logger.info(f"Listening for SipBuddy registrations on *:{port}")
+    return protocol
+
+
+def run_discovery(port: int, registry: CameraRegistry, on_camera) -> None:
+    """Blocking entry point for a discovery thread."""
+    async def main():
+        await serve(port, registry, on_camera)
+        await asyncio.Event().wait()
+    asyncio.run(main())
@@ -0,0 +1,365 @@
+"""
+Write-behind segment writer shared by every camera
+
+Without it each frame is two unbuffered write() calls (frame, index record)
+on the ingest event loop: on a slow disk (SD card, USB stick, NAS, a
+spinning disk busy with something else) one slow write stalls every camera.
+DiskWriter moves the disk off the event loop:
+
+ • `open(path, cam_id)` returns a SegmentHandle with SegmentWriter's
+   write/close; `write` only appends the frame to the handle's pending list.
+ • One writer thread wakes every FLUSH_INTERVAL (sooner once FLUSH_BYTES
+   are pending) and turns each segment's pending frames into one pwrite of
+   the frames and one of their index records – few large sequential writes
+   instead of two small ones per frame.  Frames still reach the file before
+   their records, so readers see a consistent prefix as before.
+ • Data files are preallocated PREALLOCATE bytes at a time
+   (fallocate KEEP_SIZE: the file size stays the real one; the tail is
+   released when the segment closes), so the file system can lay them out
+   contiguously.
+ • Group commit: every `durability` seconds one syncfs() per file system
+   makes everything written since the last one durable (fdatasync of each
+   file where syncfs is missing); 0: after every flush, None: leave it to
+   the kernel.  A closing segment is synced before it is announced, so what
+   the catalog and the activity gate see is on disk.
+ • Memory is bounded: frames buffered and in flight never exceed
+   `max_buffer` bytes.  At the limit each camera's policy decides:
+     block        the camera's reader waits (`await room(cam_id)`): TCP
+                  backpressure makes the camera skip frames on its side
+     drop-newest  the incoming frame is dropped
+     drop-oldest  the camera's oldest frames not yet written make room
+   Drops are counted per camera (and as recorder losses in frame_timing).
+
+Status at /disk.json: buffered bytes, MB/s, write / fsync / frame-age
+percentiles, drops and time blocked per camera.  bench_disk.py measures it
+against a slow disk.
+"""
+
+import asyncio
+import collections
+import ctypes
+import ctypes.util
+import json
+import logging
+import os
+import pathlib
+import threading
+import time
+
+from segment_store import INDEX_MAGIC, RECORD, index_path
+from telemetry import QUANTILES, WRITE_BUCKETS, Histogram, Ring, percentile
+
+logger = logging.getLogger('sipbuddy')
+
+MAX_BUFFER = 64 * 1024 * 1024          # bytes buffered + in flight, all cameras
+FLUSH_BYTES = 1024 * 1024              # pending bytes that wake the writer early
+FLUSH_INTERVAL = 0.1                   # max seconds a frame waits to be written
+DURABILITY = 1.0                       # seconds between group fsyncs
+PREALLOCATE = 8 * 1024 * 1024          # data file preallocation step
+BLOCK_POLL = 0.01                      # seconds between buffer checks of a blocked reader
+
+BLOCK, DROP_NEWEST, DROP_OLDEST = "block", "drop-newest", "drop-oldest"
+POLICIES = (BLOCK, DROP_NEWEST, DROP_OLDEST)
+
+_FALLOC_FL_KEEP_SIZE = 1
+try:
+    _libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+except (OSError, TypeError):
+    _libc = None
+_fallocate = getattr(_libc, "fallocate", None)        # Linux only
+if _fallocate is not None:
+    _fallocate.argtypes = (ctypes.c_int, ctypes.c_int, ctypes.c_int64, ctypes.c_int64)
+_syncfs = getattr(_libc, "syncfs", None)              # Linux only
+
+_datasync = getattr(os, "fdatasync", os.fsync)
+
+
+def preallocate(fd: int, offset: int, length: int) -> bool:
+    """Reserve blocks without changing the file size; False if unsupported."""
+    return _fallocate is not None and _fallocate(fd, _FALLOC_FL_KEEP_SIZE, offset, length) == 0
+
+
+class SegmentHandle:
+    """One segment being written through a DiskWriter (SegmentWriter's interface)."""
+
+    def __init__(self, writer, path, cam_id: str):
+        self.writer = writer
+        self.path = pathlib.Path(path)
+        self.cam_id = cam_id
+        self.pending = collections.deque()             # (frame bytes, arrival epoch s)
+        # writer-thread side
+        self.data_fd = self.index_fd = None
+        self.dev = None                                # file system, for syncfs
+        self.offset = 0                                # data bytes written
+        self.allocated = 0                             # data bytes preallocated
+        self.frames = 0                                # index records written
+        self.failed = False
+
+    def write(self, jpeg, ts: float) -> bool:
+        """Queue one frame that arrived at `ts`; False if it was dropped."""
+        return self.writer._put(self, bytes(jpeg), ts)
+
+    def close(self, on_closed=None) -> None:
+        """Finish the segment; `on_closed(path)` runs (on the writer thread)
+        once everything queued is written and, with a durability interval,
+        synced – also when every frame was dropped and there is no file."""
+        self.writer._close(self, on_closed)
+
+
+class DiskWriter(threading.Thread):
+    """The writer thread plus the shared buffer budget."""
+
+    def __init__(self, max_buffer: int = MAX_BUFFER, durability: float = DURABILITY,
+                 policy: str = BLOCK, policies: dict = None, flush_bytes: int = FLUSH_BYTES,
+                 flush_interval: float = FLUSH_INTERVAL, prealloc: int = PREALLOCATE):
+        super().__init__(daemon=True, name="disk-writer")
+        self.max_buffer = max_buffer
+        self.durability = durability
+        self.policy = policy
+        self.policies = dict(policies or {})           # cam id -> policy
+        self.flush_bytes = flush_bytes
+        self.flush_interval = flush_interval
+        self.prealloc = prealloc
+        self.cond = threading.Condition()
+        self.active = set()                            # handles with pending frames
+        self.closing = []                              # (handle, on_closed)
+        self.open_handles = set()
+        self.dirty = set()                             # written since the last sync
+        self.buffered = self.unflushed = self.peak = 0
+        self.urgent = self.busy = False
+        self.dropped = collections.Counter()           # cam id -> frames
+        self.blocked = collections.Counter()           # cam id -> seconds
+        self.written = self.writes = self.syncs = self.errors = 0
+        self.write_hist, self.write_ring = Histogram(WRITE_BUCKETS), Ring()
+        self.sync_hist, self.sync_ring = Histogram(WRITE_BUCKETS), Ring()
+        self.age_ring = Ring()                         # oldest frame's age when written
+        self.rate_t, self.rate_b = Ring(64), Ring(64)
+
+    # ── ingest side (any thread) ──────────────────────────────────────────
+    def open(self, path, cam_id: str) -> SegmentHandle:
+        return SegmentHandle(self, path, cam_id)
+
+    def policy_for(self, cam_id: str) -> str:
+        return self.policies.get(cam_id, self.policy)
+
+    def full(self) -> bool:
+        return self.buffered >= self.max_buffer
+
+    async def room(self, cam_id: str) -> None:
+        """Wait (on an event loop) until the buffer is below its limit."""
+        t = time.monotonic()
+        while self.full():
+            await asyncio.sleep(BLOCK_POLL)
+        self.blocked[cam_id] += time.monotonic() - t
+
+    def drain(self, timeout: float = None) -> bool:
+        """Write out everything queued so far; False on timeout."""
+        with self.cond:
+            self.urgent = True
+            self.cond.notify_all()
+            return self.cond.wait_for(lambda: not (self.buffered or self.closing or self.busy), timeout)
+
+    def _put(self, h: SegmentHandle, data: bytes, ts: float) -> bool:
+        n = len(data)
+        with self.cond:
+            if self.buffered + n > self.max_buffer:
+                policy = self.policy_for(h.cam_id)
+                if policy == DROP_OLDEST:
+                    while h.pending and self.buffered + n > self.max_buffer:
+                        old, _ = h.pending.popleft()
+                        self.buffered -= len(old)
+                        self.unflushed -= len(old)
+                        self.dropped[h.cam_id] += 1
+                if policy != BLOCK and self.buffered + n > self.max_buffer:
+                    self.dropped[h.cam_id] += 1
+                    return False
+                # BLOCK: take it; the reader waits in room() before reading more
+            h.pending.append((data, ts))
+            self.active.add(h)
+            self.buffered += n
+            self.unflushed += n
+            self.peak = max(self.peak, self.buffered)
+            if self.unflushed >= self.flush_bytes:
+                self.cond.notify_all()
+        return True
+
+    def _close(self, h: SegmentHandle, on_closed) -> None:
+        with self.cond:
+            self.closing.append((h, on_closed))
+            self.cond.notify_all()
+
+    # ── writer thread ─────────────────────────────────────────────────────
+    def run(self) -> None:
+        last_sync = time.monotonic()
+        while True:
+            with self.cond:
+                self.cond.wait_for(lambda: self.unflushed >= self.flush_bytes or self.closing
+                                   or self.urgent, self.flush_interval)
+                batch = [(h, h.pending) for h in self.active]
+                for h in self.active:
+                    h.pending = collections.deque()
+                self.active.clear()
+                closing, self.closing = self.closing, []
+                self.unflushed, self.urgent = 0, False
+                self.busy = bool(batch or closing)
+            for h, frames in batch:
+                self._flush(h, frames)
+            now = time.monotonic()
+            if self.durability is not None and self.dirty and (
+                    closing or now - last_sync >= self.durability):
+                self._sync()
+                last_sync = now
+            for h, on_closed in closing:
+                self._finish(h, on_closed)
+            with self.cond:
+                self.busy = False
+                self.cond.notify_all()                 # drain() waiters
+
+    def _open(self, h: SegmentHandle) -> None:
+        flags = os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, "O_CLOEXEC", 0)
+        h.data_fd = os.open(h.path, flags, 0o644)
+        h.index_fd = os.open(index_path(h.path), flags, 0o644)
+        h.dev = os.fstat(h.data_fd).st_dev
+        self._pwrite(h.index_fd, INDEX_MAGIC, 0)
+        self.open_handles.add(h)
+
+    def _flush(self, h: SegmentHandle, frames) -> None:
+        data = b"".join(f for f, _ in frames)
+        records = bytearray(RECORD.size * len(frames))
+        offset = h.offset
+        for i, (f, ts) in enumerate(frames):
+            RECORD.pack_into(records, i * RECORD.size, offset, len(f), int(ts * 1_000_000))
+            offset += len(f)
+        try:
+            if h.failed:
+                raise OSError("earlier write failed")
+            if h.data_fd is None:
+                self._open(h)
+            end = h.offset + len(data)
+            if self.prealloc and end > h.allocated:
+                step = max(self.prealloc, len(data))
+                if preallocate(h.data_fd, h.allocated, step):
+                    h.allocated += step
+                else:
+                    self.prealloc = 0                  # file system without fallocate
+            t = time.perf_counter()
+            # positional writes at h.offset, which moves only once both succeeded: after a
+            # failure the segment ends at its last whole batch (h.failed drops the rest)
+            self._pwrite(h.data_fd, data, h.offset)
+            self._pwrite(h.index_fd, records, len(INDEX_MAGIC) + h.frames * RECORD.size)
+            elapsed = time.perf_counter() - t
+            h.offset, h.frames = end, h.frames + len(frames)
+            self.dirty.add(h)
+            self.write_hist.observe(elapsed)
+            self.write_ring.push(elapsed)
+            self.age_ring.push(time.time() - frames[0][1])
+            self.writes += 1
+            self.written += len(data)
+            self.rate_t.push(time.monotonic())
+            self.rate_b.push(self.written)
+        except OSError as e:
+            if not h.failed:
+                logger.error(f"writing {h.path} failed, dropping its frames: {e}")
+            h.failed = True
+            self.errors += 1
+            with self.cond:
+                self.dropped[h.cam_id] += len(frames)
+        with self.cond:
+            self.buffered -= len(data)
+
+    def _pwrite(self, fd: int, data, offset: int) -> None:
+        view = memoryview(data)
+        while view:
+            n = os.pwrite(fd, view, offset)
+            view, offset = view[n:], offset + n
+
+    def _sync(self) -> None:
+        t = time.perf_counter()
+        if _syncfs is not None:                        # one flush per file system
+            for h in {h.dev: h for h in self.dirty}.values():
+                if self._syncfs(h.data_fd) != 0:
+                    logger.error(f"syncfs for {h.path} failed: {os.strerror(ctypes.get_errno())}")
+                    self.errors += 1
+        else:
+            for h in self.dirty:                       # data before index, as written
+                try:
+                    self._datasync(h.data_fd)
+                    self._datasync(h.index_fd)
+                except OSError as e:
+                    logger.error(f"syncing {h.path} failed: {e}")
+                    self.errors += 1
+        self.dirty.clear()
+        elapsed = time.perf_counter() - t
+        self.sync_hist.observe(elapsed)
+        self.sync_ring.push(elapsed)
+        self.syncs += 1
+
+    def _datasync(self, fd: int) -> None:
+        _datasync(fd)
+
+    def _syncfs(self, fd: int) -> int:
+        return _syncfs(fd)
+
+    def _finish(self, h: SegmentHandle, on_closed) -> None:
+        if h.data_fd is not None:                      # None: every frame dropped, no files
+            self._close_files(h)
+        if on_closed is not None:
+            try:
+                on_closed(h.path)
+            except Exception:
+                logger.exception(f"segment-closed callback for {h.path} failed")
+
+    def _close_files(self, h: SegmentHandle) -> None:
+        self.dirty.discard(h)
+        self.open_handles.discard(h)
+        try:
+            if h.allocated > h.offset:
+                os.ftruncate(h.data_fd, h.offset)      # give back the preallocated tail
+        except OSError:
+            pass
+        for fd in (h.data_fd, h.index_fd):
+            if fd is not None:
+                os.close(fd)
+
+    # ── status ────────────────────────────────────────────────────────────
+    def snapshot(self) -> dict:
+        def quantiles(ring):
+            values = sorted(ring.values())
+            return {str(q): percentile(values, q) for q in QUANTILES}
+        t, b = self.rate_t.values(), self.rate_b.values()
+        rate = (b[-1] - b[0]) / (t[-1] - t[0]) if len(t) > 1 and t[-1] > t[0] else 0.0
+        with self.cond:
+            dropped, blocked = dict(self.dropped), dict(self.blocked)
+        return {"buffered_bytes": self.buffered, "peak_buffered_bytes": self.peak,
+                "max_buffer_bytes": self.max_buffer, "open_segments": len(self.open_handles),
+                "written_bytes": self.written, "write_mb_per_second": rate / 1e6,
+                "writes": self.writes, "syncs": self.syncs, "errors": self.errors,
+                "durability_seconds": self.durability, "policy": self.policy,
+                "policies": dict(self.policies), "dropped_frames": dropped,
+                "blocked_seconds": blocked, "write_seconds": quantiles(self.write_ring),
+                "sync_seconds": quantiles(self.sync_ring),
+                "frame_age_seconds": quantiles(self.age_ring),
+                "write_histogram": self.write_hist.snapshot(),
+                "sync_histogram": self.sync_hist.snapshot()}
+
+
+def parse_policies(specs) -> dict:
+    """["cam_a=drop-oldest", ...] → {"cam_a": "drop-oldest"}."""
+    policies = {}
+    for spec in specs or ():
+        cam_id, _, policy = spec.partition("=")
+        if policy not in POLICIES:
+            raise ValueError(f"{spec!r}: expected CAMERA_ID=" + "|".join(POLICIES))
+        policies[cam_id] = policy
+    return policies
+
+
+def add_routes(app, writer: DiskWriter) -> None:
+    """Register /disk.json on an aiohttp application."""
+    from aiohttp import web
+
+    async def status(request):
+        return web.Response(text=json.dumps(writer.snapshot(), indent=1),
+                            content_type="application/json")
+
+    app.router.add_get("/disk.json", status)
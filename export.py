@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+"""
+Time-range clip export
+
+`export(catalog, camera, start, end, fmt)` yields one continuous clip of a
+camera across segment boundaries, as a stream of byte chunks:
+
+ • the covering segments come from the catalog (catalog.py), no directory
+   walk;
+ • native .mjpeg segments are cut at the first and last frame inside
+   [start, end] (binary search over the .idx timestamps).  A segment's
+   frames are contiguous in its data file, so the clip is a handful of byte
+   ranges read in CHUNK-sized pieces: `fmt="mjpeg"` streams them as-is
+   (`ffplay -f mjpeg`), `fmt="mp4"` pipes them through `ffmpeg -c copy`
+   into a fragmented MP4 at the clip's average frame rate;
+ • MP4 segments (ffmpeg backend) are joined by FFmpeg's concat demuxer with
+   inpoint/outpoint per segment, fed the list on stdin, stream-copied to a
+   fragmented MP4.  MJPEG cuts are frame-exact; H.264 (transcode.py) starts
+   at the keyframe before `start`.
+
+Nothing is re-encoded, nothing is staged on disk and memory stays at a few
+CHUNKs whatever the clip length.  Segments still being written are not in
+the catalog yet, so the last SEGMENT_SECONDS or so are not exportable.
+
+The recorder serves the same thing over HTTP:
+
+    GET /export/<cam_id>?start=<epoch|ISO>&end=<epoch|ISO>&format=mp4|mjpeg
+
+CLI:
+    python export.py recordings/ CAM 2025-06-03T21:00 2025-06-03T22:00 -o clip.mp4
+"""
+
+import argparse
+import bisect
+import logging
+import pathlib
+import subprocess
+import sys
+import threading
+import time
+
+from catalog import Catalog, parse_time
+from segment_store import DATA_SUFFIX, SegmentReader
+
+logger = logging.getLogger('sipbuddy')
+
+CHUNK = 1 << 20                        # bytes read / yielded at a time
+FORMATS = ("mp4", "mjpeg")
+CONTENT_TYPES = {"mp4": "video/mp4", "mjpeg": "video/x-motion-jpeg"}
+_FRAGMENTED = ["-movflags", "frag_keyframe+empty_moov+default_base_moof", "-f", "mp4", "pipe:1"]
+
+
+class ExportError(ValueError):
+    pass
+
+
+def covering_segments(catalog: Catalog, camera: str, start: float, end: float) -> list:
+    rows = catalog.query(camera, start, end)
+    if not rows:
+        raise ExportError(f"no recordings of {camera} between {start:.3f} and {end:.3f}")
+    kinds = {pathlib.Path(r["path"]).suffix for r in rows}
+    if len(kinds) > 1:
+        raise ExportError(f"{camera} has both .mjpeg and .mp4 segments in that range")
+    return rows
+
+
+def mjpeg_ranges(catalog: Catalog, rows: list, start: float, end: float):
+    """(path, first byte, end byte, frames, first ts, last ts) of the frames in [start, end]."""
+    lo, hi = int(start * 1_000_000), int(end * 1_000_000)
+    for r in rows:
+        path = catalog.path(r["path"])
+        try:
+            seg = SegmentReader(path)
+        except FileNotFoundError:                      # deleted by retention meanwhile
+            continue
+        with seg:
+            i = bisect.bisect_left(seg.timestamps_us, lo)
+            j = bisect.bisect_right(seg.timestamps_us, hi)
+            if i < j:
+                a, b = seg.byte_range(i, j)
+                yield path, a, b, j - i, seg.timestamp(i), seg.timestamp(j - 1)
+
+
+def _read_ranges(ranges):
+    for path, a, b, *_ in ranges:
+        with open(path, "rb") as f:
+            f.seek(a)
+            left = b - a
+            while left:
+                chunk = f.read(min(CHUNK, left))
+                if not chunk:                          # truncated meanwhile
+                    break
+                left -= len(chunk)
+                yield chunk
+
+
+def _pump(proc: subprocess.Popen, feed) -> None:
+    """Write `feed` to FFmpeg's stdin (own thread, so stdout never backs up)."""
+    try:
+        for chunk in feed:
+            proc.stdin.write(chunk)
+    except (BrokenPipeError, ValueError):              # consumer went away and FFmpeg died
+        pass
+    finally:
+        try:
+            proc.stdin.close()
+        except BrokenPipeError:
+            pass
+
+
+def _run_ffmpeg(cmd: list, feed):
+    proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                            stderr=subprocess.DEVNULL)
+    pump = threading.Thread(target=_pump, args=(proc, feed), daemon=True)
+    pump.start()
+    try:
+        for chunk in iter(lambda: proc.stdout.read(CHUNK), b""):
+            yield chunk
+    finally:
+        proc.stdout.close()
+        if proc.poll() is None:
+            proc.kill()
+        proc.wait()
+        pump.join()
+    if proc.returncode:
+        raise ExportError(f"ffmpeg exited with {proc.returncode}")
+
+
+def export(catalog: Catalog, camera: str, start: float, end: float, fmt: str = "mp4"):
+    """Yield the clip of `camera` between `start` and `end` (epoch seconds) in chunks."""
+    if fmt not in FORMATS:
+        raise ExportError(f"unknown format {fmt!r}")
+    if end <= start:
+        raise ExportError("end must be after start")
+    rows = covering_segments(catalog, camera, start, end)
+    if pathlib.Path(rows[0]["path"]).suffix == DATA_SUFFIX:
+        ranges = list(mjpeg_ranges(catalog, rows, start, end))
+        if not ranges:
+            raise ExportError(f"no frames of {camera} in that range")
+        if fmt == "mjpeg":
+            yield from _read_ranges(ranges)
+            return
+        frames = sum(r[3] for r in ranges)
+        span = ranges[-1][5] - ranges[0][4]
+        fps = (frames - 1) / span if frames > 1 and span > 0 else 15
+        yield from _run_ffmpeg([
+            "ffmpeg", "-hide_banner", "-loglevel", "error",
+            "-f", "mjpeg", "-framerate", f"{fps:.3f}", "-i", "pipe:0",
+            "-c", "copy", *_FRAGMENTED,
+        ], _read_ranges(ranges))
+        return
+    if fmt != "mp4":
+        raise ExportError("MP4 segments can only be exported as mp4")
+    lines = ["ffconcat version 1.0"]
+    for r in rows:
+        path = catalog.path(r["path"])
+        lines.append("file '" + str(path.resolve()).replace("'", "'\\''") + "'")
+        if start > r["start"]:
+            lines.append(f"inpoint {start - r['start']:.6f}")
+        if end < r["end"]:
+            lines.append(f"outpoint {end - r['start']:.6f}")
+    script = ("\n".join(lines) + "\n").encode()
+    yield from _run_ffmpeg([
+        "ffmpeg", "-hide_banner", "-loglevel", "error",
+        "-f", "concat", "-safe", "0", "-protocol_whitelist", "file,pipe",
+        "-i", "pipe:0", "-map", "0:v:0", "-c", "copy", *_FRAGMENTED,
+    ], [script])
+
+
+def add_routes(app, catalog: Catalog) -> None:
+    """Register /export/<cam_id> on an aiohttp application."""
+    import asyncio
+    from aiohttp import web
+
+    async def export_clip(request):
+        cam_id = request.match_info["cam_id"]
+        fmt = request.query.get("format", "mp4")
+        try:
+            start, end = parse_time(request.query["start"]), parse_time(request.query["end"])
+            chunks = export(catalog, cam_id, start, end, fmt)
+            loop = asyncio.get_running_loop()
+            first = await loop.run_in_executor(None, next, chunks, None)  # errors before headers
+        except (KeyError, ValueError) as e:
+            raise web.HTTPBadRequest(text=f"{e}\n")
+        resp = web.StreamResponse(headers={
+            "Content-Type": CONTENT_TYPES[fmt],
+            "Content-Disposition": f'attachment; filename="{cam_id}_{int(start)}_{int(end)}.{fmt}"'})
+        await resp.prepare(request)
+        try:
+            chunk = first
+            while chunk is not None:
+                await resp.write(chunk)
+                chunk = await loop.run_in_executor(None, next, chunks, None)
+        except ConnectionError:
+            pass
+        except ValueError as e:                        # ExportError too: headers are out, cut it short
+            logger.error(f"[{cam_id}] export {int(start)}..{int(end)} failed mid-stream: {e}")
+            resp.force_close()
+        finally:
+            await loop.run_in_executor(None, chunks.close)
+        return resp
+
+    app.router.add_get("/export/{cam_id}", export_clip)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export a camera's recordings between two times")
+    parser.add_argument("root", type=pathlib.Path, help="recordings directory (with catalog.sqlite)")
+    parser.add_argument("camera")
+    parser.add_argument("start", help="epoch seconds or ISO time (UTC)")
+    parser.add_argument("end", help="epoch seconds or ISO time (UTC)")
+    parser.add_argument("-o", "--output", default="-", help=".mp4 / .mjpeg file, or - for stdout")
+    parser.add_argument("--format", choices=FORMATS, help="default: from the output suffix, else mp4")
+    args = parser.parse_args()
+
+    fmt = args.format or (args.output.rsplit(".", 1)[-1] if args.output.endswith(FORMATS) else "mp4")
+    catalog = Catalog(args.root)
+    t = time.perf_counter()
+    n = 0
+    out = sys.stdout.buffer if args.output == "-" else open(args.output, "wb")
+    try:
+        for chunk in export(catalog, args.camera, parse_time(args.start), parse_time(args.end), fmt):
+            out.write(chunk)
+            n += len(chunk)
+    except ExportError as e:
+        sys.exit(f"export failed: {e}")
+    finally:
+        if out is not sys.stdout.buffer:
+            out.close()
+        catalog.close()
+    print(f"{n / 1e6:.1f} MB in {time.perf_counter() - t:.1f} s → {args.output}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,345 @@
+#!/usr/bin/env python3
+"""
+Simulated SipBuddy fleet (Linux/macOS, no OpenMV hardware needed)
+
+Each simulated camera behaves like on_ae3_AP.py:
+
+ • serves the same MJPEG-over-HTTP framing on its own TCP port, one client
+   at a time, at a configurable fps with timing jitter and a JPEG size
+   distribution, with the firmware's sequence number and tick stamps (each
+   camera's ticks start at a random boot time and run --clock-drift-ppm
+   off the host clock at most);
+ • broadcasts `SIPBUDDY_REGISTER|IP:..|MAC:..|PORT:..|CTRL:..` at once and
+   then at doubling intervals (1 s up to 30 s) until it receives
+   `SIPBUDDY_ACK`, while serving, and again after every client disconnect,
+   like the firmware's `poll_announce`;
+ • answers the firmware's control channel (rate_control.py) on UDP at its
+   own port number: JPEG quality and frame size pick re-encoded variants of
+   the frames, FPS caps the frame rate, `SIPBUDDY_DISCOVER` starts the
+   announcements over.
+
+Sending a frame keeps the "radio" busy for its size at the --link rate
+(Mbit/s per camera, optionally changing over time: "0:8,30:1,60:8"), like
+the device's WiFi.  Frames the camera could not send on time (a slow link
+or client blocks `sendall` on the device) are counted as skipped, not
+queued.
+
+Usage:
+    python fleet_sim.py --cameras 50 --fps 15 --size-mean 12000 --register-port 8000
+    python joe_try_this_one.py --backend native     # in another shell
+"""
+
+import argparse
+import asyncio
+import io
+import multiprocessing as mp
+import os
+import random
+import socket
+import time
+
+from discovery import DISCOVER
+from rate_control import FRAME_SIZES, GET, SET, SETTINGS, bytes_ratio, decode, encode
+
+HTTP_HEADER = (b"HTTP/1.1 200 OK\r\n"
+               b"Server: OpenMV\r\n"
+               b"Content-Type: multipart/x-mixed-replace;boundary=openmv\r\n"
+               b"Cache-Control: no-cache\r\n"
+               b"Pragma: no-cache\r\n\r\n")
+ANNOUNCE_INTERVAL = 1.0                # first re-announcement interval, as ANNOUNCE_MS
+ANNOUNCE_MAX = 30.0                    # longest one, as ANNOUNCE_MAX_MS
+TEMPLATES = 16                         # distinct JPEGs per size bucket
+
+
+def make_jpeg(size: int, rng: random.Random = random) -> bytes:
+    """A JPEG of roughly `size` bytes: decodable if Pillow is installed."""
+    try:
+        from PIL import Image
+    except ImportError:
+        body = bytes(rng.randrange(0, 255) for _ in range(256)) * (size // 256 + 1)
+        return b"\xff\xd8" + body[:max(0, size - 4)] + b"\xff\xd9"
+    # QVGA noise compresses to roughly 27 KB at quality 35; blend toward grey
+    # to hit smaller targets
+    noise = Image.frombytes("L", (320, 240), os.urandom(320 * 240))
+    grey = Image.new("L", (320, 240), 128)
+    lo, hi = 0.0, 1.0
+    for _ in range(8):
+        mix = (lo + hi) / 2
+        buf = io.BytesIO()
+        Image.blend(grey, noise, mix).convert("RGB").save(buf, "JPEG", quality=35)
+        if buf.tell() < size:
+            lo = mix
+        else:
+            hi = mix
+    return buf.getvalue()
+
+
+def part_header(size: int, seq: int, captured: int, encoded: int) -> bytes:
+    return (b"\r\n--openmv\r\nContent-Type: image/jpeg\r\nContent-Length:%d\r\n"
+            b"X-Frame-Seq:%d\r\nX-Capture-Ticks:%d\r\nX-Encoded-Ticks:%d\r\n\r\n"
+            % (size, seq, captured, encoded))
+
+
+def reencode(jpeg: bytes, framesize: str, quality: int, rng: random.Random = random) -> bytes:
+    """`jpeg` (QVGA, quality 35) as the camera would encode it at `framesize` / `quality`."""
+    try:
+        from PIL import Image
+    except ImportError:
+        return make_jpeg(int(len(jpeg) * bytes_ratio(framesize, quality)), rng)
+    buf = io.BytesIO()
+    Image.open(io.BytesIO(jpeg)).convert("RGB").resize(FRAME_SIZES[framesize]).save(
+        buf, "JPEG", quality=quality)
+    return buf.getvalue()
+
+
+class FramePool:
+    """Pre-rendered JPEGs whose sizes follow N(mean, sd)."""
+
+    def __init__(self, mean: int, sd: int, seed: int = 0):
+        rng = random.Random(seed)
+        sizes = sorted({max(1000, int(rng.gauss(mean, sd))) for _ in range(TEMPLATES)})
+        self.jpegs = [make_jpeg(s, rng) for s in sizes]
+        self.variants = {("QVGA", 35): self.jpegs}
+
+    def pick(self, rng: random.Random) -> bytes:
+        return rng.choice(self.jpegs)
+
+    def variant(self, framesize: str, quality: int) -> list:
+        """The same frames at another frame size / JPEG quality (rendered once)."""
+        key = (framesize, quality)
+        if key not in self.variants:
+            self.variants[key] = [reencode(j, framesize, quality) for j in self.jpegs]
+        return self.variants[key]
+
+
+class LinkSchedule:
+    """Link rate over time, "MBPS" or "SECONDS:MBPS,SECONDS:MBPS,..." (0 = unlimited)."""
+
+    def __init__(self, spec: str, start: float = None):
+        points = []
+        for part in str(spec).split(","):
+            at, _, mbps = part.rpartition(":")
+            points.append((float(at or 0), float(mbps)))
+        self.points = sorted(points)
+        self.start = time.monotonic() if start is None else start
+
+    def mbps(self, now: float = None) -> float:
+        t = (time.monotonic() if now is None else now) - self.start
+        rate = self.points[0][1]
+        for at, mbps in self.points:
+            if at <= t:
+                rate = mbps
+        return rate
+
+
+class ControlProtocol(asyncio.DatagramProtocol):
+    def __init__(self, cam):
+        self.cam = cam
+
+    def connection_made(self, transport) -> None:
+        self.transport = transport
+
+    def datagram_received(self, data: bytes, addr) -> None:
+        if data.startswith(DISCOVER):
+            if b"|MAC:" not in data or self.cam.mac.encode() in data:
+                self.cam.announce()
+            return
+        reply = self.cam.command(data)
+        if reply is not None:
+            self.transport.sendto(reply, addr)
+
+
+class SimCamera:
+    """One simulated OpenMV board."""
+
+    def __init__(self, index: int, port: int, pool: FramePool, fps: float, jitter: float,
+                 register_to=None, host: str = "127.0.0.1", stats=None, drift_ppm: float = 0.0,
+                 link: LinkSchedule = None):
+        self.index = index
+        self.port = port
+        self.pool = pool
+        self.fps = fps
+        self.jitter = jitter
+        self.register_to = register_to          # (ip, port) or None
+        self.host = host
+        self.mac = f"02bd{index:08x}"
+        self.stats = stats                      # shared array: [sent, skipped] per camera
+        self.rng = random.Random(index)
+        self.boot = time.monotonic() - self.rng.uniform(0, 3600)
+        self.rate = 1 + self.rng.uniform(-drift_ppm, drift_ppm) / 1e6
+        self.seq = 0                            # frames encoded since "boot"
+        self.link = link                        # radio rate, None = unlimited
+        self.quality, self.framesize, self.fps_cap = 35, "QVGA", 0.0   # control channel settings
+        self.client_lock = asyncio.Lock()
+        self.registered = asyncio.Event()
+        self.announcing = None                  # the register() task
+
+    def count(self, field: int, n: int = 1) -> None:
+        if self.stats is not None:
+            self.stats[2 * self.index + field] += n
+
+    def ticks_ms(self) -> int:
+        return int((time.monotonic() - self.boot) * self.rate * 1000) & 0x3FFFFFFF
+
+    async def serve(self) -> None:
+        await asyncio.start_server(self.handle, self.host, self.port)
+        loop = asyncio.get_running_loop()
+        await loop.create_datagram_endpoint(lambda: ControlProtocol(self), (self.host, self.port))
+        self.announce()
+
+    def announce(self) -> None:
+        """(Re)start register(), as SIPBUDDY_DISCOVER does on the device."""
+        if self.announcing is not None:
+            self.announcing.cancel()
+        self.announcing = asyncio.get_running_loop().create_task(self.register())
+
+    def command(self, data: bytes):
+        """apply_command() of the firmware: the SETTINGS reply, or None."""
+        kind, fields = decode(data)
+        if kind not in (SET, GET) or fields.get("MAC") != self.mac:
+            return None
+        try:
+            if kind == SET:
+                if "Q" in fields:
+                    self.quality = min(90, max(10, int(fields["Q"])))
+                if "FPS" in fields:
+                    self.fps_cap = min(60.0, max(0.0, float(fields["FPS"])))
+                if fields.get("SIZE") in FRAME_SIZES:
+                    self.framesize = fields["SIZE"]
+            seq = int(fields.get("SEQ", 0))
+        except ValueError:
+            return None
+        return encode(SETTINGS, self.mac, seq, quality=self.quality, framesize=self.framesize,
+                      fps=self.fps_cap)
+
+    async def register(self) -> None:
+        """poll_announce(): broadcast at doubling intervals until ACKed."""
+        if self.register_to is None:
+            return
+        self.registered.clear()
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+        sock.setblocking(False)
+        msg = f"SIPBUDDY_REGISTER|IP:{self.host}|MAC:{self.mac}|PORT:{self.port}|CTRL:{self.port}".encode()
+        loop = asyncio.get_running_loop()
+        interval = ANNOUNCE_INTERVAL
+        try:
+            while True:
+                sock.sendto(msg, self.register_to)
+                try:
+                    data = await asyncio.wait_for(loop.sock_recv(sock, 1024), interval)
+                    if data == b"SIPBUDDY_ACK":
+                        self.registered.set()
+                        return
+                except asyncio.TimeoutError:
+                    pass
+                interval = min(ANNOUNCE_MAX, 2 * interval)
+        finally:
+            sock.close()
+
+    async def handle(self, reader, writer) -> None:
+        async with self.client_lock:                  # the firmware serves one client
+            try:
+                await reader.read(1024)
+                writer.write(HTTP_HEADER)
+                due = time.monotonic()
+                while True:
+                    period = 1.0 / (min(self.fps, self.fps_cap) if self.fps_cap else self.fps)
+                    jpeg = self.rng.choice(self.pool.variant(self.framesize, self.quality))
+                    self.seq += 1
+                    ticks = self.ticks_ms()
+                    writer.write(part_header(len(jpeg), self.seq, ticks, ticks))
+                    writer.write(jpeg)
+                    await writer.drain()
+                    mbps = self.link.mbps() if self.link is not None else 0.0
+                    if mbps:                          # the radio is busy sending it
+                        await asyncio.sleep(len(jpeg) * 8 / (mbps * 1e6))
+                    self.count(0)
+                    due += period * max(0.0, self.rng.gauss(1.0, self.jitter))
+                    now = time.monotonic()
+                    if now > due + period:           # sendall blocked: frames were never captured
+                        skipped = int((now - due) / period)
+                        self.count(1, skipped)
+                        due += skipped * period
+                    await asyncio.sleep(max(0.0, due - now))
+            except (ConnectionError, OSError):
+                pass
+            finally:
+                writer.close()
+        self.announce()
+
+
+def run_fleet(indices, base_port: int, fps: float, size_mean: int, size_sd: int,
+              jitter: float, register_to=None, stats=None, drift_ppm: float = 0.0,
+              link: LinkSchedule = None) -> None:
+    """Run the cameras with the given indices on one event loop (blocking)."""
+    pool = FramePool(size_mean, size_sd)
+
+    async def main():
+        cams = [SimCamera(i, base_port + i, pool, fps, jitter, register_to, stats=stats,
+                          drift_ppm=drift_ppm, link=link)
+                for i in indices]
+        for cam in cams:
+            await cam.serve()
+        await asyncio.Event().wait()
+
+    asyncio.run(main())
+
+
+def start_fleet(n: int, base_port: int, fps: float = 15.0, size_mean: int = 12000,
+                size_sd: int = 3000, jitter: float = 0.1, register_to=None,
+                processes: int = 1, drift_ppm: float = 0.0, link: str = None):
+    """Start `n` cameras spread over `processes` processes, each with a
+    `link` (LinkSchedule spec) timed from now.
+
+    Returns (processes, stats) where stats[2*i] / stats[2*i+1] are camera i's
+    sent / skipped frame counters.
+    """
+    stats = mp.Array("Q", 2 * n, lock=False)
+    link = LinkSchedule(link) if link else None
+    procs = []
+    for k in range(processes):
+        p = mp.Process(target=run_fleet, daemon=True,
+                       args=(range(k, n, processes), base_port, fps, size_mean, size_sd,
+                             jitter, register_to, stats, drift_ppm, link))
+        p.start()
+        procs.append(p)
+    return procs, stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulated SipBuddy cameras")
+    parser.add_argument("--cameras", type=int, default=10)
+    parser.add_argument("--base-port", type=int, default=19000)
+    parser.add_argument("--fps", type=float, default=15.0)
+    parser.add_argument("--size-mean", type=int, default=12000, help="mean JPEG bytes")
+    parser.add_argument("--size-sd", type=int, default=3000, help="JPEG size std-dev")
+    parser.add_argument("--jitter", type=float, default=0.1, help="relative frame-interval jitter")
+    parser.add_argument("--register-ip", default="127.0.0.1",
+                        help="where to send SIPBUDDY_REGISTER (e.g. 255.255.255.255)")
+    parser.add_argument("--register-port", type=int, default=8000)
+    parser.add_argument("--no-register", action="store_true")
+    parser.add_argument("--processes", type=int, default=1)
+    parser.add_argument("--clock-drift-ppm", type=float, default=0.0,
+                        help="camera tick clocks run up to this far off the host clock")
+    parser.add_argument("--link", help='per-camera radio Mbit/s, or a schedule "0:8,30:1,60:8"')
+    args = parser.parse_args()
+
+    register_to = None if args.no_register else (args.register_ip, args.register_port)
+    procs, stats = start_fleet(args.cameras, args.base_port, args.fps, args.size_mean,
+                               args.size_sd, args.jitter, register_to, args.processes,
+                               args.clock_drift_ppm, args.link)
+    print(f"{args.cameras} cameras on ports {args.base_port}-{args.base_port + args.cameras - 1}")
+    try:
+        while True:
+            time.sleep(5)
+            sent = sum(stats[0::2])
+            skipped = sum(stats[1::2])
+            print(f"sent {sent} frames, skipped {skipped}")
+    except KeyboardInterrupt:
+        for p in procs:
+            p.terminate()
+
+
+if __name__ == "__main__":
+    main()
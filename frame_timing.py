@@ -0,0 +1,210 @@
+"""
+Capture-to-disk latency and frame-loss accounting from sequence-stamped frames
+
+The firmware stamps every multipart part with the frame's sequence number
+(every encoded frame since boot) and its `time.ticks_ms()` at capture and
+after JPEG compression (PART_HEADER in on_ae3_AP.py, parsed into
+`parser.seq/.captured/.encoded` by mjpeg_parser.py).  Per camera,
+FrameTiming turns those into:
+
+ • latency per stage, as cumulative histograms plus recent percentiles:
+     device    capture → compressed, on the device clock (exact to 1 ms)
+     network   compressed → parsed on the host, over the fastest transit seen
+     recorder  parsed → written to the segment file
+     total     the three added up
+ • the device clock's offset and drift against host time.  The device and
+   host clocks are never compared directly, only through one-way stamps, so
+   (like NTP without the return trip) the fit runs through the lower
+   envelope: the smallest `host - device` per SYNC_WINDOW seconds, least
+   squares over the last SYNC_WINDOWS of them.  The constant part of the
+   transit is folded into the offset, which is why "network" is the delay
+   above the best case rather than the absolute one-way time;
+ • lost frames by where they went missing, from the sequence gaps:
+     device    gaps inside an intact stream: the device encoded frames it
+               never sent on this connection (fan-out skips while the
+               client was still busy with an older frame, oversize JPEGs),
+     network   gaps across a reconnect or a stretch of damaged framing
+               (parser resyncs / non-JPEG parts),
+     recorder  parts the recorder received and threw away (larger than its
+               parse buffer) and frames the disk writer dropped;
+ • the capture interval on the device clock: a sensor or encoder stall
+   shows up here, a stalled radio or recorder only in the host-side gaps.
+
+Frames the device replays from its ring after a reconnect (backfill, see
+mjpeg_ingest.py) close the sequence gap they were missing from; they are
+counted as backfilled and, being late by design, left out of the latency and
+clock fit.  `capture_time` places them on the host clock.
+
+A sequence number going backwards means the device rebooted: the clock fit
+starts over and nothing is counted as lost.  Frames from firmware without
+the stamps are ignored.
+
+Served with the rest of the telemetry (`timing` in /metrics.json, the
+sipbuddy_frame_latency_seconds / sipbuddy_frames_lost_total families on
+/metrics).
+"""
+
+import collections
+
+from telemetry import QUANTILES, Histogram, Ring, percentile
+
+TICKS_PERIOD = 1 << 30                 # MicroPython ticks_ms() wraps here
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)  # seconds
+INTERVAL_BUCKETS = (0.01, 0.02, 0.04, 0.067, 0.1, 0.2, 0.5, 1.0, 5.0)                      # seconds
+SYNC_WINDOW = 10.0                     # device seconds per lower-envelope sample
+SYNC_WINDOWS = 60                      # samples in the offset / drift fit (10 minutes)
+STAGES = ("device", "network", "recorder", "total")
+LOSS_SITES = ("device", "network", "recorder")
+
+
+class ClockSync:
+    """Device ticks → host time, fitted through the lower envelope of one-way stamps."""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self) -> None:
+        self.raw = None                                # last raw ticks seen
+        self.ms = 0                                    # unwrapped device milliseconds
+        self.points = collections.deque(maxlen=SYNC_WINDOWS)  # (device s, min host - device)
+        self.window_start = None
+        self.window_x = self.window_min = None
+        self.x0, self.offset0, self.drift = 0.0, None, 0.0
+
+    def unwrap(self, ticks: int) -> float:
+        """Device seconds for raw `ticks` (must not go back more than half a period)."""
+        if self.raw is not None:
+            self.ms += (ticks - self.raw + TICKS_PERIOD // 2) % TICKS_PERIOD - TICKS_PERIOD // 2
+        else:
+            self.ms = ticks
+        self.raw = ticks
+        return self.ms / 1000
+
+    def observe(self, device_s: float, host: float) -> None:
+        d = host - device_s
+        if self.window_start is None or device_s - self.window_start >= SYNC_WINDOW:
+            if self.window_start is not None:
+                self.points.append((self.window_x, self.window_min))
+                self._fit()
+            self.window_start, self.window_min = device_s, None
+        if self.window_min is None or d < self.window_min:
+            self.window_x, self.window_min = device_s, d
+            if not self.points:                        # no fit yet: running minimum
+                self.x0, self.offset0 = device_s, d
+
+    def _fit(self) -> None:
+        n = len(self.points)
+        mx = sum(x for x, _ in self.points) / n
+        my = sum(y for _, y in self.points) / n
+        sxx = sum((x - mx) ** 2 for x, _ in self.points)
+        self.drift = (sum((x - mx) * (y - my) for x, y in self.points) / sxx) if sxx > 0 else 0.0
+        self.x0, self.offset0 = mx, my
+
+    def peek(self, ticks: int) -> float:
+        """Device seconds for raw `ticks`, like unwrap() but without moving on."""
+        return (self.ms + (ticks - self.raw + TICKS_PERIOD // 2) % TICKS_PERIOD - TICKS_PERIOD // 2) / 1000
+
+    def offset(self, device_s: float) -> float:
+        """host - device at device time `device_s` (None before the first stamp)."""
+        if self.offset0 is None:
+            return None
+        off = self.offset0 + self.drift * (device_s - self.x0)
+        if self.window_min is not None and self.window_x is not None and device_s >= self.window_x:
+            off = min(off, self.window_min)            # never above what was just seen
+        return off
+
+
+class FrameTiming:
+    """Latency, clock and loss accounting of one camera's stamped frames."""
+
+    def __init__(self):
+        self.sync = ClockSync()
+        self.hists = {stage: Histogram(LATENCY_BUCKETS) for stage in STAGES}
+        self.rings = {stage: Ring() for stage in STAGES}
+        self.intervals = Histogram(INTERVAL_BUCKETS)
+        self.lost = dict.fromkeys(LOSS_SITES, 0)
+        self.frames = 0
+        self.backfilled = 0
+        self.reboots = 0
+        self.last_seq = None
+        self.last_captured = 0.0
+        self.damage = self.overflows = 0               # parser counters at the last frame
+        self.broken = True                             # stream interrupted since the last frame
+
+    def reconnected(self) -> None:
+        """A new connection to the camera: the next gap is the network's."""
+        self.broken = True
+
+    def dropped(self) -> None:
+        """The frame just parsed was not written (disk writer backpressure)."""
+        self.lost["recorder"] += 1
+
+    def capture_time(self, parser):
+        """Host epoch seconds at which the frame `parser` just yielded was
+        captured, from the clock fit; None for unstamped frames or before the
+        first stamp."""
+        if parser.seq < 0 or parser.encoded < 0 or parser.captured < 0 or self.sync.raw is None:
+            return None
+        encoded = self.sync.peek(parser.encoded)
+        offset = self.sync.offset(encoded)
+        if offset is None:
+            return None
+        return encoded - ((parser.encoded - parser.captured) % TICKS_PERIOD) / 1000 + offset
+
+    def frame(self, parser, arrived: float, written: float, replayed: bool = False) -> None:
+        """Account the frame `parser` just yielded, parsed at `arrived` and
+        written at `written` (host epoch seconds); `replayed` for backfill."""
+        seq = parser.seq
+        if seq < 0 or parser.encoded < 0 or parser.captured < 0:
+            return
+        damage = parser.resyncs + parser.dropped - parser.overflows
+        overflows = parser.overflows - self.overflows
+        if damage != self.damage:
+            self.damage, self.broken = damage, True
+        self.overflows = parser.overflows
+        if self.last_seq is not None and seq <= self.last_seq:   # the device rebooted
+            self.sync.reset()
+            self.reboots += 1
+            self.last_seq = None
+
+        encoded = self.sync.unwrap(parser.encoded)
+        device = ((parser.encoded - parser.captured) % TICKS_PERIOD) / 1000
+        captured = encoded - device
+        if self.last_seq is not None:
+            gap = seq - self.last_seq - 1
+            if gap > 0:
+                mine = min(gap, overflows)
+                self.lost["recorder"] += mine
+                self.lost["network" if self.broken else "device"] += gap - mine
+            self.intervals.observe(captured - self.last_captured)
+        self.last_seq, self.last_captured = seq, captured
+        self.broken = False
+        self.frames += 1
+        if replayed:
+            self.backfilled += 1
+            return
+
+        self.sync.observe(encoded, arrived)
+        network = max(0.0, arrived - encoded - self.sync.offset(encoded))
+        recorder = written - arrived
+        for stage, v in (("device", device), ("network", network), ("recorder", recorder),
+                         ("total", device + network + recorder)):
+            self.hists[stage].observe(v)
+            self.rings[stage].push(v)
+
+    def snapshot(self) -> dict:
+        sync = self.sync
+        offset = sync.offset(sync.ms / 1000) if self.last_seq is not None else None
+        return {
+            "frames": self.frames,
+            "last_seq": self.last_seq,
+            "lost": dict(self.lost),
+            "backfilled": self.backfilled,
+            "device_reboots": self.reboots,
+            "clock_offset_seconds": offset,
+            "clock_drift_ppm": sync.drift * 1e6,
+            "latency_seconds": {stage: {str(q): percentile(sorted(ring.values()), q) for q in QUANTILES}
+                                for stage, ring in self.rings.items()},
+            "latency_histograms": {stage: h.snapshot() for stage, h in self.hists.items()},
+            "capture_interval_histogram": self.intervals.snapshot(),
+        }
@@ -3,22 +3,76 @@
 Very-simple SipBuddy recorder (pull model)
 
  • Each camera stays an HTTP MJPEG server on port 8080.
- • Laptop pulls the stream and FFmpeg cuts 30-second MP4 files.
- • Auto-discovers SipBuddy devices via UDP broadcasts.
+ • Laptop pulls the stream and FFmpeg cuts 30-second MP4 files
+   (`--backend ffmpeg`, default), or one asyncio event loop ingests every
+   camera in-process and writes 30-second .mjpeg files (`--backend native`).
+ • Auto-discovers SipBuddy devices via UDP broadcasts and remembers them in
+   recordings/cameras.json, so after a restart every known camera is
+   reconnected at once instead of waiting for it to broadcast again
+   (registry.py).
+ • supervisor.py keeps one recorder per MAC, restarts stalled streams with
+   jittered exponential backoff and hands a camera over when its IP changes.
+ • `--workers N` (native backend) spreads the cameras over N ingest
+   processes by consistent hashing; this process keeps discovery, the
+   registry, the catalog and the HTTP endpoint (shard.py).
+ • `--write-behind` (native backend) takes the segment writes off the
+   ingest loop: one writer thread batches every camera's frames, group-
+   fsyncs every `--durability` seconds and bounds the buffered bytes, with
+   a per-camera policy for when the disk falls behind (disk_writer.py).
+ • `--rate-control` (native backend) steers each camera's JPEG quality,
+   frame size and fps cap over its UDP control channel toward
+   `--target-fps` within `--camera-budget-kbps`, backing off when the
+   WiFi cannot carry the stream (rate_control.py).
+ • Per-camera fps, bitrate, gaps and disk latency on
+   http://<laptop>:8088/metrics (Prometheus) and /metrics.json (telemetry.py),
+   plus (native backend) capture-to-disk latency per stage and lost frames
+   by where they were lost, from the firmware's frame stamps (frame_timing.py).
+ • With the native backend the same port re-serves every camera at
+   /cam/<id>/stream and /cam/<id>/latest.jpg (relay.py), and with
+   `--mosaic` all of them tiled in one stream at /mosaic/stream, composed
+   once per tick however many viewers watch (mosaic.py).
+ • `--activity-gate` deletes segments without motion, keeping a pre-roll and
+   post-roll around activity (activity.py).
+ • Every closed segment is catalogued in recordings/catalog.sqlite; with
+   `--camera-quota` / `--total-quota` the oldest (or least active) segments
+   are deleted to stay under them (catalog.py).  Clips spanning segments are
+   exported without re-encoding at /export/<id>?start=..&end=.. (export.py).
+ • `--dedup` (native backend) pHashes every camera's frames once a second
+   into a near-duplicate index saved as recordings/dedup.npz (dedup.py).
+ • `--transcode` re-encodes finished MP4 segments to H.264 in the background
+   with spare CPU (transcode.py).
+ • SIGTERM / Ctrl+C finish every open segment (all cameras at once, at most
+   `--shutdown-timeout` seconds) before exiting; SIGHUP re-reads the cameras
+   and SEGMENT_SECONDS (`--config FILE`, or the block below) and applies only
+   what changed, leaving the other cameras recording.  Segments being written
+   are journaled, so after a crash the start-up recovery pass repairs just
+   those (recovery.py).  FFmpeg writes fragmented MP4, playable up to the
+   last fragment if it is killed, and dies with the recorder.
 
 Requirements:
     - FFmpeg in PATH   (sudo apt install ffmpeg | brew install ffmpeg)
+    - aiohttp for the native backend, numpy + Pillow for --activity-gate
+      (pip install -r requirements.txt)
     - Python 3.8+
 """
 
 import subprocess, pathlib, datetime, time, threading
-import socket
+import ast
+import json
 import logging
+import os
 import queue
-import re
+import signal
 import sys
 import argparse
 
+from discovery import run_discovery
+from recovery import OpenJournal, recover
+from registry import REGISTRY_NAME, CameraRegistry
+from segment_events import Mp4Watcher, SegmentEvents
+from supervisor import STALL_SECONDS, STREAMING, CameraState, Supervisor, camera_key
+from telemetry import MetricsRegistry
+
 # ───── CONFIGURE YOUR CAMERAS HERE ─────────────────────────────────────────
 # Default cameras (will be supplemented by auto-discovery)
 CAMERAS = [
@@ -30,6 +84,7 @@ CAMERAS = [
 SEGMENT_SECONDS = 30                       # length of each .mp4 chunk
 OUT_ROOT        = pathlib.Path("recordings")
 UDP_REGISTRATION_PORT = 8000                   # UDP port for device registration
+HTTP_PORT = 8088                               # /metrics endpoint (0 = off)
 # ───────────────────────────────────────────────────────────────────────────
 
 # Set up logging
@@ -41,119 +96,292 @@ logger = logging.getLogger('sipbuddy')
 
 # Queue for newly discovered cameras
 discovered_cameras = queue.Queue()
-# Dict to track known cameras by MAC
-known_cameras = {}
-
-def parse_registration(data):
-    """Parse registration message from SipBuddy device."""
-    try:
-        # Expected format: "SIPBUDDY_REGISTER|IP:xxx.xxx.xxx.xxx|MAC:xxxxxxxxxxxx|PORT:xxxx"
-        if not data.startswith("SIPBUDDY_REGISTER"):
-            return None
-        
-        ip_match = re.search(r'IP:([^|]+)', data)
-        mac_match = re.search(r'MAC:([^|]+)', data)
-        port_match = re.search(r'PORT:(\d+)', data)
-        
-        if not (ip_match and mac_match):
-            return None
-            
-        ip = ip_match.group(1)
-        mac = mac_match.group(1)
-        port = port_match.group(1) if port_match else "8080"
-        
-        return {
-            "ip": ip,
-            "mac": mac,
-            "id": f"sipbuddy_{mac[-6:]}", # Use last 6 chars of MAC as ID
-            "port": port
-        }
-    except Exception as e:
-        logger.error(f"Failed to parse registration data: {e}")
-        return None
+# Cameras known by MAC (shared by the discovery loop and recorder threads),
+# persisted under OUT_ROOT unless --no-registry
+known_cameras = CameraRegistry()
+# Rolling per-camera metrics served on /metrics
+metrics = MetricsRegistry()
 
 def run_udp_listener():
-    """Listen for SipBuddy device registrations via UDP."""
+    """Listen for SipBuddy device registrations via UDP (see discovery.py)."""
     logger.info(f"Starting UDP listener on port {UDP_REGISTRATION_PORT}")
-    
-    # Create UDP socket
-    udp_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    udp_sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-    
-    # Try to bind to port
     try:
-        udp_sock.bind(('', UDP_REGISTRATION_PORT))
-        logger.info(f"Successfully bound to *:{UDP_REGISTRATION_PORT}")
-    except Exception as e:
+        run_discovery(UDP_REGISTRATION_PORT, known_cameras, discovered_cameras.put)
+    except OSError as e:
         logger.error(f"Failed to bind to port {UDP_REGISTRATION_PORT}: {e}")
-        logger.info("Trying to detect if port is already in use...")
-        
-    while True:
-        print("Searching for devices over UDP...")
-        try:
-            data, addr = udp_sock.recvfrom(512)  # Receive up to 512 bytes
-            data_str = data.decode('utf-8')
-            print(data_str)
-            logger.info(f"Received registration from {addr[0]}:{addr[1]}: {data_str}")
-            
-            device_info = parse_registration(data_str)
-            if device_info:
-                mac = device_info["mac"]
-                
-                # Send acknowledgment
-                udp_sock.sendto("SIPBUDDY_ACK".encode(), addr)
-                logger.info(f"Sent acknowledgment to {addr[0]}")
-                
-                # Only add new cameras or update existing ones
-                if mac not in known_cameras:
-                    logger.info(f"New SipBuddy discovered: {device_info}")
-                    known_cameras[mac] = device_info
-                    discovered_cameras.put(device_info)
-                elif known_cameras[mac]["ip"] != device_info["ip"]:
-                    # IP has changed, update and re-add
-                    logger.info(f"SipBuddy IP updated: {device_info}")
-                    known_cameras[mac] = device_info
-                    discovered_cameras.put(device_info)
-        except Exception as e:
-            logger.error(f"Error in UDP listener: {e}")
-            time.sleep(1)
-
-def run_ffmpeg(cam: dict) -> None:
-    """Spawn (and respawn) one FFmpeg process for the given camera."""
+
+def _watch_progress(proc: subprocess.Popen, state: CameraState) -> None:
+    """Feed the stall watchdog from FFmpeg's `-progress` output (bytes written)."""
+    written = 0
+    for line in proc.stdout:
+        if line.startswith("total_size="):
+            try:
+                total = int(line.split("=", 1)[1])
+            except ValueError:                 # "N/A" before the first packet
+                continue
+            if total > written:
+                state.progress(total - written)
+                written = total
+
+PR_SET_PDEATHSIG = 1
+
+def _ffmpeg_child() -> None:
+    """In the forked FFmpeg: get SIGTERM when the recorder dies (Linux), so a
+    killed recorder leaves no FFmpeg recording on unsupervised."""
+    if sys.platform.startswith("linux"):
+        import ctypes
+        ctypes.CDLL(None).prctl(PR_SET_PDEATHSIG, signal.SIGTERM)
+
+def run_ffmpeg(cam: dict, state: CameraState = None, stop: threading.Event = None,
+               journal: OpenJournal = None, procs: dict = None, activity=None) -> None:
+    """Spawn (and respawn) one FFmpeg process for the given camera until `stop` is set."""
     ip, cam_id = cam["ip"], cam["id"]
-    while True:
+    port = cam.get("port", 8080)
+    state = state or CameraState(cam)
+    stop = stop or threading.Event()
+    metrics.camera(cam_id).state = state       # ffmpeg hides frames: state + reconnects only
+    run = None                                 # file prefix of the previous FFmpeg run
+    while not stop.is_set():
         ts = datetime.datetime.utcnow().strftime("%Y%m%d_%H%M%S")
         out_dir = OUT_ROOT / cam_id
         out_dir.mkdir(parents=True, exist_ok=True)
         out_tpl = str(out_dir / f"{ts}_%03d.mp4")
+        if journal is not None:                # the previous run's last file is complete now
+            if run is not None:
+                journal.closed(run)
+            run = out_dir / f"{ts}_"
+            journal.opened(cam_id, run, prefix=True)
+        seconds = cam.get("segment_seconds", SEGMENT_SECONDS)
+        if activity is not None:               # pre/post roll counts in segments of this length
+            activity.set_segment_seconds(seconds, cam_id)
 
         cmd = [
             "ffmpeg",
             "-hide_banner", "-loglevel", "error",
-            "-i", f"http://{ip}:8080",     # pull MJPEG directly
+            "-nostats", "-progress", "pipe:1",   # byte counter for the watchdog
+            "-i", f"http://{ip}:{port}",   # pull MJPEG directly
             "-c", "copy",                  # no re-encode → tiny CPU load
             "-f", "segment",
-            "-segment_time", str(SEGMENT_SECONDS),
+            "-segment_time", str(seconds),
             "-reset_timestamps", "1",
+            # fragmented: a killed FFmpeg leaves a file playable up to its last fragment
+            "-segment_format_options", "movflags=+frag_keyframe+empty_moov:min_frag_duration=1000000",
             out_tpl,
         ]
 
         print(f"[{cam_id}] ▶️  starting   → {out_tpl}")
-        proc = subprocess.Popen(cmd)
+        state.connecting()
+        # own session: a Ctrl+C in the terminal reaches only us, and we stop FFmpeg in order
+        proc = subprocess.Popen(cmd, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, text=True,
+                                start_new_session=True,
+                                preexec_fn=_ffmpeg_child if os.name == "posix" else None)
+        if procs is not None:
+            procs[camera_key(cam)] = proc
+        threading.Thread(target=_watch_progress, args=(proc, state), daemon=True).start()
+
+        stalled = False
+        while proc.poll() is None and not stop.wait(0.5):
+            if state.is_stalled():
+                stalled = True
+                break
+        if proc.poll() is None:
+            proc.terminate()                   # lets ffmpeg close the current segment
+            try:
+                proc.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+                proc.wait()
+        if stop.is_set():
+            break
+
+        reason = f"no output for {STALL_SECONDS:g} s" if stalled else f"ffmpeg exited with {proc.returncode}"
+        delay = state.retry_delay(reason, stalled)
+        print(f"[{cam_id}] ⚠️  {reason}; retrying in {delay:.1f} s")
+        stop.wait(delay)
+
+def report_warm_start(supervisor: Supervisor, keys: list, started: float, timeout: float = 300.0) -> None:
+    """Log how long after start-up the warm-started cameras were all streaming again."""
+    deadline, streaming = started + timeout, 0
+    while time.monotonic() < deadline:
+        streaming = sum(1 for k in keys if supervisor.states[k].state == STREAMING)
+        if streaming == len(keys):
+            logger.info(f"Warm start: all {len(keys)} known cameras streaming "
+                        f"{time.monotonic() - started:.1f} s after start-up")
+            return
+        time.sleep(0.2)
+    logger.warning(f"Warm start: {streaming}/{len(keys)} known cameras streaming after {timeout:g} s")
+
+class FfmpegBackend:
+    """Supervisor backend running one FFmpeg process (and thread) per camera."""
+
+    def __init__(self, journal: OpenJournal = None, activity=None):
+        self.journal = journal                 # recovery.OpenJournal, optional
+        self.activity = activity               # activity.ActivityMonitor, optional
+        self.running = {}                      # camera key -> (thread, stop event)
+        self.procs = {}                        # camera key -> current FFmpeg process
+
+    def start(self, cam: dict, state: CameraState) -> None:
+        stop = threading.Event()
+        t = threading.Thread(target=run_ffmpeg, daemon=True,
+                             args=(cam, state, stop, self.journal, self.procs, self.activity))
+        t.start()
+        self.running[camera_key(cam)] = (t, stop)
+
+    def stop(self, key: str) -> None:
+        t, stop = self.running.pop(key, (None, None))
+        if t is not None:
+            stop.set()
+            t.join()
+        self.procs.pop(key, None)
+
+    def shutdown(self, timeout: float) -> bool:
+        """Stop every FFmpeg at once; kill those still running after `timeout` seconds."""
+        deadline = time.monotonic() + timeout
+        running, self.running = self.running, {}
+        for _, stop in running.values():
+            stop.set()
+        for t, _ in running.values():
+            t.join(max(0.0, deadline - time.monotonic()))
+        late = [key for key, (t, _) in running.items() if t.is_alive()]
+        for key in late:
+            proc = self.procs.get(key)         # none yet, or between runs: nothing to kill
+            if proc is not None and proc.poll() is None:
+                logger.error(f"[{key}] FFmpeg still finishing after {timeout:g} s: killing it")
+                proc.kill()
+        return not late
 
-        ret = proc.wait()
-        print(f"[{cam_id}] ⚠️  ffmpeg exited with {ret}; retrying in 2 s")
-        time.sleep(2)                      # simple back-off before restart
+def load_config(path: pathlib.Path = None) -> dict:
+    """{"cameras": [...], "segment_seconds": N} from a JSON file, or from the
+    CONFIGURE block of this script as it is on disk now."""
+    if path is not None:
+        config = json.loads(path.read_text())
+        return {"cameras": list(config.get("cameras", [])),
+                "segment_seconds": config.get("segment_seconds", SEGMENT_SECONDS)}
+    config = {"cameras": CAMERAS, "segment_seconds": SEGMENT_SECONDS}
+    for node in ast.parse(pathlib.Path(__file__).read_text()).body:
+        if isinstance(node, ast.Assign) and len(node.targets) == 1 and isinstance(node.targets[0], ast.Name):
+            name = node.targets[0].id.lower()
+            if name in config:
+                config[name] = ast.literal_eval(node.value)
+    return config
+
+def reload_config(supervisor: Supervisor, backend, old: dict, new: dict) -> None:
+    """Apply what changed between two configurations: stop removed cameras,
+    start new ones, restart moved or renamed ones, retune the rest in place."""
+    global SEGMENT_SECONDS
+    before = {camera_key(c): c for c in old["cameras"]}
+    after = {camera_key(c): c for c in new["cameras"]}
+    removed = [k for k in before if k not in after]
+    added = [k for k in after if k not in before]
+    changed = [k for k in after if k in before and after[k] != before[k]]
+    for key in removed:
+        supervisor.remove(key)
+    for key in added:
+        supervisor.submit(after[key])
+    for key in changed:
+        a, b = before[key], after[key]
+        moved = (a["id"], a["ip"], str(a.get("port", 8080))) != (b["id"], b["ip"], str(b.get("port", 8080)))
+        if moved or not supervisor.retune(b):
+            supervisor.remove(key)
+            supervisor.submit(b)
+    seconds = new["segment_seconds"]
+    if seconds != SEGMENT_SECONDS:
+        SEGMENT_SECONDS = seconds
+        if hasattr(backend, "set_segment_seconds"):
+            backend.set_segment_seconds(seconds)
+        else:                                  # FFmpeg takes it when it is (re)started
+            logger.info(f"Segment length {seconds:g} s applies from each camera's next FFmpeg run")
+    logger.info(f"Configuration reloaded: {len(added)} cameras added, {len(removed)} removed, "
+                f"{len(changed)} changed, {len(after) - len(added) - len(changed)} unchanged")
 
 def main():
+    global OUT_ROOT, UDP_REGISTRATION_PORT, SEGMENT_SECONDS, known_cameras
+    started = time.monotonic()
     # Parse command line arguments
     parser = argparse.ArgumentParser(description="SipBuddy Recorder")
     parser.add_argument("--discovery-only", action="store_true", 
                       help="Run only in discovery mode without starting FFmpeg")
+    parser.add_argument("--backend", choices=["ffmpeg", "native"], default="ffmpeg",
+                      help="ffmpeg: one FFmpeg process per camera; "
+                           "native: in-process asyncio ingest of every camera")
+    parser.add_argument("--workers", type=int, default=0,
+                      help="Native backend: ingest in N worker processes (default: 0, in-process)")
+    parser.add_argument("--write-behind", action="store_true",
+                      help="Native backend: write segments from a shared writer thread, see disk_writer.py")
+    parser.add_argument("--disk-buffer-mb", type=float, default=64.0,
+                      help="Write-behind: max MB of frames buffered for the disk (default: 64)")
+    parser.add_argument("--durability", type=float, default=1.0,
+                      help="Write-behind: seconds between group fsyncs, 0 after every flush (default: 1)")
+    parser.add_argument("--drop-policy", choices=["block", "drop-newest", "drop-oldest"], default="block",
+                      help="Write-behind: what a camera does when the buffer is full (default: block)")
+    parser.add_argument("--camera-drop-policy", action="append", metavar="ID=POLICY",
+                      help="Write-behind: drop policy for one camera (repeatable)")
+    parser.add_argument("--rate-control", action="store_true",
+                      help="Native backend: adapt camera quality/frame size/fps, see rate_control.py")
+    parser.add_argument("--target-fps", type=float, default=15.0,
+                      help="Rate control: frame rate to hold per camera (default: 15)")
+    parser.add_argument("--camera-budget-kbps", type=float,
+                      help="Rate control: max kbit/s per camera (default: what the link carries)")
+    parser.add_argument("--mosaic", action="store_true",
+                      help="Native backend: serve every camera tiled in one stream, see mosaic.py")
+    parser.add_argument("--mosaic-fps", type=float, default=2.0,
+                      help="Mosaic: composites per second (default: 2)")
+    parser.add_argument("--mosaic-tile", default="240x180",
+                      help="Mosaic: tile size WxH (default: 240x180)")
+    parser.add_argument("--out", type=pathlib.Path, default=OUT_ROOT,
+                      help=f"Recordings directory (default: {OUT_ROOT})")
+    parser.add_argument("--udp-port", type=int, default=UDP_REGISTRATION_PORT,
+                      help=f"UDP registration port (default: {UDP_REGISTRATION_PORT})")
+    parser.add_argument("--http-port", type=int, default=HTTP_PORT,
+                      help=f"Telemetry HTTP port, 0 to disable (default: {HTTP_PORT})")
+    parser.add_argument("--no-registry", action="store_true",
+                      help=f"Do not remember cameras across restarts ({REGISTRY_NAME})")
+    parser.add_argument("--activity-gate", action="store_true",
+                      help="Keep only segments with motion (plus pre/post roll), see activity.py")
+    parser.add_argument("--pre-roll", type=float, default=30.0,
+                      help="Seconds kept before activity (default: 30)")
+    parser.add_argument("--post-roll", type=float, default=30.0,
+                      help="Seconds kept after activity (default: 30)")
+    parser.add_argument("--activity-threshold", type=float, default=0.01,
+                      help="Fraction of changed pixels that counts as activity (default: 0.01)")
+    parser.add_argument("--no-catalog", action="store_true",
+                      help="Do not maintain the segment catalog (disables quotas)")
+    parser.add_argument("--camera-quota", type=float,
+                      help="GB kept per camera, see catalog.py")
+    parser.add_argument("--total-quota", type=float,
+                      help="GB kept for all cameras together")
+    parser.add_argument("--retention-policy", choices=["oldest", "activity"], default="oldest",
+                      help="Which segments go first when over quota (default: oldest)")
+    parser.add_argument("--dedup", action="store_true",
+                      help="Index frames for near-duplicate detection (native backend), see dedup.py")
+    parser.add_argument("--transcode", action="store_true",
+                      help="Re-encode finished MP4 segments to H.264 in the background, see transcode.py")
+    parser.add_argument("--transcode-workers", type=int,
+                      help="Max parallel transcodes (default: half the cores)")
+    parser.add_argument("--config", type=pathlib.Path,
+                      help='JSON {"cameras": [...], "segment_seconds": N} instead of the CONFIGURE block; '
+                           "re-read on SIGHUP")
+    parser.add_argument("--shutdown-timeout", type=float, default=10.0,
+                      help="Seconds SIGTERM / Ctrl+C wait for open segments to be finished (default: 10)")
     args = parser.parse_args()
+    try:
+        config = load_config(args.config)
+    except (OSError, ValueError, SyntaxError) as e:
+        parser.error(f"cannot read the configuration: {e}")
+    SEGMENT_SECONDS = config["segment_seconds"]
+    if args.mosaic:
+        from mosaic import parse_tile
+        try:
+            mosaic_tile = parse_tile(args.mosaic_tile)
+        except ValueError as e:
+            parser.error(str(e))
 
-    OUT_ROOT.mkdir(exist_ok=True)
+    OUT_ROOT, UDP_REGISTRATION_PORT = args.out, args.udp_port
+
+    OUT_ROOT.mkdir(parents=True, exist_ok=True)
     threads = []
+    if not args.no_registry:
+        known_cameras = CameraRegistry(OUT_ROOT / REGISTRY_NAME)
     
     # Start UDP listener for device discovery
     discovery_thread = threading.Thread(target=run_udp_listener, daemon=True)
@@ -169,21 +397,199 @@ def main():
             logger.info("Discovery mode terminated by user")
             return
     
-    # Start threads for known cameras
-    for cam in CAMERAS:
-        t = threading.Thread(target=run_ffmpeg, args=(cam,), daemon=True)
-        t.start()
-        threads.append(t)
+    # Post-processing of finished segments hangs off these events
+    events = SegmentEvents()
+    catalog = None
+    if not args.no_catalog:
+        from catalog import Catalog, RetentionManager
+
+        def mac_of(cam_id):
+            return next((c["mac"] for c in known_cameras.snapshot() if c["id"] == cam_id), None)
+        catalog = Catalog(OUT_ROOT, mac_of)
+        events.subscribe(catalog.segment_closed)   # first, so later handlers find the row
+        if args.camera_quota or args.total_quota:
+            gb = lambda v: int(v * 1e9) if v else None
+            retention = RetentionManager(catalog, gb(args.camera_quota), gb(args.total_quota),
+                                         args.retention_policy)
+            retention.start()
+            threads.append(retention)
+    elif args.camera_quota or args.total_quota:
+        logger.warning("quotas need the segment catalog: ignoring --camera-quota/--total-quota")
+
+    sharded = args.backend == "native" and args.workers > 0
+    if args.workers and not sharded:
+        logger.warning("--workers only applies to the native backend")
+
+    activity = None
+    if args.activity_gate and sharded:                 # each worker gates its own cameras
+        activity = {"pre_roll": args.pre_roll, "post_roll": args.post_roll,
+                    "threshold": args.activity_threshold}
+    elif args.activity_gate:
+        from activity import ActivityMonitor
+        activity = ActivityMonitor(SEGMENT_SECONDS, args.pre_roll, args.post_roll,
+                                   args.activity_threshold,
+                                   on_score=catalog.scored if catalog is not None else None,
+                                   on_drop=catalog.removed if catalog is not None else None)
+        if args.backend == "ffmpeg":           # the native backend scores frames live
+            events.subscribe(activity.score_closed)
+
+    transcoder = None
+    if args.transcode:
+        from transcode import Transcoder
+        if args.backend == "native":
+            logger.warning("--transcode only handles MP4 segments (ffmpeg backend)")
+        transcoder = Transcoder(OUT_ROOT, args.transcode_workers,
+                                on_replaced=catalog.resized if catalog is not None else None)
+        events.subscribe(transcoder.segment_closed)
+        transcoder.start()
+        threads.append(transcoder)
+
+    hasher = None
+    if args.dedup:
+        if sharded:
+            logger.warning("--dedup is not supported with --workers (one index per process)")
+        elif args.backend == "native":
+            import dedup
+            path = OUT_ROOT / "dedup.npz"
+            index = dedup.HashIndex.load(path) if path.exists() else dedup.HashIndex()
+            hasher = dedup.FrameHasher(dedup.DedupFilter(index), path)
+            threads.append(hasher.run_hasher())
+            threads.append(hasher.run_saver())
+        else:
+            logger.warning("--dedup needs the native backend (ffmpeg never hands us frames)")
+
+    disk_config = disk = None
+    if args.write_behind and args.backend == "native":
+        from disk_writer import DiskWriter, parse_policies
+        try:
+            policies = parse_policies(args.camera_drop_policy)
+        except ValueError as e:
+            parser.error(str(e))
+        disk_config = {"max_buffer": int(args.disk_buffer_mb * 1e6) // max(1, args.workers),
+                       "durability": args.durability, "policy": args.drop_policy,
+                       "policies": policies}
+        if not sharded:                                # workers start their own writer
+            disk = DiskWriter(**disk_config)
+            disk.start()
+            threads.append(disk)
+    elif args.write_behind:
+        logger.warning("--write-behind needs the native backend (FFmpeg writes its own files)")
+
+    # Segments a crash (or a missed shutdown deadline) left unfinished: repaired
+    # and announced before anything new is written
+    journal = OpenJournal(OUT_ROOT)
+    stats = recover(journal, events.closed)
+    if stats["segments"]:
+        logger.info(f"Recovered {stats['segments']} unfinished segments in {stats['seconds']:.2f} s: "
+                    f"{stats['frames_indexed']} frames indexed, {stats['bytes_cut']} bytes cut, "
+                    f"{stats['removed']} empty removed, {stats['unplayable']} without moov")
+
+    frame_relay = None
+    metrics_source = metrics
+    if sharded:
+        from shard import ShardedBackend
+        backend = ShardedBackend(OUT_ROOT, SEGMENT_SECONDS, args.workers, events, activity,
+                                 on_score=catalog.scored if catalog is not None else None,
+                                 on_drop=catalog.removed if catalog is not None else None,
+                                 disk=disk_config, journal=True)
+        metrics_source = backend.metrics
+    elif args.backend == "native":
+        from mjpeg_ingest import IngestEngine
+        from relay import Relay
+        frame_relay = Relay() if args.http_port else None
+        backend = IngestEngine(OUT_ROOT, SEGMENT_SECONDS, metrics, frame_relay, activity, events,
+                               hasher, disk, journal)
+        threads.append(backend.start_in_thread())
+    else:
+        backend = FfmpegBackend(journal, activity)
+        if events.subscribers:
+            watcher = Mp4Watcher(OUT_ROOT, events)
+            watcher.start()
+            threads.append(watcher)
+
+    composite = None
+    if args.mosaic and frame_relay is not None:
+        from mosaic import Mosaic
+        composite = Mosaic(frame_relay, backend.loop, args.mosaic_fps, mosaic_tile)
+        composite.start()
+        threads.append(composite)
+    elif args.mosaic:
+        logger.warning("--mosaic needs the native backend in one process with the HTTP port")
+
+    controller = None
+    if args.rate_control and args.backend == "native":
+        from rate_control import RateController
+
+        def control_addresses():
+            return {c["id"]: (c["mac"], c["ip"], int(c["ctrl"]))
+                    for c in known_cameras.snapshot() if c.get("ctrl")}
+        controller = RateController(metrics_source, control_addresses, args.target_fps,
+                                    args.camera_budget_kbps)
+        controller.start()
+        threads.append(controller)
+    elif args.rate_control:
+        logger.warning("--rate-control needs the native backend (per-frame telemetry)")
+
+    if args.http_port:
+        try:
+            import telemetry
+            from recorder_http import RecorderHttp
+            http = RecorderHttp(args.http_port)
+            telemetry.add_routes(http.app, metrics_source)
+            if sharded:
+                import shard
+                shard.add_routes(http.app, backend)
+            if frame_relay is not None:
+                import relay
+                relay.add_routes(http.app, frame_relay)
+            if composite is not None:
+                import mosaic
+                mosaic.add_routes(http.app, composite)
+            if catalog is not None:
+                import export
+                export.add_routes(http.app, catalog)
+            if hasher is not None:
+                dedup.add_routes(http.app, hasher)
+            if transcoder is not None:
+                import transcode
+                transcode.add_routes(http.app, transcoder)
+            if disk is not None:
+                import disk_writer
+                disk_writer.add_routes(http.app, disk)
+            if controller is not None:
+                import rate_control
+                rate_control.add_routes(http.app, controller)
+            http.start(backend.loop if args.backend == "native" else None)
+        except ImportError:
+            logger.warning("aiohttp not installed: /metrics endpoint disabled")
+        except OSError as e:
+            logger.error(f"/metrics endpoint disabled: {e}")
+    # One recorder per MAC; a new IP hands the camera over instead of doubling it
+    supervisor = Supervisor(backend)
+
+    if not args.no_registry:
+        threads.append(known_cameras.run_saver(supervisor.health))
+
+    # Start recording known cameras: configured ones, then every camera the
+    # registry remembers (all at once; fresh registrations still reconcile
+    # through the discovery loop, a moved camera is handed off as usual)
+    for cam in config["cameras"]:
+        supervisor.submit(cam)
+    warm = [] if args.no_registry else known_cameras.warm()
+    for cam in warm:
+        supervisor.submit(cam)
+    if warm:
+        logger.info(f"Reconnecting {len(warm)} known cameras")
+        threading.Thread(target=report_warm_start, daemon=True,
+                         args=(supervisor, [camera_key(c) for c in warm], started)).start()
     
     # Process for handling newly discovered cameras
     def handle_discoveries():
         while True:
             try:
                 new_cam = discovered_cameras.get(timeout=1.0)
-                logger.info(f"Starting recording for newly discovered camera: {new_cam['id']} ({new_cam['ip']})")
-                t = threading.Thread(target=run_ffmpeg, args=(new_cam,), daemon=True)
-                t.start()
-                threads.append(t)
+                if supervisor.submit(new_cam):
+                    logger.info(f"Recording discovered camera: {new_cam['id']} ({new_cam['ip']})")
             except queue.Empty:
                 time.sleep(1)
             except Exception as e:
@@ -194,8 +600,42 @@ def main():
     discovery_handler.start()
     threads.append(discovery_handler)
     
-    # Keep main thread alive
-    for t in threads: t.join()
+    # Keep main thread alive, handling signals here (not in the handlers)
+    signals = queue.SimpleQueue()              # put() is safe in a signal handler
+    for sig in (signal.SIGTERM, signal.SIGINT, getattr(signal, "SIGHUP", None)):
+        if sig is not None:
+            signal.signal(sig, lambda signum, frame: signals.put(signum))
+    while True:
+        signum = signals.get()
+        if signum != getattr(signal, "SIGHUP", None):
+            break
+        try:
+            new = load_config(args.config)
+        except (OSError, ValueError, SyntaxError) as e:
+            logger.error(f"SIGHUP: configuration not reloaded: {e}")
+            continue
+        reload_config(supervisor, backend, config, new)
+        config = new
+
+    # Shut down: every recorder at once, then whatever missed the deadline
+    logger.info(f"{signal.Signals(signum).name}: finishing open segments "
+                f"(at most {args.shutdown_timeout:g} s)")
+    t = time.monotonic()
+    health = supervisor.health()               # as it was, not "stopped"
+    clean = supervisor.shutdown(args.shutdown_timeout)
+    stats = recover(journal, events.closed)    # FFmpeg's last files, segments of killed workers
+    if not args.no_registry:
+        known_cameras.set_health(health)
+        known_cameras.save()
+    if hasher is not None:
+        hasher.stop(args.shutdown_timeout)
+        hasher.dedup.index.save(hasher.path)
+    if transcoder is not None:
+        transcoder.stop(args.shutdown_timeout)
+    if catalog is not None:
+        catalog.close()
+    logger.info(f"Shut down in {time.monotonic() - t:.1f} s"
+                + ("" if clean else f" (deadline missed, {stats['segments']} segments recovered)"))
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,332 @@
+#!/usr/bin/env python3
+"""
+In-process MJPEG ingest engine (asyncio + aiohttp)
+
+ • One event loop pulls the `multipart/x-mixed-replace;boundary=openmv`
+   stream from every camera – no thread or ffmpeg process per camera.
+ • Frames are appended to `{ts}_NNN.mjpeg` segments (plain concatenated
+   JPEGs, playable with `ffplay -f mjpeg`) with a `.idx` sidecar for random
+   access – see segment_store.py.  With a shared disk_writer.DiskWriter the
+   writes leave the event loop: batched, preallocated, group-fsynced, with a
+   bounded buffer and a per-camera drop policy.
+ • Per-camera state is a socket, one fixed MultipartParser buffer and one
+   open file, so memory stays flat no matter how long a camera streams.
+ • Sequence-stamped frames feed per-stage latency, clock drift and loss
+   accounting (frame_timing.py) into the camera's telemetry.
+ • Backfill: a reconnect asks the camera for the frames after the last
+   sequence number received (`GET /?since=N`); firmware with a replay ring
+   answers `X-Replay-To: M` and sends frames N+1..M, plus those encoded
+   while it did, before the live ones.  They are written with their capture
+   time (device clock mapped to host time) until one arrives less than
+   CATCHUP_LAG behind it, and the open segment is kept across the reconnect
+   until its time is up, so the backfill is appended to the segment it
+   belongs to, in sequence order, before the live frames.
+ • Frames can also be re-served to local viewers (relay.py), so only the
+   recorder ever pulls from the camera, scored for motion so that empty
+   segments are deleted (activity.py) and hashed into the near-duplicate
+   index (dedup.py).
+ • Every segment is listed in the open-segment journal (recovery.py) while
+   it is written.  shutdown() closes every camera's segment at once within a
+   deadline; retune() / set_segment_seconds() change a running camera's
+   segment length (a camera's own "segment_seconds" overrides the global
+   one) without touching its connection.
+
+Used by joe_try_this_one.py with `--backend native`.
+"""
+
+import asyncio
+import datetime
+import logging
+import pathlib
+import threading
+import time
+
+import aiohttp
+
+from disk_writer import BLOCK
+from mjpeg_parser import MultipartParser
+from frame_timing import FrameTiming
+from relay import Relay
+from segment_store import SegmentWriter
+from supervisor import STALL_SECONDS, CameraState, camera_key
+from telemetry import MetricsRegistry
+
+logger = logging.getLogger('sipbuddy')
+
+READ_CHUNK = 64 * 1024                 # bytes pulled from the socket at a time
+CATCHUP_LAG = 1.0                      # seconds behind capture that still count as backfill
+PARSER_CAPACITY = 256 * 1024           # per-camera parse buffer (max frame is half)
+CONNECT_TIMEOUT = 5.0                  # seconds to open the HTTP connection
+
+
+def camera_url(cam: dict, since: int = None) -> str:
+    """The stream URL; `since` asks the camera to replay the frames after it."""
+    url = f"http://{cam['ip']}:{cam.get('port', 8080)}"
+    return url if since is None else f"{url}/?since={since}"
+
+
+def replay_to(resp) -> int:
+    """The last sequence number the camera replays on this response, -1 for none."""
+    try:
+        return int(resp.headers.get("X-Replay-To", -1))
+    except ValueError:
+        return -1
+
+
+class SegmentFile:
+    """Indexed `.mjpeg` segments that roll over every `segment_seconds`."""
+
+    def __init__(self, out_dir: pathlib.Path, segment_seconds: float, on_close=None,
+                 disk=None, cam_id: str = None, journal=None):
+        self.out_dir = out_dir
+        self.segment_seconds = segment_seconds         # read at every write: can be retuned live
+        self.on_close = on_close                       # called with each closed segment's path
+        self.disk, self.cam_id = disk, cam_id          # disk_writer.DiskWriter, optional
+        self.journal = journal                         # recovery.OpenJournal, optional
+        self.run_ts = datetime.datetime.utcnow().strftime("%Y%m%d_%H%M%S")
+        self.index = 0
+        self.writer = None
+        self.opened_at = 0.0
+        self.last_ts = 0.0
+
+    def write(self, jpeg, now: float) -> bool:
+        """Append a frame that arrived at `now` (epoch seconds); False if the
+        disk writer dropped it."""
+        if self.writer is None or now - self.opened_at >= self.segment_seconds:
+            self._roll(now)
+        self.last_ts = now
+        return self.writer.write(jpeg, now) is not False
+
+    def expire(self, now: float) -> None:
+        """Close the segment if its time is up (between connections)."""
+        if self.writer is not None and now - self.opened_at >= self.segment_seconds:
+            self.close()
+
+    def _roll(self, now: float) -> None:
+        self.close()
+        self.out_dir.mkdir(parents=True, exist_ok=True)
+        path = self.out_dir / f"{self.run_ts}_{self.index:03d}.mjpeg"
+        if self.journal is not None:
+            self.journal.opened(self.cam_id, path)
+        self.writer = self.disk.open(path, self.cam_id) if self.disk else SegmentWriter(path)
+        self.opened_at = now
+        self.index += 1
+
+    def close(self) -> None:
+        if self.writer is None:
+            return
+        writer, self.writer = self.writer, None
+        if self.disk is not None:
+            writer.close(self._closed)                 # once it is on disk
+            return
+        writer.close()
+        self._closed(writer.path)
+
+    def _closed(self, path) -> None:
+        if self.on_close is not None and path.exists():   # a writer that dropped every frame made no file
+            self.on_close(path)
+        if self.journal is not None:
+            self.journal.closed(path)
+
+
+class IngestEngine:
+    """Records every camera handed to `start` on a single event loop.
+
+    Implements the supervisor.Supervisor backend interface.
+    """
+
+    def __init__(self, out_root: pathlib.Path, segment_seconds: float,
+                 metrics: MetricsRegistry = None, relay: Relay = None, activity=None,
+                 events=None, dedup=None, disk=None, journal=None):
+        self.out_root = out_root
+        self.segment_seconds = segment_seconds
+        self.metrics = metrics or MetricsRegistry()
+        self.relay = relay                             # local re-serving, optional
+        self.activity = activity                       # activity.ActivityMonitor, optional
+        self.events = events                           # segment_events.SegmentEvents, optional
+        self.dedup = dedup                             # dedup.FrameHasher, optional
+        self.disk = disk                               # disk_writer.DiskWriter, optional
+        self.journal = journal                         # recovery.OpenJournal, optional
+        self.loop = None
+        self.session = None
+        self.tasks = {}                                # camera_key -> asyncio.Task
+        self.segments = {}                             # camera_key -> (cam, SegmentFile)
+        self._ready = threading.Event()
+
+    # ── thread-safe API ────────────────────────────────────────────────────
+    def start_in_thread(self) -> threading.Thread:
+        """Run the event loop in a daemon thread and wait until it is ready."""
+        t = threading.Thread(target=lambda: asyncio.run(self.run()), daemon=True)
+        t.start()
+        self._ready.wait()
+        return t
+
+    def start(self, cam: dict, state: CameraState = None) -> None:
+        """Start recording `cam`; safe to call from any thread."""
+        self.loop.call_soon_threadsafe(self._start, dict(cam), state or CameraState(cam))
+
+    def stop(self, key: str) -> None:
+        """Stop a camera's recorder and wait until its segment is closed."""
+        asyncio.run_coroutine_threadsafe(self._stop(key), self.loop).result()
+
+    def shutdown(self, timeout: float) -> bool:
+        """Stop every camera at once and wait until their segments are on
+        disk and announced; False if that took longer than `timeout` seconds."""
+        return asyncio.run_coroutine_threadsafe(self._shutdown(timeout), self.loop).result()
+
+    def retune(self, key: str, cam: dict) -> None:
+        """Apply a running camera's changed settings without reconnecting it."""
+        self.loop.call_soon_threadsafe(self._retune, key, dict(cam))
+
+    def set_segment_seconds(self, seconds: float) -> None:
+        """Change the default segment length; the next roll of every camera
+        without its own "segment_seconds" uses it."""
+        def apply():
+            self.segment_seconds = seconds
+            if self.activity is not None:
+                self.activity.set_segment_seconds(seconds)
+            for key, (cam, _) in list(self.segments.items()):
+                self._retune(key, cam)
+        self.loop.call_soon_threadsafe(apply)
+
+    # ── event-loop side ────────────────────────────────────────────────────
+    async def run(self) -> None:
+        self.loop = asyncio.get_running_loop()
+        connector = aiohttp.TCPConnector(limit=0, force_close=True)
+        async with aiohttp.ClientSession(connector=connector) as session:
+            self.session = session
+            self._ready.set()
+            await asyncio.Event().wait()              # run until cancelled
+
+    def _start(self, cam: dict, state: CameraState) -> None:
+        key = camera_key(cam)
+        if key in self.tasks and not self.tasks[key].done():
+            return
+        self.tasks[key] = self.loop.create_task(self.run_camera(cam, state))
+
+    async def _stop(self, key: str) -> None:
+        task = self.tasks.pop(key, None)
+        if task is None:
+            return
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+
+    async def _shutdown(self, timeout: float) -> bool:
+        deadline = time.monotonic() + timeout
+        tasks = list(self.tasks.values())
+        self.tasks.clear()
+        for task in tasks:
+            task.cancel()
+        pending = ()
+        if tasks:
+            _, pending = await asyncio.wait(tasks, timeout=timeout)
+        drained = True
+        if self.disk is not None:                      # the closes are queued behind the frames
+            drained = await self.loop.run_in_executor(
+                None, self.disk.drain, max(0.0, deadline - time.monotonic()))
+            await asyncio.sleep(0)                     # run the close callbacks it handed back
+        return drained and not pending
+
+    def _retune(self, key: str, cam: dict) -> None:
+        entry = self.segments.get(key)
+        if entry is None:
+            return
+        seconds = cam.get("segment_seconds", self.segment_seconds)
+        if seconds != entry[1].segment_seconds:
+            logger.info(f"[{cam['id']}] segment length {entry[1].segment_seconds:g} s → {seconds:g} s")
+        entry[0].update(cam)
+        entry[1].segment_seconds = seconds
+        if self.activity is not None:                  # pre/post roll counts in segments
+            self.activity.set_segment_seconds(seconds, cam["id"])
+
+    def _on_close(self, cam_id: str, activity):
+        if self.events is None and activity is None:
+            return None
+
+        def on_close(path):
+            if self.events is not None:
+                self.events.closed(cam_id, path)       # catalogued before the gate can drop it
+            if activity is not None:
+                activity.segment_closed(path)
+        if self.disk is None:
+            return on_close
+        # the disk writer closes segments on its thread: hand them back to the loop
+        return lambda path: self.loop.call_soon_threadsafe(on_close, path)
+
+    async def run_camera(self, cam: dict, state: CameraState) -> None:
+        """Pull (and re-pull) one camera's stream until cancelled."""
+        cam_id = cam["id"]
+        activity = self.activity.camera(cam_id) if self.activity is not None else None
+        segments = SegmentFile(self.out_root / cam_id, cam.get("segment_seconds", self.segment_seconds),
+                               self._on_close(cam_id, activity), self.disk, cam_id, self.journal)
+        key = camera_key(cam)
+        self.segments[key] = (cam, segments)
+        if activity is not None:
+            self.activity.set_segment_seconds(segments.segment_seconds, cam_id)
+        block = self.disk is not None and self.disk.policy_for(cam_id) == BLOCK
+        parser = MultipartParser(PARSER_CAPACITY)
+        metrics = self.metrics.camera(cam_id)
+        metrics.state = state
+        if metrics.timing is None:
+            metrics.timing = FrameTiming()
+        timing = metrics.timing
+        hub = self.relay.hub(cam_id) if self.relay is not None else None
+        timeout = aiohttp.ClientTimeout(total=None, connect=CONNECT_TIMEOUT,
+                                        sock_read=STALL_SECONDS)  # bytes watchdog
+        try:
+            while True:
+                print(f"[{cam_id}] ▶️  connecting → {camera_url(cam)}")
+                state.connecting()
+                parser.reset()
+                timing.reconnected()
+                frames = parser.frames
+                stalled = False
+                try:
+                    async with self.session.get(camera_url(cam, timing.last_seq), timeout=timeout,
+                                                read_bufsize=READ_CHUNK) as resp:
+                        upto = replay_to(resp)
+                        catching_up = upto >= 0
+                        async for chunk in resp.content.iter_any():
+                            if block and self.disk.full():
+                                await self.disk.room(cam_id)   # stop reading: TCP backpressure
+                            state.progress(len(chunk))
+                            for jpeg in parser.feed(chunk):
+                                now = time.time()
+                                ts = now
+                                if catching_up:        # backfill: when it was captured, in order
+                                    captured = timing.capture_time(parser)
+                                    catching_up = captured is not None and (
+                                        parser.seq <= upto or now - captured > CATCHUP_LAG)
+                                    if catching_up:
+                                        ts = max(captured, segments.last_ts)
+                                replayed = catching_up
+                                t = time.perf_counter()
+                                written = segments.write(jpeg, ts)
+                                elapsed = time.perf_counter() - t
+                                metrics.disk_write(elapsed)
+                                metrics.frame(len(jpeg))
+                                if not written:
+                                    timing.dropped()
+                                timing.frame(parser, now, now + elapsed, replayed)
+                                if hub is not None and not replayed:
+                                    hub.publish(jpeg, now)
+                                if activity is not None:
+                                    activity.frame(jpeg, ts)
+                                if self.dedup is not None:
+                                    self.dedup.frame(cam_id, jpeg, ts)
+                    reason = f"stream ended after {parser.frames - frames} frames"
+                except asyncio.TimeoutError:
+                    reason, stalled = f"no data for {STALL_SECONDS:g} s", True
+                except aiohttp.ClientError as e:
+                    reason = f"{type(e).__name__}: {e}"
+                segments.expire(time.time())           # kept open for the backfill
+                delay = state.retry_delay(reason, stalled)
+                print(f"[{cam_id}] ⚠️  {reason}; retrying in {delay:.1f} s")
+                await asyncio.sleep(delay)
+        finally:
+            segments.close()
+            if self.segments.get(key, (None, None))[1] is segments:
+                del self.segments[key]
@@ -0,0 +1,219 @@
+"""
+Incremental, zero-copy parser for the OpenMV `--openmv` multipart framing
+
+The firmware (`start_streaming` in on_ae3_AP.py) sends, per frame:
+
+    \\r\\n--openmv\\r\\nContent-Type: image/jpeg\\r\\nContent-Length:N\\r\\n
+    X-Frame-Seq:S\\r\\nX-Capture-Ticks:C\\r\\nX-Encoded-Ticks:E\\r\\n\\r\\n<N bytes of JPEG>
+
+ • Bytes land in one preallocated bytearray.  When the free tail runs out the
+   unconsumed remainder (at most one partial frame) is moved to the front, so
+   the buffer never grows and nothing is allocated per frame.
+ • Frames are yielded as memoryview slices of that buffer, located through
+   Content-Length – the payload itself is never scanned.
+ • A payload whose Content-Length is missing or wrong (it does not start with
+   a JPEG SOI and end with an EOI marker) is re-located by scanning for the
+   next boundary; garbage between parts is skipped and counted as a resync.
+ • The sequence number and device ticks of the frame just yielded are in
+   `parser.seq`, `.captured` and `.encoded` (-1 from firmware without them).
+
+    parser = MultipartParser()
+    for chunk in chunks:
+        for jpeg in parser.feed(chunk):       # memoryview, valid until next feed()
+            out.write(jpeg)
+
+`readinto_view()` / `commit(n)` let a socket or asyncio.BufferedProtocol read
+straight into the buffer instead of going through `feed`.
+"""
+
+BOUNDARY = b"--openmv"
+DEFAULT_CAPACITY = 1 << 20             # 1 MiB: a QVGA JPEG is ~10-40 KB
+MAX_HEADER_BYTES = 1024                # a part header longer than this is garbage
+
+_CRLF2 = b"\r\n\r\n"
+_CONTENT_LENGTH = b"Content-Length:"
+_SEQ = b"X-Frame-Seq:"
+_CAPTURED = b"X-Capture-Ticks:"
+_ENCODED = b"X-Encoded-Ticks:"
+_SOI = b"\xff\xd8"
+_EOI = b"\xff\xd9"
+
+# parser states
+_SEEK, _HEADERS, _PAYLOAD, _SCAN = range(4)
+
+
+class MultipartParser:
+    """Pull JPEG frames out of an OpenMV multipart byte stream."""
+
+    def __init__(self, capacity: int = DEFAULT_CAPACITY, boundary: bytes = BOUNDARY):
+        self.buf = bytearray(capacity)
+        self.view = memoryview(self.buf)
+        self.capacity = capacity
+        self.boundary = boundary
+        self.delimiter = b"\r\n" + boundary
+        self.start = 0                 # first unconsumed byte
+        self.end = 0                   # one past the last valid byte
+        self.state = _SEEK
+        self.payload_start = 0
+        self.length = -1
+        self.seq = self.captured = self.encoded = -1   # stamps of the current part
+        # statistics
+        self.frames = 0
+        self.bytes = 0
+        self.resyncs = 0               # times the framing had to be recovered
+        self.dropped = 0               # parts skipped because they did not fit
+        self.overflows = 0             # … of those, because of the buffer size
+
+    def reset(self) -> None:
+        """Forget any partial part, e.g. when the connection is re-opened."""
+        self.start = self.end = 0
+        self.state = _SEEK
+
+    # ── input ──────────────────────────────────────────────────────────────
+    def readinto_view(self) -> memoryview:
+        """Writable tail of the buffer; fill it, then call `commit(n)`."""
+        if self.end == self.capacity:
+            self._compact()
+        return self.view[self.end:]
+
+    def commit(self, n: int) -> None:
+        self.end += n
+
+    def feed(self, data):
+        """Copy `data` into the buffer and yield every complete frame."""
+        data = memoryview(data)
+        while data:
+            room = self.readinto_view()
+            n = min(len(room), len(data))
+            room[:n] = data[:n]
+            self.commit(n)
+            data = data[n:]
+            yield from self.parse()
+
+    # ── parsing ────────────────────────────────────────────────────────────
+    def parse(self):
+        """Yield frames completed by the bytes committed so far."""
+        buf = self.buf
+        while True:
+            state = self.state
+            if state == _SEEK:
+                i = buf.find(self.boundary, self.start, self.end)
+                if i < 0:
+                    # keep a possible boundary prefix at the tail
+                    keep = max(self.start, self.end - len(self.boundary) + 1)
+                    if keep > self.start + 2:          # more than the leading CRLF
+                        self.resyncs += 1
+                    self.start = keep
+                    return
+                if i > self.start + 2:
+                    self.resyncs += 1
+                self.start = i + len(self.boundary)
+                self.state = _HEADERS
+
+            elif state == _HEADERS:
+                h = buf.find(_CRLF2, self.start, self.end)
+                if h < 0:
+                    if self.end - self.start > MAX_HEADER_BYTES:
+                        self.resyncs += 1
+                        self.state = _SEEK
+                        continue
+                    return
+                self.length = self._content_length(self.start, h)
+                self.seq = self._number(_SEQ, self.start, h)
+                if self.seq >= 0:
+                    self.captured = self._number(_CAPTURED, self.start, h)
+                    self.encoded = self._number(_ENCODED, self.start, h)
+                self.start = self.payload_start = h + 4
+                # no (or an implausible) length: find the end by the boundary
+                if 0 <= self.length <= self.capacity // 2:
+                    self.state = _PAYLOAD
+                else:
+                    self.state = _SCAN
+
+            elif state == _PAYLOAD:
+                p, n = self.payload_start, self.length
+                if self.end - p < n:
+                    return
+                if (buf.startswith(_SOI, p, p + n) and buf.endswith(_EOI, p, p + n)):
+                    self.start = p + n
+                    self.state = _SEEK
+                    yield self._emit(p, p + n)
+                else:                                  # Content-Length lied
+                    self.resyncs += 1
+                    self.state = _SCAN
+
+            else:                                      # _SCAN
+                p = self.payload_start
+                i = buf.find(self.delimiter, p, self.end)
+                if i < 0:
+                    if self.end - p > self.capacity // 2:
+                        self.dropped += 1              # no boundary in sight
+                        self.overflows += 1
+                        self.start = self.end - len(self.delimiter) + 1
+                        self.state = _SEEK
+                    return
+                self.start = i
+                self.state = _SEEK
+                e = buf.rfind(_EOI, p, i)              # trim junk after the image
+                if e >= 0 and buf.startswith(_SOI, p, i):
+                    yield self._emit(p, e + 2)
+                else:                                  # truncated or not a JPEG
+                    self.dropped += 1
+
+    def _emit(self, a: int, b: int) -> memoryview:
+        self.frames += 1
+        self.bytes += b - a
+        return self.view[a:b]
+
+    def _content_length(self, a: int, b: int) -> int:
+        """Parse Content-Length from the header bytes buf[a:b]; -1 if absent."""
+        buf = self.buf
+        i = buf.find(_CONTENT_LENGTH, a, b)
+        if i < 0:
+            i = bytes(buf[a:b]).lower().find(_CONTENT_LENGTH.lower())
+            if i < 0:
+                return -1
+            i += a
+        i += len(_CONTENT_LENGTH)
+        while i < b and buf[i] == 0x20:                # optional space after ':'
+            i += 1
+        n, digits = 0, 0
+        while i < b and 0x30 <= buf[i] <= 0x39:
+            n = n * 10 + buf[i] - 0x30
+            i += 1
+            digits += 1
+        return n if digits else -1
+
+    def _number(self, name: bytes, a: int, b: int) -> int:
+        """Parse header `name` (exact case) from buf[a:b]; -1 if absent."""
+        buf = self.buf
+        i = buf.find(name, a, b)
+        if i < 0:
+            return -1
+        i += len(name)
+        e = buf.find(b"\r", i, b)
+        e = e if e >= 0 else b
+        while i < e and buf[i] == 0x20:                # padding, as the firmware writes it
+            i += 1
+        n, digits = 0, 0
+        while i < e and 0x30 <= buf[i] <= 0x39:        # in place: no slice per header
+            n = n * 10 + buf[i] - 0x30
+            i += 1
+            digits += 1
+        while i < e and buf[i] == 0x20:
+            i += 1
+        return n if digits and i == e else -1
+
+    def _compact(self) -> None:
+        """Move the unconsumed bytes to the front of the buffer."""
+        s, n = self.start, self.end - self.start
+        if s == 0:
+            # a single part fills the whole buffer: drop it and resync
+            self.dropped += 1
+            self.overflows += 1
+            self.start = self.end = 0
+            self.state = _SEEK
+            return
+        self.view[:n] = self.view[s:self.end]         # memoryview copy is a memmove
+        self.start, self.end = 0, n
+        self.payload_start -= s
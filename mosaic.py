@@ -0,0 +1,198 @@
+"""
+One MJPEG stream tiling the newest frame of every camera
+
+A browser tab per `http://{ip}:8080` costs each camera a client; a tab per
+/cam/<id>/stream costs the recorder nothing at the camera but still one
+stream per camera per viewer.  `--mosaic` adds one composite view:
+
+    GET /mosaic/stream          multipart/x-mixed-replace, --mosaic-fps frames/s
+    GET /mosaic/latest.jpg      the newest composite
+    GET /mosaic.json            layout and compositor counters
+
+ • A compositor thread ticks at --mosaic-fps and reads the latest frame of
+   every relay.FrameHub.  A camera's tile is decoded (DCT-scaled draft
+   decode) and downscaled to --mosaic-tile only when its hub has a frame the
+   tile has not seen; otherwise the cached tile is kept as is.
+ • Only the tiles that changed are pasted into a persistent canvas, which is
+   JPEG-encoded once per tick and published through a FrameHub: every
+   viewer shares the same bytes, so viewers cost a socket write each and no
+   CPU in the compositor.  With no viewer nothing is composed.
+ • The grid is ceil(√n) columns of the cameras ordered by id; a camera
+   without a frame for DROP_AFTER seconds leaves it, a new one joins at the
+   next tick.
+
+Native backend only (the relay is fed by the ingest loop); Pillow required.
+"""
+
+import io
+import json
+import math
+import threading
+import time
+
+from PIL import Image, ImageDraw
+
+from relay import FrameHub
+from telemetry import Ring, percentile
+
+MOSAIC_FPS = 2.0                       # composites per second
+TILE = (240, 180)                      # tile size in pixels
+QUALITY = 70                           # composite JPEG quality
+DROP_AFTER = 10.0                      # seconds without a frame before a camera leaves the grid
+WANTED_FOR = 10.0                      # seconds a /latest.jpg request keeps the compositor busy
+
+
+def parse_tile(spec: str) -> tuple:
+    """ "WxH" → (w, h); ValueError on anything else."""
+    w, sep, h = spec.lower().partition("x")
+    if not sep or int(w) < 16 or int(h) < 16:
+        raise ValueError(f"bad tile size {spec!r} (WxH, at least 16x16)")
+    return int(w), int(h)
+
+
+def make_tile(jpeg: bytes, label: str, size: tuple = TILE) -> Image.Image:
+    """`jpeg` decoded at the smallest DCT scale that covers `size`, fitted
+    into a black tile of `size` and labelled."""
+    im = Image.open(io.BytesIO(jpeg))
+    im.draft("RGB", size)
+    im = im.convert("RGB")
+    im.thumbnail(size, Image.BILINEAR)
+    tile = Image.new("RGB", size)
+    tile.paste(im, ((size[0] - im.width) // 2, (size[1] - im.height) // 2))
+    draw = ImageDraw.Draw(tile)
+    draw.text((5, 5), label, fill=(0, 0, 0))
+    draw.text((4, 4), label, fill=(255, 255, 255))
+    return tile
+
+
+class Mosaic(threading.Thread):
+    """Composite of a relay's cameras published through `self.hub`."""
+
+    def __init__(self, relay, loop, fps: float = MOSAIC_FPS, tile: tuple = TILE,
+                 quality: int = QUALITY):
+        super().__init__(daemon=True, name="mosaic")
+        self.relay = relay                             # relay.Relay fed by the ingest loop
+        self.loop = loop                               # that loop: FrameHubs are loop-only
+        self.period = 1.0 / fps
+        self.tile = tile
+        self.quality = quality
+        self.hub = FrameHub("mosaic")
+        self.tiles = {}                                # cam id -> (hub seq, tile image)
+        self.layout = None                             # cam ids of the current canvas
+        self.canvas = None
+        self.wanted = 0.0                              # monotonic time of the last /latest.jpg
+        self.lock = threading.Lock()
+        self.composed = self.decoded = self.failed = 0
+        self.compose_times = Ring(64)
+
+    def run(self) -> None:
+        due = time.monotonic()
+        while True:
+            due += self.period
+            time.sleep(max(0.0, due - time.monotonic()))
+            if self.hub.subscribers or time.monotonic() - self.wanted < WANTED_FOR:
+                self.compose()
+            if time.monotonic() - due > self.period:   # fell behind: skip, do not burst
+                due = time.monotonic()
+
+    def compose(self) -> bytes:
+        """Refresh the changed tiles, encode the canvas and publish it."""
+        with self.lock:
+            t = time.perf_counter()
+            now = time.time()
+            hubs = sorted((h for h in list(self.relay.hubs.values())
+                           if h.latest is not None and now - h.latest_ts < DROP_AFTER),
+                          key=lambda h: h.cam_id)
+            changed = []
+            for h in hubs:
+                seq, (_, jpeg) = h.seq, h.latest
+                cached = self.tiles.get(h.cam_id)
+                if cached is not None and cached[0] == seq:
+                    continue
+                try:
+                    self.tiles[h.cam_id] = (seq, make_tile(jpeg, h.cam_id, self.tile))
+                    self.decoded += 1
+                    changed.append(h.cam_id)
+                except (OSError, ValueError):          # truncated / corrupt JPEG: keep the old tile
+                    self.failed += 1
+            layout = [h.cam_id for h in hubs if h.cam_id in self.tiles]
+            for cam_id in set(self.tiles) - set(layout):
+                del self.tiles[cam_id]
+            if layout != self.layout:
+                self._relayout(layout)
+                changed = layout
+            cols = self._columns()
+            w, h = self.tile
+            for cam_id in changed:
+                i = self.layout.index(cam_id)
+                self.canvas.paste(self.tiles[cam_id][1], ((i % cols) * w, (i // cols) * h))
+            buf = io.BytesIO()
+            self.canvas.save(buf, "JPEG", quality=self.quality)
+            jpeg = buf.getvalue()
+            self.composed += 1
+            self.compose_times.push(time.perf_counter() - t)
+        self.loop.call_soon_threadsafe(self.hub.publish, jpeg, now)
+        return jpeg
+
+    def _columns(self) -> int:
+        return max(1, math.ceil(math.sqrt(len(self.layout))))
+
+    def _relayout(self, layout: list) -> None:
+        self.layout = layout
+        cols = self._columns()
+        rows = max(1, math.ceil(len(layout) / cols))
+        self.canvas = Image.new("RGB", (cols * self.tile[0], rows * self.tile[1]))
+        if not layout:
+            ImageDraw.Draw(self.canvas).text((4, 4), "no cameras", fill=(255, 255, 255))
+
+    def snapshot(self) -> dict:
+        times = sorted(self.compose_times.values())
+        layout = list(self.layout or [])
+        cols = max(1, math.ceil(math.sqrt(len(layout))))
+        return {"cameras": layout, "columns": cols, "rows": math.ceil(len(layout) / cols),
+                "viewers": len(self.hub.subscribers), "composed": self.composed,
+                "tiles_decoded": self.decoded, "tiles_failed": self.failed,
+                "compose_seconds": {"0.5": percentile(times, 0.5), "0.99": percentile(times, 0.99)}}
+
+
+def add_routes(app, mosaic: Mosaic) -> None:
+    """Register /mosaic/stream, /mosaic/latest.jpg and /mosaic.json on an aiohttp application."""
+    import asyncio
+    from aiohttp import web
+
+    from relay import BOUNDARY
+
+    async def status(request):
+        return web.Response(text=json.dumps(mosaic.snapshot(), indent=1),
+                            content_type="application/json")
+
+    async def latest(request):
+        mosaic.wanted = time.monotonic()
+        h = mosaic.hub
+        if h.latest is None or time.time() - h.latest_ts > 2 * mosaic.period:
+            jpeg = await asyncio.get_running_loop().run_in_executor(None, mosaic.compose)
+        else:
+            jpeg = h.latest[1]
+        return web.Response(body=jpeg, content_type="image/jpeg",
+                            headers={"Cache-Control": "no-cache"})
+
+    async def stream(request):
+        resp = web.StreamResponse(headers={
+            "Content-Type": "multipart/x-mixed-replace;boundary=" + BOUNDARY.decode(),
+            "Cache-Control": "no-cache", "Pragma": "no-cache"})
+        await resp.prepare(request)
+        q = mosaic.hub.subscribe()
+        try:
+            while True:
+                header, frame = await q.get()
+                await resp.write(header)
+                await resp.write(frame)
+        except ConnectionError:
+            pass
+        finally:
+            mosaic.hub.unsubscribe(q)
+        return resp
+
+    app.router.add_get("/mosaic.json", status)
+    app.router.add_get("/mosaic/stream", stream)
+    app.router.add_get("/mosaic/latest.jpg", latest)
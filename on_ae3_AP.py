@@ -17,6 +17,8 @@ import sensor
 import time
 import network
 import socket
+import select
+import errno
 
 SSID = "sipbuddy"  # Network SSID
 KEY = "sipbuddy"  # Network key (must be 10 chars)
@@ -29,11 +31,47 @@ UDP_REGISTRATION_PORT = 8000  # UDP port for device registration
 BROADCAST_IP = "255.255.255.255"  # Universal broadcast to all networks
 # Alternative broadcast addresses to try if main one fails
 BROADCAST_ALTERNATIVES = ["192.168.4.255", "192.168.1.255"]
+# Announced from the streaming loop, never blocking it: at once, then with
+# the interval doubling up to ANNOUNCE_MAX_MS until SIPBUDDY_ACK arrives;
+# the last client leaving or SIPBUDDY_DISCOVER on the control port starts it over
+ANNOUNCE_MS = 1000  # first re-announcement interval
+ANNOUNCE_MAX_MS = 30000  # longest re-announcement interval
+
+# Streaming settings
+PIPELINED = True  # preallocated single-send loop; False = original loop
+JPEG_QUALITY = 35  # changed at run time through the control channel
+FRAME_SIZE = "QVGA"  # key of FRAME_SIZES, likewise
+TARGET_FPS = 0  # frame-rate cap, 0 = as fast as the sensor delivers
+MAX_JPEG = 64 * 1024  # largest JPEG that fits the packet buffer (bigger ones take 2 sends)
+FPS_PRINT_MS = 2000  # print fps at most this often (printing every frame costs fps)
+MAX_CLIENTS = 3  # MJPEG clients served from one encode (1 = one client at a time)
+CLIENT_STALL_MS = 5000  # drop a client that accepts no bytes for this long
+
+# Control channel: the recorder adjusts quality / frame size / fps per camera
+# (rate_control.py on the recorder side)
+CONTROL_PORT = 8001  # UDP, advertised in the registration
+CONTROL_POLL_MS = 200  # PIPELINED loop: look for commands this often
+FRAME_SIZES = {"QQVGA": sensor.QQVGA, "QVGA": sensor.QVGA, "HVGA": sensor.HVGA, "VGA": sensor.VGA}
+MIN_QUALITY = 10
+MAX_QUALITY = 90
+MAX_FPS = 60
+
+# Replay ring: the last REPLAY_SECONDS of parts (header + JPEG, exactly as
+# sent) kept in one buffer allocated at boot, so a recorder that lost its
+# connection can ask for what it missed (GET /?since=<last seq it received>)
+REPLAY_BYTES = 2 * 1024 * 1024  # memory budget of the ring, 0 = no replay
+REPLAY_SECONDS = 10  # older frames are evicted, and the server keeps capturing this long after the last client left
+REPLAY_SLOTS = 512  # max frames in the ring
+REPLAY_FPS = 15  # frames kept per second while no client takes them
 
 # Reset sensor
 sensor.reset()
-sensor.set_framesize(sensor.QVGA)
+sensor.set_framesize(FRAME_SIZES[FRAME_SIZE])
 sensor.set_pixformat(sensor.RGB565)
+if PIPELINED:
+    # Triple buffering: the sensor captures frame N+1 while frame N is
+    # compressed and sent, snapshot() just hands over the newest buffer
+    sensor.set_framebuffers(3)
 
 # Init wlan module in AP mode.
 wlan = network.WLAN(network.AP_IF)
@@ -41,6 +79,7 @@ wlan.config(ssid=SSID, key=KEY, channel=2)
 wlan.active(True)
 
 print("AP mode started. SSID: {} IP: {}".format(SSID, wlan.ifconfig()[0]))
+DEVICE_MAC = wlan.config('mac').hex()
 
 
 
@@ -60,82 +99,621 @@ def print_network_info() -> str:
     print("=============================\n")
     return ip
 
-def register_device() -> None|bool:
+announce = None  # UDP registration socket, None when not announcing
+announce_due = 0  # ticks_ms of the next announcement
+announce_every = ANNOUNCE_MS
+registration_data = None
+
+
+def register_device() -> None:
     """
-    Send device information to computer in the following format:
-    `SIPBUDDY_REGISTER|IP:{}|MAC:{}|PORT:{}`
+    Start (or start over) announcing the device to the computer in the
+    following format: `SIPBUDDY_REGISTER|IP:{}|MAC:{}|PORT:{}|CTRL:{}`.
+    Returns at once; poll_announce() does the sending.
     """
+    global announce, announce_due, announce_every, registration_data
+
+    if registration_data is None:
+        # Get SipBuddy IP address and MAC address
+        device_ip = print_network_info()
+        registration_data = "SIPBUDDY_REGISTER|IP:{}|MAC:{}|PORT:{}|CTRL:{}".format(
+            device_ip, DEVICE_MAC, PORT, CONTROL_PORT
+        ).encode()
 
-    # Get SipBuddy IP address and MAC address
-    device_ip = print_network_info()
-    mac_address = wlan.config('mac').hex()
-    
-    # Create registration message
-    registration_data = "SIPBUDDY_REGISTER|IP:{}|MAC:{}|PORT:{}".format(
-        device_ip, mac_address, PORT
-    )
-    
     print("\n==== DEVICE REGISTRATION ====")
-    print("Attempting to register device...")
-    print(f"MAC: {mac_address}, PORT: {PORT}")
-    
-    
-    # Try main broadcast address first
+    print(f"Announcing to {BROADCAST_IP}:{UDP_REGISTRATION_PORT}: {registration_data.decode()}")
+
+    if announce is None:
+        try:
+            # Create UDP socket for registration, enable broadcasting
+            announce = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            announce.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+            announce.setblocking(False)
+        except OSError as e:
+            print(f"Registration socket failed: {e}")
+            announce = None
+            return
+    announce_due, announce_every = time.ticks_ms(), ANNOUNCE_MS
+
+
+def announce_wait():
+    """Milliseconds until poll_announce() has something to do (ANNOUNCE_MAX_MS if never)."""
+    if announce is None:
+        return ANNOUNCE_MAX_MS
+    return max(0, time.ticks_diff(announce_due, time.ticks_ms()))
+
+
+def poll_announce():
+    """
+    When an announcement is due: stop if an ACK has come in since the last
+    one, otherwise broadcast it again and back off. Never blocks.
+    """
+    global announce, announce_due, announce_every
+    if announce is None or time.ticks_diff(time.ticks_ms(), announce_due) < 0:
+        return
+    while True:
+        try:
+            response, addr = announce.recvfrom(64)
+        except OSError:  # EAGAIN: no (more) replies
+            break
+        if response == b"SIPBUDDY_ACK":
+            print(f"Registration acknowledged by {addr[0]}!")
+            announce.close()
+            announce = None
+            return
     try:
-        # Create UDP socket for registration
-        print("Creating UDP socket for broadcasting...")
-        udp_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        announce.sendto(registration_data, (BROADCAST_IP, UDP_REGISTRATION_PORT))
+    except OSError as e:
+        print(f"Registration broadcast failed: {e}")
+    announce_due = time.ticks_add(time.ticks_ms(), announce_every)
+    announce_every = min(ANNOUNCE_MAX_MS, announce_every * 2)
 
-        # Enable broadcasting
-        udp_sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
-        udp_sock.settimeout(3) # set timeout for recieving
-        
-        # Send registration data via broadcast - SEND MULTIPLE TIMES
-        print(f"Sending to {BROADCAST_IP}:{UDP_REGISTRATION_PORT}")
-        print(f"Data: {registration_data}")
-        
-        # Send multiple times to increase chances of reception
-        for _ in range(50):  # Send 50 times
-            udp_sock.sendto(registration_data.encode(), (BROADCAST_IP, UDP_REGISTRATION_PORT))
-            time.sleep(1)  # Small delay between sends            
 
-            # Check if we received an acknowledgment
+# Part header with fixed-width fields (right-aligned digits, spaces in front
+# are allowed after the colon), so it is written once per connection and only
+# the digit bytes change per frame. Besides Content-Length every part carries
+# the frame's sequence number (counts every encoded frame since boot, so a gap
+# means frames this client never got) and the time.ticks_ms() at capture and
+# after compression, for the recorder's latency / loss accounting.
+PART_HEADER = (
+    b"\r\n--openmv\r\nContent-Type: image/jpeg\r\n"
+    b"Content-Length:          \r\n"
+    b"X-Frame-Seq:          \r\n"
+    b"X-Capture-Ticks:          \r\n"
+    b"X-Encoded-Ticks:          \r\n\r\n"
+)
+LENGTH_END = PART_HEADER.index(b"\r\n", PART_HEADER.index(b"Content-Length:"))  # past the last digit
+SEQ_END = PART_HEADER.index(b"\r\n", PART_HEADER.index(b"X-Frame-Seq:"))
+CAPTURE_END = PART_HEADER.index(b"\r\n", PART_HEADER.index(b"X-Capture-Ticks:"))
+ENCODED_END = PART_HEADER.index(b"\r\n", PART_HEADER.index(b"X-Encoded-Ticks:"))
+
+frame_seq = 0  # frames encoded since boot
+next_due = 0  # ticks_ms before which TARGET_FPS allows no new frame
+control = None  # UDP control socket
+
+# the ring: frame k lives at replay[r_off[k]:r_off[k] + r_len[k]]; slots
+# r_first .. r_first + r_count - 1 (mod REPLAY_SLOTS) oldest to newest, laid
+# out in the buffer in the same circular order, the newest ending at r_end
+replay = bytearray(REPLAY_BYTES) if REPLAY_BYTES else None
+replay_view = memoryview(replay) if REPLAY_BYTES else None
+r_seq = [0] * REPLAY_SLOTS
+r_off = [0] * REPLAY_SLOTS
+r_len = [0] * REPLAY_SLOTS
+r_ticks = [0] * REPLAY_SLOTS  # capture ticks
+r_pins = [0] * REPLAY_SLOTS  # clients sending the frame right now
+r_first = r_count = r_end = 0
+last_encode = 0  # ticks_ms of the last next_frame()
+
+
+def open_control():
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, True)
+    sock.bind([HOST, CONTROL_PORT])
+    sock.setblocking(False)
+    return sock
+
+
+def apply_command(data):
+    """
+    Apply `SIPBUDDY_SET|MAC:..|SEQ:..|Q:..|SIZE:..|FPS:..` (fields after MAC
+    optional) or answer `SIPBUDDY_GET|MAC:..|SEQ:..`. Returns the reply
+    `SIPBUDDY_SETTINGS|MAC:..|SEQ:..|Q:..|SIZE:..|FPS:..`, or None for anything
+    else (including commands for another MAC).
+    """
+    global JPEG_QUALITY, FRAME_SIZE, TARGET_FPS
+    try:
+        parts = data.decode().split("|")
+    except UnicodeError:
+        return None
+    if parts[0] != "SIPBUDDY_SET" and parts[0] != "SIPBUDDY_GET":
+        return None
+    fields = {}
+    for part in parts[1:]:
+        i = part.find(":")
+        if i > 0:
+            fields[part[:i]] = part[i + 1:]
+    if fields.get("MAC") != DEVICE_MAC:
+        return None
+    if parts[0] == "SIPBUDDY_SET":
+        try:
+            if "Q" in fields:
+                JPEG_QUALITY = min(MAX_QUALITY, max(MIN_QUALITY, int(fields["Q"])))
+            if "FPS" in fields:
+                TARGET_FPS = min(MAX_FPS, max(0, float(fields["FPS"])))
+        except ValueError:
+            pass
+        size = fields.get("SIZE")
+        if size in FRAME_SIZES and size != FRAME_SIZE:
+            sensor.set_framesize(FRAME_SIZES[size])  # between two frames: nothing in flight
+            FRAME_SIZE = size
+    return "SIPBUDDY_SETTINGS|MAC:{}|SEQ:{}|Q:{}|SIZE:{}|FPS:{}".format(
+        DEVICE_MAC, fields.get("SEQ", "0"), JPEG_QUALITY, FRAME_SIZE, TARGET_FPS)
+
+
+def poll_control():
+    """Handle every command waiting on the control socket (never blocks)."""
+    while True:
+        try:
+            data, addr = control.recvfrom(256)
+        except OSError:  # EAGAIN: nothing (more) to read
+            return
+        if data.startswith(b"SIPBUDDY_DISCOVER"):  # optionally |MAC:.. for one device
+            if b"|MAC:" not in data or DEVICE_MAC.encode() in data:
+                register_device()
+            continue
+        reply = apply_command(data)
+        if reply is not None:
             try:
-                response, addr = udp_sock.recvfrom(1024) # will timeout in 3 seconds based off udp_sock.settimeout
-                if response.decode() == "SIPBUDDY_ACK":
-                    print(f"Registration acknowledged by {addr[0]}!")
-                    break
-            
+                control.sendto(reply, addr)
             except OSError:
                 pass
-    
-            print("Registration packets sent, waiting for acknowledgment...")
-        
-        
-        udp_sock.close()
-        
-    except Exception as e:
-        print(f"Primary broadcast failed: {e}")
-    
-    return False
+
+
+def frame_wait():
+    """Milliseconds until TARGET_FPS allows the next frame (0: now)."""
+    if not TARGET_FPS:
+        return 0
+    return max(0, time.ticks_diff(next_due, time.ticks_ms()))
+
+
+def replay_store(packet, n, seq, captured):
+    """
+    Copy the filled `packet` (n bytes) into the ring behind the newest frame,
+    wrapping to the start when it does not fit before the end. Evicts the
+    oldest frames in its way and those older than REPLAY_SECONDS. Returns
+    False if the frame is not kept (ring off, frame larger than the ring, or
+    an old frame in the way is being replayed to a client).
+    """
+    global r_first, r_count, r_end
+    if replay is None or n > REPLAY_BYTES:
+        return False
+    pos = r_end
+    wrapped = pos + n > REPLAY_BYTES
+    if wrapped:
+        pos = 0
+    while r_count:
+        o = r_off[r_first]
+        if (r_count == REPLAY_SLOTS
+                or (wrapped and o >= r_end)  # the tail past the newest frame: oldest of all
+                or (o < pos + n and o + r_len[r_first] > pos)
+                or time.ticks_diff(captured, r_ticks[r_first]) > REPLAY_SECONDS * 1000):
+            if r_pins[r_first]:
+                return False
+            r_first = (r_first + 1) % REPLAY_SLOTS
+            r_count -= 1
+        else:
+            break
+    if not r_count:
+        r_first = 0
+    slot = (r_first + r_count) % REPLAY_SLOTS
+    replay_view[pos:pos + n] = memoryview(packet)[0:n]
+    r_seq[slot], r_off[slot], r_len[slot], r_ticks[slot] = seq, pos, n, captured
+    r_count += 1
+    r_end = pos + n
+    return True
+
+
+def replay_next(after, upto):
+    """Slot of the oldest ring frame with after < seq <= upto, or -1."""
+    for k in range(r_count):
+        slot = (r_first + k) % REPLAY_SLOTS
+        if r_seq[slot] > upto:
+            break
+        if r_seq[slot] > after:
+            return slot
+    return -1
+
+
+def replay_range(since):
+    """
+    The newest sequence number to replay to a client that asked for frames
+    after `since` (-1: nothing to replay, `since` is -1 or not older than
+    the ring's newest frame, e.g. after a reboot).
+    """
+    if since < 0 or not r_count:
+        return -1
+    newest = r_seq[(r_first + r_count - 1) % REPLAY_SLOTS]
+    return newest if since < newest else -1
+
+
+def requested_since(request):
+    """The N of a `GET /?since=N ...` request line, -1 if there is none."""
+    i = request.find(b"since=")
+    if i < 0:
+        return -1
+    j = i + 6
+    while j < len(request) and 48 <= request[j] <= 57:
+        j += 1
+    try:
+        return int(request[i + 6:j])
+    except ValueError:
+        return -1
+
+
+def http_response(upto):
+    """The response head; a replay announces the last sequence it covers."""
+    if upto < 0:
+        return HTTP_RESPONSE
+    return HTTP_RESPONSE[:-2] + "X-Replay-To: {}\r\n\r\n".format(upto).encode()
+
+
+def put_number(packet, end, n):
+    """Write `n` right-aligned into the 10-byte field of `packet` ending at `end`."""
+    i = end
+    while True:
+        i -= 1
+        packet[i] = 48 + n % 10
+        n //= 10
+        if not n:
+            break
+    while i > end - 10 and packet[i - 1] != 32:
+        i -= 1
+        packet[i] = 32  # clear digits left over from a longer number
+
+
+def next_frame():
+    """Snapshot and compress in place. Returns (frame, seq, capture ticks, encoded ticks)."""
+    global frame_seq, next_due, last_encode
+    frame = sensor.snapshot()
+    captured = last_encode = time.ticks_ms()
+    if TARGET_FPS:
+        next_due = time.ticks_add(captured, int(1000 / TARGET_FPS))
+    frame.to_jpeg(quality=JPEG_QUALITY)  # in place (copy=False): no new image
+    frame_seq += 1
+    return frame, frame_seq, captured, time.ticks_ms()
+
+
+def fill_packet(packet, frame, seq, captured, encoded):
+    """
+    Fill in the header fields of `packet` and copy the compressed `frame`
+    behind them. Returns the part length, or -1 if the JPEG does not fit (the
+    header is filled in anyway, the caller can send it and the frame apart).
+    """
+    size = frame.size()
+    put_number(packet, LENGTH_END, size)
+    put_number(packet, SEQ_END, seq)
+    put_number(packet, CAPTURE_END, captured)
+    put_number(packet, ENCODED_END, encoded)
+    hdr = len(PART_HEADER)
+    if size > len(packet) - hdr:
+        return -1
+    memoryview(packet)[hdr:hdr + size] = frame.bytearray()
+    return hdr + size
+
+
+def new_packet():
+    packet = bytearray(len(PART_HEADER) + MAX_JPEG)
+    packet[0:len(PART_HEADER)] = PART_HEADER
+    return packet
+
+
+def stream_pipelined(client, since=-1, upto=-1):
+    """
+    Streaming loop without per-frame buffers: the JPEG is compressed in place
+    in the frame buffer, copied behind the header in one preallocated packet
+    and sent with a single sendall (and kept in the replay ring). Ring frames
+    after `since` up to `upto` are sent first.
+    """
+    packet = new_packet()
+    view = memoryview(packet)
+
+    while upto >= 0:
+        slot = replay_next(since, upto)
+        if slot < 0:
+            break
+        since = r_seq[slot]
+        client.sendall(replay_view[r_off[slot]:r_off[slot] + r_len[slot]])
+
+    clock = time.clock()
+    last_print = last_poll = time.ticks_ms()
+    while True:
+        wait = frame_wait()
+        if wait:
+            time.sleep_ms(wait)
+        clock.tick()
+        frame, seq, captured, encoded = next_frame()
+        n = fill_packet(packet, frame, seq, captured, encoded)
+        if n >= 0:
+            replay_store(packet, n, seq, captured)
+            client.sendall(view[0:n])
+        else:
+            client.sendall(view[0:len(PART_HEADER)])
+            client.sendall(frame)
+
+        if time.ticks_diff(time.ticks_ms(), last_poll) >= CONTROL_POLL_MS:
+            poll_control()
+            poll_announce()
+            last_poll = time.ticks_ms()
+        if time.ticks_diff(time.ticks_ms(), last_print) >= FPS_PRINT_MS:
+            print(clock.fps())
+            last_print = time.ticks_ms()
+
+
+HTTP_RESPONSE = (
+    b"HTTP/1.1 200 OK\r\n"
+    b"Server: OpenMV\r\n"
+    b"Content-Type: multipart/x-mixed-replace;boundary=openmv\r\n"
+    b"Cache-Control: no-cache\r\n"
+    b"Pragma: no-cache\r\n\r\n"
+)
+
+
+class Client:
+    """
+    One MJPEG client of the fan-out server. It holds at most one frame in
+    flight; frames encoded meanwhile are skipped for this client and it picks
+    up the newest one when done (drop-oldest, so a slow viewer only sees
+    fewer frames and never holds back the others).
+    """
+
+    def __init__(self, sock, addr):
+        self.sock = sock
+        self.addr = addr
+        self.data = memoryview(HTTP_RESPONSE)  # what is being sent
+        self.off = len(self.data)  # nothing until the request is read
+        self.rest = None  # sent after data: the JPEG of an oversized frame
+        self.ready = False  # request read and response queued
+        self.slot = -1  # packet pool slot pinned by the frame in flight
+        self.seq = 0  # last pool frame number handed to this client
+        self.rslot = -1  # replay ring slot pinned by the frame in flight
+        self.replayed = -1  # frame sequence number of the last replayed frame
+        self.upto = -1  # replay until this frame sequence number, -1 = live
+        self.progress = time.ticks_ms()
+
+    def start(self, since):
+        """Queue the response once the request is read (since: -1 = live only)."""
+        self.upto = replay_range(since)
+        self.replayed = since
+        self.data, self.off = memoryview(http_response(self.upto)), 0
+        self.ready = True
+        self.progress = time.ticks_ms()
+
+    def busy(self):
+        return self.off < len(self.data) or self.rest is not None
+
+    def pump(self):
+        """Non-blocking send of what is pending. False if the client is gone."""
+        try:
+            n = self.sock.send(self.data[self.off:])
+        except OSError as e:
+            return e.args[0] == errno.EAGAIN
+        if n:
+            self.off += n
+            self.progress = time.ticks_ms()
+        if self.off == len(self.data) and self.rest is not None:
+            self.data, self.off, self.rest = self.rest, 0, None
+        return True
+
+
+def serve_clients(server):
+    """
+    Serve up to MAX_CLIENTS MJPEG clients with one snapshot and one JPEG
+    encode per frame (at most TARGET_FPS of them). Each encoded part lives in
+    a pool slot until the last client sending it is done, and in the replay
+    ring; a client asking for `?since=N` gets the ring's frames after N
+    first. New clients are accepted, control commands handled and the
+    registration announced while streaming. Without clients frames keep going
+    into the ring at REPLAY_FPS for REPLAY_SECONDS, then the loop just
+    listens. Never returns (but for socket errors).
+    """
+    # every client can pin one slot, plus the newest frame and the one being filled
+    pool = [new_packet() for _ in range(MAX_CLIENTS + 2)]
+    lengths = [0] * len(pool)
+    pins = [0] * len(pool)
+    seqs = [0] * len(pool)  # frame sequence number in each slot
+    newest, seq = -1, 0
+    big = None  # JPEG of the newest frame if it did not fit its slot (still in the frame buffer)
+    linger = REPLAY_SECONDS * 1000 if replay is not None else 0
+    ring_period = 1000 // REPLAY_FPS
+    left = time.ticks_ms()  # when the last client left (or the server started)
+
+    server.setblocking(False)
+    poller = select.poll()
+    poller.register(server, select.POLLIN)
+    poller.register(control, select.POLLIN)
+    clients = []
+
+    clock = time.clock()
+    last_print = time.ticks_ms()
+    while True:
+        # 1. encode a frame into a free slot if anyone is waiting for one
+        encoded = False
+        waiting = False
+        for c in clients:
+            if c.ready and c.upto < 0 and c.seq == seq and not c.busy():
+                waiting = True
+        ringing = replay is not None and (left is None or time.ticks_diff(time.ticks_ms(), left) < linger)
+        wait = frame_wait() if waiting or ringing else 0
+        ring_due = ringing and not wait and \
+            time.ticks_diff(time.ticks_ms(), last_encode) >= ring_period
+        # an oversized JPEG is sent straight from the frame buffer: no new
+        # snapshot until every client sending it is done
+        for c in clients:
+            if big is not None and (c.rest is not None or c.data is big):
+                waiting = ring_due = False
+        if (waiting or ring_due) and not wait:
+            free = -1
+            for i in range(len(pool)):
+                if pins[i] == 0 and i != newest:
+                    free = i
+                    break
+            if free >= 0:
+                clock.tick()
+                frame, fseq, captured, encoded_at = next_frame()
+                n = fill_packet(pool[free], frame, fseq, captured, encoded_at)
+                if n >= 0:
+                    big = None
+                    replay_store(pool[free], n, fseq, captured)
+                else:  # header in the slot, the JPEG sent apart (and not replayed)
+                    n, big = len(PART_HEADER), memoryview(frame.bytearray())[0:frame.size()]
+                lengths[free], seqs[free], newest, seq = n, fseq, free, seq + 1
+                encoded = True
+
+        # 2. hand every idle client its next replayed frame, or else the
+        #    newest frame if it has not had it
+        for c in clients:
+            if not c.ready or c.busy():
+                continue
+            if c.rslot >= 0:
+                r_pins[c.rslot] -= 1
+                c.rslot = -1
+            if c.upto >= 0:
+                slot = replay_next(c.replayed, c.upto)
+                if slot < 0:  # caught up: replay what was encoded meanwhile too
+                    c.upto = replay_range(c.replayed)
+                    slot = replay_next(c.replayed, c.upto)
+                if slot >= 0:
+                    r_pins[slot] += 1
+                    c.rslot, c.replayed = slot, r_seq[slot]
+                    c.data, c.off = replay_view[r_off[slot]:r_off[slot] + r_len[slot]], 0
+                    poller.modify(c.sock, select.POLLIN | select.POLLOUT)
+                    continue
+                c.upto = -1  # replay done
+                if newest >= 0 and seqs[newest] <= c.replayed:
+                    c.seq = seq  # the newest frame was replayed already
+            if c.seq != seq and newest >= 0:
+                if c.slot >= 0:
+                    pins[c.slot] -= 1
+                c.slot, c.seq = newest, seq
+                pins[newest] += 1
+                c.data, c.off = memoryview(pool[newest])[0:lengths[newest]], 0
+                c.rest = big
+                poller.modify(c.sock, select.POLLIN | select.POLLOUT)
+
+        # 3. sockets: accept, write, notice hang-ups. Block only when there
+        #    is nothing to encode (no clients, or all of them busy sending)
+        if encoded:
+            timeout = 0
+        elif not clients:
+            timeout = 1000
+        else:
+            timeout = min(20, wait) if wait else 20
+        if ringing and not encoded:  # wake up for the next ring frame
+            due = ring_period - time.ticks_diff(time.ticks_ms(), last_encode)
+            timeout = min(timeout, max(1, wait, due))
+        timeout = min(timeout, announce_wait())
+        gone = []
+        for ev in poller.poll(timeout):
+            obj, event = ev[0], ev[1]
+            if obj is control:
+                poll_control()
+                continue
+            if obj is server:
+                sock, addr = server.accept()
+                if len(clients) >= MAX_CLIENTS:
+                    sock.close()
+                    continue
+                sock.setblocking(False)
+                clients.append(Client(sock, addr))
+                left = None
+                poller.register(sock, select.POLLIN)
+                print("Connected to " + addr[0] + ":" + str(addr[1]))
+                continue
+            for c in clients:
+                if c.sock is obj:
+                    break
+            else:
+                continue
+            ok = not event & (select.POLLHUP | select.POLLERR)
+            if ok and event & select.POLLIN:
+                try:
+                    request = c.sock.recv(256)  # b"" = closed
+                    ok = bool(request)
+                except OSError as e:
+                    request = None
+                    ok = e.args[0] == errno.EAGAIN
+                if ok and request and not c.ready:
+                    c.start(requested_since(request))
+                    poller.modify(c.sock, select.POLLIN | select.POLLOUT)
+            if ok and event & select.POLLOUT:
+                ok = c.pump()
+                if ok and not c.busy():
+                    poller.modify(c.sock, select.POLLIN)
+            if not ok:
+                gone.append(c)
+
+        now = time.ticks_ms()
+        for c in clients:
+            if not c.ready and time.ticks_diff(now, c.progress) > CLIENT_STALL_MS:
+                c.start(-1)  # no request line: just stream
+                poller.modify(c.sock, select.POLLIN | select.POLLOUT)
+            elif c.busy() and time.ticks_diff(now, c.progress) > CLIENT_STALL_MS and c not in gone:
+                gone.append(c)
+        for c in gone:
+            poller.unregister(c.sock)
+            c.sock.close()
+            if c.slot >= 0:
+                pins[c.slot] -= 1
+            if c.rslot >= 0:
+                r_pins[c.rslot] -= 1
+            clients.remove(c)
+            print("client left:", c.addr[0])
+        if gone and not clients:
+            left = now
+            register_device()  # the recorder may be gone: tell it again when it is back
+        poll_announce()
+
+        if time.ticks_diff(time.ticks_ms(), last_print) >= FPS_PRINT_MS:
+            print(clock.fps(), "fps,", len(clients), "clients")
+            last_print = time.ticks_ms()
+
+
+def accept_client(server):
+    """
+    Wait for the next connection (one client at a time), announcing the
+    registration and handling control commands meanwhile.
+    """
+    poller = select.poll()
+    poller.register(server, select.POLLIN)
+    poller.register(control, select.POLLIN)
+    while True:
+        poll_announce()
+        for ev in poller.poll(announce_wait()):
+            if ev[0] is control:
+                poll_control()
+            elif ev[0] is server:
+                poller.unregister(server)
+                poller.unregister(control)
+                return server.accept()
 
 
 def start_streaming(client):
     """
     Start MJPEG stream
     """
-    # Read request from client
+    global frame_seq
+
+    # Read request from client: `GET /?since=N` asks for a replay
     data = client.recv(1024)
-    # Should parse client request here
+    since = requested_since(data) if PIPELINED else -1
+    upto = replay_range(since)
 
     # Send multipart header
-    client.send(
-        "HTTP/1.1 200 OK\r\n"
-        "Server: OpenMV\r\n"
-        "Content-Type: multipart/x-mixed-replace;boundary=openmv\r\n"
-        "Cache-Control: no-cache\r\n"
-        "Pragma: no-cache\r\n\r\n"
-    )
+    client.sendall(http_response(upto))
+
+    if PIPELINED:
+        stream_pipelined(client, since, upto)
+        return
 
     # FPS clock
     clock = time.clock()
@@ -145,11 +723,16 @@ def start_streaming(client):
     while True:
         clock.tick()  # Track elapsed milliseconds between snapshots().
         frame = sensor.snapshot()
-        cframe = frame.to_jpeg(quality=35, copy=True)
+        captured = time.ticks_ms()
+        cframe = frame.to_jpeg(quality=JPEG_QUALITY, copy=True)
+        frame_seq += 1
         header = (
             "\r\n--openmv\r\n"
             "Content-Type: image/jpeg\r\n"
-            "Content-Length:" + str(cframe.size()) + "\r\n\r\n"
+            "Content-Length:" + str(cframe.size()) + "\r\n"
+            "X-Frame-Seq:" + str(frame_seq) + "\r\n"
+            "X-Capture-Ticks:" + str(captured) + "\r\n"
+            "X-Encoded-Ticks:" + str(time.ticks_ms()) + "\r\n\r\n"
         )
         client.sendall(header)
         client.sendall(cframe)
@@ -158,13 +741,11 @@ def start_streaming(client):
 
 server = None
 
-while True:
+# Register device with computer; announced from the serving loops from here on
+register_device()
 
+while True:
 
-    # Register device with computer before streaming
-    register_device()
-    
-    
     if server is None:
         # Create server socket for MJPEG stream
         server = socket.socket(socket.AF_INET, socket.SOCK_STREAM) # Create a TCP socket	• AF_INET → IPv4.
@@ -188,10 +769,23 @@ while True:
         # Set server socket to blocking
         server.setblocking(True)
 
+    if control is None:
+        control = open_control()
+
+
+    if MAX_CLIENTS > 1:
+        print("Waiting for connections..")
+        try:
+            serve_clients(server)  # serves until the server socket fails
+        except OSError as e:
+            server.close()
+            server = None
+            print("server socket error:", e)
+        continue
 
     try:
         print("Waiting for connections..")
-        client, addr = server.accept() # script will wait here until a connection is made
+        client, addr = accept_client(server) # script will wait here until a connection is made
         print("CONNECTION MADE STARTING MJPEG STREAM...")
     except OSError as e:
         server.close()
@@ -208,6 +802,7 @@ while True:
     except OSError as e:
         client.close()
         print("client socket error:", e)
+        register_device()
         # sys.print_exception(e)
 
         
\ No newline at end of file
@@ -0,0 +1,594 @@
+#!/usr/bin/env python3
+"""
+Run the OpenMV firmware (on_ae3_AP.py) under CPython on Linux
+
+The firmware's `sensor`, `network`, `socket`, `select` and `time` imports are
+answered by host shims, everything else is left alone:
+
+ • sensor   – a timing model of the camera: frames complete every
+              1/--sensor-fps s; with one frame buffer snapshot() starts a
+              capture and waits for it, with set_framebuffers(3) it returns
+              the newest frame captured in the background.  JPEG compression
+              costs --encode-ms (per QVGA worth of pixels) and yields
+              pre-rendered JPEGs of a realistic size for the frame size and
+              quality (fleet_sim.FramePool); to_jpeg(copy=True) allocates a
+              new image like the device does.
+ • network  – a WLAN that is always up on 127.0.0.1.
+ • socket   – real sockets; bind() accepts lists, send() accepts str and
+              images, each TCP send call costs --send-call-ms plus the bytes at
+              --link-mbps (the WiFi module, optionally changing over time);
+              registration broadcasts go to --register-to, or to a local
+              socket that ACKs them; other datagrams (the control channel)
+              are real.
+              During a --drop window the radio is gone: nothing is sent,
+              received or accepted (sends fail with EAGAIN / time out).
+ • select   – poll() over the shim sockets (MicroPython returns the socket
+              objects, not file descriptors).
+ • time     – host time plus ticks_ms/ticks_diff/sleep_ms and time.clock().
+
+Firmware constants can be overridden before it runs (--set NAME=VALUE, e.g.
+--set PIPELINED=False); PORT is remapped to --port.  A client process reads
+the stream for --seconds (--clients N of them, the last one throttled to
+--slow-kbps) and the harness reports fps and bytes/s per client, how long
+after boot the first frame arrived, and the heap allocated per frame by the firmware (tracemalloc peak between two
+snapshot() calls, i.e. what the device GC would have to reclaim).  With
+--clients 0 the firmware just serves (the recorder, bench_bitrate.py)
+until interrupted; CONTROL_PORT is remapped to --control-port.
+
+Usage:
+    python openmv_emu.py                                    # fan-out server
+    python openmv_emu.py --set PIPELINED=False --set MAX_CLIENTS=1   # original
+    python openmv_emu.py --clients 3 --slow-kbps 500        # + a slow viewer
+    python openmv_emu.py --profile                          # cProfile the loop
+    python openmv_emu.py --clients 0 --link-mbps 0:8,30:1   # serve, WiFi slows down at 30 s
+    python openmv_emu.py --clients 0 --drop 20:8            # serve, WiFi gone from 20 to 28 s
+"""
+
+import argparse
+import ast
+import builtins
+import cProfile
+import errno
+import multiprocessing as mp
+import pathlib
+import pstats
+import select
+import socket as _socket
+import sys
+import threading
+import time as _time
+import tracemalloc
+import types
+
+from fleet_sim import FramePool, LinkSchedule
+from rate_control import FRAME_SIZES
+
+HERE = pathlib.Path(__file__).resolve().parent
+FIRMWARE = HERE / "on_ae3_AP.py"
+
+
+class Done(BaseException):
+    """Raised into the firmware to end the run (not caught by `except OSError`)."""
+
+
+class Model:
+    """Device timing model and per-frame accounting shared by the shims."""
+
+    def __init__(self, args):
+        self.period = 1.0 / args.sensor_fps
+        self.encode = args.encode_ms / 1e3
+        self.send_call = args.send_call_ms / 1e3
+        self.link = LinkSchedule(args.link_mbps)
+        self.drops = [(self.link.start + at, self.link.start + at + length)
+                      for at, length in args.drop]       # radio down, monotonic time
+        self.register_to = args.register_to
+        self.acker = None                      # stands in for the recorder's ACKs
+        self.done = False
+        self.frames = 0
+        self.frame_peaks = []                  # bytes allocated between snapshot() calls
+        self.send_calls = 0
+        self.mark = None
+
+    def byte_time(self) -> float:
+        mbps = self.link.mbps()
+        return 8 / (mbps * 1e6) if mbps else 0.0
+
+    def down(self) -> float:
+        """Seconds until the radio is back (0: it is up)."""
+        now = _time.monotonic()
+        for start, end in self.drops:
+            if start <= now < end:
+                return end - now
+        return 0.0
+
+    def ack_address(self):
+        """Where registrations go: --register-to, or a local socket that ACKs them."""
+        if self.register_to is not None:
+            return self.register_to
+        if self.acker is None:
+            self.acker = _socket.socket(_socket.AF_INET, _socket.SOCK_DGRAM)
+            self.acker.bind(("127.0.0.1", 0))
+            self.acker.setblocking(False)
+        return self.acker.getsockname()
+
+    def ack(self) -> None:
+        """ACK what reached the local acker (delivery over loopback is immediate)."""
+        while self.acker is not None:
+            try:
+                _, addr = self.acker.recvfrom(1024)
+            except BlockingIOError:
+                return
+            self.acker.sendto(b"SIPBUDDY_ACK", addr)
+
+    def busy(self, seconds: float) -> None:
+        """Time spent by the device CPU or radio (sleep: the host core stays free)."""
+        if seconds > 0:
+            _time.sleep(seconds)
+
+    def frame_boundary(self) -> None:
+        """Called at each snapshot(): close the previous frame's allocation window."""
+        if self.mark is not None:
+            current, peak = tracemalloc.get_traced_memory()
+            self.frame_peaks.append(max(0, peak - self.mark))
+        tracemalloc.reset_peak()
+        self.mark = tracemalloc.get_traced_memory()[0]
+        self.frames += 1
+
+
+# ───── sensor ──────────────────────────────────────────────────────────────
+class Image:
+    """A frame buffer holding either raw pixels or a compressed JPEG."""
+
+    def __init__(self, sensor, capacity: int = 0, data=None):
+        self.sensor = sensor
+        self.buf = bytearray(data) if data is not None else bytearray(capacity)
+        self.view = memoryview(self.buf)
+        self.n = len(data) if data is not None else 0
+
+    def _encode(self, quality: int):
+        s = self.sensor
+        w, h = FRAME_SIZES[s.framesize]
+        s.model.busy(s.model.encode * w * h / (320 * 240))
+        jpegs = s.pool.variant(s.framesize, quality)
+        return jpegs[s.model.frames % len(jpegs)]
+
+    def to_jpeg(self, quality: int = 90, copy: bool = False, **kwargs):
+        jpeg = self._encode(quality)
+        if copy:
+            return Image(self.sensor, data=jpeg)           # new heap image, like the device
+        self.view[:len(jpeg)] = jpeg
+        self.n = len(jpeg)
+        return self
+
+    def compress(self, quality: int = 90, **kwargs):
+        return self.to_jpeg(quality)
+
+    def size(self) -> int:
+        return self.n
+
+    def bytearray(self):
+        return self.view[:self.n]
+
+
+class Sensor(types.ModuleType):
+    QQVGA, QVGA, HVGA, VGA, RGB565, GRAYSCALE, JPEG = 7, 8, 9, 10, 2, 1, 3
+    NAMES = {7: "QQVGA", 8: "QVGA", 9: "HVGA", 10: "VGA"}
+
+    def __init__(self, model: Model, pool):
+        super().__init__("sensor")
+        self.model = model
+        self.pool = pool                       # fleet_sim.FramePool
+        self.framesize = "QVGA"
+        self.buffers = [Image(self, 320 * 240 * 2)]
+        self.next_buffer = 0
+        self.epoch = _time.monotonic()
+        self.taken = -1                        # index of the last frame handed out
+
+    def reset(self):
+        pass
+
+    def set_framesize(self, size):
+        self.framesize = self.NAMES[size]
+        self.set_framebuffers(len(self.buffers))       # reallocated at the new size
+
+    def set_pixformat(self, fmt):
+        pass
+
+    def skip_frames(self, n=10, time=None):
+        pass
+
+    def set_framebuffers(self, n: int):
+        w, h = FRAME_SIZES[self.framesize]
+        self.buffers = [Image(self, w * h * 2) for _ in range(n)]
+
+    def snapshot(self) -> Image:
+        m = self.model
+        if m.done:
+            raise Done
+        m.frame_boundary()
+        now = _time.monotonic()
+        latest = int((now - self.epoch) / m.period)    # frames completed so far
+        if len(self.buffers) == 1:
+            # capture starts at the next frame start and takes a full period
+            m.busy(self.epoch + (latest + 2) * m.period - now)
+            self.taken = latest + 1
+        elif latest > self.taken:
+            self.taken = latest                        # captured in the background
+        else:
+            m.busy(self.epoch + (self.taken + 2) * m.period - now)
+            self.taken += 1
+        self.next_buffer = (self.next_buffer + 1) % len(self.buffers)
+        return self.buffers[self.next_buffer]
+
+
+# ───── network / socket ────────────────────────────────────────────────────
+class WLAN:
+    def __init__(self, mode=None):
+        self._active = False
+
+    def config(self, *args, **kwargs):
+        if args == ("mac",):
+            return bytes.fromhex("02bd0e000001")
+
+    def active(self, value=None):
+        if value is None:
+            return self._active
+        self._active = value
+
+    def ifconfig(self):
+        return ("127.0.0.1", "255.0.0.0", "127.0.0.1", "127.0.0.1")
+
+    def isconnected(self):
+        return True
+
+
+def make_network() -> types.ModuleType:
+    mod = types.ModuleType("network")
+    mod.WLAN, mod.STA_IF, mod.AP_IF = WLAN, 0, 1
+    return mod
+
+
+class Socket:
+    """MicroPython-flavoured socket over a real CPython socket."""
+
+    def __init__(self, model: Model, family=_socket.AF_INET, kind=_socket.SOCK_STREAM, sock=None):
+        self.model = model
+        self.udp = kind == _socket.SOCK_DGRAM
+        self.sock = sock or _socket.socket(family, kind)
+        self.broadcast = False                 # the registration socket
+
+    def __getattr__(self, name):
+        return getattr(self.sock, name)
+
+    def setsockopt(self, level, option, value):
+        if option == _socket.SO_BROADCAST:
+            self.broadcast = True
+        self.sock.setsockopt(level, option, value)
+
+    def bind(self, addr):
+        self.sock.bind(tuple(addr))
+
+    def accept(self):
+        while self.model.down() or not select.select([self.sock], [], [], 0.2)[0]:
+            if self.model.done:
+                raise Done
+            _time.sleep(min(0.2, self.model.down()))
+        sock, addr = self.sock.accept()
+        return Socket(self.model, sock=sock), addr
+
+    def _send_cost(self, n: int) -> None:
+        m = self.model
+        m.send_calls += 1
+        m.busy(m.send_call + n * m.byte_time())
+
+    def send(self, data):
+        data = data.encode() if isinstance(data, str) else data
+        if self.model.down():
+            raise OSError(errno.EAGAIN, "radio down")
+        self._send_cost(len(data))
+        return self.sock.send(data)
+
+    def sendall(self, data):
+        if isinstance(data, Image):
+            data = data.bytearray()
+        elif isinstance(data, str):
+            data = data.encode()
+        down = self.model.down()
+        if down:
+            timeout = self.sock.gettimeout()
+            _time.sleep(down if timeout is None else min(down, timeout))
+            if self.model.down():
+                raise OSError(errno.ETIMEDOUT, "radio down")
+        self._send_cost(len(data))
+        self.sock.sendall(data)
+
+    def write(self, data):
+        self.sendall(data)
+
+    def sendto(self, data, addr):
+        data = data.encode() if isinstance(data, str) else data
+        if not self.broadcast:
+            return self.sock.sendto(data, tuple(addr))
+        if self.model.down():
+            return len(data)                   # lost in the air
+        n = self.sock.sendto(data, self.model.ack_address())
+        self.model.ack()
+        return n
+
+
+def make_socket(model: Model) -> types.ModuleType:
+    mod = types.ModuleType("socket")
+    for name in ("AF_INET", "SOCK_STREAM", "SOCK_DGRAM", "SOL_SOCKET", "SO_REUSEADDR",
+                 "SO_BROADCAST", "IPPROTO_TCP", "TCP_NODELAY"):
+        setattr(mod, name, getattr(_socket, name))
+    mod.socket = lambda family=_socket.AF_INET, kind=_socket.SOCK_STREAM, *a: Socket(model, family, kind)
+    mod.getaddrinfo = _socket.getaddrinfo
+    return mod
+
+
+class Poll:
+    """select.poll() that takes and returns shim sockets, like MicroPython."""
+
+    def __init__(self, model: Model):
+        self.model = model
+        self.poller = select.poll()
+        self.objs = {}
+
+    def register(self, obj, mask=select.POLLIN | select.POLLOUT):
+        self.objs[obj.fileno()] = obj
+        self.poller.register(obj.fileno(), mask)
+
+    def modify(self, obj, mask):
+        self.poller.modify(obj.fileno(), mask)
+
+    def unregister(self, obj):
+        self.objs.pop(obj.fileno(), None)
+        self.poller.unregister(obj.fileno())
+
+    def poll(self, timeout=-1):
+        if self.model.done:
+            raise Done
+        down = self.model.down()
+        if down:                               # nothing gets through: just wait
+            _time.sleep(min(down, timeout / 1000) if timeout >= 0 else down)
+            return []
+        return [(self.objs[fd], ev) for fd, ev in self.poller.poll(timeout)]
+
+
+def make_select(model: Model) -> types.ModuleType:
+    mod = types.ModuleType("select")
+    for name in ("POLLIN", "POLLOUT", "POLLERR", "POLLHUP"):
+        setattr(mod, name, getattr(select, name))
+    mod.poll = lambda: Poll(model)
+    mod.select = select.select
+    return mod
+
+
+# ───── time ────────────────────────────────────────────────────────────────
+class Clock:
+    """time.clock(): fps over the interval since the last tick()."""
+
+    def __init__(self):
+        self.t = self.dt = 0.0
+
+    def tick(self):
+        now = _time.perf_counter()
+        self.dt, self.t = now - self.t if self.t else 0.0, now
+
+    def avg(self):
+        return self.dt * 1e3
+
+    def fps(self):
+        return 1.0 / self.dt if self.dt else 0.0
+
+
+def make_time() -> types.ModuleType:
+    mod = types.ModuleType("time")
+    for name in ("time", "sleep", "monotonic", "localtime", "gmtime"):
+        setattr(mod, name, getattr(_time, name))
+    mod.sleep_ms = lambda ms: _time.sleep(ms / 1e3)
+    mod.sleep_us = lambda us: _time.sleep(us / 1e6)
+    mod.ticks_ms = lambda: int(_time.monotonic() * 1e3) & 0x3FFFFFFF
+    mod.ticks_us = lambda: int(_time.monotonic() * 1e6) & 0x3FFFFFFF
+    mod.ticks_diff = lambda a, b: ((a - b + 0x20000000) & 0x3FFFFFFF) - 0x20000000
+    mod.ticks_add = lambda a, b: (a + b) & 0x3FFFFFFF
+    mod.clock = Clock
+    return mod
+
+
+# ───── firmware loading ────────────────────────────────────────────────────
+def load_firmware(path: pathlib.Path, overrides: dict):
+    """Compile the firmware with top-level constants replaced by `overrides`."""
+    tree = ast.parse(path.read_text(), str(path))
+    for node in tree.body:
+        if (isinstance(node, ast.Assign) and len(node.targets) == 1
+                and isinstance(node.targets[0], ast.Name) and node.targets[0].id in overrides):
+            node.value = ast.copy_location(ast.Constant(overrides[node.targets[0].id]), node.value)
+    return compile(tree, str(path), "exec")
+
+
+def parse_override(text: str):
+    name, _, value = text.partition("=")
+    try:
+        return name, ast.literal_eval(value)
+    except (ValueError, SyntaxError):
+        return name, value
+
+
+def parse_drop(text: str) -> tuple:
+    at, _, length = text.partition(":")
+    return float(at), float(length)
+
+
+def run_firmware(code, model: Model, pool, quiet: bool = True) -> None:
+    shims = {"sensor": Sensor(model, pool), "network": make_network(),
+             "socket": make_socket(model), "select": make_select(model), "time": make_time()}
+    real_import = builtins.__import__
+
+    def firmware_import(name, *args, **kwargs):
+        return shims[name] if name in shims else real_import(name, *args, **kwargs)
+
+    fw_builtins = dict(vars(builtins), __import__=firmware_import)
+    if quiet:
+        fw_builtins["print"] = lambda *a, **k: None
+    try:
+        exec(code, {"__name__": "__main__", "__builtins__": fw_builtins})
+    except Done:
+        pass
+
+
+# ───── measuring client ────────────────────────────────────────────────────
+def client(index: int, port: int, seconds: float, warmup: float, kbps: float, boot: float,
+           results) -> None:
+    """Read the stream for warmup + seconds (at most `kbps` if set) and report."""
+    from mjpeg_parser import MultipartParser
+
+    empty = {"client": index, "frames": 0, "bytes": 0, "seconds": 0.0, "resyncs": 0, "first": None}
+    t_end = _time.monotonic() + warmup + seconds
+    while True:
+        try:
+            sock = _socket.socket()
+            if kbps:                                   # let back-pressure reach the device
+                sock.setsockopt(_socket.SOL_SOCKET, _socket.SO_RCVBUF, 4096)
+            sock.connect(("127.0.0.1", port))
+            break
+        except OSError:
+            if _time.monotonic() > t_end:
+                results.put(empty)
+                return
+            _time.sleep(0.05)
+    sock.settimeout(max(1.0, t_end - _time.monotonic()))
+    parser = MultipartParser(1 << 20)
+    t0 = frames0 = bytes0 = first = None
+    try:
+        sock.sendall(b"GET / HTTP/1.1\r\n\r\n")
+        head = b""
+        while b"\r\n\r\n" not in head:              # HTTP response header
+            chunk = sock.recv(1024)
+            if not chunk:
+                raise ConnectionError
+            head += chunk
+        for _ in parser.feed(head[head.index(b"\r\n\r\n") + 4:]):
+            pass
+        while _time.monotonic() < t_end:
+            view = parser.readinto_view()
+            n = sock.recv_into(view[:4096] if kbps else view)
+            if not n:
+                break
+            parser.commit(n)
+            for _ in parser.parse():
+                pass
+            if first is None and parser.frames:
+                first = _time.monotonic() - boot
+            if t0 is None and _time.monotonic() >= t_end - seconds:
+                t0, frames0, bytes0 = _time.monotonic(), parser.frames, parser.bytes
+            if kbps:
+                _time.sleep(n * 8 / (kbps * 1e3))
+    except OSError:                                    # timeouts included: never served
+        pass
+    if t0 is None:
+        results.put(empty)
+    else:
+        results.put({"client": index, "frames": parser.frames - frames0,
+                     "bytes": parser.bytes - bytes0, "seconds": _time.monotonic() - t0,
+                     "resyncs": parser.resyncs, "first": first})
+    sock.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run on_ae3_AP.py under CPython with device shims")
+    parser.add_argument("--firmware", type=pathlib.Path, default=FIRMWARE)
+    parser.add_argument("--port", type=int, default=18080, help="host port for the firmware's PORT")
+    parser.add_argument("--seconds", type=float, default=10.0)
+    parser.add_argument("--warmup", type=float, default=2.0)
+    parser.add_argument("--sensor-fps", type=float, default=60.0, help="QVGA sensor frame rate")
+    parser.add_argument("--encode-ms", type=float, default=6.0, help="JPEG compression time")
+    parser.add_argument("--send-call-ms", type=float, default=2.0, help="fixed cost of one TCP send call")
+    parser.add_argument("--link-mbps", default="20",
+                        help='WiFi Mbit/s, 0 = unlimited, or a schedule "0:20,30:2,60:20"')
+    parser.add_argument("--drop", action="append", default=[], type=parse_drop, metavar="AT:SECONDS",
+                        help="WiFi gone for SECONDS from AT s after start (repeatable)")
+    parser.add_argument("--size-mean", type=int, default=12000, help="mean JPEG bytes")
+    parser.add_argument("--size-sd", type=int, default=3000)
+    parser.add_argument("--control-port", type=int, help="host port for CONTROL_PORT (default: --port + 1)")
+    parser.add_argument("--clients", type=int, default=1,
+                        help="MJPEG clients reading at once, 0 = serve others until interrupted")
+    parser.add_argument("--slow-kbps", type=float, default=0.0,
+                        help="with --clients > 1, the last client reads at this rate (a slow viewer)")
+    parser.add_argument("--register-to", default=None, metavar="HOST:PORT",
+                        help="send registrations to a recorder instead of ACKing locally")
+    parser.add_argument("--set", action="append", default=[], metavar="NAME=VALUE",
+                        help="override a firmware constant (repeatable)")
+    parser.add_argument("--profile", action="store_true", help="cProfile the firmware")
+    parser.add_argument("--verbose", action="store_true", help="show the firmware's prints")
+    args = parser.parse_args()
+    if args.register_to:
+        host, _, port = args.register_to.rpartition(":")
+        args.register_to = (host, int(port))
+
+    pool = FramePool(args.size_mean, args.size_sd)
+
+    overrides = dict(parse_override(s) for s in args.set)
+    overrides.setdefault("PORT", args.port)
+    overrides.setdefault("CONTROL_PORT", args.control_port or overrides["PORT"] + 1)
+    code = load_firmware(args.firmware, overrides)
+    model = Model(args)
+
+    results = mp.Queue()
+    readers = []
+    boot = _time.monotonic()                           # system-wide clock: valid in the readers
+    for i in range(args.clients):
+        kbps = args.slow_kbps if i and i == args.clients - 1 else 0.0
+        readers.append(mp.Process(target=client, daemon=True,
+                                  args=(i, overrides["PORT"], args.seconds, args.warmup, kbps, boot,
+                                        results)))
+        readers[-1].start()
+
+    def stop():
+        stop.results = sorted((results.get() for _ in readers), key=lambda r: r["client"])
+        model.done = True
+
+    if not readers:
+        print(f"serving {args.firmware.name} on port {overrides['PORT']} "
+              f"(control {overrides['CONTROL_PORT']}), Ctrl-C to stop")
+        try:
+            run_firmware(code, model, pool, quiet=not args.verbose)
+        except KeyboardInterrupt:
+            pass
+        return
+    threading.Thread(target=stop, daemon=True).start()
+
+    tracemalloc.start()
+    profiler = cProfile.Profile() if args.profile else None
+    if profiler:
+        profiler.enable()
+    run_firmware(code, model, pool, quiet=not args.verbose)
+    if profiler:
+        profiler.disable()
+    tracemalloc.stop()
+    for reader in readers:
+        reader.join()
+
+    rs = getattr(stop, "results", [])
+    if not any(r["frames"] for r in rs):
+        sys.exit("no frames received")
+    peaks = sorted(model.frame_peaks[len(model.frame_peaks) // 10:])   # skip start-up
+    mean_alloc = sum(peaks) / len(peaks) if peaks else 0
+    print(f"firmware      {args.firmware.name} {' '.join(args.set)}")
+    for r in rs:
+        secs = r["seconds"] or 1.0
+        slow = f"  (reading at {args.slow_kbps:g} kbit/s)" if r["client"] and r["client"] == args.clients - 1 and args.slow_kbps else ""
+        print(f"client {r['client']}      {r['frames'] / secs:5.1f} fps  {r['bytes'] / secs / 1e6:.2f} MB/s  "
+              f"{r['frames']} frames, {r['resyncs']} parser resyncs{slow}")
+    firsts = [r["first"] for r in rs if r["first"] is not None]
+    if firsts:
+        print(f"first frame   {min(firsts):.2f} s after boot")
+    print(f"encoded       {model.frames / (args.warmup + args.seconds):.1f} fps   (sensor {args.sensor_fps:g})")
+    print(f"send calls    {model.send_calls / max(1, model.frames):.2f} per frame")
+    print(f"heap / frame  {mean_alloc:,.0f} B mean, {peaks[len(peaks) // 2] if peaks else 0:,} B median")
+    if profiler:
+        pstats.Stats(profiler).sort_stats("cumulative").print_stats(15)
+
+
+if __name__ == "__main__":
+    main()
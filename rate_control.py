@@ -0,0 +1,291 @@
+"""
+Closed-loop bitrate control of the cameras
+
+The firmware (on_ae3_AP.py) listens for commands on UDP CONTROL_PORT and
+advertises it in its registration (`…|PORT:8080|CTRL:8001`):
+
+    SIPBUDDY_SET|MAC:0123456789ab|SEQ:7|Q:50|SIZE:HVGA|FPS:15
+    SIPBUDDY_GET|MAC:0123456789ab|SEQ:8
+
+(every field after MAC optional; FPS:0 = as fast as the sensor goes), and
+answers both with what it now runs:
+
+    SIPBUDDY_SETTINGS|MAC:0123456789ab|SEQ:7|Q:50|SIZE:HVGA|FPS:15
+
+RateController drives those settings for every camera that advertises a
+control port, once per INTERVAL, from the telemetry the recorder already
+keeps (frames and bytes received, inter-frame gaps):
+
+ • the settings are a LADDER of (frame size, JPEG quality) steps ordered by
+   the bytes a frame costs, plus a frame-rate cap (the target fps);
+ • congested (fps below CONGESTED × the cap: WiFi is slow, `sendall`
+   blocks on the device) or over the camera's bandwidth budget: jump down
+   to the highest step whose predicted frame size fits what the link
+   actually carried (or the budget) at the target fps; at the bottom of
+   the ladder, lower the fps cap instead;
+ • smooth (fps at the cap and the gaps tight) for `probe_after` intervals:
+   restore the fps cap, then probe one step up if the predicted bitrate
+   stays inside the budget and the frame inside the firmware's packet
+   buffer.  A probe that has to be undone straight away doubles the wait
+   before the next one (up to MAX_PROBE_AFTER);
+ • after a change one interval is skipped, its measurement mixes both
+   settings.  Commands are re-sent until acknowledged and every
+   RESEND_INTERVAL (a rebooted camera is back at its defaults).
+
+Status at /ratecontrol.json.  bench_bitrate.py shows it against simulated
+cameras (fleet_sim.py) or the emulated firmware (openmv_emu.py) whose link
+capacity changes over time.
+"""
+
+import json
+import logging
+import math
+import socket
+import threading
+import time
+
+logger = logging.getLogger('sipbuddy')
+
+SET, GET, SETTINGS = b"SIPBUDDY_SET", b"SIPBUDDY_GET", b"SIPBUDDY_SETTINGS"
+
+FRAME_SIZES = {"QQVGA": (160, 120), "QVGA": (320, 240), "HVGA": (480, 320), "VGA": (640, 480)}
+QUALITY_BYTES = ((10, 0.45), (20, 0.65), (35, 1.0), (50, 1.3), (70, 1.8), (90, 3.2))  # vs quality 35
+LADDER = (("QQVGA", 35), ("QQVGA", 70), ("QVGA", 20), ("QVGA", 35), ("QVGA", 50),
+          ("QVGA", 70), ("HVGA", 50), ("HVGA", 70), ("VGA", 50), ("VGA", 70))
+DEFAULT_STEP = LADDER.index(("QVGA", 35))      # what the firmware boots with
+
+INTERVAL = 2.0                         # seconds between decisions
+CONGESTED = 0.85                       # fps below this share of the cap → step down
+SMOOTH = 0.95                          # fps above this share (and tight gaps) → may probe up
+GAP_FACTOR = 1.5                       # p90 inter-frame gap must stay under this many periods
+HEADROOM = 0.9                         # share of the measured throughput a step down aims for
+PROBE_AFTER = 3                        # smooth intervals before probing up
+MAX_PROBE_AFTER = 48
+MIN_FPS = 2.0
+MAX_FRAME = 48 * 1024                  # firmware MAX_JPEG is 64 KB; keep a margin
+RESEND_INTERVAL = 30.0
+
+
+def bytes_ratio(framesize: str, quality: int) -> float:
+    """Rough JPEG size at (`framesize`, `quality`) relative to QVGA at quality 35."""
+    w, h = FRAME_SIZES[framesize]
+    pts = QUALITY_BYTES
+    q = min(max(quality, pts[0][0]), pts[-1][0])
+    for (q0, r0), (q1, r1) in zip(pts, pts[1:]):
+        if q <= q1:
+            return w * h / (320 * 240) * (r0 + (r1 - r0) * (q - q0) / (q1 - q0))
+    return w * h / (320 * 240) * pts[-1][1]
+
+
+def encode(kind: bytes, mac: str, seq: int, **fields) -> bytes:
+    """`KIND|MAC:..|SEQ:..|Q:..|SIZE:..|FPS:..` (None fields left out)."""
+    names = {"quality": "Q", "framesize": "SIZE", "fps": "FPS"}
+    parts = [kind, b"MAC:" + mac.encode(), b"SEQ:%d" % seq]
+    for key, name in names.items():
+        v = fields.get(key)
+        if v is not None:
+            parts.append(f"{name}:{v:g}".encode() if isinstance(v, float) else f"{name}:{v}".encode())
+    return b"|".join(parts)
+
+
+def decode(data: bytes):
+    """(kind, {field: str}) of a control datagram; kind is None if it is not one."""
+    kind, *fields = data.split(b"|")
+    if kind not in (SET, GET, SETTINGS):
+        return None, {}
+    try:
+        return kind, dict(f.decode().split(":", 1) for f in fields if b":" in f)
+    except UnicodeDecodeError:
+        return None, {}
+
+
+class CameraControl:
+    """Controller state of one camera."""
+
+    def __init__(self, cam_id: str, mac: str, fps: float):
+        self.cam_id, self.mac = cam_id, mac
+        self.step = DEFAULT_STEP
+        self.fps = fps                                 # cap sent to the device
+        self.frames = self.bytes = self.t = None       # counters at the last decision
+        self.measured_fps = self.measured_bps = 0.0
+        self.hold = 0
+        self.good = 0
+        self.probe_after = PROBE_AFTER
+        self.probed_at = None                          # decision number of the last probe
+        self.seq = 0
+        self.sent_at = 0.0
+        self.acked = False
+        self.device = None                             # settings the device last reported
+        self.changes = 0
+
+    @property
+    def settings(self) -> dict:
+        framesize, quality = LADDER[self.step]
+        return {"framesize": framesize, "quality": quality, "fps": self.fps}
+
+    def snapshot(self) -> dict:
+        return dict(self.settings, camera=self.cam_id, step=self.step,
+                    measured_fps=self.measured_fps, measured_kbps=self.measured_bps * 8 / 1000,
+                    acked=self.acked, device=self.device, changes=self.changes,
+                    probe_after=self.probe_after)
+
+
+class RateController(threading.Thread):
+    """Drive every controllable camera toward `target_fps` within `budget_kbps`."""
+
+    def __init__(self, metrics, addresses, target_fps: float = 15.0, budget_kbps: float = None,
+                 interval: float = INTERVAL, max_frame: int = MAX_FRAME):
+        super().__init__(daemon=True, name="rate-control")
+        self.metrics = metrics                         # anything with telemetry's snapshot()
+        self.addresses = addresses                     # () -> {cam id: (mac, ip, ctrl port)}
+        self.target_fps = target_fps
+        self.budget = budget_kbps * 1000 / 8 if budget_kbps else None   # bytes/s per camera
+        self.interval = interval
+        self.max_frame = max_frame
+        self.cameras = {}                              # cam id -> CameraControl
+        self.by_mac = {}
+        self.decisions = 0
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(("", 0))
+
+    def run(self) -> None:
+        due = time.monotonic()
+        while True:
+            wait = due - time.monotonic()
+            if wait > 0:
+                self._receive(wait)
+                continue
+            due += self.interval
+            self.decisions += 1
+            try:
+                addresses = self.addresses()
+                for s in self.metrics.snapshot():
+                    if s["camera"] in addresses:           # others have no control channel
+                        self._control(s, *addresses[s["camera"]])
+            except Exception:
+                logger.exception("rate control pass failed")
+
+    # ── replies ───────────────────────────────────────────────────────────
+    def _receive(self, timeout: float) -> None:
+        self.sock.settimeout(timeout)
+        try:
+            data, _ = self.sock.recvfrom(512)
+        except OSError:                                # timeout
+            return
+        kind, fields = decode(data)
+        c = self.by_mac.get(fields.get("MAC"))
+        if kind != SETTINGS or c is None:
+            return
+        try:
+            c.device = {"framesize": fields.get("SIZE"), "quality": int(fields.get("Q", 0)),
+                        "fps": float(fields.get("FPS", 0))}
+        except ValueError:
+            return
+        if fields.get("SEQ") == str(c.seq):
+            c.acked = True
+
+    def _send(self, c: CameraControl, addr) -> None:
+        c.seq += 1
+        c.acked = False
+        c.sent_at = time.monotonic()
+        try:
+            self.sock.sendto(encode(SET, c.mac, c.seq, **c.settings), addr)
+        except OSError as e:
+            logger.warning(f"[{c.cam_id}] rate control command failed: {e}")
+
+    # ── the loop ──────────────────────────────────────────────────────────
+    def _control(self, s: dict, mac: str, ip: str, port: int) -> None:
+        cam_id = s["camera"]
+        c = self.cameras.get(cam_id)
+        if c is None:
+            c = self.cameras[cam_id] = CameraControl(cam_id, mac, self.target_fps)
+            self.by_mac[mac] = c
+        now = time.monotonic()
+        if c.t is None or s["frames"] < c.frames:      # first look, or counters restarted
+            c.frames, c.bytes, c.t = s["frames"], s["bytes"], now
+            self._send(c, (ip, port))
+            return
+        dt = now - c.t
+        c.measured_fps = (s["frames"] - c.frames) / dt
+        c.measured_bps = (s["bytes"] - c.bytes) / dt
+        c.frames, c.bytes, c.t = s["frames"], s["bytes"], now
+
+        changed = False
+        if c.hold:
+            c.hold -= 1
+        elif s["state"] == "streaming" and c.measured_fps > 0:
+            changed = self._decide(c, s["frame_gap_seconds"]["0.9"])
+        if changed:
+            c.changes += 1
+            c.hold = 1
+            logger.info(f"[{c.cam_id}] rate control → {c.settings['framesize']} q{c.settings['quality']} "
+                        f"{c.fps:g} fps ({c.measured_fps:.1f} fps, {c.measured_bps * 8 / 1000:.0f} kbit/s)")
+        if changed or (not c.acked and now - c.sent_at >= self.interval) \
+                or now - c.sent_at >= RESEND_INTERVAL:
+            self._send(c, (ip, port))
+
+    def _predicted(self, c: CameraControl, step: int) -> float:
+        """Frame bytes at ladder `step`, scaled from what the current step measures."""
+        frame = c.measured_bps / c.measured_fps
+        return frame * bytes_ratio(*LADDER[step]) / bytes_ratio(*LADDER[c.step])
+
+    def _decide(self, c: CameraControl, gap_p90: float) -> bool:
+        """One decision from the last interval's measurements; True if the settings changed."""
+        fps, bps = c.measured_fps, c.measured_bps
+        over = self.budget is not None and bps > self.budget
+        if fps < CONGESTED * c.fps or over:
+            capacity = bps * HEADROOM if fps < CONGESTED * c.fps else math.inf
+            if self.budget is not None:
+                capacity = min(capacity, self.budget)
+            want = capacity / c.fps                    # bytes per frame that fit at the cap
+            step = c.step - 1
+            while step > 0 and self._predicted(c, step) > want:
+                step -= 1
+            if self.decisions - (c.probed_at or -10) <= 2:   # the last probe did not hold
+                c.probe_after = min(MAX_PROBE_AFTER, 2 * c.probe_after)
+                c.probed_at = None
+            c.good = 0
+            if c.step > 0:
+                c.step = max(0, step)
+                return True
+            lower = max(MIN_FPS, math.floor(capacity / (bps / fps)))
+            if lower < c.fps:
+                c.fps = lower
+                return True
+            return False
+        if fps < SMOOTH * c.fps or gap_p90 > GAP_FACTOR / c.fps:
+            c.good = 0
+            return False
+        c.good += 1
+        if c.probed_at is not None and self.decisions - c.probed_at > 2:
+            c.probe_after = max(PROBE_AFTER, c.probe_after // 2)   # the last probe held
+            c.probed_at = None
+        if c.good < c.probe_after:
+            return False
+        c.good = 0
+        if c.fps < self.target_fps:
+            c.fps = min(self.target_fps, c.fps * 1.5)
+            c.probed_at = self.decisions
+            return True
+        if c.step + 1 >= len(LADDER):
+            return False
+        frame = self._predicted(c, c.step + 1)
+        if frame > self.max_frame or (self.budget is not None and frame * c.fps > self.budget):
+            return False
+        c.step += 1
+        c.probed_at = self.decisions
+        return True
+
+    def snapshot(self) -> list:
+        return [c.snapshot() for c in list(self.cameras.values())]
+
+
+def add_routes(app, controller: RateController) -> None:
+    """Register /ratecontrol.json on an aiohttp application."""
+    from aiohttp import web
+
+    async def status(request):
+        return web.Response(text=json.dumps(controller.snapshot(), indent=1),
+                            content_type="application/json")
+
+    app.router.add_get("/ratecontrol.json", status)
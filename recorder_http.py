@@ -0,0 +1,54 @@
+"""
+The recorder's HTTP server (aiohttp)
+
+One small web server per recorder process.  Feature modules register their
+routes on `RecorderHttp.app` before `start()`:
+
+    telemetry.add_routes(http.app, metrics)       # /metrics, /metrics.json
+
+It runs on the native backend's event loop when there is one, otherwise on a
+daemon thread of its own.
+"""
+
+import asyncio
+import logging
+import threading
+
+from aiohttp import web
+
+logger = logging.getLogger('sipbuddy')
+
+
+class RecorderHttp:
+    def __init__(self, port: int, host: str = "0.0.0.0"):
+        self.port, self.host = port, host
+        self.app = web.Application()
+        self.runner = None
+
+    async def _start(self) -> None:
+        self.runner = web.AppRunner(self.app, access_log=None)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, self.host, self.port).start()
+        logger.info(f"HTTP endpoint on http://{self.host}:{self.port}/metrics")
+
+    def start(self, loop: asyncio.AbstractEventLoop = None) -> None:
+        """Serve on `loop` (from another thread) or on a new daemon thread."""
+        if loop is not None:
+            asyncio.run_coroutine_threadsafe(self._start(), loop).result()
+            return
+        ready, errors = threading.Event(), []
+
+        async def main():
+            try:
+                await self._start()
+            except OSError as e:
+                errors.append(e)
+                return
+            finally:
+                ready.set()
+            await asyncio.Event().wait()
+
+        threading.Thread(target=lambda: asyncio.run(main()), daemon=True).start()
+        ready.wait()
+        if errors:
+            raise errors[0]
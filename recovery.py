@@ -0,0 +1,302 @@
+#!/usr/bin/env python3
+"""
+Journal of unfinished segments and the start-up recovery pass
+
+A recorder that dies (power loss, SIGKILL, a deadline missed at shutdown)
+leaves the segments it was writing behind unfinished: an index that stops
+short of the data or points past it, a JPEG cut in half, an MP4 whose last
+box was never completed – and a segment the catalog, the activity gate and
+the transcoder never heard of.  Finding those by walking the archive costs
+time proportional to the archive; the journal makes it proportional to the
+unfinished data:
+
+ • OpenJournal keeps one small marker file per segment being written in
+   `OUT_ROOT/.open/`: created before the segment's first byte, removed once
+   its close has been announced (segment_events).  The ffmpeg backend marks
+   each FFmpeg run (its `{ts}_` file prefix); only the run's last MP4 can be
+   unfinished, the watcher announces the others.
+ • recover() visits the markers only:
+     .mjpeg  records pointing past the data and a torn last record are cut,
+             whole JPEGs written before their records are indexed (times
+             interpolated from the frames before, capped at the file's
+             mtime), a torn last JPEG is cut; a segment left without a frame
+             is removed
+     .mp4    cut back to its last complete top-level box (with the
+             fragmented MP4 the backend writes every complete fragment stays
+             playable); an MP4 without a moov box is reported, not touched
+   then announces the segment through segment_events and drops the marker.
+   The same pass finalizes what is left at a graceful shutdown.
+
+CLI (a recorder that is not running):
+    python recovery.py recordings/            # the journal's segments
+    python recovery.py recordings/ --all      # every segment (archives from before the journal)
+"""
+
+import argparse
+import json
+import logging
+import os
+import pathlib
+import struct
+import time
+
+from segment_store import DATA_SUFFIX, INDEX_MAGIC, RECORD, index_path, remove_segment
+
+logger = logging.getLogger('sipbuddy')
+
+JOURNAL_DIR = ".open"
+MARKER_SUFFIX = ".open"
+FRAME_INTERVAL = 1 / 15                # assumed frame spacing when a segment has no timing
+SCAN_CHUNK = 1 << 20                   # bytes read at a time from an unindexed tail
+
+_SOI, _EOI = b"\xff\xd8", b"\xff\xd9"
+_BOX = struct.Struct(">I4s")
+
+
+class OpenJournal:
+    """Marker files for the segments (or FFmpeg runs) being written under `root`."""
+
+    def __init__(self, root):
+        self.root = pathlib.Path(root)
+        self.dir = self.root / JOURNAL_DIR
+        self.dir.mkdir(parents=True, exist_ok=True)
+
+    def _marker(self, path) -> pathlib.Path:
+        rel = os.path.relpath(path, self.root)
+        return self.dir / (rel.replace(os.sep, "@") + MARKER_SUFFIX)
+
+    def opened(self, cam_id: str, path, prefix: bool = False) -> None:
+        """Mark `path` (a segment, or with `prefix` an FFmpeg run's file name prefix) unfinished."""
+        info = {"camera": cam_id, "path": os.path.relpath(path, self.root)}
+        if prefix:
+            info["prefix"] = True
+        try:
+            self._marker(path).write_text(json.dumps(info))
+        except OSError as e:
+            logger.error(f"[{cam_id}] cannot journal {path}: {e}")
+
+    def closed(self, path) -> None:
+        try:
+            self._marker(path).unlink()
+        except FileNotFoundError:
+            pass
+
+    def pending(self) -> list:
+        """(marker, info) of every unfinished segment or run."""
+        out = []
+        for marker in sorted(self.dir.glob("*" + MARKER_SUFFIX)):
+            try:
+                out.append((marker, json.loads(marker.read_text())))
+            except (OSError, ValueError):              # torn marker: nothing to go on
+                marker.unlink(missing_ok=True)
+        return out
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self.dir.glob("*" + MARKER_SUFFIX))
+
+
+# ───── repair ──────────────────────────────────────────────────────────────
+def _read_records(path: pathlib.Path, data_size: int) -> list:
+    """The index's whole records that point inside the data, oldest first."""
+    try:
+        raw = index_path(path).read_bytes()
+    except FileNotFoundError:
+        return []
+    if raw[:len(INDEX_MAGIC)] != INDEX_MAGIC:
+        return []
+    n = (len(raw) - len(INDEX_MAGIC)) // RECORD.size
+    records = list(RECORD.iter_unpack(raw[len(INDEX_MAGIC):len(INDEX_MAGIC) + n * RECORD.size]))
+    while records and records[-1][0] + records[-1][1] > data_size:
+        records.pop()
+    return records
+
+
+def _tail_frames(f, start: int, size: int) -> list:
+    """(offset, size) of the whole JPEGs back to back in f[start:size]."""
+    frames, pending, base = [], b"", start
+    f.seek(start)
+    while True:
+        chunk = f.read(SCAN_CHUNK)
+        pending += chunk
+        i = 0
+        while pending.startswith(_SOI, i):
+            e = pending.find(_EOI + _SOI, i + 2)
+            if e < 0:
+                if not chunk and pending.endswith(_EOI):   # the last one, complete
+                    frames.append((base + i, len(pending) - i))
+                    i = len(pending)
+                break
+            frames.append((base + i, e + 2 - i))
+            i = e + 2
+        if i < len(pending) and not pending.startswith(_SOI[:len(pending) - i], i):
+            break                                      # not a JPEG: stop indexing here
+        pending, base = pending[i:], base + i
+        if not chunk:
+            break
+    return frames
+
+
+def repair_mjpeg(path) -> dict:
+    """Make an unfinished .mjpeg segment and its index agree (see module docstring)."""
+    path = pathlib.Path(path)
+    size = path.stat().st_size
+    records = _read_records(path, size)
+    end = records[-1][0] + records[-1][1] if records else 0
+    with open(path, "rb") as f:
+        tail = _tail_frames(f, end, size) if end < size else []
+    if tail:
+        if len(records) > 1 and records[-1][2] > records[0][2]:
+            step = (records[-1][2] - records[0][2]) / (len(records) - 1)
+        else:
+            step = FRAME_INTERVAL * 1_000_000
+        mtime_us = int(path.stat().st_mtime * 1_000_000)
+        last = records[-1][2] if records else mtime_us - int(step * len(tail))
+        for k, (off, n) in enumerate(tail):
+            last = max(last, min(int(last + step), mtime_us)) if k or records else last
+            records.append((off, n, last))
+        end = tail[-1][0] + tail[-1][1]
+    if not records:
+        remove_segment(path)
+        return {"frames": 0, "indexed": 0, "bytes_cut": size, "removed": True}
+    tmp = index_path(path).with_suffix(".idx.tmp")
+    with open(tmp, "wb") as f:
+        f.write(INDEX_MAGIC)
+        for r in records:
+            f.write(RECORD.pack(*r))
+    os.replace(tmp, index_path(path))
+    if end < size:
+        os.truncate(path, end)
+    return {"frames": len(records), "indexed": len(tail), "bytes_cut": size - end, "removed": False}
+
+
+def repair_mp4(path) -> dict:
+    """Cut an unfinished MP4 back to its last complete top-level box
+    (a fragment: moof and its mdat)."""
+    path = pathlib.Path(path)
+    size = path.stat().st_size
+    pos = good = 0
+    moov = False
+    with open(path, "rb") as f:
+        while pos + _BOX.size <= size:
+            f.seek(pos)
+            header = f.read(16)
+            n, kind = _BOX.unpack_from(header)
+            if n == 1 and len(header) == 16:
+                n = struct.unpack_from(">Q", header, 8)[0]
+            if n < _BOX.size or pos + n > size:        # 0 (to the end) counts as unfinished too
+                break
+            moov |= kind == b"moov"
+            pos += n
+            if kind != b"moof":                        # a fragment is whole once its mdat is
+                good = pos
+    if not moov:
+        logger.warning(f"{path}: no moov box, needs a re-mux to play (left as is)")
+        return {"frames": None, "indexed": 0, "bytes_cut": 0, "removed": False, "unplayable": True}
+    if good < size:
+        os.truncate(path, good)
+    return {"frames": None, "indexed": 0, "bytes_cut": size - good, "removed": False}
+
+
+def repair(path) -> dict:
+    path = pathlib.Path(path)
+    return repair_mjpeg(path) if path.suffix == DATA_SUFFIX else repair_mp4(path)
+
+
+def needs_repair(path) -> bool:
+    """Cheap check (sizes and box headers, no frame data) for --all."""
+    path = pathlib.Path(path)
+    if path.suffix != DATA_SUFFIX:
+        return _mp4_torn(path)
+    size = path.stat().st_size
+    try:
+        n = (index_path(path).stat().st_size - len(INDEX_MAGIC))
+    except FileNotFoundError:
+        return True
+    if n < 0 or n % RECORD.size:
+        return True
+    if not n:
+        return size > 0
+    with open(index_path(path), "rb") as f:
+        f.seek(len(INDEX_MAGIC) + n - RECORD.size)
+        off, length, _ = RECORD.unpack(f.read(RECORD.size))
+    return off + length != size
+
+
+def _mp4_torn(path: pathlib.Path) -> bool:
+    size, pos = path.stat().st_size, 0
+    with open(path, "rb") as f:
+        while pos + _BOX.size <= size:
+            f.seek(pos)
+            n, _ = _BOX.unpack(f.read(_BOX.size))
+            if n == 1:
+                n = struct.unpack(">Q", f.read(8))[0]
+            if n < _BOX.size or pos + n > size:
+                return True
+            pos += n
+    return pos != size
+
+
+# ───── the pass ────────────────────────────────────────────────────────────
+def _targets(journal: OpenJournal, info: dict) -> list:
+    path = journal.root / info["path"]
+    if info.get("prefix"):                             # an FFmpeg run: its newest file
+        return sorted(path.parent.glob(path.name + "*.mp4"))[-1:]
+    return [path] if path.exists() else []
+
+
+def recover(journal: OpenJournal, on_closed=None) -> dict:
+    """Repair and announce (`on_closed(cam_id, path)`) every segment the
+    journal lists, dropping the markers; returns what was done."""
+    t = time.perf_counter()
+    stats = {"segments": 0, "frames_indexed": 0, "bytes_cut": 0, "removed": 0, "unplayable": 0}
+    for marker, info in journal.pending():
+        cam_id = info.get("camera", "")
+        for path in _targets(journal, info):
+            try:
+                r = repair(path)
+            except OSError as e:
+                logger.error(f"[{cam_id}] recovering {path} failed: {e}")
+                continue
+            stats["segments"] += 1
+            stats["frames_indexed"] += r["indexed"]
+            stats["bytes_cut"] += r["bytes_cut"]
+            stats["removed"] += r["removed"]
+            stats["unplayable"] += r.get("unplayable", False)
+            if r["indexed"] or r["bytes_cut"]:
+                logger.info(f"[{cam_id}] recovered {path.name}: {r['indexed']} frames indexed, "
+                            f"{r['bytes_cut']} bytes cut" + (", removed (empty)" if r["removed"] else ""))
+            if not r["removed"] and on_closed is not None:
+                on_closed(cam_id, path)
+        marker.unlink(missing_ok=True)
+    stats["seconds"] = time.perf_counter() - t
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Repair segments left unfinished by a recorder")
+    parser.add_argument("root", type=pathlib.Path)
+    parser.add_argument("--all", action="store_true",
+                        help="check every segment, not just the journal's (cheap checks, repairs where needed)")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    journal = OpenJournal(args.root)
+    stats = recover(journal)
+    if args.all:
+        for path in sorted(args.root.rglob("*")):
+            if path.suffix not in (DATA_SUFFIX, ".mp4") or JOURNAL_DIR in path.parts:
+                continue
+            if needs_repair(path):
+                r = repair(path)
+                stats["segments"] += 1
+                stats["frames_indexed"] += r["indexed"]
+                stats["bytes_cut"] += r["bytes_cut"]
+                stats["removed"] += r["removed"]
+                stats["unplayable"] += r.get("unplayable", False)
+    print(f"{stats['segments']} segments repaired: {stats['frames_indexed']} frames indexed, "
+          f"{stats['bytes_cut']} bytes cut, {stats['removed']} removed, "
+          f"{stats['unplayable']} without moov")
+
+
+if __name__ == "__main__":
+    main()
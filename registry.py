@@ -0,0 +1,144 @@
+"""
+Registry of known SipBuddy cameras, keyed by MAC
+
+Replaces the bare `known_cameras` dict: the discovery loop writes to it while
+the recorder threads read it, so every access goes through one lock.
+
+With a `path` the registry outlives the recorder: it is loaded at start-up
+and written back (atomically, only when something changed) every
+SAVE_INTERVAL seconds by `run_saver`.  Each entry keeps the camera's last
+IP/port/id, when it last registered and its health as the supervisor saw it
+(state, last time it streamed, reconnects), so a restarted recorder can
+reconnect to every camera straight away (`warm()`) instead of waiting for
+broadcasts that a camera stops sending once it has been ACKed.
+"""
+
+import json
+import logging
+import os
+import pathlib
+import threading
+import time
+
+logger = logging.getLogger('sipbuddy')
+
+NEW, MOVED, SAME = "new", "moved", "same"
+
+REGISTRY_NAME = "cameras.json"
+SAVE_INTERVAL = 5.0                    # seconds between saves (when dirty)
+SEEN_RESOLUTION = 60.0                 # last_seen / last_streaming kept to the minute
+FORGET_AFTER = 7 * 86400               # not registered or streamed for this long → no warm start
+
+
+def _coarse(t):
+    """`t` rounded down to SEEN_RESOLUTION, so a packet or a tick is not a change."""
+    return t if t is None else t - t % SEEN_RESOLUTION
+
+
+class CameraRegistry:
+    """Thread-safe MAC → camera info map, optionally persisted to `path`."""
+
+    def __init__(self, path=None):
+        self._cams = {}
+        self._lock = threading.Lock()
+        self.path = pathlib.Path(path) if path is not None else None
+        self.dirty = False
+        if self.path is not None and self.path.exists():
+            self.load()
+
+    def update(self, info: dict) -> str:
+        """Record a registration; returns NEW, MOVED (IP/port changed) or SAME."""
+        mac = info["mac"]
+        with self._lock:
+            old = self._cams.get(mac)
+            cam = dict(info, last_seen=_coarse(time.time()))
+            if old is not None and "health" in old:
+                cam["health"] = old["health"]
+            if cam != old:
+                self._cams[mac] = cam
+                self.dirty = True
+            if old is None:
+                return NEW
+            if (old["ip"], str(old.get("port"))) != (info["ip"], str(info.get("port"))):
+                return MOVED
+            return SAME
+
+    def set_health(self, health: dict) -> None:
+        """Merge {mac: {field: value}} into the cameras' health records."""
+        with self._lock:
+            for mac, fields in health.items():
+                cam = self._cams.get(mac)
+                if cam is None:
+                    continue
+                merged = dict(cam.get("health", {}), **fields)
+                if "last_streaming" in merged:
+                    merged["last_streaming"] = _coarse(merged["last_streaming"])
+                if merged != cam.get("health"):
+                    cam["health"] = merged
+                    self.dirty = True
+
+    def get(self, mac: str):
+        with self._lock:
+            cam = self._cams.get(mac)
+            return dict(cam) if cam is not None else None
+
+    def snapshot(self) -> list:
+        """Copies of every known camera."""
+        with self._lock:
+            return [dict(c) for c in self._cams.values()]
+
+    def warm(self, max_age: float = FORGET_AFTER) -> list:
+        """Cameras that registered or streamed within `max_age` seconds."""
+        cutoff = time.time() - max_age
+        return [c for c in self.snapshot()
+                if max(c.get("last_seen", 0), c.get("health", {}).get("last_streaming") or 0) >= cutoff]
+
+    def __contains__(self, mac: str) -> bool:
+        with self._lock:
+            return mac in self._cams
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._cams)
+
+    # ── persistence ───────────────────────────────────────────────────────
+    def load(self) -> None:
+        try:
+            data = json.loads(self.path.read_text())
+            cams = {c["mac"]: c for c in data["cameras"] if c.get("mac") and c.get("ip") and c.get("id")}
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logger.warning(f"Ignoring unreadable camera registry {self.path}: {e}")
+            return
+        with self._lock:
+            self._cams.update(cams)
+        logger.info(f"Loaded {len(cams)} known cameras from {self.path}")
+
+    def save(self) -> None:
+        """Write the registry if it changed since the last save."""
+        if self.path is None or not self.dirty:
+            return
+        with self._lock:
+            self.dirty = False
+            cams = sorted((dict(c) for c in self._cams.values()), key=lambda c: c["mac"])
+        tmp = self.path.with_name(self.path.name + ".tmp")
+        try:
+            with open(tmp, "w") as f:
+                json.dump({"version": 1, "cameras": cams}, f, indent=1)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self.path)
+        except OSError as e:
+            self.dirty = True
+            logger.error(f"Could not save camera registry {self.path}: {e}")
+
+    def run_saver(self, health=None, interval: float = SAVE_INTERVAL) -> threading.Thread:
+        """Save every `interval` seconds, refreshing health from `health()` first."""
+        def loop():
+            while True:
+                time.sleep(interval)
+                if health is not None:
+                    self.set_health(health())
+                self.save()
+        t = threading.Thread(target=loop, daemon=True)
+        t.start()
+        return t
@@ -0,0 +1,127 @@
+"""
+Local re-serving of the camera streams the recorder is already pulling
+
+The camera radios are weak (AP mode, one channel) and every extra client of
+`http://{ip}:8080` costs recording fps, so viewers, analytics jobs and
+dashboards read from the recorder instead:
+
+    GET /cams                   JSON list of relayed cameras
+    GET /cam/<id>/stream        multipart/x-mixed-replace;boundary=openmv,
+                                same framing as the camera
+    GET /cam/<id>/latest.jpg    the newest frame (O(1), cached)
+
+Each camera has one FrameHub fed by the native ingest loop (mjpeg_ingest.py).
+A frame is copied out of the parser buffer once into an immutable bytes object
+that every subscriber shares; each subscriber has a small bounded queue that
+drops its oldest frame when full, so a slow viewer falls behind on its own and
+never slows ingest or the other viewers.
+
+Only the native backend feeds the relay (ffmpeg writes straight to disk).
+"""
+
+import asyncio
+import json
+import time
+
+QUEUE_FRAMES = 4                       # frames buffered per subscriber
+BOUNDARY = b"openmv"
+
+
+class FrameHub:
+    """Latest frame and subscriber queues of one camera (event-loop only)."""
+
+    def __init__(self, cam_id: str):
+        self.cam_id = cam_id
+        self.latest = None                             # (part header, jpeg bytes)
+        self.latest_ts = 0.0
+        self.seq = 0
+        self.subscribers = set()
+        self.dropped = 0                               # frames dropped for slow subscribers
+
+    def publish(self, jpeg, ts: float) -> None:
+        """Share a new frame (a view into the parser buffer is fine: it is copied once)."""
+        frame = bytes(jpeg)
+        header = (b"\r\n--" + BOUNDARY + b"\r\nContent-Type: image/jpeg\r\nContent-Length:"
+                  + str(len(frame)).encode() + b"\r\n\r\n")
+        self.latest, self.latest_ts = (header, frame), ts
+        self.seq += 1
+        for q in self.subscribers:
+            if q.full():
+                q.get_nowait()                         # drop-oldest
+                self.dropped += 1
+            q.put_nowait(self.latest)
+
+    def subscribe(self) -> asyncio.Queue:
+        q = asyncio.Queue(QUEUE_FRAMES)
+        if self.latest is not None:
+            q.put_nowait(self.latest)                  # start with the newest frame
+        self.subscribers.add(q)
+        return q
+
+    def unsubscribe(self, q: asyncio.Queue) -> None:
+        self.subscribers.discard(q)
+
+
+class Relay:
+    """FrameHubs by camera id."""
+
+    def __init__(self):
+        self.hubs = {}
+
+    def hub(self, cam_id: str) -> FrameHub:
+        h = self.hubs.get(cam_id)
+        if h is None:
+            h = self.hubs[cam_id] = FrameHub(cam_id)
+        return h
+
+    def snapshot(self) -> list:
+        now = time.time()
+        return [{"camera": h.cam_id, "frames": h.seq, "subscribers": len(h.subscribers),
+                 "dropped": h.dropped,
+                 "latest_age_seconds": now - h.latest_ts if h.latest is not None else None}
+                for h in list(self.hubs.values())]
+
+
+def add_routes(app, relay: Relay) -> None:
+    """Register /cams, /cam/<id>/stream and /cam/<id>/latest.jpg on an aiohttp application."""
+    from aiohttp import web
+
+    def hub_or_404(request) -> FrameHub:
+        h = relay.hubs.get(request.match_info["cam_id"])
+        if h is None:
+            raise web.HTTPNotFound(text="camera not relayed\n")
+        return h
+
+    async def cams(request):
+        return web.Response(text=json.dumps(relay.snapshot(), indent=1),
+                            content_type="application/json")
+
+    async def latest(request):
+        h = hub_or_404(request)
+        if h.latest is None:
+            raise web.HTTPServiceUnavailable(text="no frame yet\n", headers={"Retry-After": "1"})
+        return web.Response(body=h.latest[1], content_type="image/jpeg",
+                            headers={"Cache-Control": "no-cache",
+                                     "X-Frame-Timestamp": f"{h.latest_ts:.6f}"})
+
+    async def stream(request):
+        h = hub_or_404(request)
+        resp = web.StreamResponse(headers={
+            "Content-Type": "multipart/x-mixed-replace;boundary=" + BOUNDARY.decode(),
+            "Cache-Control": "no-cache", "Pragma": "no-cache"})
+        await resp.prepare(request)
+        q = h.subscribe()
+        try:
+            while True:
+                header, frame = await q.get()
+                await resp.write(header)
+                await resp.write(frame)
+        except ConnectionError:
+            pass
+        finally:
+            h.unsubscribe(q)
+        return resp
+
+    app.router.add_get("/cams", cams)
+    app.router.add_get("/cam/{cam_id}/stream", stream)
+    app.router.add_get("/cam/{cam_id}/latest.jpg", latest)
@@ -0,0 +1,77 @@
+"""
+"Segment closed" events for everything that post-processes recordings
+
+A segment is finished once its recorder will never write to it again.  Both
+backends report that through one SegmentEvents object:
+
+ • native backend: mjpeg_ingest's SegmentFile calls `closed()` when it rolls
+   over or a camera stops;
+ • ffmpeg backend: FFmpeg does not tell us, so Mp4Watcher polls
+   `OUT_ROOT/<cam_id>/` and reports an MP4 once a newer one exists in the same
+   directory (the segmenter only opens the next file after closing the last).
+
+Subscribers (activity gate, transcoder, …) are called as `fn(cam_id, path)`
+on the thread that produced the event, in subscription order, so they must be
+quick or hand the work off.
+"""
+
+import logging
+import pathlib
+import threading
+import time
+
+logger = logging.getLogger('sipbuddy')
+
+
+class SegmentEvents:
+    """Fan-out of closed-segment notifications."""
+
+    def __init__(self):
+        self.subscribers = []
+        self._lock = threading.Lock()
+
+    def subscribe(self, fn) -> None:
+        with self._lock:
+            self.subscribers = self.subscribers + [fn]
+
+    def closed(self, cam_id: str, path) -> None:
+        path = pathlib.Path(path)
+        for fn in self.subscribers:
+            try:
+                fn(cam_id, path)
+            except Exception:
+                logger.exception(f"[{cam_id}] segment-closed handler failed for {path.name}")
+
+
+class Mp4Watcher(threading.Thread):
+    """Report the MP4 segments the ffmpeg backend finishes under `root`.
+
+    Only segments written after the watcher started are reported.
+    """
+
+    def __init__(self, root: pathlib.Path, events: SegmentEvents, interval: float = 5.0):
+        super().__init__(daemon=True)
+        self.root = pathlib.Path(root)
+        self.events = events
+        self.interval = interval
+        self.started = time.time()
+        self.seen = set()
+
+    def run(self) -> None:
+        while True:
+            self.poll()
+            time.sleep(self.interval)
+
+    def poll(self) -> None:
+        for cam_dir in sorted(p for p in self.root.iterdir() if p.is_dir()):
+            segs = sorted(cam_dir.glob("*.mp4"))
+            for path in segs[:-1]:
+                if path in self.seen:
+                    continue
+                self.seen.add(path)
+                try:
+                    if path.stat().st_mtime < self.started:
+                        continue
+                except FileNotFoundError:
+                    continue
+                self.events.closed(cam_dir.name, path)
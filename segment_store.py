@@ -0,0 +1,376 @@
+#!/usr/bin/env python3
+"""
+Indexed raw-MJPEG segments
+
+A segment is two files side by side:
+
+    20250101_120000_000.mjpeg   the JPEG frames, back to back, exactly as received
+    20250101_120000_000.idx     8-byte magic + one record per frame:
+                                (offset, size, arrival time in µs since the epoch)
+                                as three little-endian uint64
+
+ • SegmentWriter appends a frame and its index record; nothing is rewritten,
+   so a crash loses at most the frames not yet indexed.
+ • SegmentReader memory-maps both files: frame N and "the frame at time T"
+   (binary search over the timestamps) come back as memoryview slices of the
+   mapping – no copy, no decode, O(log n).
+ • to_mp4 / from_mp4 convert to and from the MP4 files the ffmpeg backend
+   writes, without re-encoding when the MP4 holds MJPEG.
+
+CLI:
+    python segment_store.py info   SEG.mjpeg
+    python segment_store.py frame  SEG.mjpeg (--index N | --time EPOCH) -o out.jpg
+    python segment_store.py sample recordings/cam_id -n 100 -o samples/
+    python segment_store.py to-mp4   SEG.mjpeg out.mp4
+    python segment_store.py from-mp4 in.mp4 SEG.mjpeg
+"""
+
+import argparse
+import bisect
+import datetime
+import mmap
+import os
+import pathlib
+import random
+import struct
+import subprocess
+import sys
+import time
+
+INDEX_MAGIC = b"SBIDX001"
+RECORD = struct.Struct("<QQQ")                 # offset, size, timestamp_us
+FIELDS = 3                                     # uint64 per record
+DATA_SUFFIX = ".mjpeg"
+INDEX_SUFFIX = ".idx"
+
+_SOI, _EOI = b"\xff\xd8", b"\xff\xd9"
+
+
+def index_path(data_path) -> pathlib.Path:
+    return pathlib.Path(data_path).with_suffix(INDEX_SUFFIX)
+
+
+class SegmentWriter:
+    """Append JPEG frames to `path` (.mjpeg) and their records to its .idx."""
+
+    def __init__(self, path):
+        self.path = pathlib.Path(path)
+        # unbuffered: a frame's bytes reach the page cache before its record,
+        # so readers (and crash recovery) always see a consistent prefix
+        self.data = open(self.path, "wb", buffering=0)
+        self.index = open(index_path(self.path), "wb", buffering=0)
+        self.index.write(INDEX_MAGIC)
+        self.record = bytearray(RECORD.size)
+        self.offset = 0
+        self.frames = 0
+        self.first_ts = self.last_ts = None
+
+    def write(self, jpeg, ts: float) -> None:
+        """Append one frame that arrived at `ts` (epoch seconds)."""
+        size = len(jpeg)
+        ts_us = int(ts * 1_000_000)
+        self.data.write(jpeg)
+        RECORD.pack_into(self.record, 0, self.offset, size, ts_us)
+        self.index.write(self.record)
+        self.offset += size
+        self.frames += 1
+        if self.first_ts is None:
+            self.first_ts = ts
+        self.last_ts = ts
+
+    def close(self) -> None:
+        if self.data.closed:
+            return
+        self.data.close()
+        self.index.close()
+
+
+class _Column:
+    """Read-only sequence over one field of the mapped index (for bisect)."""
+
+    def __init__(self, words: memoryview, field: int):
+        self.words, self.field = words, field
+
+    def __len__(self):
+        return len(self.words) // FIELDS
+
+    def __getitem__(self, i):
+        return self.words[i * FIELDS + self.field]
+
+
+class SegmentReader:
+    """Random access to the frames of one segment through mmap."""
+
+    def __init__(self, path):
+        if sys.byteorder != "little":
+            raise RuntimeError("segment indexes are little-endian; big-endian hosts are not supported")
+        self.path = pathlib.Path(path)
+        self._data_f = open(self.path, "rb")
+        self._index_f = open(index_path(self.path), "rb")
+        self._data = self._map(self._data_f)
+        self._index = self._map(self._index_f)
+        if self._index[:len(INDEX_MAGIC)] != INDEX_MAGIC:
+            self.close()
+            raise ValueError(f"{index_path(self.path)}: not a segment index")
+        n = (len(self._index) - len(INDEX_MAGIC)) // RECORD.size
+        self._index_view = memoryview(self._index)
+        words = self._index_view[len(INDEX_MAGIC):len(INDEX_MAGIC) + n * RECORD.size].cast("Q")
+        # a crash can leave the last records pointing past the data: ignore them
+        while n and words[(n - 1) * FIELDS] + words[(n - 1) * FIELDS + 1] > len(self._data):
+            n -= 1
+        self._words = words[:n * FIELDS]
+        words.release()
+        self._view = memoryview(self._data)
+        self.timestamps_us = _Column(self._words, 2)
+
+    @staticmethod
+    def _map(f):
+        if os.fstat(f.fileno()).st_size == 0:
+            return b""
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __len__(self) -> int:
+        return len(self._words) // FIELDS
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def frame(self, i: int) -> memoryview:
+        """JPEG bytes of frame `i` as a view into the mapped segment."""
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        off, size = self._words[i * FIELDS], self._words[i * FIELDS + 1]
+        return self._view[off:off + size]
+
+    def byte_range(self, i: int, j: int) -> tuple:
+        """(start, end) offsets of frames i..j-1, which are contiguous in the data file."""
+        if not 0 <= i < j <= len(self):
+            raise IndexError((i, j))
+        return self._words[i * FIELDS], self._words[(j - 1) * FIELDS] + self._words[(j - 1) * FIELDS + 1]
+
+    def timestamp(self, i: int) -> float:
+        return self.timestamps_us[i] / 1_000_000
+
+    def index_at(self, ts: float) -> int:
+        """Index of the last frame that arrived at or before `ts` (0 if none)."""
+        i = bisect.bisect_right(self.timestamps_us, int(ts * 1_000_000)) - 1
+        return max(i, 0)
+
+    def frame_at(self, ts: float) -> memoryview:
+        return self.frame(self.index_at(ts))
+
+    @property
+    def start(self) -> float:
+        return self.timestamp(0) if len(self) else 0.0
+
+    @property
+    def end(self) -> float:
+        return self.timestamp(len(self) - 1) if len(self) else 0.0
+
+    def close(self) -> None:
+        """Unmap the segment; views returned by frame() must be released first."""
+        for v in ("_words", "_index_view", "_view"):
+            if hasattr(self, v):
+                getattr(self, v).release()
+        for m in (self._data, self._index):
+            if isinstance(m, mmap.mmap):
+                m.close()
+        self._data_f.close()
+        self._index_f.close()
+
+
+def segment_files(path) -> tuple:
+    """The files a segment consists of (.mjpeg + .idx, or a single MP4)."""
+    path = pathlib.Path(path)
+    return (path, index_path(path)) if path.suffix == DATA_SUFFIX else (path,)
+
+
+def segment_bytes(path) -> int:
+    total = 0
+    for p in segment_files(path):
+        try:
+            total += p.stat().st_size
+        except FileNotFoundError:
+            pass
+    return total
+
+
+def remove_segment(path) -> None:
+    for p in segment_files(path):
+        try:
+            p.unlink()
+        except FileNotFoundError:
+            pass
+
+
+def iter_segments(root):
+    """Every indexed segment below `root`, oldest name first."""
+    for path in sorted(pathlib.Path(root).rglob("*" + DATA_SUFFIX)):
+        if index_path(path).exists():
+            yield path
+
+
+# ───── MP4 conversion (needs ffmpeg / ffprobe in PATH) ─────────────────────
+def to_mp4(seg_path, mp4_path) -> None:
+    """Stream-copy a segment into an MP4 at the segment's average frame rate."""
+    with SegmentReader(seg_path) as seg:
+        n, duration = len(seg), seg.end - seg.start
+    fps = (n - 1) / duration if n > 1 and duration > 0 else 15
+    subprocess.run([
+        "ffmpeg", "-hide_banner", "-loglevel", "error", "-y",
+        "-f", "mjpeg", "-framerate", f"{fps:.3f}",
+        "-i", str(seg_path),
+        "-c", "copy",
+        str(mp4_path),
+    ], check=True)
+
+
+def _probe_times(mp4_path) -> list:
+    out = subprocess.run([
+        "ffprobe", "-v", "error", "-select_streams", "v:0",
+        "-show_entries", "packet=pts_time", "-of", "csv=p=0", str(mp4_path),
+    ], check=True, capture_output=True, text=True).stdout
+    return sorted(float(t) for t in out.split() if t and t != "N/A")
+
+
+def _split_jpegs(stream):
+    """Yield complete JPEGs from a concatenated stream of them."""
+    pending = b""
+    for chunk in iter(lambda: stream.read(1 << 16), b""):
+        pending += chunk
+        start = 0
+        while True:
+            e = pending.find(_EOI + _SOI, start)
+            if e < 0:
+                break
+            yield pending[start:e + 2]
+            start = e + 2
+        pending = pending[start:]
+    if pending.startswith(_SOI):
+        yield pending
+
+
+def from_mp4(mp4_path, seg_path, start: float = None) -> int:
+    """Write an MP4's video frames as a segment; returns the frame count.
+
+    Frame times are `start` + packet pts; `start` defaults to the MP4's mtime
+    minus its duration (the ffmpeg segmenter closes a file when it ends).
+    MJPEG streams are copied as-is, anything else is encoded to JPEG.
+    """
+    times = _probe_times(mp4_path)
+    codec = subprocess.run([
+        "ffprobe", "-v", "error", "-select_streams", "v:0",
+        "-show_entries", "stream=codec_name", "-of", "csv=p=0", str(mp4_path),
+    ], check=True, capture_output=True, text=True).stdout.strip()
+    if start is None:
+        start = os.stat(mp4_path).st_mtime - (times[-1] - times[0] if times else 0)
+    base = times[0] if times else 0.0
+    proc = subprocess.Popen([
+        "ffmpeg", "-hide_banner", "-loglevel", "error",
+        "-i", str(mp4_path), "-map", "0:v:0",
+        *(["-c", "copy"] if codec == "mjpeg" else ["-c:v", "mjpeg", "-q:v", "4"]),
+        "-f", "mjpeg", "pipe:1",
+    ], stdout=subprocess.PIPE)
+    writer = SegmentWriter(seg_path)
+    try:
+        for i, jpeg in enumerate(_split_jpegs(proc.stdout)):
+            t = times[i] if i < len(times) else (times[-1] if times else 0.0)
+            writer.write(jpeg, start + t - base)
+    finally:
+        writer.close()
+        proc.stdout.close()
+        if proc.wait():
+            raise subprocess.CalledProcessError(proc.returncode, "ffmpeg")
+    return writer.frames
+
+
+# ───── CLI ─────────────────────────────────────────────────────────────────
+def _fmt(ts: float) -> str:
+    return datetime.datetime.fromtimestamp(ts, datetime.timezone.utc).strftime("%Y-%m-%d %H:%M:%S.%f")[:-3]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SipBuddy indexed MJPEG segments")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("info", help="frame count, time span and size of a segment")
+    p.add_argument("segment")
+    p = sub.add_parser("frame", help="extract one frame as a .jpg")
+    p.add_argument("segment")
+    g = p.add_mutually_exclusive_group(required=True)
+    g.add_argument("--index", type=int)
+    g.add_argument("--time", type=float, help="epoch seconds")
+    p.add_argument("-o", "--output", required=True)
+    p = sub.add_parser("sample", help="copy N random frames from every segment below DIR")
+    p.add_argument("root")
+    p.add_argument("-n", type=int, default=100)
+    p.add_argument("-o", "--output", required=True)
+    p.add_argument("--seed", type=int)
+    p = sub.add_parser("to-mp4")
+    p.add_argument("segment")
+    p.add_argument("mp4")
+    p = sub.add_parser("from-mp4")
+    p.add_argument("mp4")
+    p.add_argument("segment")
+    p.add_argument("--start", type=float, help="epoch seconds of the first frame")
+    args = parser.parse_args()
+
+    if args.cmd == "info":
+        with SegmentReader(args.segment) as seg:
+            n = len(seg)
+            span = seg.end - seg.start
+            print(f"{args.segment}: {n} frames, {os.path.getsize(args.segment) / 1e6:.1f} MB")
+            if n:
+                print(f"  {_fmt(seg.start)} → {_fmt(seg.end)}  ({span:.1f} s, "
+                      f"{(n - 1) / span if span > 0 else 0:.1f} fps)")
+    elif args.cmd == "frame":
+        with SegmentReader(args.segment) as seg:
+            i = args.index if args.index is not None else seg.index_at(args.time)
+            jpeg = seg.frame(i)
+            with open(args.output, "wb") as f:
+                f.write(jpeg)
+            jpeg.release()
+            print(f"frame {i} @ {_fmt(seg.timestamp(i))} → {args.output}")
+    elif args.cmd == "sample":
+        rng = random.Random(args.seed)
+        segments = list(iter_segments(args.root))
+        counts = []
+        for path in segments:
+            with SegmentReader(path) as seg:
+                counts.append(len(seg))
+        total = sum(counts)
+        out = pathlib.Path(args.output)
+        out.mkdir(parents=True, exist_ok=True)
+        t0 = time.perf_counter()
+        picks = sorted(rng.sample(range(total), min(args.n, total)))
+        si, base = 0, 0
+        seg = None
+        for k in picks:
+            while k >= base + counts[si]:
+                base += counts[si]
+                si += 1
+                if seg is not None:
+                    seg.close()
+                    seg = None
+            if seg is None:
+                seg = SegmentReader(segments[si])
+            jpeg = seg.frame(k - base)
+            (out / f"{segments[si].stem}_{k - base:06d}.jpg").write_bytes(jpeg)
+            jpeg.release()
+        if seg is not None:
+            seg.close()
+        print(f"sampled {len(picks)} of {total} frames from {len(segments)} segments "
+              f"in {time.perf_counter() - t0:.2f} s → {out}")
+    elif args.cmd == "to-mp4":
+        to_mp4(args.segment, args.mp4)
+    elif args.cmd == "from-mp4":
+        n = from_mp4(args.mp4, args.segment, args.start)
+        print(f"{n} frames → {args.segment}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,395 @@
+"""
+Multi-process sharded recording: one coordinator, N ingest workers
+
+With the native backend everything (parsing, segment writes, motion
+scoring, telemetry) runs under one GIL.  `--workers N` splits it:
+
+ • The coordinator (the joe_try_this_one.py process) keeps UDP discovery,
+   the camera registry, the supervisor, the catalog / retention and the
+   HTTP endpoint.  ShardedBackend is its supervisor backend: `start(cam)`
+   sends the camera to the worker that owns its MAC on a consistent-hash
+   ring (VNODES points per worker), `stop(key)` waits for that worker to
+   close the camera's segment.
+ • Each worker is a spawned process with its own IngestEngine (and
+   activity gate).  Over one shared queue it reports back telemetry
+   snapshots every METRICS_INTERVAL, closed segments (fed into the
+   coordinator's SegmentEvents, so the catalog sees every segment), motion
+   scores / dropped segments and stop acknowledgements.
+ • The coordinator's CameraStates follow the workers' telemetry, so the
+   registry's health and the warm-start report work as in one process.
+ • A dead worker leaves the ring: only its cameras move, to the survivors,
+   straight away.  It is respawned after RESPAWN_DELAY, rejoins the ring and
+   takes the same share back.  A worker whose coordinator is gone exits.
+
+/metrics(.json) serve the merged worker snapshots; /workers.json lists the
+workers with their pid, cameras and restarts.  Frames stay in the workers,
+so the local relay (/cam/<id>/...) and --dedup are in-process only.  With
+--write-behind every worker runs its own disk writer with its share of the
+buffer; its /disk.json is in-process only too.
+
+shutdown(timeout) tells every worker to close its segments and drain its
+disk writer at once, and terminates those still busy at the deadline (the
+open-segment journal, recovery.py, has their segments); no worker is
+respawned after it.  retune / set_segment_seconds are forwarded to the
+owning worker / every worker.
+"""
+
+import bisect
+import hashlib
+import logging
+import multiprocessing as mp
+import os
+import pathlib
+import queue
+import threading
+import time
+
+from supervisor import camera_key
+
+logger = logging.getLogger('sipbuddy')
+
+VNODES = 64                            # ring points per worker
+METRICS_INTERVAL = 1.0                 # seconds between worker telemetry reports
+RESPAWN_DELAY = 2.0                    # seconds before a dead worker is replaced
+STOP_TIMEOUT = 15.0                    # max wait for a worker to close a camera
+EXIT_GRACE = 1.0                       # seconds a terminated worker gets to go
+
+
+def _hash(s: str) -> int:
+    return int.from_bytes(hashlib.blake2b(s.encode(), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    """Consistent-hash ring: keys map to nodes, adding or removing a node
+    only moves the keys next to its points."""
+
+    def __init__(self, vnodes: int = VNODES):
+        self.vnodes = vnodes
+        self.points = []                               # sorted (hash, node)
+        self.hashes = []
+        self.nodes = set()
+
+    def add(self, node) -> None:
+        if node in self.nodes:
+            return
+        self.nodes.add(node)
+        for i in range(self.vnodes):
+            bisect.insort(self.points, (_hash(f"{node}#{i}"), node))
+        self.hashes = [h for h, _ in self.points]
+
+    def remove(self, node) -> None:
+        if node not in self.nodes:
+            return
+        self.nodes.discard(node)
+        self.points = [p for p in self.points if p[1] != node]
+        self.hashes = [h for h, _ in self.points]
+
+    def lookup(self, key: str):
+        """The node owning `key`, None on an empty ring."""
+        if not self.points:
+            return None
+        i = bisect.bisect(self.hashes, _hash(key)) % len(self.points)
+        return self.points[i][1]
+
+    def __len__(self) -> int:
+        return len(self.nodes)
+
+
+# ───── worker process ──────────────────────────────────────────────────────
+def worker_main(index: int, inbox, outbox, config: dict) -> None:
+    """Record the cameras the coordinator sends until told to exit or orphaned."""
+    from activity import ActivityMonitor
+    from disk_writer import DiskWriter
+    from mjpeg_ingest import IngestEngine
+    from recovery import OpenJournal
+    from segment_events import SegmentEvents
+    from telemetry import MetricsRegistry
+
+    metrics = MetricsRegistry()
+    events = SegmentEvents()
+    events.subscribe(lambda cam_id, path: outbox.put(("closed", cam_id, str(path))))
+    activity = None
+    if config.get("activity"):
+        activity = ActivityMonitor(config["segment_seconds"], **config["activity"],
+                                   on_score=lambda path, score: outbox.put(("scored", str(path), score)),
+                                   on_drop=lambda path: outbox.put(("dropped", str(path))))
+    disk = None
+    if config.get("disk"):
+        disk = DiskWriter(**config["disk"])
+        disk.start()
+    journal = OpenJournal(config["out_root"]) if config.get("journal") else None
+    engine = IngestEngine(pathlib.Path(config["out_root"]), config["segment_seconds"],
+                          metrics, None, activity, events, disk=disk, journal=journal)
+    engine.start_in_thread()
+    ids = {}                                           # camera key -> cam id
+    due = time.monotonic()
+    while os.getppid() == config["parent"]:
+        try:
+            cmd = inbox.get(timeout=max(0.0, due - time.monotonic()))
+        except queue.Empty:
+            cmd = None
+        if cmd is not None:
+            op, arg = cmd
+            if op == "start":
+                ids[camera_key(arg)] = arg["id"]
+                engine.start(arg)
+            elif op == "stop":
+                engine.stop(arg)
+                metrics.cameras.pop(ids.pop(arg, None), None)
+                outbox.put(("stopped", index, arg))
+            elif op == "retune":
+                engine.retune(camera_key(arg), arg)
+            elif op == "segment_seconds":
+                engine.set_segment_seconds(arg)
+            elif op == "exit":                         # arg: seconds to finish in
+                engine.shutdown(arg)
+                outbox.put(("metrics", index, metrics.snapshot()))
+                return
+        if time.monotonic() >= due:
+            outbox.put(("metrics", index, metrics.snapshot()))
+            due = time.monotonic() + METRICS_INTERVAL
+
+
+class Worker:
+    """Coordinator-side handle of one worker process."""
+
+    def __init__(self, ctx, index: int, outbox, config: dict):
+        self.index = index
+        self.inbox = ctx.Queue()
+        self.process = ctx.Process(target=worker_main, name=f"sipbuddy-worker-{index}",
+                                   args=(index, self.inbox, outbox, config), daemon=True)
+        self.process.start()
+        self.snapshots = []
+        self.restarts = 0
+        self.dead_since = None
+
+    def send(self, op: str, arg) -> None:
+        self.inbox.put((op, arg))
+
+
+# ───── coordinator ─────────────────────────────────────────────────────────
+class ShardMetrics:
+    """The workers' latest telemetry, shaped like telemetry.MetricsRegistry."""
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    def snapshot(self) -> list:
+        return [s for w in list(self.backend.workers.values()) if w.dead_since is None
+                for s in w.snapshots]
+
+
+class ShardedBackend:
+    """Supervisor backend spreading cameras over worker processes."""
+
+    def __init__(self, out_root: pathlib.Path, segment_seconds: float, workers: int,
+                 events=None, activity: dict = None, on_score=None, on_drop=None,
+                 disk: dict = None, journal: bool = False):
+        self.events = events                           # segment_events.SegmentEvents, optional
+        self.on_score, self.on_drop = on_score, on_drop
+        self.config = {"out_root": str(out_root), "segment_seconds": segment_seconds,
+                       "activity": activity, "disk": disk, "journal": journal,
+                       "parent": os.getpid()}
+        self.ctx = mp.get_context("spawn")             # no fork of a threaded process
+        self.outbox = self.ctx.Queue()
+        self.ring = HashRing()
+        self.workers = {}
+        for i in range(workers):
+            self.workers[i] = Worker(self.ctx, i, self.outbox, self.config)
+            self.ring.add(i)
+        self.cameras = {}                              # key -> (cam, CameraState)
+        self.owner = {}                                # key -> worker index
+        self.by_id = {}                                # cam id -> key
+        self.seen_bytes = {}                           # (key, worker) -> bytes reported
+        self.acks = {}                                 # (worker, key) -> Event
+        self.metrics = ShardMetrics(self)
+        self._lock = threading.RLock()
+        self.loop = None                               # no event loop in the coordinator
+        self.closing = False                           # shutting down: no respawns
+        threading.Thread(target=self._pump, daemon=True).start()
+        threading.Thread(target=self._monitor, daemon=True).start()
+
+    # ── supervisor backend interface ───────────────────────────────────────
+    def start(self, cam: dict, state) -> None:
+        key = camera_key(cam)
+        with self._lock:
+            self.cameras[key] = (dict(cam), state)
+            self.by_id[cam["id"]] = key
+            self._assign(key)
+
+    def stop(self, key: str) -> None:
+        with self._lock:
+            self.cameras.pop(key, None)
+            index = self.owner.pop(key, None)
+            if index is not None:
+                self._stop_on(index, key)
+
+    def retune(self, key: str, cam: dict) -> None:
+        with self._lock:
+            entry = self.cameras.get(key)
+            if entry is None:
+                return
+            entry[0].update(cam)
+            index = self.owner.get(key)
+            if index is not None:
+                self.workers[index].send("retune", entry[0])
+
+    def set_segment_seconds(self, seconds: float) -> None:
+        with self._lock:
+            self.config["segment_seconds"] = seconds   # respawned workers start with it
+            for w in self.workers.values():
+                if w.dead_since is None:
+                    w.send("segment_seconds", seconds)
+
+    def shutdown(self, timeout: float) -> bool:
+        """Close every worker's segments within `timeout` seconds; False if
+        a worker had to be terminated."""
+        deadline = time.monotonic() + timeout
+        with self._lock:
+            self.closing = True
+            workers = [w for w in self.workers.values() if w.dead_since is None]
+            for w in workers:
+                w.send("exit", timeout)
+            self.cameras.clear()
+            self.owner.clear()
+        for w in workers:
+            w.process.join(max(0.0, deadline - time.monotonic()))
+        late = [w for w in workers if w.process.is_alive()]
+        for w in late:
+            logger.error(f"worker {w.index} (pid {w.process.pid}) still busy after {timeout:g} s: terminating")
+            w.process.terminate()
+            w.process.join(EXIT_GRACE)
+        while not self.outbox.empty() and time.monotonic() < deadline:
+            time.sleep(0.05)                           # let the pump announce the last segments
+        return not late
+
+    # ── placement ──────────────────────────────────────────────────────────
+    def _assign(self, key: str) -> None:
+        index = self.ring.lookup(key)
+        if index is None:                              # every worker is down
+            return
+        self.owner[key] = index
+        self.workers[index].send("start", self.cameras[key][0])
+
+    def _stop_on(self, index: int, key: str) -> None:
+        self.seen_bytes.pop((key, index), None)        # its next run there counts from 0
+        w = self.workers[index]
+        if w.dead_since is not None:
+            return
+        ack = self.acks[(index, key)] = threading.Event()
+        w.send("stop", key)
+        if not ack.wait(STOP_TIMEOUT):
+            logger.error(f"worker {index} did not stop {key} within {STOP_TIMEOUT:g} s")
+        self.acks.pop((index, key), None)
+
+    def _rebalance(self) -> None:
+        """Move every camera whose ring owner changed (stop first, then start).
+
+        The stops are waited for without the placement lock, so start / stop
+        of other cameras are not held up behind them."""
+        with self._lock:
+            moves = [(key, self.owner.pop(key, None)) for key in list(self.cameras)
+                     if self.ring.lookup(key) != self.owner.get(key)]
+        for key, old in moves:
+            if old is not None:
+                self._stop_on(old, key)
+        moved = 0
+        with self._lock:
+            for key, _ in moves:                       # unless stopped or placed meanwhile
+                if key in self.cameras and key not in self.owner and self.ring.lookup(key) is not None:
+                    self._assign(key)
+                    moved += 1
+        if moved:
+            logger.info(f"Rebalanced {moved} cameras over {len(self.ring)} workers")
+
+    # ── worker supervision ────────────────────────────────────────────────
+    def _monitor(self) -> None:
+        while not self.closing:
+            time.sleep(0.5)
+            for w in list(self.workers.values()):
+                if self.closing:
+                    return
+                if w.dead_since is None and not w.process.is_alive():
+                    logger.error(f"worker {w.index} (pid {w.process.pid}) died "
+                                 f"with exit code {w.process.exitcode}; moving its cameras")
+                    w.dead_since = time.monotonic()
+                    for (index, _), ack in list(self.acks.items()):
+                        if index == w.index:
+                            ack.set()
+                    self.ring.remove(w.index)
+                    with self._lock:
+                        for key in [k for k, i in self.owner.items() if i == w.index]:
+                            del self.owner[key]
+                    self._rebalance()
+                elif w.dead_since is not None and time.monotonic() - w.dead_since >= RESPAWN_DELAY:
+                    fresh = Worker(self.ctx, w.index, self.outbox, self.config)
+                    fresh.restarts = w.restarts + 1
+                    for seen in [k for k in list(self.seen_bytes) if k[1] == w.index]:
+                        del self.seen_bytes[seen]      # the new process counts from 0
+                    self.workers[w.index] = fresh
+                    self.ring.add(w.index)
+                    logger.info(f"worker {w.index} respawned (pid {fresh.process.pid})")
+                    self._rebalance()
+
+    def _pump(self) -> None:
+        """Apply what the workers report (one thread, never takes the placement lock)."""
+        while True:
+            msg = self.outbox.get()
+            kind = msg[0]
+            try:
+                if kind == "metrics":
+                    self._metrics(msg[1], msg[2])
+                elif kind == "closed":
+                    if self.events is not None:
+                        self.events.closed(msg[1], pathlib.Path(msg[2]))
+                elif kind == "scored":
+                    if self.on_score is not None:
+                        self.on_score(pathlib.Path(msg[1]), msg[2])
+                elif kind == "dropped":
+                    if self.on_drop is not None:
+                        self.on_drop(pathlib.Path(msg[1]))
+                elif kind == "stopped":
+                    ack = self.acks.get((msg[1], msg[2]))
+                    if ack is not None:
+                        ack.set()
+            except Exception:
+                logger.exception(f"handling worker message {kind!r} failed")
+
+    def _metrics(self, index: int, snapshots: list) -> None:
+        w = self.workers.get(index)
+        if w is None:
+            return
+        w.snapshots = snapshots
+        for s in snapshots:                            # mirror into the supervisor's states
+            key = self.by_id.get(s["camera"])
+            entry = self.cameras.get(key)
+            if entry is None or self.owner.get(key) != index:
+                continue
+            state = entry[1]
+            last = self.seen_bytes.get((key, index), 0)
+            self.seen_bytes[(key, index)] = s["bytes"]
+            if s["bytes"] > last:
+                state.progress(s["bytes"] - last)
+            elif s["state"] not in ("unknown", state.state):
+                state.transition(s["state"], f"worker {index}")
+            state.reconnects = max(state.reconnects, s["reconnects"])
+
+    def snapshot(self) -> list:
+        counts = {}
+        for index in list(self.owner.values()):
+            counts[index] = counts.get(index, 0) + 1
+        return [{"worker": w.index, "pid": w.process.pid, "alive": w.dead_since is None,
+                 "cameras": counts.get(w.index, 0), "restarts": w.restarts}
+                for w in list(self.workers.values())]
+
+
+def add_routes(app, backend: ShardedBackend) -> None:
+    """Register /workers.json on an aiohttp application."""
+    import json
+    from aiohttp import web
+
+    async def workers(request):
+        return web.Response(text=json.dumps(backend.snapshot(), indent=1),
+                            content_type="application/json")
+
+    app.router.add_get("/workers.json", workers)
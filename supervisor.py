@@ -0,0 +1,192 @@
+"""
+Camera supervision: one recorder per MAC, explicit states, jittered backoff
+
+    connecting ──first bytes──▶ streaming ──no bytes for STALL_SECONDS──▶ stalled
+        ▲                           │                                     │
+        └────── backoff ◀───────────┴──── error / stream ended ◀──────────┘
+
+ • CameraState is the state machine plus the bytes-received watchdog the
+   recorder loops (native and ffmpeg) update as data arrives.
+ • Backoff is exponential with jitter, so when the AP blips the cameras do
+   not all reconnect in lockstep.
+ • Supervisor owns the MAC → recorder map.  A registration with a new IP stops
+   the old recorder (and waits for it) before the new one starts, so a camera
+   is never written to `recordings/<cam_id>` twice.
+
+A backend is any object with `start(cam, state)` and `stop(key)`; `stop` must
+not return while the old recorder can still write.  Optionally:
+`shutdown(timeout)` stops every recorder at once and returns False if one
+was still writing after `timeout` seconds (otherwise Supervisor.shutdown
+stops them one by one), and `retune(key, cam)` applies changed settings to a
+running recorder without reconnecting it.
+"""
+
+import logging
+import random
+import threading
+import time
+
+logger = logging.getLogger('sipbuddy')
+
+CONNECTING = "connecting"
+STREAMING = "streaming"
+STALLED = "stalled"
+BACKOFF = "backoff"
+STOPPED = "stopped"
+
+STALL_SECONDS = 10.0                   # no bytes for this long → stalled
+BACKOFF_BASE = 1.0                     # first retry delay (seconds)
+BACKOFF_CAP = 60.0                     # longest retry delay (seconds)
+HEALTHY_SECONDS = 30.0                 # streaming this long resets the backoff
+
+
+def camera_key(cam: dict) -> str:
+    """Stable identity of a camera: its MAC if discovered, otherwise its id."""
+    return cam.get("mac") or cam["id"]
+
+
+class Backoff:
+    """Exponential backoff with 'equal jitter': delay ∈ [d/2, d], d = base·2ⁿ."""
+
+    def __init__(self, base: float = BACKOFF_BASE, cap: float = BACKOFF_CAP):
+        self.base, self.cap = base, cap
+        self.attempt = 0
+
+    def next(self) -> float:
+        d = min(self.cap, self.base * 2 ** self.attempt)
+        self.attempt += 1
+        return random.uniform(d / 2, d)
+
+    def reset(self) -> None:
+        self.attempt = 0
+
+
+class CameraState:
+    """Connection state machine and watchdog for one camera."""
+
+    def __init__(self, cam: dict):
+        self.cam = cam
+        self.state = STOPPED
+        self.since = time.monotonic()
+        self.last_bytes_at = self.since
+        self.bytes_received = 0
+        self.reconnects = 0
+        self.backoff = Backoff()
+
+    @property
+    def cam_id(self) -> str:
+        return self.cam["id"]
+
+    def transition(self, new: str, reason: str = "") -> None:
+        if new == self.state:
+            return
+        now = time.monotonic()
+        logger.info(f"[{self.cam_id}] {self.state} → {new}" + (f" ({reason})" if reason else ""))
+        self.state, self.since = new, now
+
+    def connecting(self) -> None:
+        self.last_bytes_at = time.monotonic()
+        self.transition(CONNECTING)
+
+    def progress(self, nbytes: int) -> None:
+        """Feed the watchdog: `nbytes` more bytes arrived."""
+        self.bytes_received += nbytes
+        self.last_bytes_at = time.monotonic()
+        if self.state != STREAMING:
+            self.transition(STREAMING)
+
+    def is_stalled(self, timeout: float = STALL_SECONDS) -> bool:
+        return time.monotonic() - self.last_bytes_at > timeout
+
+    def retry_delay(self, reason: str, stalled: bool = False) -> float:
+        """Record a failed/ended connection and return how long to back off."""
+        if self.state == STREAMING and time.monotonic() - self.since >= HEALTHY_SECONDS:
+            self.backoff.reset()
+        if stalled:
+            self.transition(STALLED, reason)
+        self.reconnects += 1
+        delay = self.backoff.next()
+        self.transition(BACKOFF, f"{reason}; retry in {delay:.1f} s")
+        return delay
+
+
+class Supervisor:
+    """Keeps exactly one running recorder per camera key."""
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.states = {}                               # key -> CameraState
+        self.closing = False                           # shutting down: no new recorders
+        self._lock = threading.Lock()
+
+    def submit(self, cam: dict) -> bool:
+        """Record `cam`, replacing a recorder for the same MAC at another address.
+
+        Returns False when the camera is already being recorded as-is.
+        """
+        key = camera_key(cam)
+        with self._lock:
+            if self.closing:
+                return False
+            state = self.states.get(key)
+            if state is not None and state.state != STOPPED:
+                old = state.cam
+                if (old["ip"], str(old.get("port", 8080))) == (cam["ip"], str(cam.get("port", 8080))):
+                    return False
+                logger.info(f"[{cam['id']}] address {old['ip']} → {cam['ip']}: handing off recorder")
+                self.backend.stop(key)
+            if state is None:
+                state = self.states[key] = CameraState(cam)
+            state.cam = dict(cam)
+            state.backoff.reset()
+            state.connecting()
+            self.backend.start(state.cam, state)
+            return True
+
+    def health(self) -> dict:
+        """{key: {state, reconnects[, last_streaming]}} for the camera registry."""
+        wall, now = time.time(), time.monotonic()
+        with self._lock:
+            states = list(self.states.items())
+        health = {}
+        for key, s in states:
+            h = health[key] = {"state": s.state, "reconnects": s.reconnects}
+            if s.bytes_received:
+                h["last_streaming"] = wall - (now - s.last_bytes_at)
+        return health
+
+    def remove(self, key: str) -> None:
+        with self._lock:
+            state = self.states.get(key)
+            if state is not None and state.state != STOPPED:
+                self.backend.stop(key)
+                state.transition(STOPPED, "removed")
+
+    def retune(self, cam: dict) -> bool:
+        """Apply `cam`'s settings to its running recorder (same address);
+        False if it is not running or the backend cannot, so submit it instead."""
+        key = camera_key(cam)
+        with self._lock:
+            state = self.states.get(key)
+            if state is None or state.state == STOPPED or not hasattr(self.backend, "retune"):
+                return False
+            state.cam = dict(cam)
+            self.backend.retune(key, state.cam)
+            return True
+
+    def shutdown(self, timeout: float) -> bool:
+        """Stop every recorder within `timeout` seconds and refuse new ones;
+        False if the deadline was missed."""
+        deadline = time.monotonic() + timeout
+        with self._lock:
+            self.closing = True
+            running = [(k, s) for k, s in self.states.items() if s.state != STOPPED]
+            if hasattr(self.backend, "shutdown"):
+                ok = self.backend.shutdown(timeout)
+            else:
+                for key, _ in running:
+                    self.backend.stop(key)
+                ok = time.monotonic() <= deadline
+            for _, state in running:
+                state.transition(STOPPED, "shutdown")
+        return ok
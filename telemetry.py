@@ -0,0 +1,268 @@
+"""
+Per-camera live telemetry for the recorder
+
+Every camera gets a CameraMetrics object whose storage is allocated once:
+
+ • rings (array.array) of the last WINDOW frame arrival times, frame sizes and
+   disk-write latencies → fps, bytes/s and inter-frame gap percentiles;
+ • fixed-bucket histograms of frame size and disk-write latency (cumulative,
+   Prometheus style);
+ • the supervisor CameraState for connection state and reconnect count;
+ • with stamped frames, per-stage latency histograms, device clock offset /
+   drift and lost frames by where they were lost (frame_timing.FrameTiming).
+
+Recording a frame is a handful of array stores, so the cost per camera is
+flat.  Percentiles are only computed when someone scrapes:
+
+    GET /metrics        Prometheus text exposition format
+    GET /metrics.json   same data as JSON
+"""
+
+import bisect
+import json
+import threading
+import time
+from array import array
+
+WINDOW = 256                           # frames kept for rates and percentiles
+SIZE_BUCKETS = (2048, 4096, 8192, 16384, 32768, 65536, 131072, 262144)        # bytes
+WRITE_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0)     # seconds
+QUANTILES = (0.5, 0.9, 0.99)
+
+
+class Histogram:
+    """Cumulative fixed-bucket histogram (the last slot is +Inf)."""
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = array("Q", bytes(8 * (len(bounds) + 1)))
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, v: float) -> None:
+        self.counts[bisect.bisect_left(self.bounds, v)] += 1
+        self.sum += v
+        self.count += 1
+
+    def snapshot(self) -> dict:
+        """Cumulative bucket counts keyed by upper bound ('+Inf' last), sum, count."""
+        buckets, acc = [], 0
+        for b, c in zip(list(self.bounds) + ["+Inf"], self.counts):
+            acc += c
+            buckets.append((str(b), acc))
+        return {"buckets": buckets, "sum": self.sum, "count": self.count}
+
+
+class Ring:
+    """Fixed-size ring of floats."""
+
+    def __init__(self, size: int = WINDOW, typecode: str = "d"):
+        self.data = array(typecode, bytes(array(typecode).itemsize * size))
+        self.size = size
+        self.n = 0                                     # total items ever pushed
+
+    def push(self, v) -> None:
+        self.data[self.n % self.size] = v
+        self.n += 1
+
+    def __len__(self) -> int:
+        return min(self.n, self.size)
+
+    def values(self) -> list:
+        """Items oldest → newest."""
+        if self.n <= self.size:
+            return list(self.data[:self.n])
+        i = self.n % self.size
+        return list(self.data[i:]) + list(self.data[:i])
+
+    def last(self):
+        return self.data[(self.n - 1) % self.size] if self.n else None
+
+
+def percentile(sorted_values: list, q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+
+class CameraMetrics:
+    """Rolling metrics of one camera."""
+
+    def __init__(self, cam_id: str):
+        self.cam_id = cam_id
+        self.arrivals = Ring()                         # monotonic seconds
+        self.sizes = Ring(typecode="I")
+        self.sizes_hist = Histogram(SIZE_BUCKETS)
+        self.writes = Ring()
+        self.writes_hist = Histogram(WRITE_BUCKETS)
+        self.frames = 0
+        self.bytes = 0
+        self.state = None                              # supervisor.CameraState
+        self.timing = None                             # frame_timing.FrameTiming
+
+    def frame(self, size: int, now: float = None) -> None:
+        """A frame of `size` bytes arrived (at monotonic time `now`)."""
+        self.arrivals.push(time.monotonic() if now is None else now)
+        self.sizes.push(size)
+        self.sizes_hist.observe(size)
+        self.frames += 1
+        self.bytes += size
+
+    def disk_write(self, seconds: float) -> None:
+        self.writes.push(seconds)
+        self.writes_hist.observe(seconds)
+
+    def snapshot(self) -> dict:
+        now = time.monotonic()
+        times = self.arrivals.values()
+        sizes = self.sizes.values()
+        span = times[-1] - times[0] if len(times) > 1 else 0.0
+        gaps = sorted(b - a for a, b in zip(times, times[1:]))
+        writes = sorted(self.writes.values())
+        last = self.arrivals.last()
+        state = self.state
+        return {
+            "camera": self.cam_id,
+            "state": state.state if state is not None else "unknown",
+            "reconnects": state.reconnects if state is not None else 0,
+            "frames": self.frames,
+            "bytes": self.bytes,
+            "fps": (len(times) - 1) / span if span > 0 else 0.0,
+            "bytes_per_second": sum(sizes[1:]) / span if span > 0 else 0.0,
+            "seconds_since_last_frame": now - last if last is not None else None,
+            "frame_gap_seconds": {str(q): percentile(gaps, q) for q in QUANTILES},
+            "disk_write_seconds": {str(q): percentile(writes, q) for q in QUANTILES},
+            "frame_bytes_histogram": self.sizes_hist.snapshot(),
+            "disk_write_histogram": self.writes_hist.snapshot(),
+            "timing": self.timing.snapshot() if self.timing is not None and self.timing.frames else None,
+        }
+
+
+class MetricsRegistry:
+    """All cameras' metrics, created on first use."""
+
+    def __init__(self):
+        self.cameras = {}
+        self._lock = threading.Lock()
+
+    def camera(self, cam_id: str) -> CameraMetrics:
+        m = self.cameras.get(cam_id)
+        if m is None:
+            with self._lock:
+                m = self.cameras.setdefault(cam_id, CameraMetrics(cam_id))
+        return m
+
+    def snapshot(self) -> list:
+        return [m.snapshot() for m in list(self.cameras.values())]
+
+
+# ───── exposition ──────────────────────────────────────────────────────────
+_GAUGES = (
+    ("fps", "sipbuddy_fps", "Frames per second over the last frames"),
+    ("bytes_per_second", "sipbuddy_bytes_per_second", "Ingest bytes per second over the last frames"),
+    ("seconds_since_last_frame", "sipbuddy_seconds_since_last_frame", "Seconds since the last frame arrived"),
+)
+_COUNTERS = (
+    ("frames", "sipbuddy_frames_total", "Frames received"),
+    ("bytes", "sipbuddy_bytes_total", "JPEG bytes received"),
+    ("reconnects", "sipbuddy_reconnects_total", "Connections that ended and were retried"),
+)
+
+
+def _num(v) -> str:
+    return str(v) if isinstance(v, int) else f"{v:.6g}"
+
+
+def _label(v: str) -> str:
+    return str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def prometheus_text(snapshots: list) -> str:
+    lines = []
+    for key, name, help_ in _GAUGES + _COUNTERS:
+        kind = "counter" if name.endswith("_total") else "gauge"
+        lines += [f"# HELP {name} {help_}", f"# TYPE {name} {kind}"]
+        for s in snapshots:
+            if s[key] is not None:
+                lines.append(f'{name}{{camera="{_label(s["camera"])}"}} {_num(s[key])}')
+
+    lines += ["# HELP sipbuddy_camera_state Connection state (1 = current)",
+              "# TYPE sipbuddy_camera_state gauge"]
+    for s in snapshots:
+        lines.append(f'sipbuddy_camera_state{{camera="{_label(s["camera"])}",state="{s["state"]}"}} 1')
+
+    for key, name, help_ in (("frame_gap_seconds", "sipbuddy_frame_gap_seconds", "Inter-frame gap over the last frames"),
+                             ("disk_write_seconds", "sipbuddy_disk_write_quantile_seconds", "Disk write latency over the last frames")):
+        lines += [f"# HELP {name} {help_}", f"# TYPE {name} gauge"]
+        for s in snapshots:
+            for q, v in s[key].items():
+                lines.append(f'{name}{{camera="{_label(s["camera"])}",quantile="{q}"}} {_num(v)}')
+
+    for key, name, help_ in (("frame_bytes_histogram", "sipbuddy_frame_bytes", "JPEG frame size"),
+                             ("disk_write_histogram", "sipbuddy_disk_write_seconds", "Disk write latency per frame")):
+        lines += [f"# HELP {name} {help_}", f"# TYPE {name} histogram"]
+        for s in snapshots:
+            cam, h = _label(s["camera"]), s[key]
+            for le, count in h["buckets"]:
+                lines.append(f'{name}_bucket{{camera="{cam}",le="{le}"}} {count}')
+            lines.append(f'{name}_sum{{camera="{cam}"}} {_num(h["sum"])}')
+            lines.append(f'{name}_count{{camera="{cam}"}} {h["count"]}')
+
+    timed = [s for s in snapshots if s.get("timing")]
+    if timed:
+        lines += _timing_lines(timed)
+    return "\n".join(lines) + "\n"
+
+
+def _histogram_lines(name: str, labels: str, h: dict) -> list:
+    lines = [f'{name}_bucket{{{labels},le="{le}"}} {count}' for le, count in h["buckets"]]
+    lines.append(f'{name}_sum{{{labels}}} {_num(h["sum"])}')
+    lines.append(f'{name}_count{{{labels}}} {h["count"]}')
+    return lines
+
+
+def _timing_lines(snapshots: list) -> list:
+    """Families of the cameras that send stamped frames (frame_timing.py)."""
+    lines = ["# HELP sipbuddy_frames_lost_total Frames missing from the sequence, by where they were lost",
+             "# TYPE sipbuddy_frames_lost_total counter"]
+    for s in snapshots:
+        for where, n in s["timing"]["lost"].items():
+            lines.append(f'sipbuddy_frames_lost_total{{camera="{_label(s["camera"])}",where="{where}"}} {n}')
+    lines += ["# HELP sipbuddy_frames_backfilled_total Frames replayed by the device after a reconnect",
+              "# TYPE sipbuddy_frames_backfilled_total counter"]
+    for s in snapshots:
+        lines.append(f'sipbuddy_frames_backfilled_total{{camera="{_label(s["camera"])}"}} {s["timing"]["backfilled"]}')
+    for key, name, help_ in (("clock_offset_seconds", "sipbuddy_device_clock_offset_seconds", "Host minus device clock"),
+                             ("clock_drift_ppm", "sipbuddy_device_clock_drift_ppm", "Device clock drift against the host")):
+        lines += [f"# HELP {name} {help_}", f"# TYPE {name} gauge"]
+        for s in snapshots:
+            if s["timing"][key] is not None:
+                lines.append(f'{name}{{camera="{_label(s["camera"])}"}} {s["timing"][key]:.6f}')  # epoch-sized
+    lines += ["# HELP sipbuddy_frame_latency_seconds Capture-to-disk latency per stage",
+              "# TYPE sipbuddy_frame_latency_seconds histogram"]
+    for s in snapshots:
+        for stage, h in s["timing"]["latency_histograms"].items():
+            lines += _histogram_lines("sipbuddy_frame_latency_seconds",
+                                      f'camera="{_label(s["camera"])}",stage="{stage}"', h)
+    lines += ["# HELP sipbuddy_capture_interval_seconds Time between captures on the device clock",
+              "# TYPE sipbuddy_capture_interval_seconds histogram"]
+    for s in snapshots:
+        lines += _histogram_lines("sipbuddy_capture_interval_seconds", f'camera="{_label(s["camera"])}"',
+                                  s["timing"]["capture_interval_histogram"])
+    return lines
+
+
+def add_routes(app, registry: MetricsRegistry) -> None:
+    """Register /metrics and /metrics.json on an aiohttp application."""
+    from aiohttp import web
+
+    async def metrics(request):
+        return web.Response(body=prometheus_text(registry.snapshot()).encode(),
+                            headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
+
+    async def metrics_json(request):
+        return web.Response(text=json.dumps(registry.snapshot(), indent=1),
+                            content_type="application/json")
+
+    app.router.add_get("/metrics", metrics)
+    app.router.add_get("/metrics.json", metrics_json)
@@ -0,0 +1,391 @@
+#!/usr/bin/env python3
+"""
+Background transcoding of finished segments
+
+The ffmpeg backend stores the camera's MJPEG as-is (`-c copy`), which is
+roughly ten times the size of the same footage in H.264.  Re-encoding inline
+would cost ingest CPU, so finished segments are queued and transcoded later:
+
+ • Queue – fed by segment_events ("segment closed"), FIFO, and journaled to
+   `OUT_ROOT/.transcode.journal` (`+ path` queued, `- path` finished), so a
+   restart resumes the pending segments without rescanning the recordings.
+   A segment taken but not finished is simply queued again.
+ • Pool – at most `workers` FFmpeg children, niced.  A new job only starts
+   when a core beyond RESERVE_CPUS is idle (1-min load average), at most one
+   per tick so the load average can catch up.  While the kernel reports CPU
+   or I/O pressure (Linux PSI, /proc/pressure) running jobs are paused
+   (SIGSTOP) and resumed once it clears, so ingest always comes first.
+ • Replace – FFmpeg writes `<segment>.mp4.part` next to the original.  The
+   result must have the target codec, the same frame count and the same
+   duration (ffprobe) and be smaller; then it is fsynced, gets the original's
+   mtime and atomically replaces it (os.replace) under the same name.
+   Anything else leaves the original untouched.
+
+Only MP4 segments are transcoded; the native backend's indexed .mjpeg
+segments are left alone (segment_store.py relies on their JPEG frames).
+
+Backlog (transcode every MJPEG-in-MP4 below DIR, then exit):
+    python transcode.py recordings/ --workers 2
+"""
+
+import argparse
+import json
+import logging
+import os
+import pathlib
+import signal
+import subprocess
+import tempfile
+import threading
+import time
+
+logger = logging.getLogger('sipbuddy')
+
+TARGET_CODEC = "h264"
+ENCODE_ARGS = ["-c:v", "libx264", "-preset", "veryfast", "-crf", "28",
+               "-pix_fmt", "yuv420p", "-threads", "1", "-movflags", "+faststart"]
+JOURNAL_NAME = ".transcode.journal"
+PART_SUFFIX = ".part"
+RESERVE_CPUS = 1.0                     # cores always left to ingest
+PSI_LIMIT = 20.0                       # % of time stalled (avg10) that counts as pressure
+NICE = 10
+TICK = 1.0                             # scheduler period (seconds)
+DURATION_TOLERANCE = 0.5               # seconds the transcode may differ by
+FRAME_TOLERANCE = 2                    # frames the transcode may differ by
+ERROR_TAIL = 4096                      # bytes of FFmpeg's stderr kept for the log
+STOP_TIMEOUT = 10.0                    # seconds stop() waits for the scheduler's tick
+
+
+class TranscodeQueue:
+    """FIFO of segment paths, journaled so it survives restarts."""
+
+    def __init__(self, root: pathlib.Path):
+        self.root = pathlib.Path(root)
+        self.path = self.root / JOURNAL_NAME
+        self.pending = {}                              # relative path -> None, insertion-ordered
+        self.taken = set()
+        self.lines = 0                                 # journal lines since the last compaction
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self) -> None:
+        try:
+            with open(self.path) as f:
+                for line in f:
+                    op, rel = line[:1], line[2:].rstrip("\n")
+                    if op == "+":
+                        self.pending[rel] = None
+                    elif op == "-":
+                        self.pending.pop(rel, None)
+        except FileNotFoundError:
+            pass
+        self._compact()
+
+    def _compact(self) -> None:
+        tmp = self.path.with_name(self.path.name + PART_SUFFIX)
+        with open(tmp, "w") as f:
+            f.writelines(f"+ {rel}\n" for rel in self.pending)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+        self.lines = len(self.pending)
+        self._f = open(self.path, "a")
+
+    def _append(self, op: str, rel: str) -> None:
+        self._f.write(f"{op} {rel}\n")
+        self._f.flush()
+        os.fsync(self._f.fileno())
+        self.lines += 1
+        if self.lines > 4 * len(self.pending) + 1024:
+            self._f.close()
+            self._compact()
+
+    def _rel(self, path) -> str:
+        return os.path.relpath(path, self.root)
+
+    def put(self, path) -> None:
+        rel = self._rel(path)
+        with self._lock:
+            if rel not in self.pending:
+                self.pending[rel] = None
+                self._append("+", rel)
+
+    def take(self):
+        """Oldest pending segment not already being worked on, or None."""
+        with self._lock:
+            for rel in self.pending:
+                if rel not in self.taken:
+                    self.taken.add(rel)
+                    return self.root / rel
+        return None
+
+    def done(self, path) -> None:
+        rel = self._rel(path)
+        with self._lock:
+            self.taken.discard(rel)
+            if self.pending.pop(rel, 0) is None:
+                self._append("-", rel)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self.pending) - len(self.taken)
+
+
+# ───── load ────────────────────────────────────────────────────────────────
+def spare_cpus() -> float:
+    """Cores not in use according to the 1-minute load average."""
+    try:
+        return (os.cpu_count() or 1) - os.getloadavg()[0]
+    except (AttributeError, OSError):                  # no load average (Windows)
+        return 1.0 + RESERVE_CPUS
+
+
+def _psi(resource: str) -> float:
+    """`some avg10` of /proc/pressure/<resource> (0 where PSI is unavailable)."""
+    try:
+        with open(f"/proc/pressure/{resource}") as f:
+            fields = f.readline().split()
+    except OSError:
+        return 0.0
+    return float(fields[1].split("=")[1]) if len(fields) > 1 else 0.0
+
+
+def under_pressure() -> bool:
+    """True while tasks stall on CPU or I/O often enough to hurt ingest."""
+    return max(_psi("cpu"), _psi("io")) >= PSI_LIMIT
+
+
+# ───── ffmpeg / ffprobe ────────────────────────────────────────────────────
+def probe(path) -> dict:
+    """Codec, frame count and duration of a file's first video stream."""
+    out = subprocess.run([
+        "ffprobe", "-v", "error", "-select_streams", "v:0", "-count_packets",
+        "-show_entries", "stream=codec_name,nb_read_packets:format=duration",
+        "-of", "json", str(path),
+    ], check=True, capture_output=True, text=True).stdout
+    info = json.loads(out)
+    stream = (info.get("streams") or [{}])[0]
+    return {"codec": stream.get("codec_name"),
+            "frames": int(stream.get("nb_read_packets") or 0),
+            "duration": float(info.get("format", {}).get("duration") or 0.0)}
+
+
+def part_path(path: pathlib.Path) -> pathlib.Path:
+    return path.with_name(path.name + PART_SUFFIX)
+
+
+def _nice() -> None:
+    os.nice(NICE)
+
+
+def start_ffmpeg(src: pathlib.Path, stderr) -> subprocess.Popen:
+    """FFmpeg writing `src`'s transcode to its .part file.  `stderr` is a
+    file: a pipe nobody reads while the job runs fills up and hangs it."""
+    return subprocess.Popen([
+        "ffmpeg", "-hide_banner", "-loglevel", "error", "-nostdin", "-y",
+        "-i", str(src), "-map", "0:v:0", "-vsync", "passthrough",
+        *ENCODE_ARGS, "-f", "mp4", str(part_path(src)),
+    ], stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=stderr,
+        preexec_fn=_nice if os.name == "posix" else None)
+
+
+def verify(before: dict, after: dict) -> str:
+    """Why a transcode does not match its original ('' if it does)."""
+    if after["codec"] != TARGET_CODEC:
+        return f"codec {after['codec']}"
+    if abs(after["frames"] - before["frames"]) > FRAME_TOLERANCE:
+        return f"{after['frames']} frames, original has {before['frames']}"
+    if abs(after["duration"] - before["duration"]) > DURATION_TOLERANCE:
+        return f"{after['duration']:.2f} s, original is {before['duration']:.2f} s"
+    return ""
+
+
+def replace(src: pathlib.Path, part: pathlib.Path) -> None:
+    """Atomically put `part` in place of `src`, keeping its timestamps."""
+    st = src.stat()
+    with open(part, "rb") as f:
+        os.fsync(f.fileno())
+    os.utime(part, ns=(st.st_atime_ns, st.st_mtime_ns))
+    os.replace(part, src)
+    if os.name == "posix":
+        fd = os.open(src.parent, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+
+class Job:
+    def __init__(self, src: pathlib.Path, before: dict):
+        self.src = src
+        self.before = before
+        self.size = src.stat().st_size
+        self.stderr = tempfile.TemporaryFile()
+        self.proc = start_ffmpeg(src, self.stderr)
+        self.started = time.monotonic()
+        self.paused = False
+
+    def errors(self) -> str:
+        """The tail of what FFmpeg wrote to stderr; closes the file."""
+        with self.stderr:
+            self.stderr.seek(max(0, self.stderr.seek(0, os.SEEK_END) - ERROR_TAIL))
+            return self.stderr.read().decode(errors="replace").strip()
+
+    def signal(self, sig) -> None:
+        try:
+            self.proc.send_signal(sig)
+        except OSError:
+            pass
+
+
+class Transcoder(threading.Thread):
+    """Transcodes queued segments with spare CPU (see module docstring)."""
+
+    def __init__(self, root: pathlib.Path, workers: int = None, exit_when_idle: bool = False,
+                 on_replaced=None):
+        super().__init__(daemon=True)
+        self.queue = TranscodeQueue(root)
+        self.on_replaced = on_replaced                 # called with (path, new size) after a swap
+        self.workers = workers or max(1, (os.cpu_count() or 1) // 2)
+        self.exit_when_idle = exit_when_idle
+        self.jobs = []
+        self.paused = False
+        self.stopping = False
+        # counters for telemetry
+        self.done = self.failed = self.skipped = 0
+        self.bytes_in = self.bytes_out = 0
+        self.seconds = 0.0
+        for rel in list(self.queue.pending):           # leftovers of an interrupted run
+            try:
+                part_path(self.queue.root / rel).unlink()
+            except FileNotFoundError:
+                pass
+
+    def segment_closed(self, cam_id: str, path: pathlib.Path) -> None:
+        """segment_events subscriber: queue finished MP4 segments."""
+        if path.suffix == ".mp4":
+            self.queue.put(path)
+
+    def run(self) -> None:
+        while not self.stopping:
+            self._reap()
+            pressure = under_pressure()
+            if pressure != self.paused:
+                self.paused = pressure
+                for job in self.jobs:
+                    job.signal(signal.SIGSTOP if pressure else signal.SIGCONT)
+                logger.info(f"transcoder {'paused: system under pressure' if pressure else 'resumed'}")
+            if not pressure and len(self.jobs) < self.workers and spare_cpus() >= 1 + RESERVE_CPUS:
+                self._start_next()
+            if self.exit_when_idle and not self.jobs and not len(self.queue):
+                return
+            time.sleep(TICK)
+
+    def stop(self, timeout: float = STOP_TIMEOUT) -> None:
+        """Kill the running transcodes (recorder shutdown); they stay queued
+        and start over on the next run."""
+        self.stopping = True
+        if self.is_alive():
+            self.join(timeout)                         # its tick ends: self.jobs is ours now
+            if self.is_alive():
+                logger.warning(f"transcoder still busy after {timeout:g} s, killing its jobs anyway")
+        for job in list(self.jobs):
+            job.proc.kill()
+            job.proc.wait()
+            job.stderr.close()
+        self.jobs = []
+
+    def _start_next(self) -> None:
+        while True:
+            src = self.queue.take()
+            if src is None:
+                return
+            if not src.exists():                       # gated away or deleted meanwhile
+                self.queue.done(src)
+                continue
+            try:
+                before = probe(src)
+            except subprocess.CalledProcessError as e:
+                self._fail(src, f"ffprobe failed: {e.stderr.strip()}")
+                continue
+            if before["codec"] == TARGET_CODEC:        # already done before a restart
+                self.skipped += 1
+                self.queue.done(src)
+                continue
+            self.jobs.append(Job(src, before))
+            return
+
+    def _reap(self) -> None:
+        for job in [j for j in self.jobs if j.proc.poll() is not None]:
+            self.jobs.remove(job)
+            err = job.errors()
+            part = part_path(job.src)
+            try:
+                if job.proc.returncode:
+                    raise RuntimeError(f"ffmpeg exited with {job.proc.returncode}: {err}")
+                why = verify(job.before, probe(part))
+                if why:
+                    raise RuntimeError(f"verification failed: {why}")
+                size = part.stat().st_size
+                if size >= job.size:                   # nothing gained: keep the original
+                    part.unlink()
+                    self.skipped += 1
+                else:
+                    replace(job.src, part)
+                    if self.on_replaced is not None:
+                        self.on_replaced(job.src, size)
+                    self.done += 1
+                    self.bytes_in += job.size
+                    self.bytes_out += size
+                    self.seconds += time.monotonic() - job.started
+                self.queue.done(job.src)
+            except (RuntimeError, OSError, subprocess.CalledProcessError) as e:
+                try:
+                    part.unlink()
+                except FileNotFoundError:
+                    pass
+                self._fail(job.src, str(e))
+
+    def _fail(self, src: pathlib.Path, why: str) -> None:
+        logger.warning(f"transcode of {src} failed, keeping the original: {why}")
+        self.failed += 1
+        self.queue.done(src)
+
+    def snapshot(self) -> dict:
+        return {"queued": len(self.queue), "running": len(self.jobs), "paused": self.paused,
+                "workers": self.workers, "done": self.done, "failed": self.failed,
+                "skipped": self.skipped, "bytes_in": self.bytes_in, "bytes_out": self.bytes_out,
+                "seconds_per_segment": self.seconds / self.done if self.done else None}
+
+
+def add_routes(app, transcoder: Transcoder) -> None:
+    """Register /transcode.json on an aiohttp application."""
+    from aiohttp import web
+
+    async def status(request):
+        return web.Response(text=json.dumps(transcoder.snapshot(), indent=1),
+                            content_type="application/json")
+
+    app.router.add_get("/transcode.json", status)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Transcode MJPEG-in-MP4 segments to H.264")
+    parser.add_argument("root", type=pathlib.Path, help="recordings directory")
+    parser.add_argument("--workers", type=int, help="max parallel FFmpeg jobs (default: half the cores)")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    t = Transcoder(args.root, args.workers, exit_when_idle=True)
+    for path in sorted(args.root.rglob("*.mp4")):
+        t.queue.put(path)
+    t.start()
+    while t.is_alive():
+        t.join(10)
+        s = t.snapshot()
+        print(f"queued {s['queued']}, running {s['running']}, done {s['done']}, "
+              f"failed {s['failed']}, {s['bytes_in'] / 1e6:.0f} → {s['bytes_out'] / 1e6:.0f} MB")
+
+
+if __name__ == "__main__":
+    main()